@@ -6,6 +6,7 @@ Only inserts into tables with simple schemas to avoid column count issues.
 
 import sqlite3
 import os
+from db_inspect import format_rows, inspect_database
 
 def clean_existing_data():
     """Clean all existing data from the database tables."""
@@ -379,31 +380,20 @@ def check_data():
         return
     
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
         print("📊 Checking database contents...")
         print("=" * 50)
         
-        # Check all tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-        
-        total_rows = 0
+        # Trigger-maintained row counts; tables without them are counted in parallel
+        health = inspect_database(db_path, estimates=False)
         
-        for table in tables:
-            table_name = table[0]
-            if table_name == 'sqlite_sequence':  # Skip system table
+        for table in health.tables:
+            if table.error:
+                print(f"❌ {table.name}: Error - {table.error}")
                 continue
-            try:
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                count = cursor.fetchone()[0]
-                total_rows += count
-                status = "✅" if count > 0 else "❌"
-                print(f"{status} {table_name}: {count} rows")
-            except Exception as e:
-                print(f"❌ {table_name}: Error - {e}")
+            status = "✅" if table.rows else "❌"
+            print(f"{status} {table.name}: {format_rows(table)}")
         
+        total_rows = health.total_rows
         print("=" * 50)
         print(f"📈 Total rows across all tables: {total_rows}")
         
@@ -414,8 +404,6 @@ def check_data():
         else:
             print("❌ Database is still empty")
         
-        conn.close()
-        
     except Exception as e:
         print(f"❌ Error checking data: {e}")
 
@@ -0,0 +1,1230 @@
+#!/usr/bin/env python3
+"""
+Benchmark Program for Farm Financial Data RAG Application
+Generates synthetic farm data and measures the performance-critical paths.
+Run a single benchmark with: python benchmark_rag.py <name> [options]
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+STATES = ['MN', 'WI', 'ND', 'IA', 'IL', 'KS', 'NE', 'SD', 'MO', 'OH']
+COUNTIES = ['Hennepin', 'Dane', 'Cass', 'Polk', 'McLean', 'Sedgwick', 'Lancaster', 'Minnehaha', 'Boone', 'Franklin']
+
+def generate_synthetic_database(db_path: str, farms: int, tenants: int = 8, years: int = 1, seed: int = 42):
+    """Create a database with the production schema and `farms` synthetic farm-years."""
+    from create_database import create_database_schema
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    create_database_schema(cursor)
+
+    farm_ids = [f"farm_{i:07d}" for i in range(farms)]
+    tenant_idx = rng.integers(0, tenants, farms)
+    state_idx = rng.integers(0, len(STATES), farms)
+    year_values = 2021 - rng.integers(0, years, farms)
+
+    cursor.executemany(
+        """INSERT INTO hdb_main_data (
+            hdb_main_data_id, tenant_id, organization_id, branch_id, fbm_farm_id,
+            primary_banker_name, year, state, county, client_first_last_name, delete_data
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'N')""",
+        (
+            (farm_ids[i], f"tenant_{tenant_idx[i]:03d}", f"org_{tenant_idx[i]:03d}",
+             f"branch_{tenant_idx[i]:03d}_{state_idx[i]}", f"fbm_{i % max(farms // years, 1):07d}",
+             f"Banker {tenant_idx[i]}", str(year_values[i]), STATES[state_idx[i]],
+             COUNTIES[state_idx[i]], f"Client {i} Farm")
+            for i in range(farms)
+        )
+    )
+    cursor.executemany(
+        "INSERT INTO fm_genin (fm_genin_guid, hdb_main_data_id, item_name) VALUES (?, ?, ?)",
+        ((f"guid_{i:07d}", farm_ids[i], f"Client {i} Farm") for i in range(farms))
+    )
+
+    current_beg = rng.uniform(0.8, 3.5, farms)
+    working_beg = rng.uniform(50_000, 900_000, farms)
+    nfi = rng.normal(200_000, 80_000, farms)
+    debt_beg = rng.uniform(0.1, 0.7, farms)
+    cursor.executemany(
+        """INSERT INTO fm_guide (
+            item_name, fm_genin_guid, hdb_main_data_id, current_ratio_beg, current_ratio_end,
+            working_capital_beg, working_capital_end, net_farm_income_cost, net_farm_income_mkt,
+            rate_of_ret_on_farm_assets_mkt, operating_expense_ratio, term_debt_coverage_ratio_accr,
+            beg_cost_farm_debt_to_asset_ratio, end_cost_farm_debt_to_asset_ratio,
+            beg_mkt_farm_debt_to_asset_ratio, end_mkt_farm_debt_to_asset_ratio
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (
+            (f"Client {i} Farm", f"guid_{i:07d}", farm_ids[i],
+             float(current_beg[i]), float(current_beg[i] * rng.uniform(0.8, 1.3)),
+             float(working_beg[i]), float(working_beg[i] * rng.uniform(0.8, 1.3)),
+             float(nfi[i]), float(nfi[i]), float(rng.uniform(-0.02, 0.12)),
+             float(rng.uniform(0.5, 0.9)), float(rng.uniform(0.8, 4.0)),
+             float(debt_beg[i]), float(debt_beg[i] * rng.uniform(0.85, 1.1)),
+             float(debt_beg[i] * 0.9), float(debt_beg[i] * 0.9 * rng.uniform(0.85, 1.1)))
+            for i in range(farms)
+        )
+    )
+
+    net_worth = rng.uniform(300_000, 4_000_000, farms)
+    change = nfi * rng.uniform(0.4, 0.9, farms)
+    gross = rng.uniform(200_000, 2_000_000, farms)
+    expense = gross * rng.uniform(0.5, 0.9, farms)
+    cursor.executemany(
+        """INSERT INTO fm_stmts (
+            item_name, fm_genin_guid, hdb_main_data_id, beginning_net_worth, net_farm_income,
+            total_change_in_net_worth, ending_net_worth_calculated, ending_net_worth_reported,
+            equity_discrepancy, beg_cash_balance_farm_and_nonfarm, gross_cash_farm_income,
+            total_cash_farm_expense, cash_from_operations
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (
+            (f"Client {i} Farm", f"guid_{i:07d}", farm_ids[i], float(net_worth[i]), float(nfi[i]),
+             float(change[i]), float(net_worth[i] + change[i]), float(net_worth[i] + change[i]), 0.0,
+             float(gross[i] * 0.1), float(gross[i]), float(expense[i]), float(gross[i] - expense[i]))
+            for i in range(farms)
+        )
+    )
+
+    conn.commit()
+    conn.close()
+
+def _timed(func, repeat: int = 3) -> float:
+    """Best wall-clock time of several runs, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_shards(args):
+    """Portfolio aggregate on one database vs. parallel fan-out across tenant shards."""
+    from tenant_shards import build_tenant_shards, FanOutExecutor, Aggregate
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    print(f"📊 Generating {args.farms} farms across {args.tenants} tenants...")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    build_tenant_shards(db_path, os.path.join(workdir, "shards"))
+
+    from_clause = "fm_guide g JOIN hdb_main_data h ON g.hdb_main_data_id = h.hdb_main_data_id"
+    aggregates = {
+        "farms": Aggregate("count"),
+        "avg_current_ratio": Aggregate("avg", "g.current_ratio_end"),
+        "total_net_farm_income": Aggregate("sum", "g.net_farm_income_mkt"),
+    }
+    single_sql = (
+        "SELECT h.state AS state, COUNT(*) AS farms, AVG(g.current_ratio_end) AS avg_current_ratio, "
+        f"SUM(g.net_farm_income_mkt) AS total_net_farm_income FROM {from_clause} GROUP BY h.state"
+    )
+
+    def single_db():
+        conn = sqlite3.connect(db_path)
+        conn.execute(single_sql).fetchall()
+        conn.close()
+
+    baseline = _timed(single_db)
+    print(f"   single database:           {baseline * 1000:8.1f} ms")
+
+    for use_processes in (False, True):
+        kind = "processes" if use_processes else "threads"
+        for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+            executor = FanOutExecutor(os.path.join(workdir, "shards"), max_workers=workers,
+                                      use_processes=use_processes)
+            # Warm the pool so process start-up is not measured
+            executor.aggregate(from_clause, aggregates, group_by=["h.state"])
+            elapsed = _timed(lambda: executor.aggregate(from_clause, aggregates, group_by=["h.state"]))
+            executor.close()
+            print(f"   fan-out {workers:2d} {kind:<9}:      {elapsed * 1000:8.1f} ms  "
+                  f"({baseline / elapsed:4.2f}x)")
+
+def _percentile(values, pct: float) -> float:
+    """Percentile of a list of latencies."""
+    return float(np.percentile(values, pct)) if values else 0.0
+
+def _post_json(url: str, body: dict, timeout: float = 60.0) -> dict:
+    """POST a JSON body and decode the JSON reply."""
+    request = urllib.request.Request(url, data=json.dumps(body).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def _wait_for_server(base_url: str, timeout: float = 60.0):
+    """Poll /health until the API answers and the RAG engine has finished warming."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/health", timeout=2) as response:
+                if json.loads(response.read()).get("rag_app_status") == "healthy":
+                    return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"API at {base_url} did not become healthy")
+
+def _load_test(base_url: str, questions, concurrency: int):
+    """Send every question to /ask with the given concurrency; returns (elapsed, latencies)."""
+    def ask(question):
+        start = time.perf_counter()
+        _post_json(f"{base_url}/ask", {"question": question})
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(ask, questions))
+    return time.perf_counter() - start, latencies
+
+def bench_workers(args):
+    """/ask throughput with 1..N prefork workers against a stub LLM, plus shared-cache reuse."""
+    from stub_llm_server import start_stub_server
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    server, stub_config, stub_url = start_stub_server(latency_ms=args.latency_ms)
+
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    worker_counts = sorted({1, 2, 4, args.workers})
+    for workers in worker_counts:
+        port = 8700 + workers
+        env = dict(os.environ, OPENAI_API_KEY="sk-stub", OPENAI_BASE_URL=stub_url,
+                   DATABASE_PATH=db_path, SHARED_CACHE_PATH=os.path.join(workdir, f"cache_{workers}.db"))
+        process = subprocess.Popen(
+            [sys.executable, "prefork_server.py", "--workers", str(workers), "--port", str(port),
+             "--host", "127.0.0.1"],
+            cwd=src_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            _wait_for_server(base_url)
+            questions = [f"How many farms are in state group {i}?" for i in range(args.requests)]
+            elapsed, latencies = _load_test(base_url, questions, args.concurrency)
+            cached_elapsed, _ = _load_test(base_url, questions, args.concurrency)
+            print(f"   {workers:2d} workers: {len(questions) / elapsed:7.1f} req/s  "
+                  f"p50 {_percentile(latencies, 50) * 1000:6.0f} ms  "
+                  f"p95 {_percentile(latencies, 95) * 1000:6.0f} ms  "
+                  f"| repeat (shared cache): {len(questions) / cached_elapsed:7.1f} req/s")
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    print(f"   stub LLM served {stub_config.requests} completions")
+    server.shutdown()
+
+def bench_coalesce(args):
+    """LLM calls for bursts of identical /ask requests, which share one execution."""
+    from stub_llm_server import start_stub_server
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    server, stub_config, stub_url = start_stub_server(latency_ms=args.latency_ms)
+
+    # No answer cache: every saved LLM call comes from in-flight deduplication
+    port = 8790
+    env = dict(os.environ, OPENAI_API_KEY="sk-stub", OPENAI_BASE_URL=stub_url, DATABASE_PATH=db_path)
+    env.pop("SHARED_CACHE_PATH", None)
+    process = subprocess.Popen(
+        [sys.executable, "prefork_server.py", "--workers", "1", "--port", str(port), "--host", "127.0.0.1"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        _wait_for_server(base_url)
+        bursts = max(1, args.requests // args.concurrency)
+        for burst in range(bursts):
+            # e.g. a dashboard refresh: everyone asks the same example question at once
+            questions = [f"Which farms have the highest current ratio in region {burst}?"] * args.concurrency
+            _load_test(base_url, questions, args.concurrency)
+        requests = bursts * args.concurrency
+        print(f"   {requests} requests in {bursts} bursts of {args.concurrency}: "
+              f"{stub_config.requests} LLM calls (without coalescing: {requests * 2})")
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        server.shutdown()
+
+@contextmanager
+def _environment(env: dict):
+    """Temporarily set environment variables (FarmDataRAG reads its settings from them)."""
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+def _get_json(url: str, timeout: float = 10.0) -> dict:
+    """GET a URL and decode the JSON reply."""
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def bench_warming(args):
+    """First-user latency and cache hit rate for the example questions after a restart, cold vs. warmed."""
+    from stub_llm_server import start_stub_server
+    from farm_rag_api import all_example_questions
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    server, stub_config, stub_url = start_stub_server(latency_ms=args.latency_ms)
+    questions = all_example_questions()
+
+    for label, warming in [("cold start", "false"), ("cache warming", "true")]:
+        port = 8795
+        env = dict(os.environ, OPENAI_API_KEY="sk-stub", OPENAI_BASE_URL=stub_url, DATABASE_PATH=db_path,
+                   CACHE_WARMING=warming)
+        env.pop("SHARED_CACHE_PATH", None)
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "farm_rag_api:app", "--port", str(port), "--host", "127.0.0.1"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            _wait_for_server(base_url)
+            # Users arrive once the warm-up pass is done (it runs alongside startup)
+            deadline = time.time() + 120
+            while warming == "true" and time.time() < deadline:
+                status = _get_json(f"{base_url}/metrics")["cache_warmer"]
+                if status and status["runs"] and status["state"] == "idle":
+                    break
+                time.sleep(0.2)
+            _, latencies = _load_test(base_url, questions, 1)
+            cache = _get_json(f"{base_url}/metrics")["answer_cache"]
+            print(f"   {label:<14} first-user p50 {_percentile(latencies, 50) * 1000:6.0f} ms  "
+                  f"max {max(latencies) * 1000:6.0f} ms  answer cache hit rate {cache['hit_rate']:.0%}")
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+    server.shutdown()
+
+def _run_rag_questions(env: dict, questions):
+    """Build a FarmDataRAG under the given environment and time each question."""
+    with _environment(env):
+        from farm_rag_app import FarmDataRAG
+        rag_app = FarmDataRAG()
+        latencies, prompt_tokens = [], 0
+        for question in questions:
+            start = time.perf_counter()
+            result = rag_app.ask_question(question)
+            latencies.append(time.perf_counter() - start)
+            prompt_tokens += result.get("token_usage", {}).get("prompt_tokens", 0)
+    return latencies, prompt_tokens
+
+def bench_tokens(args):
+    """Prompt tokens and p95 latency with unbounded prompts vs. the token budget manager."""
+    from stub_llm_server import start_stub_server
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+
+    # A wide result (every fm_guide and fm_stmts column) is the worst case for the data section
+    wide_sql = ("SELECT * FROM fm_guide g JOIN fm_stmts s ON g.hdb_main_data_id = s.hdb_main_data_id "
+                "JOIN hdb_main_data h ON h.hdb_main_data_id = g.hdb_main_data_id LIMIT 50")
+    server, stub_config, stub_url = start_stub_server(
+        latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 2,
+        ms_per_1k_prompt_tokens=args.ms_per_1k_tokens, sql=wide_sql
+    )
+    base_env = {"OPENAI_API_KEY": "sk-stub", "OPENAI_BASE_URL": stub_url, "DATABASE_PATH": db_path}
+    questions = [f"Show the full financial profile of farms in group {i}" for i in range(args.requests)]
+
+    modes = [
+        ("unbounded (head(20), max_tokens=4000)",
+         {"PROMPT_TOKEN_BUDGET": "0", "DATA_TOKEN_BUDGET": "0", "SQL_MAX_TOKENS": "4000", "RESPONSE_MAX_TOKENS": "4000"}),
+        ("token budget (defaults)", {}),
+    ]
+    for label, overrides in modes:
+        latencies, prompt_tokens = _run_rag_questions(dict(base_env, **overrides), questions)
+        print(f"   {label:<40} prompt tokens/question {prompt_tokens / len(questions):8.0f}  "
+              f"p50 {_percentile(latencies, 50) * 1000:6.0f} ms  p95 {_percentile(latencies, 95) * 1000:6.0f} ms")
+    server.shutdown()
+
+# Keeps every question on the LLM path, for benchmarks that measure LLM-call behaviour
+LLM_PATH_ENV = {"INTENT_ROUTER": "false", "SQL_TEMPLATE_CACHE": "false"}
+
+def bench_ratelimit(args):
+    """Burst of questions against a rate-limited stub LLM, with and without the LLM scheduler."""
+    from stub_llm_server import start_stub_server
+    from llm_scheduler import SchedulerOverloaded
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    base_env = dict({"OPENAI_API_KEY": "sk-stub", "DATABASE_PATH": db_path}, **LLM_PATH_ENV)
+
+    modes = [
+        ("no admission control", {"LLM_RPM": "0", "LLM_TPM": "0"}),
+        # Stay a little under the provider limits so bursts never reach them
+        ("LLM scheduler", {"LLM_RPM": str(args.rpm * 0.9), "LLM_TPM": str(args.tpm * 0.9),
+                           "LLM_QUEUE_TIMEOUT": "20"}),
+    ]
+    for label, overrides in modes:
+        # Fresh stub per mode so both start with an empty rate window
+        server, stub_config, stub_url = start_stub_server(
+            latency_ms=args.latency_ms, rpm=args.rpm, tpm=args.tpm, rate_window_seconds=10
+        )
+        def ask(index):
+            # Every fourth question is background (batch) work
+            priority = "batch" if index % 4 == 3 else "interactive"
+            start = time.perf_counter()
+            try:
+                result = rag_app.ask_question(f"How many farms are in group {index}?", priority=priority)
+                outcome = "ok" if result["success"] and result.get("query_result", {}).get("success") else "failed"
+            except SchedulerOverloaded:
+                outcome = "shed"
+            return priority, outcome, time.perf_counter() - start
+
+        # The OpenAI client reads OPENAI_BASE_URL when it is first used
+        with _environment(dict(base_env, OPENAI_BASE_URL=stub_url, **overrides)):
+            from farm_rag_app import FarmDataRAG
+            rag_app = FarmDataRAG()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                results = list(pool.map(ask, range(args.requests)))
+            elapsed = time.perf_counter() - start
+        server.shutdown()
+
+        outcomes = [outcome for _, outcome, _ in results]
+        ok_latency = {p: [t for q, o, t in results if q == p and o == "ok"] for p in ("interactive", "batch")}
+        print(f"   {label:<22} ok {outcomes.count('ok'):4d}  failed {outcomes.count('failed'):4d}  "
+              f"shed {outcomes.count('shed'):4d}  provider 429s {stub_config.rate_limited:5d}  {elapsed:5.1f}s")
+        for priority, latencies in ok_latency.items():
+            if latencies:
+                print(f"      {priority:<12} p50 {_percentile(latencies, 50):5.2f}s  p95 {_percentile(latencies, 95):5.2f}s")
+
+def bench_hedging(args):
+    """Tail latency against a stub LLM with latency spikes and errors: plain calls vs. retries + hedging."""
+    from stub_llm_server import start_stub_server
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    questions = [f"How many farms are in group {i}?" for i in range(args.requests)]
+
+    modes = [
+        ("single attempt", {"LLM_MAX_RETRIES": "0", "LLM_HEDGE": "false"}),
+        ("retries + hedging", {"LLM_MAX_RETRIES": "2", "LLM_HEDGE": "true"}),
+    ]
+    for label, overrides in modes:
+        server, stub_config, stub_url = start_stub_server(
+            latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 2,
+            spike_rate=args.spike_rate, spike_ms=args.latency_ms * 20, error_rate=args.error_rate
+        )
+        env = dict({"OPENAI_API_KEY": "sk-stub", "OPENAI_BASE_URL": stub_url, "DATABASE_PATH": db_path,
+                    "LLM_DEADLINE_SECONDS": "20", "LLM_BREAKER_FAILURES": "1000"}, **LLM_PATH_ENV, **overrides)
+        with _environment(env):
+            from farm_rag_app import FarmDataRAG
+            rag_app = FarmDataRAG()
+            latencies, failures = [], 0
+            for question in questions:
+                start = time.perf_counter()
+                result = rag_app.ask_question(question)
+                latencies.append(time.perf_counter() - start)
+                failures += not (result["success"] and result.get("query_result", {}).get("success"))
+        server.shutdown()
+        stats = rag_app.llm_caller.stats
+        print(f"   {label:<18} p50 {_percentile(latencies, 50) * 1000:6.0f} ms  "
+              f"p95 {_percentile(latencies, 95) * 1000:6.0f} ms  p99 {_percentile(latencies, 99) * 1000:6.0f} ms  "
+              f"failed {failures:3d}  provider calls {stub_config.requests + stub_config.errors:4d}  "
+              f"(retries {stats['retries']}, hedges {stats['hedges']}, hedge wins {stats['hedge_wins']})")
+
+def bench_planner(args):
+    """Comparison questions answered one-shot vs. planned sub-queries run one at a time vs. as a parallel DAG."""
+    from stub_llm_server import start_stub_server
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    # The stub answers planner prompts with a scripted three-step plan (stub_llm_server.DEFAULT_PLAN)
+    server, stub_config, stub_url = start_stub_server(latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 2)
+    base_env = {"OPENAI_API_KEY": "sk-stub", "OPENAI_BASE_URL": stub_url, "DATABASE_PATH": db_path}
+    questions = [f"Compare farm performance between Minnesota and Wisconsin for group {i}"
+                 for i in range(min(args.requests, 50))]
+
+    modes = [
+        ("one-shot SQL", {"QUERY_PLANNER": "false"}),
+        ("plan, sequential steps", {"QUERY_PLANNER": "true", "PLANNER_MAX_PARALLEL": "1"}),
+        ("plan, parallel DAG", {"QUERY_PLANNER": "true", "PLANNER_MAX_PARALLEL": "4"}),
+    ]
+    for label, overrides in modes:
+        calls_before = stub_config.requests
+        latencies, _ = _run_rag_questions(dict(base_env, **overrides), questions)
+        calls = (stub_config.requests - calls_before) / len(questions)
+        print(f"   {label:<24} p50 {_percentile(latencies, 50) * 1000:6.0f} ms  "
+              f"p95 {_percentile(latencies, 95) * 1000:6.0f} ms  LLM calls/question {calls:4.1f}")
+    server.shutdown()
+
+# Question mix for the intent router benchmark: templated shapes plus free-form questions
+INTENT_QUESTIONS = [
+    "How many farms are in each state?",
+    "How many farms are in {state}?",
+    "Top {n} farms by current ratio",
+    "Which {n} farms have the lowest net farm income in {state}?",
+    "Average working capital by state",
+    "What is the average debt to asset ratio by county in {state}?",
+    "What is the 90th percentile of net farm income?",
+    "What drives profitability for farms in {state}?",
+    "Which expenses grew the most for farms with high debt in {state}?",
+]
+
+def bench_intents(args):
+    """Latency and LLM calls for a realistic question mix with and without the local intent router."""
+    from stub_llm_server import start_stub_server
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    server, stub_config, stub_url = start_stub_server(latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 2)
+    # Answer cache off, so every question is answered
+    base_env = {"OPENAI_API_KEY": "sk-stub", "OPENAI_BASE_URL": stub_url, "DATABASE_PATH": db_path,
+                "ANSWER_CACHE_TTL": "0"}
+    states = ["Minnesota", "Wisconsin", "Iowa", "Illinois", "Ohio"]
+    questions = [INTENT_QUESTIONS[i % len(INTENT_QUESTIONS)].format(state=states[i % len(states)], n=5 + i % 20)
+                 for i in range(args.requests)]
+
+    for label, routing in [("LLM for every question", "false"), ("intent router", "true")]:
+        calls_before = stub_config.requests
+        latencies, _ = _run_rag_questions(dict(base_env, INTENT_ROUTER=routing), questions)
+        calls = (stub_config.requests - calls_before) / len(questions)
+        print(f"   {label:<24} p50 {_percentile(latencies, 50) * 1000:6.0f} ms  "
+              f"p95 {_percentile(latencies, 95) * 1000:6.0f} ms  LLM calls/question {calls:4.2f}")
+    server.shutdown()
+
+def bench_templates(args):
+    """A family of same-shape questions with different states: LLM SQL every time vs. the SQL template cache."""
+    from stub_llm_server import start_stub_server
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    # The stub writes SQL for the first question of the family (Minnesota and Wisconsin)
+    family_sql = ("SELECT h.state, COUNT(*) AS farms, AVG(g.net_farm_income_cost) AS avg_net_farm_income "
+                  "FROM hdb_main_data h JOIN fm_guide g ON g.hdb_main_data_id = h.hdb_main_data_id "
+                  "WHERE h.state IN ('MN', 'WI') GROUP BY h.state")
+    server, stub_config, stub_url = start_stub_server(latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 2,
+                                                      sql=family_sql)
+    base_env = {"OPENAI_API_KEY": "sk-stub", "OPENAI_BASE_URL": stub_url, "DATABASE_PATH": db_path,
+                "ANSWER_CACHE_TTL": "0"}
+    states = ["Minnesota", "Wisconsin", "Iowa", "Illinois", "Ohio", "Missouri", "Kansas", "Nebraska"]
+    questions = [f"What is the profitability of farms in {states[i % 8]} and {states[(i + 1 + i // 8) % 8]}?"
+                 for i in range(args.requests)]
+
+    for label, caching in [("LLM SQL every time", "false"), ("SQL template cache", "true")]:
+        calls_before = stub_config.requests
+        latencies, _ = _run_rag_questions(dict(base_env, SQL_TEMPLATE_CACHE=caching), questions)
+        calls = (stub_config.requests - calls_before) / len(questions)
+        print(f"   {label:<20} p50 {_percentile(latencies, 50) * 1000:6.0f} ms  "
+              f"p95 {_percentile(latencies, 95) * 1000:6.0f} ms  LLM calls/question {calls:4.2f}")
+    server.shutdown()
+
+def bench_responses(args):
+    """Dashboard refreshes (same questions, unchanged data, no answer cache): response calls with and without the response cache."""
+    from stub_llm_server import start_stub_server
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    server, stub_config, stub_url = start_stub_server(latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 2)
+    # Templated dashboard tiles: SQL comes from the intent router, the narrative from the LLM
+    base_env = {"OPENAI_API_KEY": "sk-stub", "OPENAI_BASE_URL": stub_url, "DATABASE_PATH": db_path,
+                "ANSWER_CACHE_TTL": "0", "INTENT_LOCAL_ANSWERS": "false"}
+    tiles = [question.format(state="Minnesota", n=10) for question in INTENT_QUESTIONS[:7]]
+    refreshes = max(2, args.requests // len(tiles))
+    questions = tiles * refreshes
+
+    for label, caching in [("no response cache", "false"), ("response cache", "true")]:
+        calls_before = stub_config.requests
+        latencies, _ = _run_rag_questions(dict(base_env, RESPONSE_CACHE=caching), questions)
+        calls = (stub_config.requests - calls_before) / len(questions)
+        later = latencies[len(tiles):]
+        print(f"   {label:<18} refresh p50 {_percentile(later, 50) * 1000:6.0f} ms  "
+              f"p95 {_percentile(later, 95) * 1000:6.0f} ms  LLM calls/question {calls:4.2f} "
+              f"({refreshes} refreshes of {len(tiles)} tiles)")
+    server.shutdown()
+
+def bench_batching(args):
+    """Throughput and token cost of SQL generation for concurrent distinct questions: one call each vs. micro-batches."""
+    from stub_llm_server import start_stub_server
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    # Every question is new: no caches, templates or router shortcuts
+    base_env = {"OPENAI_API_KEY": "sk-stub", "DATABASE_PATH": db_path, "ANSWER_CACHE_TTL": "0",
+                "RESPONSE_CACHE": "false", "SQL_TEMPLATE_CACHE": "false", "INTENT_ROUTER": "false"}
+    topics = ["liquidity", "profitability", "solvency", "repayment capacity", "efficiency", "household spending"]
+    questions = [f"Summarize {topics[i % len(topics)]} trends for farm cohort {chr(65 + i % 26)}{i}"
+                 for i in range(args.requests)]
+
+    for label, batching in [("one call per question", "false"), ("micro-batching", "true")]:
+        server, stub_config, stub_url = start_stub_server(
+            latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 2,
+            ms_per_1k_prompt_tokens=args.ms_per_1k_tokens, ms_per_completion_token=1.0
+        )
+        with _environment(dict(base_env, OPENAI_BASE_URL=stub_url, SQL_BATCHING=batching, SQL_BATCH_WAIT_MS="25")):
+            from farm_rag_app import FarmDataRAG
+            rag_app = FarmDataRAG()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                results = list(pool.map(rag_app.ask_question, questions))
+            elapsed = time.perf_counter() - start
+        server.shutdown()
+        failed = sum(not (r["success"] and r.get("query_result", {}).get("success")) for r in results)
+        batches = rag_app.sql_batcher.stats() if rag_app.sql_batcher else None
+        print(f"   {label:<22} {len(questions) / elapsed:6.1f} questions/s  "
+              f"prompt tokens/question {stub_config.prompt_tokens / len(questions):6.0f}  "
+              f"LLM calls {stub_config.requests:4d}  failed {failed}"
+              + (f"  (avg batch {batches['avg_batch_size']:.1f})" if batches else ""))
+
+def bench_fairness(args):
+    """Interactive p95 while another tenant floods the pipeline with batch work, with and without fair scheduling."""
+    from stub_llm_server import start_stub_server
+    from llm_scheduler import SchedulerOverloaded
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    # Distinct questions and no caches, so every request does the full pipeline
+    base_env = {"OPENAI_API_KEY": "sk-stub", "DATABASE_PATH": db_path, "ANSWER_CACHE_TTL": "0",
+                "RESPONSE_CACHE": "false", "SQL_TEMPLATE_CACHE": "false", "INTENT_ROUTER": "false"}
+    interactive_users, questions_per_user = 4, max(5, args.requests // 20)
+
+    def ask(rag_app, tenant, request_class, question):
+        """One request the way /ask runs it; returns (latency, outcome)."""
+        start = time.perf_counter()
+        try:
+            if rag_app.fair_scheduler is None:
+                result = rag_app.ask_question(question, tenant_id=tenant, priority=request_class)
+            else:
+                with rag_app.fair_scheduler.slot(tenant, request_class) as admission:
+                    result = rag_app.ask_question(question, tenant_id=tenant, priority=request_class)
+                    admission.charge_result(result)
+            outcome = "ok" if result["success"] else "failed"
+        except SchedulerOverloaded:
+            outcome = "shed"
+        return time.perf_counter() - start, outcome
+
+    modes = [
+        ("interactive only", "true", 0),
+        ("flood, no scheduler", "false", args.concurrency * 2),
+        ("flood, fair scheduler", "true", args.concurrency * 2),
+    ]
+    for label, fair, flood_threads in modes:
+        server, _, stub_url = start_stub_server(latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 2,
+                                                ms_per_1k_prompt_tokens=args.ms_per_1k_tokens)
+        with _environment(dict(base_env, OPENAI_BASE_URL=stub_url, FAIR_SCHEDULING=fair)):
+            from farm_rag_app import FarmDataRAG
+            rag_app = FarmDataRAG()
+            ask(rag_app, "warmup", "interactive", "How many farms are there?")
+            done = threading.Event()
+            batch_results = []
+
+            def flood(worker):
+                index = 0
+                while not done.is_set():
+                    batch_results.append(ask(rag_app, "branch-a", "batch",
+                                             f"Review loan file {worker}-{index} for the branch audit"))
+                    index += 1
+
+            def user(number):
+                latencies = []
+                for index in range(questions_per_user):
+                    latencies.append(ask(rag_app, f"branch-{number + 2}", "interactive",
+                                         f"How many farms are in group {number * 100 + index}?"))
+                    time.sleep(0.05)
+                return latencies
+
+            flooders = [threading.Thread(target=flood, args=(i,), daemon=True) for i in range(flood_threads)]
+            for thread in flooders:
+                thread.start()
+            time.sleep(0.5 if flood_threads else 0)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=interactive_users) as pool:
+                interactive = [item for items in pool.map(user, range(interactive_users)) for item in items]
+            elapsed = time.perf_counter() - start
+            done.set()
+            for thread in flooders:
+                thread.join()
+        server.shutdown()
+
+        latencies = [latency for latency, outcome in interactive if outcome == "ok"]
+        shed = sum(outcome == "shed" for _, outcome in interactive)
+        batch_ok = sum(outcome == "ok" for _, outcome in batch_results)
+        print(f"   {label:<22} interactive p50 {_percentile(latencies, 50) * 1000:6.0f} ms  "
+              f"p95 {_percentile(latencies, 95) * 1000:6.0f} ms  shed {shed:3d}  "
+              f"batch {batch_ok / elapsed:5.1f} questions/s")
+
+def bench_entities(args):
+    """Entity-filtered queries: LIKE '%name%' table scans vs. the trigram index vs. resolved equality lookups."""
+    from contextlib import closing
+    from entity_index import EntityResolver, build_entity_index, rewrite_like_predicates
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    start = time.perf_counter()
+    counts = build_entity_index(db_path)
+    print(f"   index built in {time.perf_counter() - start:.2f}s ({sum(counts.values())} values)")
+
+    target = args.farms * 2 // 3
+    like_queries = {
+        "farm name": f"SELECT h.state, g.item_name FROM hdb_main_data h JOIN fm_genin g "
+                     f"ON g.hdb_main_data_id = h.hdb_main_data_id WHERE g.item_name LIKE '%Client {target} Farm%'",
+        "client name": f"SELECT COUNT(*) FROM hdb_main_data h WHERE h.client_first_last_name LIKE '%Client {target} F%'",
+    }
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    resolver = EntityResolver(lambda: closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)))
+    question = f"How is Client {target} Farm doing?"
+    resolve_seconds = _timed(lambda: resolver.resolve(question), args.repeat)
+    match = resolver.resolve(question)[0]
+    equality = {
+        "farm name": f"SELECT h.state, g.item_name FROM hdb_main_data h JOIN fm_genin g "
+                     f"ON g.hdb_main_data_id = h.hdb_main_data_id WHERE g.item_name = '{match.value}'",
+        "client name": f"SELECT COUNT(*) FROM hdb_main_data h WHERE h.client_first_last_name = '{match.value}'",
+    }
+    print(f"   resolve {question!r}: {resolve_seconds * 1000:.2f} ms -> {match.kind} = {match.value!r}")
+    for label, sql in like_queries.items():
+        rewritten, _ = rewrite_like_predicates(sql)
+        expected = sorted(conn.execute(sql).fetchall())
+        assert sorted(conn.execute(rewritten).fetchall()) == expected
+        assert sorted(conn.execute(equality[label]).fetchall()) == expected
+        scan = _timed(lambda: conn.execute(sql).fetchall(), args.repeat)
+        trigram = _timed(lambda: conn.execute(rewritten).fetchall(), args.repeat)
+        exact = _timed(lambda: conn.execute(equality[label]).fetchall(), args.repeat)
+        print(f"   {label:<12} LIKE scan {scan * 1000:8.2f} ms  trigram index {trigram * 1000:7.2f} ms  "
+              f"resolved = {exact * 1000:6.2f} ms")
+    conn.close()
+
+def bench_facts(args):
+    """Common analytic questions over the joined source tables vs. the farm-year fact table, plus sync cost."""
+    from fact_table import FACT_TABLE, build_fact_table, fact_columns, verify_fact_table
+    from intent_router import IntentRouter
+    from sql_template_cache import render_sql
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    conn = sqlite3.connect(db_path)
+    metrics = [row[1] for row in conn.execute("PRAGMA table_info(fm_guide)") if row[2] == "REAL"]
+    joined_router = IntentRouter(metrics)
+    fact_router = IntentRouter(metrics, fact_columns=[metric for metric in metrics if metric in fact_columns()])
+    routed = [
+        "Average working capital by state",
+        "Top 10 farms by current ratio in Minnesota",
+        "What is the average debt to asset ratio by county in Iowa?",
+        "What is the 90th percentile of net farm income?",
+    ]
+    queries = [(question, render_sql(joined.sql, joined.params), render_sql(fact.sql, fact.params))
+               for question, joined, fact in ((question, joined_router.route(question), fact_router.route(question))
+                                              for question in routed)]
+    # LLM-style questions that also need fm_stmts
+    queries.append((
+        "Net worth change and cash margin by state",
+        "SELECT h.state, AVG(s.ending_net_worth_reported - s.beginning_net_worth), "
+        "AVG(s.gross_cash_farm_income - s.total_cash_farm_expense) FROM hdb_main_data h "
+        "JOIN fm_genin gi ON gi.hdb_main_data_id = h.hdb_main_data_id "
+        "JOIN fm_stmts s ON s.fm_genin_guid = gi.fm_genin_guid GROUP BY h.state ORDER BY h.state",
+        f"SELECT state, AVG(ending_net_worth_reported - beginning_net_worth), "
+        f"AVG(gross_cash_farm_income - total_cash_farm_expense) FROM {FACT_TABLE} GROUP BY state ORDER BY state"))
+    queries.append((
+        "Highly leveraged farms with positive income in Wisconsin",
+        "SELECT COUNT(*) FROM hdb_main_data h JOIN fm_guide g ON g.hdb_main_data_id = h.hdb_main_data_id "
+        "JOIN fm_stmts s ON s.hdb_main_data_id = h.hdb_main_data_id WHERE h.state = 'WI' "
+        "AND g.end_cost_farm_debt_to_asset_ratio > 0.5 AND s.net_farm_income > 0",
+        f"SELECT COUNT(*) FROM {FACT_TABLE} WHERE state = 'WI' "
+        f"AND end_cost_farm_debt_to_asset_ratio > 0.5 AND net_farm_income > 0"))
+
+    # Before: the joins on the database as loaded (no child-table indexes)
+    before = {question: _timed(lambda: conn.execute(joined_sql).fetchall(), args.repeat)
+              for question, joined_sql, _ in queries}
+    conn.close()
+    start = time.perf_counter()
+    rows = build_fact_table(db_path)
+    print(f"   {FACT_TABLE} built in {time.perf_counter() - start:.2f}s ({rows} rows)")
+    conn = sqlite3.connect(db_path)
+
+    print(f"   {'':<44} {'joins':>9} {'+indexes':>9} {'fact table':>11}")
+    for question, joined_sql, fact_sql in queries:
+        expected = conn.execute(joined_sql).fetchall()
+        assert conn.execute(fact_sql).fetchall() == expected, question
+        # The build also indexes hdb_main_data_id on the child tables, which speeds up the joins too
+        indexed = _timed(lambda: conn.execute(joined_sql).fetchall(), args.repeat)
+        fact = _timed(lambda: conn.execute(fact_sql).fetchall(), args.repeat)
+        print(f"   {question[:44]:<44} {before[question] * 1000:6.1f} ms {indexed * 1000:6.1f} ms "
+              f"{fact * 1000:8.1f} ms  ({before[question] / fact:4.1f}x)")
+
+    # Incremental sync: the triggers refresh one fact row per changed source row
+    changed = min(1000, args.farms)
+    ids = [(f"farm_{i:07d}",) for i in range(changed)]
+    start = time.perf_counter()
+    with conn:
+        conn.executemany("UPDATE fm_guide SET current_ratio_end = current_ratio_end * 1.01 "
+                         "WHERE hdb_main_data_id = ?", ids)
+    synced = time.perf_counter() - start
+    for trigger in [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'fm_guide' AND name LIKE ?",
+            (f"{FACT_TABLE}%",))]:
+        conn.execute(f"DROP TRIGGER {trigger}")
+    start = time.perf_counter()
+    with conn:
+        conn.executemany("UPDATE fm_guide SET current_ratio_end = current_ratio_end / 1.01 "
+                         "WHERE hdb_main_data_id = ?", ids)
+    unsynced = time.perf_counter() - start
+    conn.close()
+    print(f"   {changed} fm_guide updates: {unsynced * 1000:.1f} ms without sync, {synced * 1000:.1f} ms with "
+          f"trigger sync ({(synced - unsynced) / changed * 1e6:.0f} µs per farm-year)")
+    build_fact_table(db_path)
+    counts = verify_fact_table(db_path)
+    print(f"   rebuilt: {counts['rows']} rows, {counts['stale']} stale")
+
+def bench_optimizer(args):
+    """LLM-style problem SQL run as written vs. after the optimizer's rewrites and cost gate."""
+    from sql_optimizer import SQLOptimizer
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    optimizer = SQLOptimizer()
+    cap_seconds = 10.0
+    queries = {
+        "correlated subqueries": (
+            "SELECT h.hdb_main_data_id, h.state, "
+            "(SELECT g.current_ratio_end FROM fm_guide g WHERE g.hdb_main_data_id = h.hdb_main_data_id) AS cr, "
+            "(SELECT s.net_farm_income FROM fm_stmts s WHERE s.hdb_main_data_id = h.hdb_main_data_id) AS nfi "
+            "FROM hdb_main_data h WHERE h.state = 'MN' ORDER BY cr DESC LIMIT 20"),
+        "SELECT * over a join": (
+            "SELECT * FROM hdb_main_data h JOIN fm_guide g ON g.hdb_main_data_id = h.hdb_main_data_id "
+            "JOIN fm_stmts s ON s.hdb_main_data_id = h.hdb_main_data_id WHERE h.state = 'WI' LIMIT 50"),
+        "missing LIMIT": (
+            "SELECT h.hdb_main_data_id, h.county, g.working_capital_end FROM hdb_main_data h "
+            "JOIN fm_guide g ON g.hdb_main_data_id = h.hdb_main_data_id WHERE g.working_capital_end > 100000"),
+        "LIMIT outside a subquery": (
+            "SELECT state, nfi FROM (SELECT h.state, s.net_farm_income AS nfi FROM hdb_main_data h "
+            "JOIN fm_stmts s ON s.hdb_main_data_id = h.hdb_main_data_id) LIMIT 10"),
+        "cartesian join": (
+            "SELECT h.state, AVG(g.current_ratio_end) FROM hdb_main_data h, fm_guide g "
+            "WHERE h.state IN ('MN', 'WI') GROUP BY h.state"),
+    }
+
+    def run(sql):
+        """Seconds to fetch every row, or None when the query is still running after cap_seconds."""
+        deadline = time.perf_counter() + cap_seconds
+        conn.set_progress_handler(lambda: int(time.perf_counter() > deadline), 100_000)
+        start = time.perf_counter()
+        try:
+            conn.execute(sql).fetchall()
+            return time.perf_counter() - start
+        except sqlite3.OperationalError:
+            return None
+        finally:
+            conn.set_progress_handler(None, 0)
+
+    def show(seconds):
+        return f"{seconds * 1000:9.1f} ms" if seconds is not None else f"  >{cap_seconds:.0f} s   "
+
+    for label, sql in queries.items():
+        start = time.perf_counter()
+        review = optimizer.review(conn, sql)
+        review_ms = (time.perf_counter() - start) * 1000
+        before = run(sql)
+        after = None if review.rejected else run(review.sql)
+        outcome = "rejected" if review.rejected else ", ".join(review.rewrites) or "unchanged"
+        print(f"   {label:<26} as written {show(before)}  optimized {show(after) if after is not None else '   (not run)'}"
+              f"  review {review_ms:5.2f} ms  [{outcome}]")
+    conn.close()
+
+def bench_querylog(args):
+    """Request-path cost of logging each question: a synchronous insert+commit vs. the queued background writer."""
+    from query_log import QueryLog, QueryLogRecord, _COLUMNS, _create_table
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    records = [QueryLogRecord(question=f"How many farms are in group {i}?", normalized=f"how many farms are in group {i}",
+                              sql=f"SELECT COUNT(*) FROM hdb_main_data WHERE grp = {i}", row_count=1, llm_calls=2,
+                              total_ms=150.0)
+               for i in range(args.requests * 25)]
+
+    conn = sqlite3.connect(os.path.join(workdir, "sync_log.db"))
+    conn.execute("PRAGMA journal_mode=WAL")
+    _create_table(conn)
+    insert = f"INSERT INTO query_log ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' for _ in _COLUMNS)})"
+    start = time.perf_counter()
+    for record in records:
+        with conn:
+            conn.execute(insert, tuple(getattr(record, name) for name in _COLUMNS))
+    sync_seconds = time.perf_counter() - start
+    conn.close()
+
+    log = QueryLog(os.path.join(workdir, "query_log.db"))
+    start = time.perf_counter()
+    for record in records:
+        log.record(record)
+    queued_seconds = time.perf_counter() - start
+    log.flush(timeout=120)
+    drained_seconds = time.perf_counter() - start
+    stats = log.stats()
+
+    print(f"   {len(records)} records")
+    print(f"   synchronous insert+commit {sync_seconds / len(records) * 1e6:8.1f} µs per request")
+    print(f"   queued background writer  {queued_seconds / len(records) * 1e6:8.1f} µs per request  "
+          f"(all written after {drained_seconds:.2f}s in {stats['batches']} commits, {stats['dropped']} dropped)")
+
+def bench_statements(args):
+    """Short farm-year lookups: planned per query vs. compiled statements reused across requests."""
+    from db_pool import ConnectionPool
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    conn = sqlite3.connect(db_path)
+    # Indexed farm-year lookups (as after a fact-table build), so planning is a visible share of each query
+    for table in ("fm_guide", "fm_stmts"):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_hdb_main_data_id ON {table}(hdb_main_data_id)")
+    conn.commit()
+    conn.close()
+    lookup = ("SELECT h.hdb_main_data_id, h.state, h.year, g.current_ratio_end, g.working_capital_end, "
+              "s.net_farm_income FROM hdb_main_data h JOIN fm_guide g ON g.hdb_main_data_id = h.hdb_main_data_id "
+              "JOIN fm_stmts s ON s.hdb_main_data_id = h.hdb_main_data_id WHERE h.hdb_main_data_id = {}")
+    # More distinct farms than statement cache slots: literal SQL keeps compiling new texts
+    farm_ids = [f"farm_{i:07d}" for i in range(0, args.farms, max(1, args.farms // 1000))]
+    lookups = [farm_ids[i % len(farm_ids)] for i in range(args.requests * 25)]
+
+    def run_with(pool: ConnectionPool, parameterized: bool) -> float:
+        with pool.connection() as conn:
+            conn.execute(lookup.format("'farm_0000000'")).fetchall()  # open and load the schema outside the timing
+        start = time.perf_counter()
+        for farm_id in lookups:
+            with pool.connection() as conn:
+                if parameterized:
+                    conn.execute(pool.statement(conn, lookup.format("?")), (farm_id,)).fetchall()
+                else:
+                    conn.execute(pool.statement(conn, lookup.format(f"'{farm_id}'"))).fetchall()
+        return (time.perf_counter() - start) / len(lookups)
+
+    start = time.perf_counter()
+    for farm_id in lookups[:len(lookups) // 5]:
+        conn = sqlite3.connect(db_path)
+        conn.execute(lookup.format("?"), (farm_id,)).fetchall()
+        conn.close()
+    fresh = (time.perf_counter() - start) / (len(lookups) // 5)
+    uncached = run_with(ConnectionPool(db_path, size=1, statement_cache_size=0), parameterized=True)
+    literal_pool = ConnectionPool(db_path, size=1)
+    literal = run_with(literal_pool, parameterized=False)
+    compiled_pool = ConnectionPool(db_path, size=1)
+    compiled = run_with(compiled_pool, parameterized=True)
+
+    print(f"   {len(lookups)} lookups over {len(farm_ids)} farm-years")
+    print(f"   new connection per query       {fresh * 1e6:8.1f} µs per query")
+    print(f"   pooled, planned every time     {uncached * 1e6:8.1f} µs per query")
+    print(f"   pooled, literal SQL            {literal * 1e6:8.1f} µs per query  "
+          f"(hit rate {literal_pool.stats()['statement_hit_rate']:.0%})")
+    print(f"   pooled, compiled statement     {compiled * 1e6:8.1f} µs per query  "
+          f"(hit rate {compiled_pool.stats()['statement_hit_rate']:.0%}, "
+          f"planning saved {(uncached - compiled) * 1e6:.1f} µs per query)")
+
+def bench_metrics(args):
+    """Derived FINBIN metrics for every farm-year: SQL arithmetic vs. registered SQL functions vs. NumPy columns."""
+    import ast
+    from farm_metrics import (METRICS, base_columns, compute_metrics, load_base_columns, recompute_metrics,
+                              register_sql_functions)
+
+    def sql_expression(expression: str) -> str:
+        """The metric as plain SQLite arithmetic, the way generated SQL spells it out."""
+        tree = ast.parse(expression, mode="eval")
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call):
+                numerator, denominator = node.args
+                node.func = ast.Name("__div__")
+                node.args = [numerator, ast.Call(ast.Name("NULLIF"), [denominator, ast.Constant(0)], [])]
+        return ast.unparse(tree).replace("__div__(", "(").replace(", NULLIF", " / NULLIF")
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    # Several years per farm, so the year-over-year changes have previous years to compare with
+    generate_synthetic_database(db_path, args.farms, args.tenants, years=5)
+    conn = sqlite3.connect(db_path)
+    register_sql_functions(conn)
+    joined = ("FROM hdb_main_data h LEFT JOIN fm_guide g ON g.hdb_main_data_id = h.hdb_main_data_id "
+              "LEFT JOIN fm_stmts s ON s.hdb_main_data_id = h.hdb_main_data_id")
+    for table in ("fm_guide", "fm_stmts"):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_hdb_main_data_id ON {table}(hdb_main_data_id)")
+    arithmetic = f"SELECT {', '.join(sql_expression(metric.expression) for metric in METRICS)} {joined}"
+    functions = f"SELECT {', '.join(f'{metric.name}({chr(44).join(metric.inputs)})' for metric in METRICS)} {joined}"
+    scan = f"SELECT {', '.join(base_columns())} {joined}"
+
+    scan_seconds = _timed(lambda: conn.execute(scan).fetchall(), args.repeat)
+    arithmetic_seconds = _timed(lambda: conn.execute(arithmetic).fetchall(), args.repeat)
+    function_seconds = _timed(lambda: conn.execute(functions).fetchall(), args.repeat)
+    frame = load_base_columns(conn)
+    columns = {column: frame[column].to_numpy(dtype=float) for column in base_columns()}
+    numpy_seconds = _timed(lambda: compute_metrics(columns), args.repeat)
+    conn.close()
+    run = recompute_metrics(db_path)
+
+    rows = len(frame)
+    print(f"   {rows} farm-years, {len(METRICS)} metrics")
+    print(f"   reading the input columns         {scan_seconds * 1000:8.1f} ms")
+    print(f"   SQL arithmetic per row            {arithmetic_seconds * 1000:8.1f} ms  "
+          f"({rows / arithmetic_seconds:12,.0f} farm-years/s)")
+    print(f"   registered SQL functions          {function_seconds * 1000:8.1f} ms  "
+          f"({rows / function_seconds:12,.0f} farm-years/s)")
+    print(f"   NumPy over loaded columns         {numpy_seconds * 1000:8.1f} ms  "
+          f"({rows / numpy_seconds:12,.0f} farm-years/s)")
+    print(f"   batch recompute into farm_metrics: load {run.load_seconds:.2f}s, "
+          f"compute {run.compute_seconds * 1000:.1f} ms (with year over year), write {run.write_seconds:.2f}s")
+
+def bench_changes(args):
+    """Top movers computed on the fly vs. read from the change table, plus full build and new-year update cost."""
+    from change_engine import build_change_table, update_change_table
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants, years=5)
+    conn = sqlite3.connect(db_path)
+    for table in ("fm_guide", "fm_stmts"):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_hdb_main_data_id ON {table}(hdb_main_data_id)")
+    # Hold the latest year back to load it afterwards as a new year
+    conn.execute("CREATE TABLE held_back AS SELECT * FROM hdb_main_data WHERE year = '2021'")
+    conn.execute("DELETE FROM hdb_main_data WHERE year = '2021'")
+    conn.commit()
+    run = build_change_table(db_path)
+    print(f"   build: {run.rows} rows for {run.farm_years} farm-years in {run.seconds:.2f}s")
+    conn.execute("INSERT INTO hdb_main_data SELECT * FROM held_back")
+    conn.execute("DROP TABLE held_back")
+    conn.commit()
+    run = update_change_table(db_path)
+    print(f"   new year loaded: {run.farms} farms ({run.farm_years} farm-years) recomputed in {run.seconds:.2f}s")
+
+    queries = [
+        ("Biggest increase in working capital",
+         "SELECT h.hdb_main_data_id, h.year, g.working_capital_end - g.working_capital_beg AS delta "
+         "FROM fm_guide g JOIN hdb_main_data h ON h.hdb_main_data_id = g.hdb_main_data_id "
+         "WHERE delta IS NOT NULL ORDER BY delta DESC LIMIT 10",
+         "SELECT hdb_main_data_id, year, delta FROM farm_changes WHERE metric = 'working_capital' "
+         "AND delta IS NOT NULL ORDER BY delta DESC LIMIT 10"),
+        ("Largest net worth decrease in percent",
+         "SELECT h.hdb_main_data_id, h.year, (s.ending_net_worth_reported - s.beginning_net_worth) "
+         "/ ABS(NULLIF(s.beginning_net_worth, 0)) AS pct FROM fm_stmts s "
+         "JOIN hdb_main_data h ON h.hdb_main_data_id = s.hdb_main_data_id WHERE pct IS NOT NULL ORDER BY pct LIMIT 10",
+         "SELECT hdb_main_data_id, year, pct_change FROM farm_changes WHERE metric = 'net_worth' "
+         "AND pct_change IS NOT NULL ORDER BY pct_change LIMIT 10"),
+        ("Biggest year-over-year current ratio gain",
+         "SELECT h.hdb_main_data_id, h.year, g.current_ratio_end - gp.current_ratio_end AS yoy FROM hdb_main_data h "
+         "JOIN fm_guide g ON g.hdb_main_data_id = h.hdb_main_data_id JOIN hdb_main_data hp "
+         "ON hp.fbm_farm_id = h.fbm_farm_id AND CAST(hp.year AS INTEGER) = CAST(h.year AS INTEGER) - 1 "
+         "JOIN fm_guide gp ON gp.hdb_main_data_id = hp.hdb_main_data_id ORDER BY yoy DESC LIMIT 10",
+         "SELECT hdb_main_data_id, year, yoy_delta FROM farm_changes WHERE metric = 'current_ratio' "
+         "AND yoy_delta IS NOT NULL ORDER BY yoy_delta DESC LIMIT 10"),
+    ]
+    print(f"   {'':<44} {'on the fly':>11} {'change table':>13}")
+    for question, direct_sql, change_sql in queries:
+        direct = _timed(lambda: conn.execute(direct_sql).fetchall(), args.repeat)
+        table = _timed(lambda: conn.execute(change_sql).fetchall(), args.repeat)
+        print(f"   {question:<44} {direct * 1000:8.1f} ms {table * 1000:10.2f} ms  ({direct / table:6.0f}x)")
+    conn.close()
+
+def bench_quality(args):
+    """Accounting-identity checks as one SQL scan per check vs. the vectorized chunked scan, plus an incremental update."""
+    from data_quality import CHECKS, FLAGS_TABLE, scan_database, update_flags
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants, years=5)
+    conn = sqlite3.connect(db_path)
+    # Seed discrepancies into 1% of the statements
+    conn.execute("UPDATE fm_stmts SET ending_net_worth_reported = ending_net_worth_reported + 25000 "
+                 "WHERE rowid % 100 = 0")
+    conn.commit()
+    rows = conn.execute("SELECT COUNT(*) FROM fm_stmts").fetchone()[0]
+
+    def sql_scan():
+        flagged = 0
+        for check in CHECKS:
+            tolerance = f"MAX({check.abs_tolerance}, {check.rel_tolerance} * ABS(COALESCE({check.scale}, 0)))"
+            residual = check.residual
+            for column in check.optional:
+                residual = residual.replace(column, f"COALESCE({column}, 0)")
+            flagged += conn.execute(f"SELECT COUNT(*) FROM fm_stmts WHERE ABS({residual}) > {tolerance}").fetchone()[0]
+        return flagged
+
+    sql_seconds = _timed(sql_scan, args.repeat)
+    # The first scan also pays the pandas/NumPy import
+    run = scan_database(db_path)
+    scan_seconds = _timed(lambda: scan_database(db_path), args.repeat)
+    print(f"   {rows} statements, {len(CHECKS)} checks, {run.flags} flags")
+    print(f"   one SQL COUNT per check: {sql_seconds:.2f}s (counts only)")
+    print(f"   vectorized chunked scan: {scan_seconds:.2f}s in {run.chunks} chunks "
+          f"({rows / scan_seconds:,.0f} rows/s, flags written)")
+
+    conn.execute("UPDATE fm_stmts SET total_change_in_net_worth = total_change_in_net_worth + 5000 "
+                 "WHERE rowid IN (SELECT rowid FROM fm_stmts ORDER BY RANDOM() LIMIT 1000)")
+    conn.commit()
+    run = update_flags(db_path)
+    total = conn.execute(f"SELECT COUNT(*) FROM {FLAGS_TABLE}").fetchone()[0]
+    print(f"   incremental update:      {run.seconds:.2f}s for {run.rows_checked} changed rows ({total} flags)")
+    conn.close()
+
+def bench_inspect(args):
+    """Database health: a COUNT(*) per table vs. parallel exact counts vs. trigger-maintained counts."""
+    from db_inspect import inspect_database, install_row_counts, user_tables
+
+    workdir = tempfile.mkdtemp(prefix="farm_bench_")
+    db_path = os.path.join(workdir, "finbin_farm_data.db")
+    generate_synthetic_database(db_path, args.farms, args.tenants)
+    conn = sqlite3.connect(db_path)
+    tables = user_tables(conn)
+
+    def count_each():
+        return sum(conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables)
+
+    sequential = _timed(count_each, args.repeat)
+    parallel = _timed(lambda: inspect_database(db_path, exact=True), args.repeat)
+    install_row_counts(conn)
+    maintained = _timed(lambda: inspect_database(db_path), args.repeat)
+    health = inspect_database(db_path)
+    assert health.total_rows == count_each()
+    print(f"   {health.total_rows} rows in {len(tables)} tables, {health.size_bytes / 1e6:.0f} MB")
+    print(f"   COUNT(*) per table:        {sequential * 1000:8.1f} ms")
+    print(f"   exact, counted in parallel:{parallel * 1000:8.1f} ms")
+    print(f"   trigger-maintained counts: {maintained * 1000:8.1f} ms")
+
+    # What the triggers cost on a load
+    rows = [(f"bench_{i}",) for i in range(args.farms // 10)]
+    conn.execute("DELETE FROM fm_hhold")
+    conn.commit()
+    start = time.perf_counter()
+    with conn:
+        conn.executemany("INSERT INTO fm_hhold (hdb_main_data_id) VALUES (?)", rows)
+    with_triggers = time.perf_counter() - start
+    conn.execute("DROP TRIGGER table_row_counts_fm_hhold_insert")
+    conn.execute("DELETE FROM fm_hhold")
+    conn.commit()
+    start = time.perf_counter()
+    with conn:
+        conn.executemany("INSERT INTO fm_hhold (hdb_main_data_id) VALUES (?)", rows)
+    without_triggers = time.perf_counter() - start
+    print(f"   inserting {len(rows)} rows: {without_triggers * 1000:.1f} ms without, "
+          f"{with_triggers * 1000:.1f} ms with the count trigger")
+    conn.close()
+
+# Modules that must not be loaded just by importing the API
+LAZY_MODULES = ("pandas", "numpy", "openai")
+
+def bench_importtime(args):
+    """Checked import-time budget for farm_rag_api (python -X importtime)."""
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "sk-stub"))
+    runs = []
+    for _ in range(args.repeat):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import farm_rag_api"],
+            cwd=src_dir, env=env, capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            print(f"❌ Import failed:\n{completed.stderr[-2000:]}")
+            return 1
+
+        cumulative = {}
+        for line in completed.stderr.splitlines():
+            # Format: "import time: <self us> | <cumulative us> | <indented module name>"
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative_us, name = line[len("import time:"):].split("|")
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            cumulative[name.strip()] = (int(cumulative_us), depth)
+        runs.append(cumulative)
+
+    total_ms = min(run["farm_rag_api"][0] for run in runs) / 1000.0
+    direct = [(name, us) for name, (us, depth) in runs[0].items() if depth == 1]
+    top_level = sorted(direct, key=lambda item: item[1], reverse=True)[:5]
+    eager = [module for module in LAZY_MODULES if module in runs[0]]
+
+    print(f"   import farm_rag_api: {total_ms:7.1f} ms (budget {args.budget_ms:.0f} ms)")
+    for name, us in top_level:
+        print(f"      {name:<30} {us / 1000:7.1f} ms")
+
+    failed = False
+    if eager:
+        print(f"❌ Imported eagerly: {', '.join(eager)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"❌ Import time over budget by {total_ms - args.budget_ms:.1f} ms")
+        failed = True
+    if not failed:
+        print("✅ Import time within budget and heavy modules stay lazy")
+    return 1 if failed else 0
+
+BENCHMARKS = {
+    "shards": bench_shards,
+    "workers": bench_workers,
+    "importtime": bench_importtime,
+    "tokens": bench_tokens,
+    "coalesce": bench_coalesce,
+    "ratelimit": bench_ratelimit,
+    "hedging": bench_hedging,
+    "warming": bench_warming,
+    "planner": bench_planner,
+    "intents": bench_intents,
+    "templates": bench_templates,
+    "responses": bench_responses,
+    "batching": bench_batching,
+    "fairness": bench_fairness,
+    "querylog": bench_querylog,
+    "entities": bench_entities,
+    "facts": bench_facts,
+    "optimizer": bench_optimizer,
+    "statements": bench_statements,
+    "metrics": bench_metrics,
+    "changes": bench_changes,
+    "quality": bench_quality,
+    "inspect": bench_inspect,
+}
+
+def main():
+    """Parse arguments and run the selected benchmark."""
+    parser = argparse.ArgumentParser(description="Farm Financial RAG benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--farms", type=int, default=200_000, help="synthetic farm-years to generate")
+    parser.add_argument("--tenants", type=int, default=8, help="synthetic tenants to spread farms over")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="maximum API worker processes")
+    parser.add_argument("--requests", type=int, default=200, help="requests per load test")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients per load test")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="stub LLM latency per call")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=40.0,
+                        help="stub LLM prompt processing time per 1000 prompt tokens")
+    parser.add_argument("--rpm", type=float, default=300, help="stub LLM requests-per-minute limit")
+    parser.add_argument("--tpm", type=float, default=600000, help="stub LLM tokens-per-minute limit")
+    parser.add_argument("--spike-rate", type=float, default=0.05, help="fraction of stub LLM calls with a latency spike")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="fraction of stub LLM calls that fail with 500")
+    parser.add_argument("--budget-ms", type=float, default=800.0, help="import-time budget for farm_rag_api")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions for timing benchmarks")
+    args = parser.parse_args()
+
+    print(f"🚀 Running benchmark: {args.benchmark}")
+    print("=" * 60)
+    return BENCHMARKS[args.benchmark](args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Background Cache Warming
+Precomputes answers for the example questions and the most frequent recent
+questions (from the query log) at startup and again whenever the database
+changes, so the first users after a deploy or data load get cache hits. Warming runs on one
+low-priority thread, one question at a time, and backs off while live
+requests are in flight; with a fair scheduler it is admitted as its own
+low-weight "warmup" flow.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Flow the fair scheduler accounts warm-up work to (not any customer's quota)
+WARMUP_TENANT = "cache-warmer"
+
+class RecentQuestions:
+    """Sliding window of recently asked questions for popularity ranking."""
+
+    def __init__(self, maxlen: int = 1000, normalize: Callable[[str], str] = str.lower):
+        self.normalize = normalize
+        self._questions: Deque[Tuple[str, Optional[str]]] = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, question: str, tenant_id: Optional[str] = None):
+        with self._lock:
+            self._questions.append((question, tenant_id))
+
+    def top(self, n: int) -> List[Tuple[str, Optional[str]]]:
+        """Most frequent (question, tenant_id) pairs, most frequent first."""
+        with self._lock:
+            entries = list(self._questions)
+        counts = Counter((self.normalize(question), tenant_id) for question, tenant_id in entries)
+        # Keep the latest original wording for each normalized question
+        wording = {(self.normalize(question), tenant_id): question for question, tenant_id in entries}
+        return [(wording[key], key[1]) for key, _ in counts.most_common(n)]
+
+class CacheWarmer:
+    """Warms the answer cache in the background at startup and after each data change."""
+
+    def __init__(self, rag_app, example_questions: Callable[[], List[str]], top_n: int = 20,
+                 check_interval: float = 30.0, is_busy: Optional[Callable[[], bool]] = None,
+                 scheduler=None):
+        self.rag_app = rag_app
+        self.example_questions = example_questions
+        self.top_n = top_n
+        self.check_interval = check_interval
+        self.is_busy = is_busy or (lambda: False)
+        self.scheduler = scheduler
+        self.state = "idle"
+        self.runs = 0
+        self.warmed = 0
+        self.already_cached = 0
+        self.failed = 0
+        self.last_run_started: Optional[float] = None
+        self.last_run_seconds: Optional[float] = None
+        self.warmed_data_version: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the warming thread (once)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="cache-warmer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _lower_priority(self):
+        """Lower this thread's CPU priority (Linux schedules threads individually)."""
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+
+    def _run(self):
+        self._lower_priority()
+        while not self._stop.is_set():
+            data_version = self.rag_app.data_version()
+            if data_version != self.warmed_data_version:
+                try:
+                    self.warm(data_version)
+                except Exception as e:
+                    logger.error(f"Cache warming failed: {e}")
+                    self.state = "idle"
+            self._stop.wait(self.check_interval)
+
+    def questions(self) -> List[Tuple[str, Optional[str]]]:
+        """Examples first, then the most popular recent questions not already listed."""
+        recent = self.rag_app.recent_questions
+        selected = [(question, None) for question in self.example_questions()]
+        seen = {(recent.normalize(question), tenant_id) for question, tenant_id in selected}
+        for question, tenant_id in self.rag_app.popular_questions(self.top_n):
+            if (recent.normalize(question), tenant_id) not in seen:
+                selected.append((question, tenant_id))
+        return selected
+
+    def _ask(self, question: str, tenant_id: Optional[str]) -> Dict[str, Any]:
+        if self.scheduler is None:
+            return self.rag_app.ask_question(question, tenant_id=tenant_id, priority="batch")
+        with self.scheduler.slot(WARMUP_TENANT, "warmup") as admission:
+            result = self.rag_app.ask_question(question, tenant_id=tenant_id, priority="batch")
+            admission.charge_result(result)
+            return result
+
+    def warm(self, data_version: str):
+        """Answer every warm-up question that is not already cached for this data version."""
+        self.state = "warming"
+        self.runs += 1
+        self.last_run_started = time.time()
+        started = time.monotonic()
+        logger.info(f"Warming answer cache for data version {data_version}")
+
+        for question, tenant_id in self.questions():
+            if self._stop.is_set():
+                return
+            # Live traffic first: wait while requests are in flight
+            while self.is_busy() and not self._stop.is_set():
+                time.sleep(0.2)
+            if self.rag_app.has_cached_answer(question, tenant_id):
+                self.already_cached += 1
+                continue
+            result = self._ask(question, tenant_id)
+            if result.get("success") and result.get("query_result", {}).get("success"):
+                self.warmed += 1
+            else:
+                self.failed += 1
+
+        self.warmed_data_version = data_version
+        self.last_run_seconds = time.monotonic() - started
+        self.state = "idle"
+        logger.info(f"Cache warming finished in {self.last_run_seconds:.1f}s")
+
+    def status(self) -> Dict[str, Any]:
+        """Warming progress for /metrics."""
+        return {
+            "state": self.state,
+            "runs": self.runs,
+            "warmed": self.warmed,
+            "already_cached": self.already_cached,
+            "failed": self.failed,
+            "last_run_started": self.last_run_started,
+            "last_run_seconds": self.last_run_seconds,
+            "warmed_data_version": self.warmed_data_version
+        }
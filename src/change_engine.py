@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Change Engine
+A precomputed change table for trend questions. For every farm-year and every
+paired metric (the beg_/end_ and _beg/_end column pairs in fm_guide, plus
+beginning vs ending net worth from fm_stmts) it holds the beginning and ending
+values, their delta and percent change, the change from the farm's previous
+year, and the compound annual growth rate over the farm's history so far. The
+table is built by a vectorized batch job, updated incrementally for farms with
+newly loaded (or removed) years, and indexed on (metric, change) so "biggest
+increase in working capital" is an index range scan:
+`python change_engine.py build|update <database>`.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, TYPE_CHECKING
+
+from farm_metrics import _array_ratio, farm_history, previous_year
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CHANGE_TABLE = "farm_changes"
+# Pairs not named with beg/end markers: metric -> (table, beginning column, ending column)
+EXTRA_PAIRS = {"net_worth": ("fm_stmts", "beginning_net_worth", "ending_net_worth_reported")}
+_TABLE_ALIASES = {"fm_guide": "g", "fm_stmts": "s"}
+
+CHANGE_COLUMNS = ["beginning", "ending", "delta", "pct_change", "yoy_delta", "yoy_pct", "history_years", "cagr"]
+# Columns a mover question can rank by; each gets a (metric, column) index
+RANK_COLUMNS = ["delta", "pct_change", "yoy_delta", "cagr"]
+
+@dataclass(frozen=True)
+class PairedMetric:
+    """A metric recorded at the beginning and the end of each farm-year."""
+    metric: str
+    table: str
+    beginning: str
+    ending: str
+
+def pairs_for_columns(numeric_columns: Dict[str, Sequence[str]]) -> List[PairedMetric]:
+    """Beginning/ending pairs among the numeric columns of fm_guide and fm_stmts."""
+    guide = set(numeric_columns.get("fm_guide", ()))
+    pairs = []
+    for column in numeric_columns.get("fm_guide", ()):
+        if column.startswith("beg_"):
+            metric, ending = column[4:], "end_" + column[4:]
+        elif column.endswith("_beg"):
+            metric, ending = column[:-4], column[:-4] + "_end"
+        else:
+            continue
+        if ending in guide:
+            pairs.append(PairedMetric(metric, "fm_guide", column, ending))
+    for metric, (table, beginning, ending) in EXTRA_PAIRS.items():
+        if {beginning, ending} <= set(numeric_columns.get(table, ())):
+            pairs.append(PairedMetric(metric, table, beginning, ending))
+    return pairs
+
+def paired_metrics(conn: sqlite3.Connection) -> List[PairedMetric]:
+    """Numeric beginning/ending column pairs present in this database."""
+    return pairs_for_columns({table: [row[1] for row in conn.execute(f"PRAGMA table_info({table})")
+                                      if (row[2] or "").upper() == "REAL"]
+                              for table in _TABLE_ALIASES})
+
+def _load_pairs(conn: sqlite3.Connection, pairs: List[PairedMetric], where: str = "") -> "pd.DataFrame":
+    """Farm-year keys and both columns of every pair; farm_key groups a farm's years (fbm_farm_id when known)."""
+    import pandas as pd
+
+    selected = ", ".join(f"{_TABLE_ALIASES[pair.table]}.{column}" for pair in pairs
+                         for column in (pair.beginning, pair.ending))
+    joins = " ".join(f"LEFT JOIN {table} {alias} ON {alias}.hdb_main_data_id = h.hdb_main_data_id"
+                     for table, alias in _TABLE_ALIASES.items())
+    frame = pd.read_sql_query(f"SELECT h.hdb_main_data_id, COALESCE(h.fbm_farm_id, h.hdb_main_data_id) AS farm_key, "
+                              f"h.year, {selected} FROM hdb_main_data h {joins}{where}", conn)
+    for pair in pairs:
+        for column in (pair.beginning, pair.ending):
+            frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    return frame
+
+def compute_changes(frame: "pd.DataFrame", pairs: List[PairedMetric]) -> List[tuple]:
+    """Change rows (keys, metric, CHANGE_COLUMNS) for every farm-year and pair with a beginning or ending value."""
+    import numpy as np
+
+    if frame.empty:
+        return []
+    history = farm_history(frame["farm_key"].to_numpy(), frame["year"].to_numpy())
+    order = history.order
+    history_years = history.years - history.years[history.first] + 1
+    keys = frame[["hdb_main_data_id", "farm_key", "year"]].astype(object).to_numpy()[order]
+
+    rows: List[tuple] = []
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        for pair in pairs:
+            beginning = frame[pair.beginning].to_numpy(dtype=float)[order]
+            ending = frame[pair.ending].to_numpy(dtype=float)[order]
+            delta = ending - beginning
+            previous = previous_year(history, frame[pair.ending].to_numpy(dtype=float))
+            yoy_delta = ending - previous
+            # Growth from the first year's beginning value, compounded over the years since
+            start = beginning[history.first]
+            growing = (start > 0) & (ending > 0) & (history_years >= 2)
+            cagr = np.full(len(order), np.nan)
+            cagr[growing] = (ending[growing] / start[growing]) ** (1 / history_years[growing]) - 1
+            values = np.column_stack([beginning, ending, delta, _array_ratio(delta, np.abs(beginning)),
+                                      yoy_delta, _array_ratio(yoy_delta, np.abs(previous)), history_years, cagr])
+            present = ~(np.isnan(beginning) & np.isnan(ending))
+            cells = values[present].astype(object)
+            cells[np.isnan(values[present])] = None
+            rows.extend(tuple(key) + (pair.metric,) + tuple(cell)
+                        for key, cell in zip(keys[present].tolist(), cells.tolist()))
+    return rows
+
+@dataclass
+class ChangeRun:
+    """What one build or update did."""
+    farms: int
+    farm_years: int
+    rows: int
+    seconds: float
+
+def _insert(conn: sqlite3.Connection, rows: List[tuple]):
+    columns = ["hdb_main_data_id", "farm_key", "year", "metric"] + CHANGE_COLUMNS
+    conn.executemany(f"INSERT INTO {CHANGE_TABLE} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                     rows)
+
+def build_change_table(database_path: str) -> ChangeRun:
+    """(Re)build the change table for every farm-year, then its indexes."""
+    start = time.perf_counter()
+    conn = sqlite3.connect(database_path)
+    try:
+        pairs = paired_metrics(conn)
+        # Incremental updates load single farms' histories through these
+        for table in _TABLE_ALIASES:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_hdb_main_data_id ON {table}(hdb_main_data_id)")
+        frame = _load_pairs(conn, pairs)
+        rows = compute_changes(frame, pairs)
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {CHANGE_TABLE}")
+            conn.execute(f"CREATE TABLE {CHANGE_TABLE} (hdb_main_data_id TEXT, farm_key TEXT, year TEXT, metric TEXT, "
+                         f"beginning REAL, ending REAL, delta REAL, pct_change REAL, yoy_delta REAL, yoy_pct REAL, "
+                         f"history_years INTEGER, cagr REAL, PRIMARY KEY (hdb_main_data_id, metric))")
+            _insert(conn, rows)
+            # Built after the bulk insert; ranked columns are read in index order for top-k movers
+            for column in RANK_COLUMNS:
+                conn.execute(f"CREATE INDEX idx_{CHANGE_TABLE}_{column} ON {CHANGE_TABLE} (metric, {column})")
+            conn.execute(f"CREATE INDEX idx_{CHANGE_TABLE}_farm ON {CHANGE_TABLE} (farm_key, year)")
+        conn.execute(f"ANALYZE {CHANGE_TABLE}")
+        return ChangeRun(farms=frame["farm_key"].nunique(), farm_years=len(frame), rows=len(rows),
+                         seconds=time.perf_counter() - start)
+    finally:
+        conn.close()
+
+def has_change_table(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (CHANGE_TABLE,)).fetchone() is not None
+
+def update_change_table(database_path: str, farm_keys: Optional[Sequence[str]] = None) -> ChangeRun:
+    """
+    Bring the change table up to date with hdb_main_data: add rows for newly loaded
+    farm-years, and rewrite farms with removed or backfilled years, or the given farm_keys
+    after corrections. A farm-year's values depend only on its own, its previous and its
+    first year, so a farm whose new years all follow its existing ones only gains rows.
+    """
+    import pandas as pd
+
+    start = time.perf_counter()
+    conn = sqlite3.connect(database_path)
+    if not has_change_table(conn):
+        conn.close()
+        return build_change_table(database_path)
+    try:
+        rewrite = set(farm_keys or ())
+        new_ids = set()
+        if farm_keys is None:
+            # Farm-years without any paired value have no rows and are re-examined each time, which is cheap
+            new_rows = conn.execute(f"SELECT hdb_main_data_id, COALESCE(fbm_farm_id, hdb_main_data_id) "
+                                    f"FROM hdb_main_data WHERE hdb_main_data_id NOT IN "
+                                    f"(SELECT hdb_main_data_id FROM {CHANGE_TABLE})").fetchall()
+            new_ids = {row[0] for row in new_rows}
+            rewrite = {row[0] for row in conn.execute(
+                f"SELECT DISTINCT farm_key FROM {CHANGE_TABLE} "
+                f"WHERE hdb_main_data_id NOT IN (SELECT hdb_main_data_id FROM hdb_main_data)")}
+            affected = rewrite | {row[1] for row in new_rows}
+        else:
+            affected = set(rewrite)
+        if not affected:
+            return ChangeRun(farms=0, farm_years=0, rows=0, seconds=time.perf_counter() - start)
+
+        pairs = paired_metrics(conn)
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS changed_farms (farm_key TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.changed_farms")
+        conn.executemany("INSERT INTO temp.changed_farms VALUES (?)", ((key,) for key in affected))
+        frame = _load_pairs(conn, pairs, " WHERE COALESCE(h.fbm_farm_id, h.hdb_main_data_id) "
+                                         "IN (SELECT farm_key FROM temp.changed_farms)")
+        is_new = frame["hdb_main_data_id"].isin(new_ids)
+        years = pd.to_numeric(frame["year"], errors="coerce")
+        last_existing = years.where(~is_new).groupby(frame["farm_key"]).transform("max")
+        first_new = years.where(is_new).groupby(frame["farm_key"]).transform("min")
+        rewrite |= set(frame.loc[is_new & (first_new <= last_existing), "farm_key"])
+        written = set(frame.loc[is_new | frame["farm_key"].isin(rewrite), "hdb_main_data_id"])
+
+        rows = [row for row in compute_changes(frame, pairs) if row[0] in written]
+        with conn:
+            conn.executemany(f"DELETE FROM {CHANGE_TABLE} WHERE farm_key = ?", ((key,) for key in rewrite))
+            _insert(conn, rows)
+        logger.info(f"Updated {CHANGE_TABLE}: {len(written)} farm-years of {len(affected)} farms "
+                    f"({len(rewrite)} rewritten, {len(rows)} rows)")
+        return ChangeRun(farms=len(affected), farm_years=len(written), rows=len(rows),
+                         seconds=time.perf_counter() - start)
+    finally:
+        conn.close()
+
+def top_movers(conn: sqlite3.Connection, metric: str, n: int = 10, by: str = "delta",
+               descending: bool = True, year: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Farm-years with the largest (or smallest) change in one metric, read in (metric, change) index order."""
+    if by not in RANK_COLUMNS:
+        raise ValueError(f"Cannot rank by {by}; choose one of {', '.join(RANK_COLUMNS)}")
+    year_filter = " AND year = ?" if year else ""
+    cursor = conn.execute(f"SELECT hdb_main_data_id, year, beginning, ending, {by} FROM {CHANGE_TABLE} "
+                          f"WHERE metric = ? AND {by} IS NOT NULL{year_filter} "
+                          f"ORDER BY {by} {'DESC' if descending else 'ASC'} LIMIT ?",
+                          [metric] + ([year] if year else []) + [n])
+    columns = [desc[0] for desc in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def main():
+    """Build, update or query the change table."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Beginning-vs-ending and year-over-year change table")
+    parser.add_argument("command", choices=["build", "update", "top"])
+    parser.add_argument("database", nargs="?", default=os.getenv("DATABASE_PATH", "finbin_farm_data.db"))
+    parser.add_argument("--metric", default="working_capital", help="paired metric for `top`")
+    parser.add_argument("--by", default="delta", choices=RANK_COLUMNS)
+    parser.add_argument("-n", type=int, default=10)
+    parser.add_argument("--ascending", action="store_true", help="largest decreases instead of increases")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"❌ Database not found: {args.database}")
+        return 1
+    if args.command in ("build", "update"):
+        run = (build_change_table if args.command == "build" else update_change_table)(args.database)
+        print(f"✅ {CHANGE_TABLE} {args.command}: {run.rows} rows for {run.farm_years} farm-years "
+              f"of {run.farms} farms in {run.seconds:.2f}s")
+        return 0
+
+    conn = sqlite3.connect(args.database)
+    try:
+        for row in top_movers(conn, args.metric, args.n, args.by, descending=not args.ascending):
+            print(f"   {row['hdb_main_data_id']} {row['year']}: {row['beginning']} -> {row['ending']} "
+                  f"({args.by} {row[args.by]})")
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 """
 Simple script to check database contents
+Row counts come from db_inspect (trigger-maintained counts or ANALYZE
+statistics) instead of a COUNT(*) scan per table; pass --exact to count.
 """
 
-import sqlite3
 import os
+import sys
+from db_inspect import format_rows, inspect_database
 
 def check_database():
     """Check database contents."""
@@ -15,32 +18,24 @@ def check_database():
         return
     
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Get all tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
+        health = inspect_database(db_path, exact="--exact" in sys.argv[1:])
         
         print(f"📊 Database: {db_path}")
-        print(f"📋 Found {len(tables)} tables:")
+        print(f"📋 Found {len(health.tables)} tables:")
         print("=" * 50)
         
-        total_rows = 0
-        
-        for table in tables:
-            table_name = table[0]
-            try:
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                count = cursor.fetchone()[0]
-                total_rows += count
-                status = "✅" if count > 0 else "❌"
-                print(f"{status} {table_name}: {count} rows")
-            except Exception as e:
-                print(f"❌ {table_name}: Error - {e}")
+        for table in health.tables:
+            if table.error:
+                print(f"❌ {table.name}: Error - {table.error}")
+                continue
+            status = "✅" if table.rows else "❌"
+            print(f"{status} {table.name}: {format_rows(table)}")
         
+        total_rows = health.total_rows
         print("=" * 50)
         print(f"📈 Total rows across all tables: {total_rows}")
+        print(f"💾 {health.size_bytes / 1e6:.1f} MB, {health.page_count} pages, "
+              f"{health.fragmentation:.1%} free (checked in {health.seconds * 1000:.1f} ms)")
         
         # Check if data exists
         if total_rows == 0:
@@ -50,8 +45,6 @@ def check_database():
         else:
             print(f"\n✅ Database has {total_rows} rows of data")
         
-        conn.close()
-        
     except Exception as e:
         print(f"❌ Database error: {e}")
 
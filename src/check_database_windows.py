@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 """
 Windows-compatible script to check database contents (no emoji characters)
+Row counts come from db_inspect (trigger-maintained counts or ANALYZE
+statistics) instead of a COUNT(*) scan per table; pass --exact to count.
 """
 
-import sqlite3
 import os
 import sys
+from db_inspect import format_rows, inspect_database
 
 def check_database():
     """Check database contents."""
@@ -16,35 +18,27 @@ def check_database():
         return False
     
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Get all tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
+        health = inspect_database(db_path, exact="--exact" in sys.argv[1:])
         
         print(f"[INFO] Database: {db_path}")
-        print(f"[INFO] Found {len(tables)} tables:")
+        print(f"[INFO] Found {len(health.tables)} tables:")
         print("=" * 50)
         
-        total_rows = 0
-        
-        for table in tables:
-            table_name = table[0]
-            try:
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                count = cursor.fetchone()[0]
-                total_rows += count
-                status = "[OK]" if count > 0 else "[EMPTY]"
-                print(f"{status} {table_name}: {count} rows")
-            except Exception as e:
-                print(f"[ERROR] {table_name}: Error - {e}")
+        for table in health.tables:
+            if table.error:
+                print(f"[ERROR] {table.name}: Error - {table.error}")
+                continue
+            status = "[OK]" if table.rows else "[EMPTY]"
+            print(f"{status} {table.name}: {format_rows(table)}")
         
+        total_rows = health.total_rows
         print("=" * 50)
         print(f"[INFO] Total rows across all tables: {total_rows}")
+        print(f"[INFO] {health.size_bytes / 1e6:.1f} MB, {health.page_count} pages, "
+              f"{health.fragmentation:.1%} free (checked in {health.seconds * 1000:.1f} ms)")
         
         # Check if data exists
-        if total_rows == 0 or len(tables) == 0:
+        if total_rows == 0 or len(health.tables) == 0:
             print("\n[WARNING] Database is empty or has no tables!")
             print("   The database creation script may not have completed successfully.")
             print("   Run: python create_database.py")
@@ -53,8 +47,6 @@ def check_database():
             print(f"\n[SUCCESS] Database has {total_rows} rows of data")
             return True
         
-        conn.close()
-        
     except Exception as e:
         print(f"[ERROR] Database error: {e}")
         return False
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Conversation Sessions
+Server-side sessions that remember the last question, SQL and result DataFrame.
+Follow-ups that only refine the previous result (filter, sort, top-k, column
+subset) are answered with pandas on the cached frame instead of new SQL, and
+the conversation history sent to the model is compacted to a token budget.
+"""
+
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from token_budget import count_tokens, shrink_lines
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+US_STATES = {
+    'alabama': 'AL', 'alaska': 'AK', 'arizona': 'AZ', 'arkansas': 'AR', 'california': 'CA',
+    'colorado': 'CO', 'connecticut': 'CT', 'delaware': 'DE', 'florida': 'FL', 'georgia': 'GA',
+    'hawaii': 'HI', 'idaho': 'ID', 'illinois': 'IL', 'indiana': 'IN', 'iowa': 'IA', 'kansas': 'KS',
+    'kentucky': 'KY', 'louisiana': 'LA', 'maine': 'ME', 'maryland': 'MD', 'massachusetts': 'MA',
+    'michigan': 'MI', 'minnesota': 'MN', 'mississippi': 'MS', 'missouri': 'MO', 'montana': 'MT',
+    'nebraska': 'NE', 'nevada': 'NV', 'new hampshire': 'NH', 'new jersey': 'NJ', 'new mexico': 'NM',
+    'new york': 'NY', 'north carolina': 'NC', 'north dakota': 'ND', 'ohio': 'OH', 'oklahoma': 'OK',
+    'oregon': 'OR', 'pennsylvania': 'PA', 'rhode island': 'RI', 'south carolina': 'SC',
+    'south dakota': 'SD', 'tennessee': 'TN', 'texas': 'TX', 'utah': 'UT', 'vermont': 'VT',
+    'virginia': 'VA', 'washington': 'WA', 'west virginia': 'WV', 'wisconsin': 'WI', 'wyoming': 'WY'
+}
+
+_STATE_NAMES = {code: name for name, code in US_STATES.items()}
+
+# Openers and references that mark a question as depending on the previous turn
+_FOLLOWUP_PATTERN = re.compile(
+    r"^(now|then|and|also|only|just|sort|order|rank|filter|exclude|without|except|top|bottom|"
+    r"what about|how about|same)\b|\b(those|them|these|the same|previous|above|that list)\b",
+    re.IGNORECASE
+)
+_STOP_WORDS = {'the', 'a', 'an', 'by', 'of', 'for', 'in', 'on', 'to', 'and', 'or', 'with', 'them', 'those',
+               'these', 'only', 'just', 'now', 'show', 'me', 'sort', 'order', 'rank', 'column', 'columns',
+               'farm', 'farms', 'please', 'then', 'their', 'is', 'are', 'it', 'what', 'how', 'about'}
+_ASCENDING_WORDS = {'asc', 'ascending', 'lowest', 'smallest', 'least', 'bottom'}
+_COMPARATORS = {
+    'above': '>', 'over': '>', 'greater than': '>', 'more than': '>', 'at least': '>=',
+    'below': '<', 'under': '<', 'less than': '<', 'fewer than': '<', 'at most': '<='
+}
+
+def is_followup(question: str) -> bool:
+    """Short questions that open with a refinement cue or refer back to a previous result."""
+    return len(question.split()) <= 15 and bool(_FOLLOWUP_PATTERN.search(question.strip()))
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+def _match_column(phrase: str, columns: List[str]) -> Optional[str]:
+    """Column whose name best matches the words of phrase (net farm income -> net_farm_income)."""
+    wanted = {word for word in _words(phrase) if word not in _STOP_WORDS}
+    best, best_score = None, 0.0
+    for column in columns:
+        tokens = set(str(column).lower().split("_"))
+        overlap = len(wanted & tokens)
+        if overlap == 0:
+            continue
+        score = overlap - 0.1 * len(tokens - wanted)
+        if score > best_score:
+            best, best_score = column, score
+    return best
+
+@dataclass
+class Refinement:
+    """Pandas operations applied to a session's base result, keyed by kind so new ones replace old ones."""
+    filters: Dict[str, Tuple[str, Any]] = field(default_factory=dict)
+    sort: Optional[Tuple[str, bool]] = None
+    limit: Optional[Tuple[int, bool]] = None
+    columns: Optional[List[str]] = None
+
+    def merged_with(self, newer: "Refinement") -> "Refinement":
+        """Combine with a newer refinement; a new filter on the same column replaces the old one."""
+        return Refinement(
+            filters=dict(self.filters, **newer.filters),
+            sort=newer.sort or self.sort,
+            limit=newer.limit or self.limit,
+            columns=newer.columns or self.columns
+        )
+
+    def describe(self) -> str:
+        parts = []
+        for column, (op, value) in self.filters.items():
+            parts.append(f"{column} {op} {value!r}")
+        if self.sort:
+            parts.append(f"sort by {self.sort[0]} {'desc' if self.sort[1] else 'asc'}")
+        if self.limit:
+            parts.append(f"{'top' if self.limit[1] else 'bottom'} {self.limit[0]}")
+        if self.columns:
+            parts.append(f"columns {', '.join(self.columns)}")
+        return "; ".join(parts)
+
+    def apply(self, df: "pd.DataFrame") -> "pd.DataFrame":
+        """Vectorized filter / sort / limit / column selection."""
+        result = df
+        for column, (op, value) in self.filters.items():
+            series = result[column]
+            if op == "in":
+                mask = series.astype(str).str.lower().isin([str(v).lower() for v in value])
+            elif op == "not in":
+                mask = ~series.astype(str).str.lower().isin([str(v).lower() for v in value])
+            else:
+                numeric = series.astype(float)
+                mask = {'>': numeric > value, '>=': numeric >= value,
+                        '<': numeric < value, '<=': numeric <= value}[op]
+            result = result[mask]
+        if self.sort:
+            result = result.sort_values(self.sort[0], ascending=not self.sort[1], kind="stable")
+        if self.limit:
+            count, from_top = self.limit
+            result = result.head(count) if from_top else result.tail(count)
+        if self.columns:
+            result = result[self.columns]
+        return result
+
+def parse_refinement(question: str, df: "pd.DataFrame", base_complete: bool) -> Optional[Refinement]:
+    """
+    Recognize a follow-up that only filters, sorts, limits or selects columns of df.
+    Returns None when the question needs new SQL. Filters are only allowed when
+    df is the complete result (the previous SQL was not cut off by its LIMIT).
+    """
+    from pandas.api.types import is_numeric_dtype
+
+    if not is_followup(question):
+        return None
+    text = question.lower().strip().rstrip("?.!")
+    columns = [str(column) for column in df.columns]
+    numeric_columns = [column for column in columns if is_numeric_dtype(df[column])]
+    refinement = Refinement()
+    recognized = False
+
+    # Top / bottom k, optionally "by <column>"
+    match = re.search(r"\b(top|first|bottom|last)\s+(\d+)\b", text)
+    if match:
+        refinement.limit = (int(match.group(2)), match.group(1) in ("top", "first"))
+        recognized = True
+
+    # Sort: "sort/order/rank (those) by <column> [direction]" or "top 5 by <column>"
+    match = re.search(r"\b(?:sort|sorted|order|ordered|rank|ranked|top\s+\d+|bottom\s+\d+)\b.*?\bby\s+([a-z0-9 _-]+)", text)
+    if match:
+        phrase = match.group(1)
+        column = _match_column(phrase, numeric_columns) or _match_column(phrase, columns)
+        if column is None:
+            return None
+        descending = not (set(_words(text)) & _ASCENDING_WORDS)
+        if refinement.limit and not refinement.limit[1]:
+            # "bottom 5 by X" means the 5 lowest values of X
+            refinement.limit = (refinement.limit[0], True)
+        refinement.sort = (column, descending)
+        recognized = True
+
+    # Numeric thresholds: "<column> above 100000", "with net farm income over 50k"
+    for phrase, op in sorted(_COMPARATORS.items(), key=lambda item: -len(item[0])):
+        match = re.search(rf"([a-z0-9 _-]+?)\s+{phrase}\s+\$?(-?[\d,]+(?:\.\d+)?)\s*(k|m)?\b", text)
+        if not match:
+            continue
+        column = _match_column(match.group(1), numeric_columns)
+        if column is None:
+            return None
+        value = float(match.group(2).replace(",", "")) * {"k": 1e3, "m": 1e6}.get(match.group(3), 1)
+        refinement.filters[column] = (op, value)
+        recognized = True
+        break
+
+    # Category values: "only for Minnesota", "exclude Wisconsin", "what about IA and MN"
+    negate = bool(re.search(r"\b(exclude|excluding|without|except|not)\b", text))
+    for column in columns:
+        if column in numeric_columns:
+            continue
+        values = df[column].dropna().astype(str).unique()
+        if len(values) > 1000:
+            continue
+        found = []
+        for value in values:
+            if value in _STATE_NAMES:
+                # State codes match the full name, or the code written in capitals ("MN", not "in")
+                matched = (re.search(rf"\b{_STATE_NAMES[value]}\b", text)
+                           or re.search(rf"\b{re.escape(value)}\b", question))
+            else:
+                matched = len(value) >= 3 and re.search(rf"\b{re.escape(value.lower())}\b", text)
+            if matched:
+                found.append(value)
+        if found:
+            refinement.filters[column] = ("not in" if negate else "in", found)
+            recognized = True
+
+    # Column subset: "only show the state and net farm income columns"
+    match = re.search(r"\b(?:only show|show only|just show|only the|just the)\s+(.+?)(?:\s+columns?)?$", text)
+    if match and not refinement.filters:
+        selected = []
+        for part in re.split(r",|\band\b", match.group(1)):
+            column = _match_column(part, columns)
+            if column and column not in selected:
+                selected.append(column)
+        if selected:
+            refinement.columns = selected
+            recognized = True
+
+    if not recognized:
+        return None
+    if refinement.filters and not base_complete:
+        return None
+    return refinement
+
+@dataclass
+class Session:
+    """One conversation: its turns and the last SQL result."""
+    session_id: str
+    tenant_id: Optional[str] = None
+    turns: List[Dict[str, Any]] = field(default_factory=list)
+    base_sql: Optional[str] = None
+    base_result: Optional["pd.DataFrame"] = field(default=None, repr=False)
+    base_complete: bool = False
+    refinement: Optional[Refinement] = None
+    result_bytes: int = 0
+    last_used: float = field(default_factory=time.time)
+
+    def record_turn(self, question: str, sql: str, row_count: int, refined: Optional[str] = None,
+                    max_turns: int = 20):
+        """Remember a turn; only the most recent max_turns are kept."""
+        self.turns.append({"question": question, "sql": sql, "row_count": row_count, "refined": refined})
+        del self.turns[:-max_turns]
+
+    def history(self, max_tokens: int, full_turns: int = 2) -> str:
+        """
+        Compacted conversation for the prompt: the last full_turns with their SQL,
+        earlier turns as questions only, oldest lines dropped to fit max_tokens.
+        """
+        lines = []
+        for index, turn in enumerate(self.turns):
+            lines.append(f"Q{index + 1}: {turn['question']}")
+            if index >= len(self.turns) - full_turns:
+                lines.append(f"SQL{index + 1}: {turn['sql']}")
+        text = "\n".join(lines)
+        return shrink_lines(text, max_tokens) if count_tokens(text) > max_tokens else text
+
+class SessionStore:
+    """Memory-bounded, TTL-evicted conversation sessions."""
+
+    def __init__(self, ttl_seconds: float = 1800.0, max_sessions: int = 1000,
+                 max_bytes: int = 256 * 1024 * 1024, max_frame_bytes: int = 32 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_frame_bytes = max_frame_bytes
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+
+    def _evict(self, now: float):
+        """Drop expired sessions, then least recently used ones beyond the count/memory limits."""
+        for session_id in [sid for sid, s in self._sessions.items() if now - s.last_used > self.ttl_seconds]:
+            self._remove(session_id)
+        while self._sessions and (len(self._sessions) > self.max_sessions or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self._sessions)))
+
+    def _remove(self, session_id: str):
+        session = self._sessions.pop(session_id)
+        self.total_bytes -= session.result_bytes
+
+    def get(self, session_id: str, tenant_id: Optional[str] = None) -> Session:
+        """Return the session, starting a new one if it is unknown, expired or for another tenant."""
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get(session_id)
+            if session is None or session.tenant_id != tenant_id:
+                if session is not None:
+                    self._remove(session_id)
+                session = Session(session_id=session_id, tenant_id=tenant_id)
+                self._sessions[session_id] = session
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def store_result(self, session: Session, sql: str, df: Optional["pd.DataFrame"], complete: bool):
+        """
+        Keep a new base result for refinements; frames over max_frame_bytes are not kept, nor
+        frames of a session evicted since get() (its bytes already left total_bytes).
+        """
+        size = int(df.memory_usage(deep=True).sum()) if df is not None else 0
+        with self._lock:
+            tracked = self._sessions.get(session.session_id) is session
+            if tracked:
+                self.total_bytes -= session.result_bytes
+            keep = tracked and df is not None and size <= self.max_frame_bytes
+            session.base_sql = sql
+            session.base_result = df if keep else None
+            session.base_complete = complete
+            session.refinement = None
+            session.result_bytes = size if keep else 0
+            self.total_bytes += session.result_bytes
+            self._evict(time.time())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"sessions": len(self._sessions), "result_bytes": self.total_bytes}
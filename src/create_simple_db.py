@@ -6,6 +6,7 @@ Simple database creation script for Windows
 import sqlite3
 import os
 import sys
+from db_inspect import format_rows, inspect_database, install_row_counts
 
 def create_simple_database():
     """Create a simple database with sample data."""
@@ -163,8 +164,9 @@ def create_simple_database():
             """)
             print(f"[OK] Added 3 records to {table_name}")
         
-        # Commit changes
+        # Commit changes and keep row counts current from here on
         conn.commit()
+        install_row_counts(conn)
         conn.close()
         
         print("[SUCCESS] Database created successfully!")
@@ -185,34 +187,23 @@ def verify_database(db_path):
     """Verify the database has data."""
     
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Get all tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
+        # Trigger-maintained row counts; tables without them are counted in parallel
+        health = inspect_database(db_path, estimates=False)
         
-        total_rows = 0
-        
-        for table in tables:
-            table_name = table[0]
-            try:
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                count = cursor.fetchone()[0]
-                total_rows += count
-                status = "[OK]" if count > 0 else "[EMPTY]"
-                print(f"{status} {table_name}: {count} rows")
-            except Exception as e:
-                print(f"[ERROR] {table_name}: Error - {e}")
+        for table in health.tables:
+            if table.error:
+                print(f"[ERROR] {table.name}: Error - {table.error}")
+                continue
+            status = "[OK]" if table.rows else "[EMPTY]"
+            print(f"{status} {table.name}: {format_rows(table)}")
         
+        total_rows = health.total_rows
         print(f"[INFO] Total rows across all tables: {total_rows}")
         
         if total_rows > 0:
             print("[SUCCESS] Database has data!")
         else:
             print("[ERROR] Database is empty!")
-            
-        conn.close()
         
     except Exception as e:
         print(f"[ERROR] Error checking database: {e}")
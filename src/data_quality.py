@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Data-Quality Scan
+Checks the accounting identities of fm_stmts (beginning net worth plus the
+change equals calculated ending net worth, reported vs calculated ending net
+worth and cash, the cash-flow statement adding up) over every row with
+vectorized NumPy checks, reading the table in rowid chunks so memory stays
+bounded. Failing rows go to the indexed data_quality_flags table. Triggers
+record changed rows in a dirty-row table, and `update` re-checks only those:
+`python data_quality.py scan|update|summary <database>`.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FLAGS_TABLE = "data_quality_flags"
+DIRTY_TABLE = "data_quality_dirty"
+SOURCE_TABLE = "fm_stmts"
+
+@dataclass(frozen=True)
+class Check:
+    """
+    An identity whose residual (an expression over fm_stmts columns) should be zero. A row
+    fails when |residual| exceeds abs_tolerance and rel_tolerance times |scale|. Rows missing
+    a required input are not checked; optional inputs count as 0 when NULL.
+    """
+    name: str
+    residual: str
+    description: str
+    scale: Optional[str] = None
+    abs_tolerance: float = 1.0
+    rel_tolerance: float = 0.0
+    optional: Tuple[str, ...] = ()
+
+CHECKS = [
+    Check("net_worth_rollforward",
+          "beginning_net_worth + total_change_in_net_worth - ending_net_worth_calculated",
+          "beginning net worth plus the total change differs from calculated ending net worth",
+          scale="ending_net_worth_calculated", rel_tolerance=0.001),
+    Check("net_worth_reported",
+          "ending_net_worth_reported - ending_net_worth_calculated",
+          "reported ending net worth differs from the calculated value",
+          scale="ending_net_worth_calculated", abs_tolerance=1000.0, rel_tolerance=0.01),
+    Check("equity_discrepancy_mismatch",
+          "equity_discrepancy - (ending_net_worth_reported - ending_net_worth_calculated)",
+          "equity_discrepancy does not equal reported minus calculated ending net worth",
+          scale="ending_net_worth_calculated", rel_tolerance=0.001),
+    Check("cash_rollforward",
+          "beg_cash_balance_farm_and_nonfarm + net_change_in_cash_balance - ending_cash_balance_calculated",
+          "beginning cash plus the net change differs from calculated ending cash",
+          scale="ending_cash_balance_calculated", rel_tolerance=0.001),
+    Check("cash_flow_sum",
+          "cash_from_operations + cash_from_investing_activities + cash_from_financing_activities"
+          " - net_change_in_cash_balance",
+          "operating, investing and financing cash flows do not add up to the net change in cash",
+          scale="net_change_in_cash_balance", rel_tolerance=0.001),
+    Check("cash_from_operations",
+          "gross_cash_farm_income - total_cash_farm_expense + net_cash_from_hedging - cash_from_operations",
+          "gross cash income less cash expense (and hedging) differs from cash from operations",
+          scale="gross_cash_farm_income", rel_tolerance=0.001, optional=("net_cash_from_hedging",)),
+    Check("cash_reported",
+          "ending_cash_balance_reported - ending_cash_balance_calculated",
+          "reported ending cash differs from the calculated value",
+          scale="ending_cash_balance_calculated", abs_tolerance=1000.0, rel_tolerance=0.05),
+    Check("cash_discrepancy_mismatch",
+          "cash_flow_discrepancy - (ending_cash_balance_reported - ending_cash_balance_calculated)",
+          "cash_flow_discrepancy does not equal reported minus calculated ending cash",
+          scale="ending_cash_balance_calculated", rel_tolerance=0.001),
+]
+CHECKS_BY_NAME = {check.name: check for check in CHECKS}
+
+_COMPILED: Dict[str, Tuple[Any, Tuple[str, ...]]] = {}
+
+def _compiled(check: Check) -> Tuple[Any, Tuple[str, ...]]:
+    if check.name not in _COMPILED:
+        code = compile(check.residual, f"<check {check.name}>", "eval")
+        _COMPILED[check.name] = (code, code.co_names)
+    return _COMPILED[check.name]
+
+def checked_columns() -> List[str]:
+    """Every fm_stmts column some check reads."""
+    columns: List[str] = []
+    for check in CHECKS:
+        for column in _compiled(check)[1] + ((check.scale,) if check.scale else ()):
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+def run_checks(columns: Dict[str, "np.ndarray"]) -> Dict[str, Tuple["np.ndarray", "np.ndarray"]]:
+    """Per check: (failing row mask, residuals) over float columns with NaN for NULL."""
+    import numpy as np
+
+    results = {}
+    with np.errstate(invalid="ignore"):
+        for check in CHECKS:
+            code, inputs = _compiled(check)
+            values = {name: np.nan_to_num(columns[name], nan=0.0) if name in check.optional else columns[name]
+                      for name in inputs}
+            residual = np.asarray(eval(code, {"__builtins__": {}}, values), dtype=float)
+            tolerance = np.full(len(residual), check.abs_tolerance)
+            if check.scale:
+                tolerance = np.maximum(tolerance, check.rel_tolerance * np.abs(np.nan_to_num(columns[check.scale])))
+            # NaN residuals (a required input is missing) compare False: not checked, not flagged
+            results[check.name] = (np.abs(residual) > tolerance, residual)
+    return results
+
+def _flag_rows(frame: "pd.DataFrame", checked_at: float) -> List[tuple]:
+    columns = {name: frame[name].to_numpy(dtype=float) for name in checked_columns()}
+    rowids = frame["stmt_rowid"].to_numpy()
+    farm_ids = frame["hdb_main_data_id"].to_numpy(dtype=object)
+    rows = []
+    for name, (failing, residual) in run_checks(columns).items():
+        rows.extend(zip(rowids[failing].tolist(), farm_ids[failing].tolist(), [name] * int(failing.sum()),
+                        residual[failing].tolist(), [checked_at] * int(failing.sum())))
+    return rows
+
+def _read(conn: sqlite3.Connection, where: str, params: Sequence[Any] = ()) -> "pd.DataFrame":
+    import pandas as pd
+
+    frame = pd.read_sql_query(f"SELECT rowid AS stmt_rowid, hdb_main_data_id, {', '.join(checked_columns())} "
+                              f"FROM {SOURCE_TABLE} {where}", conn, params=tuple(params) or None)
+    for column in checked_columns():
+        frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    return frame
+
+def _insert_flags(conn: sqlite3.Connection, rows: List[tuple]):
+    conn.executemany(f"INSERT OR REPLACE INTO {FLAGS_TABLE} (stmt_rowid, hdb_main_data_id, check_name, residual, "
+                     f"checked_at) VALUES (?, ?, ?, ?, ?)", rows)
+
+def _create_tables(conn: sqlite3.Connection):
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {FLAGS_TABLE} (stmt_rowid INTEGER, hdb_main_data_id TEXT, "
+                 f"check_name TEXT, residual REAL, checked_at REAL, PRIMARY KEY (stmt_rowid, check_name))")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{FLAGS_TABLE}_check ON {FLAGS_TABLE} (check_name, residual)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{FLAGS_TABLE}_farm ON {FLAGS_TABLE} (hdb_main_data_id)")
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {DIRTY_TABLE} (stmt_rowid INTEGER PRIMARY KEY)")
+    # Changed and removed rows are queued for the next incremental update
+    watched = ", ".join(["hdb_main_data_id"] + checked_columns())
+    triggers = {
+        "ai": f"AFTER INSERT ON {SOURCE_TABLE} BEGIN INSERT OR IGNORE INTO {DIRTY_TABLE} VALUES (new.rowid); END",
+        "au": (f"AFTER UPDATE OF {watched} ON {SOURCE_TABLE} "
+               f"BEGIN INSERT OR IGNORE INTO {DIRTY_TABLE} VALUES (new.rowid); END"),
+        "ad": f"AFTER DELETE ON {SOURCE_TABLE} BEGIN INSERT OR IGNORE INTO {DIRTY_TABLE} VALUES (old.rowid); END",
+    }
+    for name, body in triggers.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {FLAGS_TABLE}_{name}")
+        conn.execute(f"CREATE TRIGGER {FLAGS_TABLE}_{name} {body}")
+
+@dataclass
+class ScanRun:
+    """What one full scan or incremental update did."""
+    rows_checked: int
+    flags: int
+    chunks: int
+    seconds: float
+
+def scan_database(database_path: str, chunk_size: int = 50_000) -> ScanRun:
+    """Check every fm_stmts row, chunk by chunk, and replace all flags."""
+    start = time.perf_counter()
+    checked_at = time.time()
+    conn = sqlite3.connect(database_path)
+    try:
+        with conn:
+            _create_tables(conn)
+            conn.execute(f"DELETE FROM {FLAGS_TABLE}")
+            conn.execute(f"DELETE FROM {DIRTY_TABLE}")
+            rows_checked = flags = chunks = 0
+            last_rowid = -1
+            # Keyset pagination on rowid: each chunk is one index range, however far into the table
+            while True:
+                frame = _read(conn, "WHERE rowid > ? ORDER BY rowid LIMIT ?", (last_rowid, chunk_size))
+                if frame.empty:
+                    break
+                rows = _flag_rows(frame, checked_at)
+                _insert_flags(conn, rows)
+                rows_checked += len(frame)
+                flags += len(rows)
+                chunks += 1
+                last_rowid = int(frame["stmt_rowid"].iloc[-1])
+        return ScanRun(rows_checked=rows_checked, flags=flags, chunks=chunks, seconds=time.perf_counter() - start)
+    finally:
+        conn.close()
+
+def has_flags_table(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (FLAGS_TABLE,)).fetchone() is not None
+
+def update_flags(database_path: str, chunk_size: int = 50_000) -> ScanRun:
+    """Re-check only the rows changed since the last scan or update (a full scan when there are no flags yet)."""
+    start = time.perf_counter()
+    checked_at = time.time()
+    conn = sqlite3.connect(database_path)
+    if not has_flags_table(conn):
+        conn.close()
+        return scan_database(database_path, chunk_size)
+    try:
+        rows_checked = flags = chunks = 0
+        while True:
+            with conn:
+                dirty = [row[0] for row in conn.execute(f"SELECT stmt_rowid FROM {DIRTY_TABLE} ORDER BY stmt_rowid "
+                                                        f"LIMIT ?", (chunk_size,))]
+                if not dirty:
+                    break
+                placeholders = ", ".join("?" for _ in dirty)
+                conn.execute(f"DELETE FROM {FLAGS_TABLE} WHERE stmt_rowid IN ({placeholders})", dirty)
+                # Deleted rows simply are not read back, so their flags stay removed
+                frame = _read(conn, f"WHERE rowid IN ({placeholders})", dirty)
+                rows = _flag_rows(frame, checked_at)
+                _insert_flags(conn, rows)
+                conn.execute(f"DELETE FROM {DIRTY_TABLE} WHERE stmt_rowid IN ({placeholders})", dirty)
+            rows_checked += len(dirty)
+            flags += len(rows)
+            chunks += 1
+        return ScanRun(rows_checked=rows_checked, flags=flags, chunks=chunks, seconds=time.perf_counter() - start)
+    finally:
+        conn.close()
+
+def flag_summary(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Flagged rows per check, read from the check index."""
+    counts = dict(conn.execute(f"SELECT check_name, COUNT(*) FROM {FLAGS_TABLE} GROUP BY check_name"))
+    return {check.name: counts.get(check.name, 0) for check in CHECKS}
+
+def describe_checks() -> str:
+    """One line per check for the SQL-generation prompt."""
+    return "\n".join(f"  - {check.name}: {check.description}" for check in CHECKS)
+
+def main():
+    """Scan, update or summarize the data-quality flags."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Accounting-identity checks on fm_stmts")
+    parser.add_argument("command", choices=["scan", "update", "summary"])
+    parser.add_argument("database", nargs="?", default=os.getenv("DATABASE_PATH", "finbin_farm_data.db"))
+    parser.add_argument("--chunk-size", type=int, default=int(os.getenv("DATA_QUALITY_CHUNK_ROWS", 50_000)))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"❌ Database not found: {args.database}")
+        return 1
+    if args.command in ("scan", "update"):
+        run = (scan_database if args.command == "scan" else update_flags)(args.database, args.chunk_size)
+        print(f"✅ {args.command}: {run.rows_checked} rows checked in {run.chunks} chunks, "
+              f"{run.flags} flags, {run.seconds:.2f}s")
+        return 0
+
+    conn = sqlite3.connect(args.database)
+    try:
+        if not has_flags_table(conn):
+            print(f"❌ No {FLAGS_TABLE} table; run `python data_quality.py scan` first")
+            return 1
+        pending = conn.execute(f"SELECT COUNT(*) FROM {DIRTY_TABLE}").fetchone()[0]
+        for name, count in flag_summary(conn).items():
+            print(f"   {name:<30} {count:>8} flagged")
+        print(f"   {pending} changed rows waiting for `update`")
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Database Inspection
+Row counts, page counts, index sizes and fragmentation for the farm database
+without scanning every table. Row counts come from a stats table that
+triggers keep current (`install`), falling back to the sqlite_stat1 estimates
+that ANALYZE writes, and only then to COUNT(*). The exact mode counts all
+tables in parallel, one connection per table. Shared by the check scripts:
+`python db_inspect.py health|install [database] [--exact] [--sizes]`.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+STATS_TABLE = "table_row_counts"
+
+# The loaded source tables. Derived tables (fact, metrics, change, data-quality flags) are
+# upserted with INSERT OR REPLACE, whose implicit deletes do not fire DELETE triggers
+# (recursive_triggers is off by default), so their counts would drift; they are counted instead
+MAINTAINED_TABLES = [
+    'hdb_main_data', 'fm_genin', 'fm_guide', 'fm_stmts', 'fm_prf_lq', 'fm_cap_ad', 'fm_hhold',
+    'fm_nf_ie', 'fm_fm_exp', 'fm_fm_inc', 'fm_beg_bs_end_bs'
+]
+
+# Where a row count came from, most to least trustworthy
+SOURCE_TRIGGERS = "triggers"
+SOURCE_EXACT = "exact"
+SOURCE_ANALYZE = "analyze"
+
+@dataclass
+class TableStats:
+    """One table's row count (and, when requested, its size on disk)."""
+    name: str
+    rows: Optional[int]
+    source: str
+    pages: Optional[int] = None
+    index_pages: Optional[int] = None
+    error: Optional[str] = None
+
+@dataclass
+class DatabaseHealth:
+    """Row counts and storage figures for a database, plus how long gathering them took."""
+    database_path: str
+    size_bytes: int
+    page_size: int
+    page_count: int
+    freelist_count: int
+    tables: List[TableStats] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def fragmentation(self) -> float:
+        """Share of the file's pages on the freelist (reclaimed by VACUUM)."""
+        return self.freelist_count / self.page_count if self.page_count else 0.0
+
+    @property
+    def total_rows(self) -> int:
+        return sum(table.rows or 0 for table in self.tables)
+
+def user_tables(conn: sqlite3.Connection) -> List[str]:
+    """Tables other than SQLite's own bookkeeping and the row-count stats table."""
+    return [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")
+            if not row[0].startswith("sqlite_") and row[0] != STATS_TABLE]
+
+def _trigger_names(table: str) -> List[str]:
+    return [f"{STATS_TABLE}_{table}_insert", f"{STATS_TABLE}_{table}_delete"]
+
+def install_row_counts(conn: sqlite3.Connection, tables: Optional[Sequence[str]] = None) -> Dict[str, int]:
+    """
+    Keep row counts for `tables` (default: the MAINTAINED_TABLES present) current with
+    insert/delete triggers, seeded with one exact count each; any other table loses its triggers.
+    Only list tables written with plain INSERT/DELETE. Dropping a table drops its triggers, and a
+    count is only trusted while they exist, so tables rebuilt by other scripts are counted instead.
+    """
+    existing = user_tables(conn)
+    tables = list(tables) if tables is not None else [table for table in MAINTAINED_TABLES if table in existing]
+    counts = {}
+    with conn:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {STATS_TABLE} (table_name TEXT PRIMARY KEY, "
+                     f"row_count INTEGER NOT NULL, updated_at REAL)")
+        for table in existing:
+            if table not in tables:
+                for trigger in _trigger_names(table):
+                    conn.execute(f'DROP TRIGGER IF EXISTS "{trigger}"')
+                conn.execute(f"DELETE FROM {STATS_TABLE} WHERE table_name = ?", (table,))
+        for table in tables:
+            insert_trigger, delete_trigger = _trigger_names(table)
+            conn.execute(f'DROP TRIGGER IF EXISTS "{insert_trigger}"')
+            conn.execute(f'DROP TRIGGER IF EXISTS "{delete_trigger}"')
+            counts[table] = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+            conn.execute(f"INSERT OR REPLACE INTO {STATS_TABLE} VALUES (?, ?, ?)", (table, counts[table], time.time()))
+            conn.execute(f'CREATE TRIGGER "{insert_trigger}" AFTER INSERT ON "{table}" BEGIN '
+                         f"UPDATE {STATS_TABLE} SET row_count = row_count + 1 WHERE table_name = '{table}'; END")
+            conn.execute(f'CREATE TRIGGER "{delete_trigger}" AFTER DELETE ON "{table}" BEGIN '
+                         f"UPDATE {STATS_TABLE} SET row_count = row_count - 1 WHERE table_name = '{table}'; END")
+    return counts
+
+def maintained_counts(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Trigger-maintained counts, for tables whose triggers are still in place."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (STATS_TABLE,)).fetchone() is None:
+        return {}
+    triggers = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    return {table: count for table, count in conn.execute(f"SELECT table_name, row_count FROM {STATS_TABLE}")
+            if all(name in triggers for name in _trigger_names(table))}
+
+def analyze_counts(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Row counts recorded by the last ANALYZE (estimates once the table has changed since)."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+        return {}
+    counts = {}
+    # The first number of every stat (table or index row) is the table's row count
+    for table, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+        if stat and table not in counts:
+            counts[table] = int(stat.split()[0])
+    return counts
+
+def _count(database_path: str, table: str) -> TableStats:
+    conn = sqlite3.connect(f"file:{database_path}?mode=ro", uri=True)
+    try:
+        return TableStats(table, conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0], SOURCE_EXACT)
+    except sqlite3.Error as e:
+        return TableStats(table, None, SOURCE_EXACT, error=str(e))
+    finally:
+        conn.close()
+
+def exact_counts(database_path: str, tables: Sequence[str], workers: Optional[int] = None) -> Dict[str, TableStats]:
+    """COUNT(*) every table, in parallel: sqlite3 releases the GIL while a statement runs."""
+    workers = workers or int(os.getenv("DB_INSPECT_WORKERS", min(8, (os.cpu_count() or 1) + 1)))
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tables) or 1))) as pool:
+        return {stats.name: stats for stats in pool.map(lambda table: _count(database_path, table), tables)}
+
+def table_sizes(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Pages per table and index from the dbstat virtual table ({} when SQLite is built without it)."""
+    try:
+        return dict(conn.execute("SELECT name, pageno FROM dbstat WHERE aggregate = TRUE"))
+    except sqlite3.OperationalError:
+        return {}
+
+def inspect_database(database_path: str, exact: bool = False, sizes: bool = False,
+                     estimates: bool = True) -> DatabaseHealth:
+    """
+    Row counts and storage figures. By default counts are read from the trigger-maintained stats
+    table, then from sqlite_stat1; only tables with neither are counted. `estimates=False` skips
+    sqlite_stat1 (stale right after a load); `exact` counts every table; `sizes` adds per-table
+    and per-index pages, which reads every page of the file.
+    """
+    start = time.perf_counter()
+    conn = sqlite3.connect(f"file:{database_path}?mode=ro", uri=True)
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        tables = user_tables(conn)
+        stats: Dict[str, TableStats] = {}
+        if not exact:
+            known = [(maintained_counts(conn), SOURCE_TRIGGERS)]
+            if estimates:
+                known.append((analyze_counts(conn), SOURCE_ANALYZE))
+            for table in tables:
+                for counts, source in known:
+                    if table in counts:
+                        stats[table] = TableStats(table, counts[table], source)
+                        break
+        stats.update(exact_counts(database_path, [table for table in tables if table not in stats]))
+
+        if sizes:
+            pages = table_sizes(conn)
+            indexes: Dict[str, List[str]] = {}
+            for name, table in conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index'"):
+                indexes.setdefault(table, []).append(name)
+            for table in tables:
+                stats[table].pages = pages.get(table)
+                stats[table].index_pages = sum(pages.get(index, 0) for index in indexes.get(table, []))
+    finally:
+        conn.close()
+    return DatabaseHealth(database_path=database_path, size_bytes=os.path.getsize(database_path),
+                          page_size=page_size, page_count=page_count, freelist_count=freelist_count,
+                          tables=[stats[table] for table in tables], seconds=time.perf_counter() - start)
+
+def format_rows(table: TableStats) -> str:
+    """Row count as the check scripts print it, marking estimates."""
+    if table.rows is None:
+        return "unknown"
+    return f"{table.rows} rows" + (" (estimated by ANALYZE)" if table.source == SOURCE_ANALYZE else "")
+
+def main():
+    """Print a health summary, or install the row-count triggers."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Farm database row counts and storage health")
+    parser.add_argument("command", choices=["health", "install"])
+    parser.add_argument("database", nargs="?", default=os.getenv("DATABASE_PATH", "finbin_farm_data.db"))
+    parser.add_argument("--exact", action="store_true", help="COUNT(*) every table (in parallel)")
+    parser.add_argument("--sizes", action="store_true", help="pages per table and index (reads the whole file)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"❌ Database not found: {args.database}")
+        return 1
+    if args.command == "install":
+        conn = sqlite3.connect(args.database)
+        try:
+            counts = install_row_counts(conn)
+        finally:
+            conn.close()
+        print(f"✅ Row counts maintained by triggers for {len(counts)} tables ({sum(counts.values())} rows)")
+        return 0
+
+    health = inspect_database(args.database, exact=args.exact, sizes=args.sizes)
+    print(f"📊 {health.database_path}: {health.size_bytes / 1e6:.1f} MB, {health.page_count} pages of "
+          f"{health.page_size} bytes, {health.fragmentation:.1%} free")
+    for table in health.tables:
+        line = f"   {table.name:<28} {format_rows(table):>32}  [{table.source}]"
+        if table.pages is not None:
+            line += f"  {table.pages} pages + {table.index_pages} index pages"
+        print(line)
+    print(f"📈 {health.total_rows} rows in {len(health.tables)} tables, gathered in {health.seconds * 1000:.1f} ms")
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
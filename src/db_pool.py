@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+SQLite Connection Pool
+A bounded pool of read-only connections to the farm database, shared by the
+threads that run generated SQL. Reusing connections skips the open/schema-load
+cost on every query and caps how many queries hit the file at once. Each
+connection keeps its compiled statements across requests (sqlite3's per-connection
+statement cache, keyed on the exact SQL text); statements are run under their
+canonical text so formatting differences do not defeat it, and the pool tracks
+how often a statement was already compiled on the connection that runs it. The
+cache is mirrored from every statement the connection executes, so internal
+queries that evict request statements are accounted for.
+"""
+
+import os
+import re
+import queue
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+_LITERAL_OR_SPACE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\s+")
+
+def canonical_sql(sql: str) -> str:
+    """One spelling per statement: whitespace runs outside literals collapsed, trailing semicolons dropped."""
+    text = _LITERAL_OR_SPACE.sub(lambda match: " " if match.group(0).isspace() else match.group(0), sql)
+    return text.strip().rstrip(";").rstrip()
+
+class PooledCursor(sqlite3.Cursor):
+    """Cursor whose statements are recorded in its connection's mirror of the statement cache."""
+
+    def execute(self, sql, *args):
+        self.connection.record(sql)
+        return super().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        self.connection.record(sql)
+        return super().executemany(sql, *args)
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A connection that mirrors its statement cache: every text it executes (request SQL, but
+    also EXPLAIN probes, entity lookups and catalog queries) in the cache's LRU order.
+    """
+
+    def __init__(self, *args, cached_statements: int = 128, **kwargs):
+        super().__init__(*args, cached_statements=cached_statements, **kwargs)
+        self.cache_size = cached_statements
+        self.compiled: "OrderedDict[str, None]" = OrderedDict()
+
+    def record(self, sql):
+        """sqlite3 looks every str statement up in its LRU cache (keyed on the exact text); do the same."""
+        if not isinstance(sql, str) or not self.cache_size:
+            return
+        if sql in self.compiled:
+            self.compiled.move_to_end(sql)
+            return
+        self.compiled[sql] = None
+        while len(self.compiled) > self.cache_size:
+            self.compiled.popitem(last=False)
+
+    def cursor(self, factory=PooledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        self.record(sql)
+        return super().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        self.record(sql)
+        return super().executemany(sql, *args)
+
+class ConnectionPool:
+    """Hands out up to `size` read-only connections; callers block while all are in use."""
+
+    def __init__(self, database_path: str, size: int = 4, timeout: float = 30.0, statement_cache_size: int = 256,
+                 on_connect: Optional[Callable[[sqlite3.Connection], None]] = None):
+        self.database_path = database_path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.statement_cache_size = max(0, statement_cache_size)
+        # Per-connection setup, e.g. registering SQL functions
+        self.on_connect = on_connect
+        self.created = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.statement_hits = 0
+        self.statement_misses = 0
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open one read-only connection usable from any pool thread."""
+        conn = sqlite3.connect(f"file:{self.database_path}?mode=ro", uri=True, timeout=self.timeout,
+                               check_same_thread=False, cached_statements=self.statement_cache_size,
+                               factory=PooledConnection)
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        self.created += 1
+        return conn
+
+    def statement(self, conn: sqlite3.Connection, sql: str) -> str:
+        """
+        The text to execute sql under on conn. Counts a hit when conn compiled the same
+        canonical text recently enough to still hold it in its statement cache; executing
+        the text (like any other statement on conn) updates the cache mirror.
+        """
+        text = canonical_sql(sql)
+        compiled = getattr(conn, "compiled", None)
+        if compiled is None or not self.statement_cache_size:
+            return text
+        # Only the thread that checked conn out touches its LRU; the counters are shared
+        hit = text in compiled
+        with self._lock:
+            if hit:
+                self.statement_hits += 1
+            else:
+                self.statement_misses += 1
+        return text
+
+    def _reset_after_fork(self):
+        """Connections must not cross fork(); a forked worker starts with an empty pool."""
+        if self._pid != os.getpid():
+            self._idle = queue.LifoQueue()
+            self.created = 0
+            self._pid = os.getpid()
+
+    def _checkout(self) -> sqlite3.Connection:
+        with self._lock:
+            self._reset_after_fork()
+            self.checkouts += 1
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                if self.created < self.size:
+                    return self._connect()
+            self.waits += 1
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No database connection free after {self.timeout:.0f}s")
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection for the duration of the with-block."""
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            # Bad generated SQL leaves the connection usable; just end any open transaction
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self.created = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool counters for monitoring."""
+        lookups = self.statement_hits + self.statement_misses
+        return {
+            "size": self.size,
+            "open": self.created,
+            "idle": self._idle.qsize(),
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "statement_cache_size": self.statement_cache_size,
+            "statement_hits": self.statement_hits,
+            "statement_misses": self.statement_misses,
+            "statement_hit_rate": self.statement_hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+FTS5 Entity Index
+A trigram full-text index over the entity-name columns (farm/item names, client
+names, counties and banker names), stored in the farm database and kept in sync
+by triggers. Before SQL generation the resolver maps names mentioned in the
+question to the exact stored values and farm ids, so the LLM writes equality
+predicates instead of `LIKE '%...%'`; LIKE predicates it still writes on these
+columns are rewritten into lookups on the index. Build the index once with
+`python entity_index.py build <database>`; B-tree indexes on the same columns
+are created alongside it.
+"""
+
+import os
+import re
+import sqlite3
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Tuple
+
+from conversation import US_STATES, _STATE_NAMES
+from data_quality import DIRTY_TABLE
+from db_inspect import STATS_TABLE
+
+logger = logging.getLogger(__name__)
+
+INDEX_TABLE = "entity_index"
+KEYS_TABLE = "entity_index_keys"
+
+@dataclass(frozen=True)
+class EntityColumn:
+    kind: str
+    table: str
+    column: str
+    key: str       # primary key of the table, recorded for each indexed value
+
+ENTITY_COLUMNS = [
+    EntityColumn("farm", "fm_genin", "item_name", "fm_genin_guid"),
+    EntityColumn("client", "hdb_main_data", "client_first_last_name", "hdb_main_data_id"),
+    EntityColumn("county", "hdb_main_data", "county", "hdb_main_data_id"),
+    EntityColumn("banker", "hdb_main_data", "primary_banker_name", "hdb_main_data_id"),
+]
+_BY_TABLE_COLUMN = {(entity.table, entity.column): entity for entity in ENTITY_COLUMNS}
+
+def is_internal_table(name: str) -> bool:
+    """Index, change-tracking, row-count and SQLite bookkeeping tables, which are not part of the schema shown to the LLM."""
+    return name.startswith((INDEX_TABLE, DIRTY_TABLE, STATS_TABLE, "sqlite_"))
+
+def build_entity_index(database_path: str) -> Dict[str, int]:
+    """(Re)create the FTS5 index, its sync triggers and B-tree indexes; returns indexed values per kind."""
+    conn = sqlite3.connect(database_path)
+    try:
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {INDEX_TABLE}")
+            conn.execute(f"DROP TABLE IF EXISTS {KEYS_TABLE}")
+            conn.execute(f"CREATE VIRTUAL TABLE {INDEX_TABLE} USING fts5(value, kind UNINDEXED, tokenize='trigram')")
+            # Index rowid -> the source row's primary key; rowids of the source tables change on VACUUM
+            conn.execute(f"CREATE TABLE {KEYS_TABLE} (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, key TEXT NOT NULL, "
+                         f"UNIQUE (key, kind))")
+            for entity in ENTITY_COLUMNS:
+                key = f"{entity.table}_{entity.column}"
+                present = f"new.{entity.column} IS NOT NULL AND new.{entity.column} != ''"
+                old_id = f"SELECT id FROM {KEYS_TABLE} WHERE key = old.{entity.key} AND kind = '{entity.kind}'"
+                delete_old = (f"DELETE FROM {INDEX_TABLE} WHERE rowid = ({old_id}); "
+                              f"DELETE FROM {KEYS_TABLE} WHERE key = old.{entity.key} AND kind = '{entity.kind}';")
+                insert_new = (f"INSERT INTO {KEYS_TABLE} (kind, key) SELECT '{entity.kind}', new.{entity.key} "
+                              f"WHERE {present}; "
+                              f"INSERT INTO {INDEX_TABLE} (rowid, value, kind) SELECT id, new.{entity.column}, kind "
+                              f"FROM {KEYS_TABLE} WHERE key = new.{entity.key} AND kind = '{entity.kind}' AND {present};")
+                conn.execute(f"INSERT INTO {KEYS_TABLE} (kind, key) SELECT '{entity.kind}', {entity.key} "
+                             f"FROM {entity.table} WHERE {entity.column} IS NOT NULL AND {entity.column} != ''")
+                conn.execute(f"INSERT INTO {INDEX_TABLE} (rowid, value, kind) SELECT k.id, t.{entity.column}, k.kind "
+                             f"FROM {KEYS_TABLE} k JOIN {entity.table} t ON t.{entity.key} = k.key "
+                             f"WHERE k.kind = '{entity.kind}'")
+                for trigger in ("ai", "ad", "au"):
+                    conn.execute(f"DROP TRIGGER IF EXISTS {INDEX_TABLE}_{key}_{trigger}")
+                conn.execute(f"CREATE TRIGGER {INDEX_TABLE}_{key}_ai AFTER INSERT ON {entity.table} "
+                             f"BEGIN {insert_new} END")
+                conn.execute(f"CREATE TRIGGER {INDEX_TABLE}_{key}_ad AFTER DELETE ON {entity.table} "
+                             f"BEGIN {delete_old} END")
+                conn.execute(f"CREATE TRIGGER {INDEX_TABLE}_{key}_au AFTER UPDATE OF {entity.column}, {entity.key} "
+                             f"ON {entity.table} BEGIN {delete_old} {insert_new} END")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{key} ON {entity.table} ({entity.column})")
+            conn.execute(f"INSERT INTO {INDEX_TABLE} ({INDEX_TABLE}) VALUES ('optimize')")
+        return dict(conn.execute(f"SELECT kind, COUNT(*) FROM {INDEX_TABLE} GROUP BY kind").fetchall())
+    finally:
+        conn.close()
+
+def has_entity_index(conn: sqlite3.Connection) -> bool:
+    """True for an index with its key table (indexes built before keys were recorded need a rebuild)."""
+    return conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name IN (?, ?)",
+                        (INDEX_TABLE, KEYS_TABLE)).fetchone()[0] == 2
+
+@dataclass
+class EntityMatch:
+    """One stored value a mention in the question resolved to."""
+    mention: str
+    kind: str
+    value: str
+    farm_ids: List[str] = field(default_factory=list)
+    exact: bool = False
+
+    def describe(self) -> str:
+        entity = next(e for e in ENTITY_COLUMNS if e.kind == self.kind)
+        text = f'- "{self.mention}" is {self.kind} {entity.table}.{entity.column} = \'{self.value}\''
+        if self.farm_ids:
+            ids = ", ".join(f"'{farm_id}'" for farm_id in self.farm_ids)
+            text += f" (hdb_main_data_id IN ({ids}))"
+        return text
+
+# Capitalized names, optionally with numbers and joining words ("Client 12 Farm", "Lac qui Parle")
+_MENTION_PATTERN = re.compile(r"\b[A-Z][\w'&.-]*(?:\s+(?:[A-Z][\w'&.-]*|\d+|of|and|qui|du|de|la|&))*")
+_QUOTED_PATTERN = re.compile(r"[\"“]([^\"”]{3,80})[\"”]|'([^']{3,80})'")
+_QUESTION_WORDS = {"which", "what", "show", "how", "list", "compare", "find", "give", "tell", "who", "where",
+                   "are", "is", "do", "does", "the", "for", "top", "me", "and", "in"}
+_GENERIC_SUFFIXES = ("county", "farms", "farm")
+# Farm ids are only listed for narrow matches
+_MAX_FARM_IDS = 10
+
+def extract_mentions(question: str) -> List[str]:
+    """Names in the question worth looking up: quoted strings, then capitalized phrases that are not states."""
+    mentions = [a or b for a, b in _QUOTED_PATTERN.findall(question)]
+    for match in _MENTION_PATTERN.finditer(question):
+        words = match.group(0).split()
+        while words and words[0].lower() in _QUESTION_WORDS:
+            words = words[1:]
+        phrase = " ".join(words).strip(".,?!")
+        if len(phrase) < 3 or phrase.lower() in US_STATES or phrase in _STATE_NAMES:
+            continue
+        if phrase not in mentions:
+            mentions.append(phrase)
+    return mentions
+
+class EntityResolver:
+    """Resolves mentions against the index through a connection factory (e.g. the read-only pool)."""
+
+    def __init__(self, connection: Callable, max_matches: int = 5):
+        self.connection = connection
+        self.max_matches = max_matches
+        self.lookups = 0
+        self.resolved = 0
+
+    def _lookup(self, conn: sqlite3.Connection, text: str) -> List[Tuple[str, str, int]]:
+        """(kind, value, rows) for stored values containing text, exact matches first."""
+        # A quoted trigram phrase is a case-insensitive substring match served by the index
+        phrase = 'value:"' + text.replace('"', '""') + '"'
+        return conn.execute(
+            f"SELECT kind, value, COUNT(*) AS rows FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH ? "
+            "GROUP BY kind, value ORDER BY lower(value) = lower(?) DESC, length(value) LIMIT ?",
+            (phrase, text, self.max_matches)).fetchall()
+
+    def resolve(self, question: str) -> List[EntityMatch]:
+        mentions = extract_mentions(question)
+        if not mentions:
+            return []
+        matches: List[EntityMatch] = []
+        with self.connection() as conn:
+            if not has_entity_index(conn):
+                return []
+            for mention in mentions:
+                self.lookups += 1
+                found = self._lookup(conn, mention)
+                words = mention.split()
+                if not found and len(words) > 1 and words[-1].lower() in _GENERIC_SUFFIXES:
+                    # "Boone County" is stored as county 'Boone'
+                    found = self._lookup(conn, " ".join(words[:-1]))
+                for kind, value, rows in found:
+                    match = EntityMatch(mention, kind, value, exact=value.lower() == mention.lower())
+                    if rows <= _MAX_FARM_IDS:
+                        match.farm_ids = self._farm_ids(conn, kind, value)
+                    matches.append(match)
+        # A mention that matches a value exactly does not need its looser matches
+        exact = {match.mention for match in matches if match.exact}
+        matches = [match for match in matches if match.exact or match.mention not in exact]
+        self.resolved += len({match.mention for match in matches})
+        return matches
+
+    @staticmethod
+    def _farm_ids(conn: sqlite3.Connection, kind: str, value: str) -> List[str]:
+        entity = next(e for e in ENTITY_COLUMNS if e.kind == kind)
+        # Served by the B-tree index built with the entity index
+        rows = conn.execute(
+            f"SELECT DISTINCT hdb_main_data_id FROM {entity.table} WHERE {entity.column} = ? LIMIT ?",
+            (value, _MAX_FARM_IDS)).fetchall()
+        return [row[0] for row in rows if row[0]]
+
+    def prompt_hint(self, question: str) -> str:
+        """Resolved entities as prompt lines, or "" when nothing resolved."""
+        try:
+            matches = self.resolve(question)
+        except sqlite3.Error as e:
+            logger.warning(f"Entity lookup failed: {e}")
+            return ""
+        return "\n".join(match.describe() for match in matches)
+
+    def stats(self) -> Dict[str, int]:
+        return {"lookups": self.lookups, "resolved": self.resolved}
+
+_TABLE_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!(?:ON|WHERE|JOIN|LEFT|INNER|CROSS|GROUP|"
+                          r"ORDER|LIMIT|USING|NATURAL|OUTER|RIGHT|FULL)\b)(\w+))?", re.IGNORECASE)
+_LIKE_PREDICATE = re.compile(r"(?<!NOT\s)\b(?:(\w+)\.)?(\w+)\s+LIKE\s+('(?:[^']|'')*')(?!\s+ESCAPE)", re.IGNORECASE)
+
+def rewrite_like_predicates(sql: str) -> Tuple[str, int]:
+    """
+    Turn `alias.column LIKE '...'` on an indexed entity column into a primary-key lookup
+    through the trigram index, which answers LIKE without scanning the table. Returns (sql, rewrites).
+    """
+    aliases: Dict[str, str] = {}
+    # How each table is referred to in FROM/JOIN: its alias when it has one
+    references: Dict[str, List[str]] = {}
+    for table, alias in _TABLE_ALIAS.findall(sql):
+        aliases[(alias or table).lower()] = table.lower()
+        aliases.setdefault(table.lower(), table.lower())
+        references.setdefault(table.lower(), []).append(alias or table)
+    if not aliases:
+        return sql, 0
+    tables = set(references)
+    rewrites = 0
+
+    def replace(match: re.Match) -> str:
+        nonlocal rewrites
+        qualifier, column, pattern = match.group(1), match.group(2).lower(), match.group(3)
+        if qualifier:
+            table = aliases.get(qualifier.lower())
+        else:
+            # Unqualified: only when exactly one table in the query has this entity column,
+            # and that table appears once, so its key can be qualified unambiguously
+            owners = [t for t in tables if (t, column) in _BY_TABLE_COLUMN]
+            table = owners[0] if len(owners) == 1 and len(references[owners[0]]) == 1 else None
+        entity = _BY_TABLE_COLUMN.get((table, column)) if table else None
+        if entity is None:
+            return match.group(0)
+        rewrites += 1
+        key = f"{qualifier or references[table][0]}.{entity.key}"
+        return (f"{key} IN (SELECT key FROM {KEYS_TABLE} WHERE id IN (SELECT rowid FROM {INDEX_TABLE} "
+                f"WHERE value LIKE {pattern} AND kind = '{entity.kind}'))")
+
+    return _LIKE_PREDICATE.sub(replace, sql), rewrites
+
+def main():
+    """Build the entity index or resolve a question against it."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="FTS5 entity index for farm, client, county and banker names")
+    parser.add_argument("command", choices=["build", "resolve"])
+    parser.add_argument("database", nargs="?", default=os.getenv("DATABASE_PATH", "finbin_farm_data.db"))
+    parser.add_argument("--question", default="", help="question to resolve (resolve command)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"❌ Database not found: {args.database}")
+        return 1
+    if args.command == "build":
+        counts = build_entity_index(args.database)
+        print(f"✅ Entity index built in {args.database}")
+        for kind, count in counts.items():
+            print(f"   {kind:<8} {count:8d} values")
+        return 0
+
+    from contextlib import closing
+    resolver = EntityResolver(lambda: closing(sqlite3.connect(args.database)))
+    hint = resolver.prompt_hint(args.question)
+    print(hint or "No entities resolved")
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Farm-Year Fact Table
+A denormalized wide table with one row per farm-year (hdb_main_data row): the
+descriptor columns from hdb_main_data and fm_genin plus the most-used metric
+columns from fm_guide and fm_stmts, under their source names. Analytic
+questions over these columns read one table instead of joining four on
+hdb_main_data_id. The table is built in bulk with `python fact_table.py build
+<database>` and kept in sync afterwards by triggers on the source tables, which
+refresh only the affected farm-year.
+"""
+
+import os
+import sqlite3
+import logging
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+FACT_TABLE = "farm_year_facts"
+
+# Source table -> (alias, columns copied into the fact table); names stay as in the source
+FACT_SOURCES = {
+    "hdb_main_data": ("h", [
+        "hdb_main_data_id", "tenant_id", "organization_id", "branch_id", "primary_banker_name",
+        "fbm_farm_id", "year", "state", "county", "client_first_last_name"
+    ]),
+    "fm_genin": ("gi", ["fm_genin_guid", "item_name"]),
+    "fm_guide": ("g", [
+        "current_ratio_beg", "current_ratio_end", "working_capital_beg", "working_capital_end",
+        "rate_of_ret_on_farm_assets_cost", "rate_of_ret_on_farm_assets_mkt", "rate_of_ret_on_farm_equity_cost",
+        "operating_profit_margin_cost", "net_farm_income_cost", "net_farm_income_mkt", "ebitda_cost",
+        "capital_repayment_margin", "term_debt_coverage_ratio_accr", "asset_turnover_rate_cost",
+        "operating_expense_ratio", "interest_expense_ratio", "beg_cost_farm_debt_to_asset_ratio",
+        "end_cost_farm_debt_to_asset_ratio", "end_mkt_farm_debt_to_asset_ratio",
+        "end_cost_farm_debt_to_equity_ratio", "end_cost_farm_equity_to_asset_ratio"
+    ]),
+    "fm_stmts": ("s", [
+        "beginning_net_worth", "net_farm_income", "ending_net_worth_reported", "total_change_in_net_worth",
+        "gross_cash_farm_income", "total_cash_farm_expense", "net_nonfarm_income",
+        "family_living_expense_reported", "principal_payments", "money_borrowed"
+    ]),
+}
+_CHILD_TABLES = [table for table in FACT_SOURCES if table != "hdb_main_data"]
+FACT_INDEXES = {"state_year": ["state", "year"], "county": ["county"], "tenant": ["tenant_id", "year"]}
+
+def fact_columns() -> List[str]:
+    return [column for _, columns in FACT_SOURCES.values() for column in columns]
+
+def _select_sql(where: str = "") -> str:
+    """One fact row per hdb_main_data row; farm-years without child rows get NULL metrics."""
+    selected = ", ".join(f"{alias}.{column}" for alias, columns in FACT_SOURCES.values() for column in columns)
+    joins = " ".join(f"LEFT JOIN {table} {FACT_SOURCES[table][0]} "
+                     f"ON {FACT_SOURCES[table][0]}.hdb_main_data_id = h.hdb_main_data_id" for table in _CHILD_TABLES)
+    return f"SELECT {selected} FROM hdb_main_data h {joins}{where}"
+
+def _refresh(farm_id: str) -> str:
+    """Trigger statement that rewrites the fact row of one farm-year."""
+    return (f"INSERT OR REPLACE INTO {FACT_TABLE} ({', '.join(fact_columns())}) "
+            f"{_select_sql(f' WHERE h.hdb_main_data_id = {farm_id}')};")
+
+def _create_triggers(conn: sqlite3.Connection):
+    remove_old = f"DELETE FROM {FACT_TABLE} WHERE hdb_main_data_id = old.hdb_main_data_id;"
+    watched = ", ".join(FACT_SOURCES["hdb_main_data"][1])
+    triggers = {
+        "hdb_main_data_ai": f"AFTER INSERT ON hdb_main_data BEGIN {_refresh('new.hdb_main_data_id')} END",
+        "hdb_main_data_au": (f"AFTER UPDATE OF {watched} ON hdb_main_data "
+                             f"BEGIN {remove_old} {_refresh('new.hdb_main_data_id')} END"),
+        "hdb_main_data_ad": f"AFTER DELETE ON hdb_main_data BEGIN {remove_old} END",
+    }
+    for table in _CHILD_TABLES:
+        watched = ", ".join(["hdb_main_data_id"] + FACT_SOURCES[table][1])
+        triggers[f"{table}_ai"] = f"AFTER INSERT ON {table} BEGIN {_refresh('new.hdb_main_data_id')} END"
+        triggers[f"{table}_au"] = (f"AFTER UPDATE OF {watched} ON {table} "
+                                   f"BEGIN {_refresh('old.hdb_main_data_id')} {_refresh('new.hdb_main_data_id')} END")
+        triggers[f"{table}_ad"] = f"AFTER DELETE ON {table} BEGIN {_refresh('old.hdb_main_data_id')} END"
+    for name, body in triggers.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {FACT_TABLE}_{name}")
+        conn.execute(f"CREATE TRIGGER {FACT_TABLE}_{name} {body}")
+
+def build_fact_table(database_path: str) -> int:
+    """(Re)build the fact table in bulk with its indexes and sync triggers; returns the number of rows."""
+    conn = sqlite3.connect(database_path)
+    try:
+        with conn:
+            types = {}
+            for table, (_, columns) in FACT_SOURCES.items():
+                declared = {row[1]: row[2] for row in conn.execute(f"PRAGMA table_info({table})")}
+                missing = [column for column in columns if column not in declared]
+                if missing:
+                    raise ValueError(f"{table} has no column(s) {', '.join(missing)}")
+                types.update((column, declared[column] or "TEXT") for column in columns)
+            # The incremental refreshes look child rows up by farm-year
+            for table in _CHILD_TABLES:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_hdb_main_data_id ON {table}(hdb_main_data_id)")
+
+            conn.execute(f"DROP TABLE IF EXISTS {FACT_TABLE}")
+            definitions = ", ".join(f"{column} {types[column]}" + (" PRIMARY KEY" if column == "hdb_main_data_id" else "")
+                                    for column in fact_columns())
+            conn.execute(f"CREATE TABLE {FACT_TABLE} ({definitions})")
+            # Stored in state/county/year order, so the indexes on those columns read neighbouring pages
+            conn.execute(f"INSERT OR REPLACE INTO {FACT_TABLE} ({', '.join(fact_columns())}) "
+                         f"{_select_sql()} ORDER BY h.state, h.county, h.year")
+            for name, columns in FACT_INDEXES.items():
+                conn.execute(f"CREATE INDEX idx_{FACT_TABLE}_{name} ON {FACT_TABLE} ({', '.join(columns)})")
+            _create_triggers(conn)
+        conn.execute(f"ANALYZE {FACT_TABLE}")
+        return conn.execute(f"SELECT COUNT(*) FROM {FACT_TABLE}").fetchone()[0]
+    finally:
+        conn.close()
+
+def has_fact_table(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (FACT_TABLE,)).fetchone() is not None
+
+def verify_fact_table(database_path: str) -> Dict[str, int]:
+    """Fact rows, source farm-years, and fact rows that differ from a fresh join (0 when in sync)."""
+    conn = sqlite3.connect(database_path)
+    try:
+        columns = ", ".join(fact_columns())
+        return {
+            "rows": conn.execute(f"SELECT COUNT(*) FROM {FACT_TABLE}").fetchone()[0],
+            "farm_years": conn.execute("SELECT COUNT(*) FROM hdb_main_data").fetchone()[0],
+            "stale": conn.execute(f"SELECT COUNT(*) FROM (SELECT {columns} FROM {FACT_TABLE} "
+                                  f"EXCEPT {_select_sql()})").fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+def main():
+    """Build or verify the fact table."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Denormalized farm-year fact table")
+    parser.add_argument("command", choices=["build", "verify"])
+    parser.add_argument("database", nargs="?", default=os.getenv("DATABASE_PATH", "finbin_farm_data.db"))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"❌ Database not found: {args.database}")
+        return 1
+    if args.command == "build":
+        rows = build_fact_table(args.database)
+        print(f"✅ {FACT_TABLE} built in {args.database}: {rows} farm-years, {len(fact_columns())} columns")
+        return 0
+
+    counts = verify_fact_table(args.database)
+    in_sync = counts["rows"] == counts["farm_years"] and counts["stale"] == 0
+    print(f"{'✅' if in_sync else '❌'} {FACT_TABLE}: {counts['rows']} rows for {counts['farm_years']} farm-years, "
+          f"{counts['stale']} stale")
+    return 0 if in_sync else 1
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
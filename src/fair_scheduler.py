@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Weighted Fair Request Scheduling
+Admits whole questions into the pipeline per tenant and request class
+(interactive, batch, warm-up). Waiting requests are served in weighted fair
+queueing order (virtual finish times per tenant/class flow), so a tenant
+flooding the service with batch work cannot starve interactive users. Each
+tenant also has a concurrency cap and per-minute quotas for LLM calls and SQL
+CPU seconds. While several classes are active, each may only occupy its
+weighted share of the slots, and a few slots are kept free for interactive
+requests.
+"""
+
+import time
+import asyncio
+import itertools
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+from llm_scheduler import SchedulerOverloaded, TokenBucket
+from llm_resilience import LatencyTracker
+
+logger = logging.getLogger(__name__)
+
+# Share of the pipeline each class gets while several are waiting
+CLASS_WEIGHTS = {"interactive": 8.0, "batch": 1.0, "warmup": 0.5}
+ANONYMOUS_TENANT = "anonymous"
+
+class TenantQuotaExceeded(SchedulerOverloaded):
+    """The tenant used up its LLM-call or SQL-time quota; retry after `retry_after` seconds."""
+
+def tenant_key(tenant_id: Optional[str] = None, organization_id: Optional[str] = None) -> str:
+    """The flow a request is accounted to: its tenant, else its organization."""
+    return tenant_id or organization_id or ANONYMOUS_TENANT
+
+def usage_from_result(result: Dict[str, Any]) -> Tuple[int, float]:
+    """(LLM calls, SQL CPU seconds) spent by one ask_question result."""
+    llm_calls = (result.get("token_usage") or {}).get("llm_calls", 0)
+    sql_seconds = (result.get("query_result") or {}).get("cpu_time", 0.0)
+    return llm_calls, sql_seconds
+
+@dataclass
+class Admission:
+    """A granted (or still waiting) request; charge() records what it spent."""
+    tenant: str
+    request_class: str
+    start: float       # virtual start and finish tags
+    finish: float
+    sequence: int
+    enqueued: float = field(default_factory=time.monotonic)
+    admitted_at: Optional[float] = None
+    llm_calls: int = 0
+    sql_seconds: float = 0.0
+    future: Optional["asyncio.Future"] = None
+
+    def charge(self, llm_calls: int = 0, sql_seconds: float = 0.0):
+        self.llm_calls += llm_calls
+        self.sql_seconds += sql_seconds
+
+    def charge_result(self, result: Dict[str, Any]):
+        self.charge(*usage_from_result(result))
+
+class _TenantState:
+    """Per-tenant counters, quota buckets and latency samples."""
+
+    def __init__(self, llm_calls_per_minute: float, sql_seconds_per_minute: float):
+        # A minute of quota may be spent in one burst
+        self.llm_bucket = TokenBucket(llm_calls_per_minute, burst_seconds=60) if llm_calls_per_minute > 0 else None
+        self.sql_bucket = TokenBucket(sql_seconds_per_minute, burst_seconds=60) if sql_seconds_per_minute > 0 else None
+        self.running = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0
+        self.llm_calls = 0
+        self.sql_seconds = 0.0
+        self.wait = LatencyTracker()
+        self.latency = LatencyTracker()
+
+    def quota_wait(self, now: float) -> float:
+        """Seconds until both quota buckets are out of debt."""
+        return max([bucket.wait_time(0, now) for bucket in (self.llm_bucket, self.sql_bucket) if bucket] or [0.0])
+
+class FairScheduler:
+    """Thread-safe weighted fair admission; usable from threads (slot) and from asyncio (slot_async)."""
+
+    def __init__(self, max_concurrent: int = 8, tenant_concurrency: int = 4, interactive_reserve: int = 2,
+                 llm_calls_per_minute: float = 0, sql_seconds_per_minute: float = 0,
+                 max_queue_per_tenant: int = 100, max_wait_seconds: float = 30.0,
+                 tenant_weights: Optional[Dict[str, float]] = None):
+        """Zero for a quota disables it."""
+        self.max_concurrent = max(1, max_concurrent)
+        self.tenant_concurrency = max(1, tenant_concurrency)
+        self.interactive_reserve = min(max(0, interactive_reserve), self.max_concurrent - 1)
+        self.llm_calls_per_minute = llm_calls_per_minute
+        self.sql_seconds_per_minute = sql_seconds_per_minute
+        self.max_queue_per_tenant = max_queue_per_tenant
+        self.max_wait_seconds = max_wait_seconds
+        self.tenant_weights = tenant_weights or {}
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._waiting: Dict[int, Admission] = {}
+        self._finish_tags: Dict[Tuple[str, str], float] = {}
+        self._tenants: Dict[str, _TenantState] = {}
+        self._class_latency = {name: LatencyTracker() for name in CLASS_WEIGHTS}
+        self._class_running = {name: 0 for name in CLASS_WEIGHTS}
+        self._sequence = itertools.count()
+        self.virtual_time = 0.0
+        self.running = 0
+
+    def _tenant(self, tenant: str) -> _TenantState:
+        state = self._tenants.get(tenant)
+        if state is None:
+            state = self._tenants[tenant] = _TenantState(self.llm_calls_per_minute, self.sql_seconds_per_minute)
+        return state
+
+    def _enqueue(self, tenant: str, request_class: str) -> Admission:
+        """Tag a new request with its virtual finish time, or shed it at once."""
+        if request_class not in CLASS_WEIGHTS:
+            request_class = "batch"
+        state = self._tenant(tenant)
+        now = time.monotonic()
+        if state.queued >= self.max_queue_per_tenant:
+            state.shed += 1
+            raise SchedulerOverloaded(f"Too many queued requests for tenant {tenant}", 1.0)
+        quota_wait = state.quota_wait(now)
+        if quota_wait > self.max_wait_seconds:
+            state.shed += 1
+            raise TenantQuotaExceeded(f"Quota exhausted for tenant {tenant}", quota_wait)
+
+        flow = (tenant, request_class)
+        weight = CLASS_WEIGHTS[request_class] * self.tenant_weights.get(tenant, 1.0)
+        start = max(self.virtual_time, self._finish_tags.get(flow, 0.0))
+        admission = Admission(tenant, request_class, start, start + 1.0 / weight, next(self._sequence), now)
+        self._finish_tags[flow] = admission.finish
+        self._waiting[admission.sequence] = admission
+        state.queued += 1
+        return admission
+
+    def _class_share(self, request_class: str) -> int:
+        """Slots a class may hold: its weighted share among the classes running or waiting now."""
+        active = {name for name, running in self._class_running.items() if running}
+        active.update(admission.request_class for admission in self._waiting.values())
+        active.add(request_class)
+        total = sum(CLASS_WEIGHTS[name] for name in active)
+        return max(1, int(self.max_concurrent * CLASS_WEIGHTS[request_class] / total))
+
+    def _eligible(self, admission: Admission, now: float) -> bool:
+        state = self._tenants[admission.tenant]
+        limit = self.max_concurrent if admission.request_class == "interactive" \
+            else self.max_concurrent - self.interactive_reserve
+        return (self.running < limit and state.running < self.tenant_concurrency
+                and self._class_running[admission.request_class] < self._class_share(admission.request_class)
+                and state.quota_wait(now) == 0.0)
+
+    def _dispatch(self):
+        """Admit waiting requests in virtual finish order while capacity allows (lock held)."""
+        now = time.monotonic()
+        for admission in sorted(self._waiting.values(), key=lambda a: (a.finish, a.sequence)):
+            if self.running >= self.max_concurrent:
+                break
+            if not self._eligible(admission, now):
+                continue
+            del self._waiting[admission.sequence]
+            state = self._tenants[admission.tenant]
+            state.queued -= 1
+            state.running += 1
+            state.admitted += 1
+            state.wait.record(now - admission.enqueued)
+            self.running += 1
+            self._class_running[admission.request_class] += 1
+            self.virtual_time = max(self.virtual_time, admission.start)
+            admission.admitted_at = now
+            if admission.future is not None:
+                admission.future.get_loop().call_soon_threadsafe(_resolve, admission.future)
+        self._condition.notify_all()
+        if not self._waiting and not self.running:
+            # Idle: restart virtual time so tags stay small
+            self._finish_tags.clear()
+            self.virtual_time = 0.0
+
+    def _poll_interval(self, remaining: float) -> float:
+        """Quota buckets refill without any release, so waiters re-check now and then."""
+        return max(0.01, min(remaining, 0.05))
+
+    def _give_up(self, admission: Admission, now: float) -> SchedulerOverloaded:
+        """Remove a request that waited too long (lock held)."""
+        del self._waiting[admission.sequence]
+        state = self._tenants[admission.tenant]
+        state.queued -= 1
+        state.shed += 1
+        quota_wait = state.quota_wait(now)
+        if quota_wait > 0:
+            return TenantQuotaExceeded(f"Quota exhausted for tenant {admission.tenant}", quota_wait)
+        return SchedulerOverloaded(f"Queue wait exceeded for tenant {admission.tenant}", max(1.0, self.max_wait_seconds / 2))
+
+    def acquire(self, tenant: str, request_class: str = "interactive") -> Admission:
+        """Block until the request may run; raises SchedulerOverloaded when shedding."""
+        with self._condition:
+            admission = self._enqueue(tenant, request_class)
+            try:
+                while True:
+                    self._dispatch()
+                    if admission.admitted_at is not None:
+                        return admission
+                    now = time.monotonic()
+                    remaining = self.max_wait_seconds - (now - admission.enqueued)
+                    if remaining <= 0:
+                        raise self._give_up(admission, now)
+                    self._condition.wait(self._poll_interval(remaining))
+            except BaseException:
+                if admission.sequence in self._waiting:
+                    self._give_up(admission, time.monotonic())
+                raise
+
+    async def acquire_async(self, tenant: str, request_class: str = "interactive") -> Admission:
+        """acquire() for the event loop: waits without holding a worker thread."""
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            admission = self._enqueue(tenant, request_class)
+            admission.future = future
+            self._dispatch()
+        try:
+            while admission.admitted_at is None:
+                remaining = self.max_wait_seconds - (time.monotonic() - admission.enqueued)
+                if remaining > 0:
+                    await asyncio.wait({future}, timeout=self._poll_interval(remaining))
+                with self._lock:
+                    if admission.admitted_at is not None:
+                        break
+                    if remaining <= 0:
+                        raise self._give_up(admission, time.monotonic())
+                    self._dispatch()
+            return admission
+        except asyncio.CancelledError:
+            # Client went away while waiting (or just after being admitted)
+            with self._lock:
+                if admission.sequence in self._waiting:
+                    self._give_up(admission, time.monotonic())
+                    admitted = False
+                else:
+                    admitted = admission.admitted_at is not None
+            if admitted:
+                self.release(admission)
+            raise
+
+    def release(self, admission: Admission):
+        """Free the slot, charge the tenant's quotas and record the request's latency."""
+        now = time.monotonic()
+        with self._condition:
+            state = self._tenants[admission.tenant]
+            state.running -= 1
+            self.running -= 1
+            self._class_running[admission.request_class] -= 1
+            state.llm_calls += admission.llm_calls
+            state.sql_seconds += admission.sql_seconds
+            if state.llm_bucket and admission.llm_calls:
+                state.llm_bucket.take(admission.llm_calls, now)
+            if state.sql_bucket and admission.sql_seconds:
+                state.sql_bucket.take(admission.sql_seconds, now)
+            state.latency.record(now - admission.enqueued)
+            self._class_latency[admission.request_class].record(now - admission.enqueued)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, tenant: str, request_class: str = "interactive") -> Iterator[Admission]:
+        admission = self.acquire(tenant, request_class)
+        try:
+            yield admission
+        finally:
+            self.release(admission)
+
+    @asynccontextmanager
+    async def slot_async(self, tenant: str, request_class: str = "interactive") -> AsyncIterator[Admission]:
+        admission = await self.acquire_async(tenant, request_class)
+        try:
+            yield admission
+        finally:
+            self.release(admission)
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-tenant queue depth, usage and latency, and latency per request class."""
+        with self._lock:
+            tenants = {
+                name: {
+                    "queued": state.queued,
+                    "running": state.running,
+                    "admitted": state.admitted,
+                    "shed": state.shed,
+                    "llm_calls": state.llm_calls,
+                    "sql_seconds": round(state.sql_seconds, 4),
+                    "wait_p95_ms": state.wait.percentile(95) * 1000,
+                    "latency_p50_ms": state.latency.percentile(50) * 1000,
+                    "latency_p95_ms": state.latency.percentile(95) * 1000
+                }
+                for name, state in self._tenants.items()
+            }
+            return {
+                "running": self.running,
+                "queued": len(self._waiting),
+                "tenants": tenants,
+                "classes": {
+                    name: {"latency_p50_ms": tracker.percentile(50) * 1000,
+                           "latency_p95_ms": tracker.percentile(95) * 1000}
+                    for name, tracker in self._class_latency.items() if len(tracker)
+                }
+            }
+
+def _resolve(future: "asyncio.Future"):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Vectorized Farm Financial Metrics
+The FINBIN ratios that are not stored in fm_guide (statement-based returns and
+margins, liquidity and repayment coverage, beginning-to-ending balance changes,
+year-over-year changes) defined once as expressions over the base columns. The
+same definitions are computed in bulk with NumPy over whole columns, registered
+as SQL functions on query connections (so generated SQL can call
+`return_on_beginning_equity(net_farm_income, beginning_net_worth)` instead of
+spelling the formula out), and materialized by a batch job into the
+farm_metrics table: `python farm_metrics.py recompute <database>`.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+METRICS_TABLE = "farm_metrics"
+# Tables the metric inputs are read from, joined to hdb_main_data on hdb_main_data_id
+BASE_TABLES = {"fm_guide": "g", "fm_stmts": "s"}
+
+@dataclass(frozen=True)
+class Metric:
+    """A derived metric: an arithmetic expression over base columns; ratio(a, b) is NULL when b is 0."""
+    name: str
+    expression: str
+    description: str
+
+    @property
+    def inputs(self) -> Tuple[str, ...]:
+        """Base columns in order of first use, which is also the SQL function's argument order."""
+        return _compiled(self)[1]
+
+METRICS = [
+    # Profitability
+    Metric("return_on_beginning_equity", "ratio(net_farm_income, beginning_net_worth)",
+           "net farm income over beginning net worth"),
+    Metric("return_on_farm_assets_implied",
+           "ratio(net_farm_income * (1 - end_cost_farm_debt_to_asset_ratio), ending_net_worth_reported)",
+           "net farm income over farm assets implied by ending net worth and the debt-to-asset ratio"),
+    Metric("cash_operating_margin", "ratio(gross_cash_farm_income - total_cash_farm_expense, gross_cash_farm_income)",
+           "cash operating margin"),
+    Metric("cash_expense_ratio", "ratio(total_cash_farm_expense, gross_cash_farm_income)",
+           "cash farm expense per dollar of gross cash farm income"),
+    Metric("nonfarm_income_share", "ratio(net_nonfarm_income, net_farm_income + net_nonfarm_income)",
+           "share of total net income earned off the farm"),
+    # Liquidity and repayment
+    Metric("working_capital_to_gross_income", "ratio(working_capital_end, gross_cash_farm_income)",
+           "ending working capital over gross cash farm income"),
+    Metric("family_living_coverage",
+           "ratio(net_farm_income + net_nonfarm_income, family_living_expense_reported)",
+           "total net income over family living expense"),
+    Metric("principal_coverage",
+           "ratio(cash_from_operations + net_nonfarm_income - family_living_expense_reported, principal_payments)",
+           "cash available for debt service over principal payments"),
+    Metric("net_borrowing", "money_borrowed - principal_payments", "new borrowing net of principal repaid"),
+    # Beginning vs ending balance sheet
+    Metric("net_worth_change", "ending_net_worth_reported - beginning_net_worth", "change in net worth"),
+    Metric("net_worth_growth", "ratio(ending_net_worth_reported - beginning_net_worth, beginning_net_worth)",
+           "change in net worth over beginning net worth"),
+    Metric("working_capital_change", "working_capital_end - working_capital_beg", "change in working capital"),
+    Metric("current_ratio_change", "current_ratio_end - current_ratio_beg", "change in current ratio"),
+    Metric("debt_to_asset_change", "end_cost_farm_debt_to_asset_ratio - beg_cost_farm_debt_to_asset_ratio",
+           "change in debt-to-asset ratio (cost basis)"),
+    Metric("equity_to_asset_change", "beg_cost_farm_debt_to_asset_ratio - end_cost_farm_debt_to_asset_ratio",
+           "change in equity-to-asset ratio (cost basis)"),
+]
+METRICS_BY_NAME = {metric.name: metric for metric in METRICS}
+
+# Columns whose change from the same farm's previous year is materialized by the batch job
+YOY_COLUMNS = ["net_farm_income", "ending_net_worth_reported", "working_capital_end", "gross_cash_farm_income"]
+
+_COMPILED: Dict[str, Tuple[Any, Tuple[str, ...]]] = {}
+
+def _compiled(metric: Metric) -> Tuple[Any, Tuple[str, ...]]:
+    if metric.name not in _COMPILED:
+        code = compile(metric.expression, f"<metric {metric.name}>", "eval")
+        _COMPILED[metric.name] = (code, tuple(name for name in code.co_names if name != "ratio"))
+    return _COMPILED[metric.name]
+
+def base_columns() -> List[str]:
+    """Every base column some metric reads, in first-use order."""
+    columns: List[str] = []
+    for metric in METRICS:
+        columns.extend(column for column in metric.inputs if column not in columns)
+    columns.extend(column for column in YOY_COLUMNS if column not in columns)
+    return columns
+
+def metric_columns() -> List[str]:
+    """Columns of the farm_metrics table after its keys."""
+    return [metric.name for metric in METRICS] + [f"{column}_yoy_{kind}" for column in YOY_COLUMNS
+                                                   for kind in ("change", "pct")]
+
+def _scalar_ratio(numerator: float, denominator: float) -> Optional[float]:
+    return numerator / denominator if denominator else None
+
+def _array_ratio(numerator: "np.ndarray", denominator: "np.ndarray") -> "np.ndarray":
+    import numpy as np
+
+    out = np.full(np.shape(denominator), np.nan)
+    np.divide(numerator, denominator, out=out, where=(denominator != 0) & ~np.isnan(denominator))
+    return out
+
+def _sql_function(metric: Metric):
+    # Compiled once into a plain function: SQLite calls it once per row
+    formula = eval(f"lambda {', '.join(metric.inputs)}: {metric.expression}",
+                   {"__builtins__": {}, "ratio": _scalar_ratio})
+
+    def evaluate(*values):
+        if None in values:
+            return None
+        try:
+            return formula(*map(float, values))
+        except (TypeError, ValueError):
+            return None
+
+    return evaluate
+
+def register_sql_functions(conn: sqlite3.Connection):
+    """Make every metric callable in SQL on conn, taking its inputs in Metric.inputs order."""
+    conn.create_function("ratio", 2, lambda a, b: None if a is None or b is None else _scalar_ratio(a, b),
+                         deterministic=True)
+    for metric in METRICS:
+        conn.create_function(metric.name, len(metric.inputs), _sql_function(metric), deterministic=True)
+
+def describe_sql_functions() -> str:
+    """One line per metric function for the SQL-generation prompt."""
+    return "\n".join(f"  - {metric.name}({', '.join(metric.inputs)}): {metric.description}" for metric in METRICS)
+
+def compute_metrics(columns: Dict[str, "np.ndarray"], names: Optional[Sequence[str]] = None) -> Dict[str, "np.ndarray"]:
+    """Evaluate metrics over whole float columns (NaN for NULL); one NumPy pass per operation, no per-row Python."""
+    import numpy as np
+
+    arrays = {name: np.asarray(values, dtype=float) for name, values in columns.items()}
+    results = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for name in names or METRICS_BY_NAME:
+            code, inputs = _compiled(METRICS_BY_NAME[name])
+            results[name] = np.asarray(eval(code, {"__builtins__": {}, "ratio": _array_ratio},
+                                            {column: arrays[column] for column in inputs}), dtype=float)
+    return results
+
+@dataclass
+class FarmHistory:
+    """Farm-years ordered by farm, then year."""
+    order: "np.ndarray"          # positions of the input rows in history order
+    years: "np.ndarray"          # year of each row in history order
+    has_previous: "np.ndarray"   # the row before is the same farm's previous year
+    first: "np.ndarray"          # history position of each row's farm's first year
+
+def farm_history(farm_keys: Sequence[Any], years: Sequence[Any]) -> FarmHistory:
+    """Sort farm-years into per-farm histories; rows without a farm key are farms of their own."""
+    import numpy as np
+    import pandas as pd
+
+    farm_codes = pd.factorize(np.asarray(farm_keys, dtype=object))[0]
+    missing = farm_codes < 0
+    farm_codes[missing] = farm_codes.max(initial=-1) + 1 + np.arange(missing.sum())
+    year_values = pd.to_numeric(pd.Series(years), errors="coerce").to_numpy(dtype=float)
+    order = np.lexsort((year_values, farm_codes))
+    farms_sorted, years_sorted = farm_codes[order], year_values[order]
+    same_farm = np.zeros(len(order), dtype=bool)
+    same_farm[1:] = farms_sorted[1:] == farms_sorted[:-1]
+    has_previous = same_farm.copy()
+    has_previous[1:] &= years_sorted[1:] == years_sorted[:-1] + 1
+    first = np.maximum.accumulate(np.where(same_farm, 0, np.arange(len(order))))
+    return FarmHistory(order=order, years=years_sorted, has_previous=has_previous, first=first)
+
+def previous_year(history: FarmHistory, values: "np.ndarray") -> "np.ndarray":
+    """The same farm's previous-year value for each row, in history order (NaN when that year is missing)."""
+    import numpy as np
+
+    current = np.asarray(values, dtype=float)[history.order]
+    previous = np.full(len(current), np.nan)
+    previous[1:] = current[:-1]
+    previous[~history.has_previous] = np.nan
+    return previous
+
+def year_over_year(farm_keys: Sequence[Any], years: Sequence[Any],
+                   columns: Dict[str, "np.ndarray"]) -> Dict[str, "np.ndarray"]:
+    """Change and percent change from the same farm's previous year, NaN where that year is missing."""
+    import numpy as np
+
+    history = farm_history(farm_keys, years)
+    results = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for column, values in columns.items():
+            current = np.asarray(values, dtype=float)[history.order]
+            previous = previous_year(history, values)
+            for kind, sorted_values in (("change", current - previous),
+                                        ("pct", _array_ratio(current - previous, np.abs(previous)))):
+                unsorted = np.empty(len(current))
+                unsorted[history.order] = sorted_values
+                results[f"{column}_yoy_{kind}"] = unsorted
+    return results
+
+def load_base_columns(conn: sqlite3.Connection) -> "pd.DataFrame":
+    """Farm-year keys plus every metric input column, one row per hdb_main_data row."""
+    import pandas as pd
+
+    sources = {}
+    for table, alias in BASE_TABLES.items():
+        for row in conn.execute(f"PRAGMA table_info({table})"):
+            sources.setdefault(row[1], alias)
+    missing = [column for column in base_columns() if column not in sources]
+    if missing:
+        raise ValueError(f"No base table has column(s) {', '.join(missing)}")
+    selected = ", ".join(f"{sources[column]}.{column}" for column in base_columns())
+    joins = " ".join(f"LEFT JOIN {table} {alias} ON {alias}.hdb_main_data_id = h.hdb_main_data_id"
+                     for table, alias in BASE_TABLES.items())
+    frame = pd.read_sql_query(f"SELECT h.hdb_main_data_id, h.fbm_farm_id, h.year, {selected} "
+                              f"FROM hdb_main_data h {joins}", conn)
+    # TEXT-affinity leftovers and empty strings become NaN
+    for column in base_columns():
+        frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    return frame
+
+@dataclass
+class MetricsRun:
+    """Timings of one batch recompute."""
+    rows: int
+    load_seconds: float
+    compute_seconds: float
+    write_seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.compute_seconds if self.compute_seconds else float("inf")
+
+def recompute_metrics(database_path: str) -> MetricsRun:
+    """Recompute every metric for every farm-year and replace the farm_metrics table."""
+    import numpy as np
+
+    conn = sqlite3.connect(database_path)
+    try:
+        start = time.perf_counter()
+        frame = load_base_columns(conn)
+        loaded = time.perf_counter()
+        columns = {column: frame[column].to_numpy(dtype=float) for column in base_columns()}
+        results = compute_metrics(columns)
+        results.update(year_over_year(frame["fbm_farm_id"].to_numpy(), frame["year"].to_numpy(),
+                                      {column: columns[column] for column in YOY_COLUMNS}))
+        computed = time.perf_counter()
+
+        names = metric_columns()
+        values = np.column_stack([results[name] for name in names]).astype(object) if len(frame) else []
+        if len(frame):
+            values[np.isnan(values.astype(float))] = None
+        keys = frame[["hdb_main_data_id", "fbm_farm_id", "year"]].astype(object).to_numpy()
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {METRICS_TABLE}")
+            conn.execute(f"CREATE TABLE {METRICS_TABLE} (hdb_main_data_id TEXT PRIMARY KEY, fbm_farm_id TEXT, "
+                         f"year TEXT, {', '.join(f'{name} REAL' for name in names)})")
+            conn.executemany(f"INSERT INTO {METRICS_TABLE} VALUES ({', '.join('?' for _ in range(3 + len(names)))})",
+                             (tuple(key) + tuple(row) for key, row in zip(keys, values)))
+        written = time.perf_counter()
+        run = MetricsRun(rows=len(frame), load_seconds=loaded - start, compute_seconds=computed - loaded,
+                         write_seconds=written - computed)
+        logger.info(f"Recomputed {len(names)} metrics for {run.rows} farm-years "
+                    f"({run.rows_per_second:,.0f} farm-years/s computed)")
+        return run
+    finally:
+        conn.close()
+
+def main():
+    """Recompute the farm_metrics table or list the metric functions."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Vectorized farm financial metrics")
+    parser.add_argument("command", choices=["recompute", "list"])
+    parser.add_argument("database", nargs="?", default=os.getenv("DATABASE_PATH", "finbin_farm_data.db"))
+    args = parser.parse_args()
+
+    if args.command == "list":
+        print(describe_sql_functions())
+        return 0
+    if not os.path.exists(args.database):
+        print(f"❌ Database not found: {args.database}")
+        return 1
+    run = recompute_metrics(args.database)
+    print(f"✅ {METRICS_TABLE} rebuilt in {args.database}: {run.rows} farm-years, {len(metric_columns())} metrics")
+    print(f"   load {run.load_seconds:.2f}s, compute {run.compute_seconds * 1000:.1f} ms "
+          f"({run.rows_per_second:,.0f} farm-years/s), write {run.write_seconds:.2f}s")
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -5,15 +5,23 @@ FastAPI web service for farm financial data analysis using OpenAI LLM.
 """
 
 import os
+import time
 import logging
-from typing import Dict, Any, Optional
-from fastapi import FastAPI, HTTPException
+import threading
+from contextlib import asynccontextmanager, nullcontext
+from typing import Dict, Any, List, Optional
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from farm_rag_app import FarmDataRAG
+from single_flight import SingleFlight, WaiterDisconnected
+from llm_scheduler import SchedulerOverloaded
+from fair_scheduler import TenantQuotaExceeded, tenant_key
+from cache_warmer import CacheWarmer
 
 # Load environment variables from parent directory
 load_dotenv('../.env')
@@ -22,11 +30,79 @@ load_dotenv('../.env')
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# RAG engine state; built at startup (in the background by default) instead of at import
+rag_app: Optional[FarmDataRAG] = None
+rag_app_status = "warming"
+_rag_init_lock = threading.Lock()
+
+# Concurrent identical questions share one ask_question execution
+single_flight = SingleFlight()
+
+# Background warm-up of the answer cache (examples + popular questions)
+cache_warmer: Optional[CacheWarmer] = None
+started_at = time.time()
+
+def init_rag_app() -> Optional[FarmDataRAG]:
+    """Build the RAG engine once; safe to call from several threads."""
+    global rag_app, rag_app_status
+    
+    with _rag_init_lock:
+        if rag_app is not None or rag_app_status == "unhealthy":
+            return rag_app
+        try:
+            rag_app = FarmDataRAG()
+            rag_app_status = "healthy"
+            logger.info("RAG application initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize RAG application: {e}")
+            rag_app_status = "unhealthy"
+    return rag_app
+
+def start_cache_warmer():
+    """
+    Warm the answer cache now and after every database change (CACHE_WARMING=false to disable).
+    Under the prefork server only worker 0 warms, so each warm-up question costs one LLM call.
+    """
+    global cache_warmer
+    
+    if rag_app is None or cache_warmer is not None or os.getenv('CACHE_WARMING', 'true').lower() != 'true':
+        return
+    if os.getenv('API_WORKER_INDEX', '0') != '0':
+        return
+    if 'API_WORKER_INDEX' in os.environ and not rag_app.shared_cache_path:
+        logger.info("Cache warming runs in worker 0 only; set SHARED_CACHE_PATH so the other workers share it")
+    cache_warmer = CacheWarmer(
+        rag_app,
+        all_example_questions,
+        top_n=int(os.getenv('CACHE_WARM_TOP_N', 20)),
+        check_interval=float(os.getenv('CACHE_WARM_CHECK_SECONDS', 30)),
+        is_busy=lambda: single_flight.stats()["in_flight"] > 0,
+        scheduler=rag_app.fair_scheduler
+    )
+    cache_warmer.start()
+
+def warm_up():
+    """Build the RAG engine, then start warming its answer cache."""
+    init_rag_app()
+    start_cache_warmer()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start serving immediately and build the RAG engine in the background (RAG_STARTUP_MODE=eager to block)."""
+    if os.getenv('RAG_STARTUP_MODE', 'background') == 'eager':
+        warm_up()
+    else:
+        threading.Thread(target=warm_up, name="rag-warmup", daemon=True).start()
+    yield
+    if cache_warmer is not None:
+        cache_warmer.stop()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Farm Financial Data RAG API",
     description="AI-powered farm financial data analysis using OpenAI LLM",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -41,19 +117,71 @@ app.add_middleware(
 # Mount static files
 app.mount("/static", StaticFiles(directory="."), name="static")
 
-# Initialize RAG application
-try:
-    rag_app = FarmDataRAG()
-    logger.info("RAG application initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize RAG application: {e}")
-    rag_app = None
+# Example questions served by /examples and preloaded into the answer cache
+EXAMPLE_QUESTIONS = [
+    {
+        "category": "Financial Performance",
+        "questions": [
+            "Which farms have the highest current ratio?",
+            "What is the average working capital by state?",
+            "Show me farms with the best debt-to-equity ratios",
+            "Which farms had the highest net farm income?"
+        ]
+    },
+    {
+        "category": "Geographic Analysis",
+        "questions": [
+            "How many farms are in each state?",
+            "What's the average financial performance by county?",
+            "Compare farm performance between Minnesota and Wisconsin"
+        ]
+    },
+    {
+        "category": "Trends and Changes",
+        "questions": [
+            "How did net worth change from beginning to end of year?",
+            "Which farms had the biggest increase in working capital?",
+            "Show me farms with significant changes in debt levels"
+        ]
+    },
+    {
+        "category": "Benchmarking",
+        "questions": [
+            "What's the 75th percentile for current ratio?",
+            "How do farms rank by return on assets?",
+            "Which farms are in the top 10% for profitability?"
+        ]
+    }
+]
+
+def all_example_questions() -> List[str]:
+    """Flatten the example categories into a list of questions."""
+    return [question for category in EXAMPLE_QUESTIONS for question in category["questions"]]
+
+def preload():
+    """Load shared read-only state before worker processes are forked."""
+    if init_rag_app():
+        rag_app.preload_answers(all_example_questions())
+
+def require_rag_app() -> FarmDataRAG:
+    """Return the RAG engine or raise 503 while it is warming up or unavailable."""
+    if rag_app is not None:
+        return rag_app
+    if rag_app_status == "warming":
+        raise HTTPException(status_code=503, detail="RAG application is warming up",
+                            headers={"Retry-After": "1"})
+    raise HTTPException(status_code=503, detail="RAG application not available")
 
 # Pydantic models
 class QuestionRequest(BaseModel):
     question: str
     include_data_preview: bool = True
     max_preview_rows: int = 10
+    tenant_id: Optional[str] = None
+    organization_id: Optional[str] = None
+    session_id: Optional[str] = None
+    # "interactive" or "batch"; batch work yields to interactive users
+    request_class: str = "interactive"
 
 class QuestionResponse(BaseModel):
     success: bool
@@ -63,6 +191,7 @@ class QuestionResponse(BaseModel):
     query_result: Dict[str, Any]
     data_preview: Optional[list] = None
     error: Optional[str] = None
+    session_id: Optional[str] = None
 
 class HealthResponse(BaseModel):
     status: str
@@ -91,40 +220,97 @@ async def web_interface():
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
-    """Health check endpoint."""
-    rag_status = "healthy" if rag_app else "unhealthy"
-    
+    """Health check endpoint; reports `warming` until the RAG engine is built."""
     return HealthResponse(
-        status="healthy",
-        rag_app_status=rag_status,
+        status="warming" if rag_app_status == "warming" else "healthy",
+        rag_app_status=rag_app_status,
         database_path=os.getenv('DATABASE_PATH', 'unknown'),
         openai_model=os.getenv('OPENAI_MODEL', 'unknown')
     )
 
+@app.get("/metrics")
+async def metrics():
+    """Answer cache hit rate since startup, cache warming progress and LLM call statistics."""
+    body: Dict[str, Any] = {
+        "rag_app_status": rag_app_status,
+        "uptime_seconds": time.time() - started_at,
+        "single_flight": single_flight.stats(),
+        "cache_warmer": cache_warmer.status() if cache_warmer else None
+    }
+    if rag_app is not None:
+        body["answer_cache"] = rag_app.cache_metrics()
+        body["llm"] = rag_app.llm_caller.status()
+        body["llm_scheduler"] = rag_app.llm_scheduler.stats() if rag_app.llm_scheduler else None
+        body["fair_scheduler"] = rag_app.fair_scheduler.stats() if rag_app.fair_scheduler else None
+        body["sessions"] = rag_app.sessions.stats()
+        body["db_pool"] = rag_app.db_pool.stats()
+        body["intent_router"] = rag_app.intent_router.stats() if rag_app.intent_router else None
+        body["response_cache"] = rag_app.response_cache.stats() if rag_app.response_cache else None
+        body["sql_batcher"] = rag_app.sql_batcher.stats() if rag_app.sql_batcher else None
+        body["sql_templates"] = rag_app.sql_templates.stats() if rag_app.sql_templates else None
+        body["sql_optimizer"] = rag_app.sql_optimizer.stats() if rag_app.sql_optimizer else None
+        body["entity_resolver"] = rag_app.entity_resolver.stats() if rag_app.entity_resolver else None
+        body["query_log"] = rag_app.query_log.stats() if rag_app.query_log else None
+    return body
+
 @app.post("/ask", response_model=QuestionResponse)
-async def ask_question(request: QuestionRequest):
+async def ask_question(request: QuestionRequest, http_request: Request):
     """Ask a question about farm financial data."""
     
-    if not rag_app:
-        raise HTTPException(status_code=503, detail="RAG application not available")
+    rag_app = require_rag_app()
     
     try:
-        # Process the question
-        result = rag_app.ask_question(request.question)
+        # Process the question; identical concurrent questions attach to one execution,
+        # which is cancelled if every client waiting on it disconnects. Session turns are
+        # recorded on their own session, so they only coalesce within that session. Classes
+        # never share a flight, so an interactive caller never waits behind a batch admission.
+        request_class = "batch" if request.request_class == "batch" else "interactive"
+        flight_key = rag_app.question_key(request.question, request.tenant_id) + f"|class:{request_class}"
+        if request.session_id:
+            flight_key += f"|session:{request.session_id}"
+        # Weighted fair admission per tenant and class, waiting on the event loop. Only the
+        # execution is admitted and charged; callers that join it take no slot of their own.
+        scheduler = rag_app.fair_scheduler
+        tenant = tenant_key(request.tenant_id, request.organization_id)
+        
+        async def execute(cancel_event):
+            async with (scheduler.slot_async(tenant, request_class) if scheduler else nullcontext()) as admission:
+                result = await run_in_threadpool(
+                    rag_app.ask_question, request.question,
+                    tenant_id=request.tenant_id,
+                    session_id=request.session_id,
+                    priority=request_class,
+                    cancel_event=cancel_event
+                )
+                if admission is not None:
+                    admission.charge_result(result)
+                return result
+        
+        result = await single_flight.run(flight_key, execute, disconnected=http_request.is_disconnected)
         
         # Prepare response
         response = QuestionResponse(
             success=result["success"],
             question=result["question"],
-            sql_query=result["sql_query"],
+            sql_query=result.get("sql_query", ""),
             response=result["response"],
-            query_result=result["query_result"],
+            query_result=result.get("query_result", {}),
             data_preview=result.get("data_preview") if request.include_data_preview else None,
-            error=result.get("error")
+            error=result.get("error"),
+            session_id=result.get("session_id")
         )
         
         return response
         
+    except WaiterDisconnected:
+        raise HTTPException(status_code=499, detail="Client closed request")
+    except TenantQuotaExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e),
+                            headers={"Retry-After": str(max(1, round(e.retry_after)))})
+    except SchedulerOverloaded as e:
+        # Backpressure: tell clients when to come back instead of queueing without bound
+        raise HTTPException(status_code=503, detail=f"LLM capacity exhausted: {e}",
+                            headers={"Retry-After": str(max(1, round(e.retry_after)))})
     except Exception as e:
         logger.error(f"Error processing question: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -133,8 +319,7 @@ async def ask_question(request: QuestionRequest):
 async def get_database_schema():
     """Get database schema information."""
     
-    if not rag_app:
-        raise HTTPException(status_code=503, detail="RAG application not available")
+    rag_app = require_rag_app()
     
     try:
         return {
@@ -149,52 +334,29 @@ async def get_database_schema():
 async def get_example_questions():
     """Get example questions users can ask."""
     
-    examples = [
-        {
-            "category": "Financial Performance",
-            "questions": [
-                "Which farms have the highest current ratio?",
-                "What is the average working capital by state?",
-                "Show me farms with the best debt-to-equity ratios",
-                "Which farms had the highest net farm income?"
-            ]
-        },
-        {
-            "category": "Geographic Analysis",
-            "questions": [
-                "How many farms are in each state?",
-                "What's the average financial performance by county?",
-                "Compare farm performance between Minnesota and Wisconsin"
-            ]
-        },
-        {
-            "category": "Trends and Changes",
-            "questions": [
-                "How did net worth change from beginning to end of year?",
-                "Which farms had the biggest increase in working capital?",
-                "Show me farms with significant changes in debt levels"
-            ]
-        },
-        {
-            "category": "Benchmarking",
-            "questions": [
-                "What's the 75th percentile for current ratio?",
-                "How do farms rank by return on assets?",
-                "Which farms are in the top 10% for profitability?"
-            ]
-        }
-    ]
-    
-    return {"examples": examples}
+    return {"examples": EXAMPLE_QUESTIONS}
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
     
-    # Run the API server
-    uvicorn.run(
-        "farm_rag_api:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        log_level="info"
-    )
+    parser = argparse.ArgumentParser(description="Farm Financial Data RAG API server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv('API_WORKERS', 1)),
+                        help="prefork worker processes; more than 1 enables production mode")
+    args = parser.parse_args()
+    
+    if args.workers > 1:
+        # Production mode: preload once, then fork workers that share the loaded state
+        from prefork_server import serve
+        serve("farm_rag_api:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        # Development mode with auto-reload
+        uvicorn.run(
+            "farm_rag_api:app",
+            host=args.host,
+            port=args.port,
+            reload=True,
+            log_level="info"
+        )
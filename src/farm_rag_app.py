@@ -5,14 +5,43 @@ Uses OpenAI LLM to understand questions, generate SQL, execute queries, and prov
 """
 
 import os
+import re
 import sqlite3
 import json
+import time
+import hashlib
 import logging
-from typing import Dict, List, Any, Optional
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Sequence, Tuple, TYPE_CHECKING
 from dataclasses import dataclass
 from dotenv import load_dotenv
-import openai
-import pandas as pd
+from token_budget import TokenBudget, PromptSection, count_message_tokens, shrink_schema, shrink_lines
+from result_digest import summarize_result
+from llm_scheduler import LLMScheduler, SchedulerOverloaded
+from fair_scheduler import FairScheduler
+from llm_resilience import ResilientCaller, CircuitBreaker, LLMUnavailable
+from cache_warmer import RecentQuestions
+from query_log import QueryLog, QueryLogRecord
+from fact_table import FACT_TABLE
+from change_engine import CHANGE_TABLE, RANK_COLUMNS, pairs_for_columns
+from data_quality import FLAGS_TABLE, describe_checks
+from farm_metrics import METRICS_TABLE, describe_sql_functions, register_sql_functions
+from sql_optimizer import SQLOptimizer, SQLRejected
+from entity_index import EntityResolver, has_entity_index, is_internal_table, rewrite_like_predicates
+from conversation import SessionStore, Session, Refinement, is_followup, parse_refinement
+from db_pool import ConnectionPool
+from intent_router import IntentRouter, RoutedQuestion, build_metric_synonyms, columns_from_schema, template_answer
+from sql_template_cache import SQLTemplateCache, render_sql
+from response_cache import ResponseCache
+from sql_batcher import BATCH_SYSTEM_PROMPT, SQLBatcher, batch_prompt, parse_batch_reply
+from query_planner import (PLANNER_SYSTEM_PROMPT, PlanStep, QueryPlan, needs_plan,
+                           parse_plan, planner_prompt, run_plan, split_comparison)
+
+# pandas and openai are imported on first use so that importing this module
+# (and farm_rag_api) stays fast for worker boot and the CLI scripts
+if TYPE_CHECKING:
+    import pandas as pd
 
 # Load environment variables from parent directory
 load_dotenv('../.env')
@@ -21,15 +50,23 @@ load_dotenv('../.env')
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class QuestionCancelled(Exception):
+    """Raised between pipeline steps once nobody is waiting for the answer any more."""
+
 @dataclass
 class QueryResult:
     """Container for query results and metadata."""
     success: bool
-    data: Optional[pd.DataFrame]
+    data: Optional["pd.DataFrame"]
     sql_query: str
     error_message: Optional[str] = None
     row_count: int = 0
     execution_time: float = 0.0
+    cpu_time: float = 0.0
+
+def normalize_question(question: str) -> str:
+    """Normalize a question for cache keys: case, whitespace and trailing punctuation."""
+    return re.sub(r'\s+', ' ', question.strip().lower()).rstrip('?.! ')
 
 class FarmDataRAG:
     """RAG application for farm financial data analysis."""
@@ -40,17 +77,349 @@ class FarmDataRAG:
         self.model = os.getenv('OPENAI_MODEL', 'gpt-4-turbo-preview')
         self.database_path = os.getenv('DATABASE_PATH', 'finbin_farm_data.db')
         self.max_tokens = int(os.getenv('MAX_TOKENS', 4000))
+        # Output caps per call type: SQL needs a few hundred tokens, answers a bit more
+        self.sql_max_tokens = int(os.getenv('SQL_MAX_TOKENS', 400))
+        self.response_max_tokens = int(os.getenv('RESPONSE_MAX_TOKENS', min(self.max_tokens, 1000)))
+        # Prompt budgets (0 disables budgeting)
+        self.prompt_token_budget = int(os.getenv('PROMPT_TOKEN_BUDGET', 6000))
+        self.data_token_budget = int(os.getenv('DATA_TOKEN_BUDGET', 1500))
         self.temperature = float(os.getenv('TEMPERATURE', 0.1))
         self.system_prompt = os.getenv('SYSTEM_PROMPT', 'You are a financial analyst assistant for farm data.')
+        self.shard_dir = os.getenv('SHARD_DIR')
+        # Off by default: on small databases or few cores one file beats the fan-out's overhead
+        self.shard_fan_out = os.getenv('SHARD_FAN_OUT', 'false').lower() == 'true'
+        self.shared_cache_path = os.getenv('SHARED_CACHE_PATH')
+        self.answer_cache_ttl = float(os.getenv('ANSWER_CACHE_TTL', 3600))
+        # Provider rate limits (0 disables admission control)
+        self.llm_rpm = float(os.getenv('LLM_RPM', 0))
+        self.llm_tpm = float(os.getenv('LLM_TPM', 0))
+        # Resilient LLM calls: deadline, retries, optional hedging, circuit breaker
+        self.llm_deadline = float(os.getenv('LLM_DEADLINE_SECONDS', 30))
+        self.llm_max_retries = int(os.getenv('LLM_MAX_RETRIES', 2))
+        self.llm_hedge = os.getenv('LLM_HEDGE', 'false').lower() == 'true'
+        self.llm_hedge_percentile = float(os.getenv('LLM_HEDGE_PERCENTILE', 95))
+        self.fallback_answer_ttl = float(os.getenv('FALLBACK_ANSWER_TTL', 7 * 24 * 3600))
+        self.history_token_budget = int(os.getenv('HISTORY_TOKEN_BUDGET', 600))
+        # Templated question shapes get their SQL (and answer) locally, without the LLM
+        self.intent_routing = os.getenv('INTENT_ROUTER', 'true').lower() == 'true'
+        self.intent_min_confidence = float(os.getenv('INTENT_MIN_CONFIDENCE', 0.8))
+        self.intent_local_answers = os.getenv('INTENT_LOCAL_ANSWERS', 'true').lower() == 'true'
+        # Generated SQL is reused, with new parameters, for questions of the same shape
+        self.sql_template_caching = os.getenv('SQL_TEMPLATE_CACHE', 'true').lower() == 'true'
+        self.sql_template_ttl = float(os.getenv('SQL_TEMPLATE_TTL', 7 * 24 * 3600))
+        # Narratives reused for the same question over identical result rows
+        self.response_caching = os.getenv('RESPONSE_CACHE', 'true').lower() == 'true'
+        # Optional micro-batching: concurrent SQL-generation calls share one completion
+        self.sql_batching = os.getenv('SQL_BATCHING', 'false').lower() == 'true'
+        self.sql_batch_size = int(os.getenv('SQL_BATCH_SIZE', 8))
+        self.sql_batch_wait_ms = float(os.getenv('SQL_BATCH_WAIT_MS', 10))
+        self.sql_batcher = None
+        self._sql_batcher_pid = None
+        # Comparison questions are split into sub-queries that run in parallel
+        self.query_planner = os.getenv('QUERY_PLANNER', 'true').lower() == 'true'
+        self.planner_max_steps = int(os.getenv('PLANNER_MAX_STEPS', 6))
+        self.planner_max_parallel = int(os.getenv('PLANNER_MAX_PARALLEL', 4))
+        # The farm-year fact table (when built) is offered to the SQL generator as the join-free source
+        self.use_fact_table = os.getenv('FACT_TABLE', 'true').lower() == 'true'
+        # The change table (when built) answers beginning-vs-ending and year-over-year questions
+        self.use_change_table = os.getenv('CHANGE_TABLE', 'true').lower() == 'true'
+        # SQL is rewritten, join-checked and costed with EXPLAIN QUERY PLAN before it runs
+        self.sql_regenerate = os.getenv('SQL_REGENERATE', 'true').lower() == 'true'
+        # Derived FINBIN metrics are callable as SQL functions on every query connection
+        self.farm_metrics = os.getenv('FARM_METRICS', 'true').lower() == 'true'
         
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
         
-        # Initialize OpenAI client
-        openai.api_key = self.api_key
+        # OpenAI client is created lazily, once per process
+        self._llm_client = None
+        self._llm_client_pid = None
+        self._local = threading.local()
+        
+        self.llm_caller = ResilientCaller(
+            deadline_seconds=self.llm_deadline,
+            max_retries=self.llm_max_retries,
+            hedge=self.llm_hedge,
+            hedge_percentile=self.llm_hedge_percentile,
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv('LLM_BREAKER_FAILURES', 5)),
+                reset_seconds=float(os.getenv('LLM_BREAKER_RESET_SECONDS', 30))
+            )
+        )
+        
+        # Admission control in front of the provider's RPM/TPM limits
+        self.llm_scheduler = None
+        if self.llm_rpm > 0 or self.llm_tpm > 0:
+            self.llm_scheduler = LLMScheduler(
+                requests_per_minute=self.llm_rpm,
+                tokens_per_minute=self.llm_tpm,
+                max_queue=int(os.getenv('LLM_QUEUE_SIZE', 64)),
+                max_wait_seconds=float(os.getenv('LLM_QUEUE_TIMEOUT', 30))
+            )
+        
+        # Weighted fair admission of whole questions per tenant and request class (used by the API)
+        self.fair_scheduler = None
+        if os.getenv('FAIR_SCHEDULING', 'true').lower() == 'true':
+            self.fair_scheduler = FairScheduler(
+                max_concurrent=int(os.getenv('FAIR_MAX_CONCURRENT', 8)),
+                tenant_concurrency=int(os.getenv('FAIR_TENANT_CONCURRENCY', 4)),
+                interactive_reserve=int(os.getenv('FAIR_INTERACTIVE_RESERVE', 2)),
+                llm_calls_per_minute=float(os.getenv('TENANT_LLM_CALLS_PER_MINUTE', 0)),
+                sql_seconds_per_minute=float(os.getenv('TENANT_SQL_SECONDS_PER_MINUTE', 0)),
+                max_queue_per_tenant=int(os.getenv('FAIR_QUEUE_SIZE', 100)),
+                max_wait_seconds=float(os.getenv('FAIR_QUEUE_TIMEOUT', 30)),
+                tenant_weights={name.strip(): float(weight) for name, weight in
+                                (pair.split('=') for pair in os.getenv('TENANT_WEIGHTS', '').split(',') if '=' in pair)}
+            )
         
         # Database schema information for context
         self.db_schema = self._get_database_schema()
+        self.has_fact_table = f"Table: {FACT_TABLE}\n" in self.db_schema
+        self.has_metrics_table = f"Table: {METRICS_TABLE}\n" in self.db_schema
+        self.has_change_table = f"Table: {CHANGE_TABLE}\n" in self.db_schema
+        self.has_flags_table = f"Table: {FLAGS_TABLE}\n" in self.db_schema
+        self.change_metrics: List[str] = []
+        if self.has_change_table:
+            numeric = {table: columns_from_schema(self.db_schema, table) for table in ("fm_guide", "fm_stmts")}
+            self.change_metrics = [pair.metric for pair in pairs_for_columns(numeric)]
+        if self.use_fact_table and not self.has_fact_table:
+            logger.info("No fact table; run `python fact_table.py build` for join-free analytics")
+        self.db_pool = ConnectionPool(self.database_path, size=int(os.getenv('DB_POOL_SIZE', 4)),
+                                      statement_cache_size=int(os.getenv('DB_STATEMENT_CACHE_SIZE', 256)),
+                                      on_connect=register_sql_functions if self.farm_metrics else None)
+        self.sql_optimizer = None
+        if os.getenv('SQL_OPTIMIZER', 'true').lower() == 'true':
+            self.sql_optimizer = SQLOptimizer(
+                max_cost=float(os.getenv('SQL_MAX_COST', 1e9)),
+                row_limit=int(os.getenv('SQL_ROW_LIMIT', 1000)),
+                data_version=self.data_version
+            )
+        # Names in questions are resolved against the FTS5 entity index when the database has one
+        self.entity_resolver = None
+        if os.getenv('ENTITY_INDEX', 'true').lower() == 'true':
+            with self.db_pool.connection() as conn:
+                if has_entity_index(conn):
+                    self.entity_resolver = EntityResolver(self.db_pool.connection)
+                else:
+                    logger.info("No entity index; run `python entity_index.py build` to enable entity lookup")
+        self.intent_router = None
+        if self.intent_routing:
+            self.intent_router = IntentRouter.from_schema(self.db_schema, self.intent_min_confidence)
+        
+        # Optional per-tenant shards; single-tenant questions only touch their own shard
+        self.shard_executor = None
+        if self.shard_dir:
+            try:
+                from tenant_shards import FanOutExecutor
+                self.shard_executor = FanOutExecutor(self.shard_dir)
+                logger.info(f"Loaded {len(self.shard_executor.shards)} tenant shards from {self.shard_dir}")
+            except Exception as e:
+                logger.error(f"Error loading tenant shards: {e}")
+        # Tenants without a shard read the shared database through views of their own rows
+        self._tenant_pools: "OrderedDict[str, ConnectionPool]" = OrderedDict()
+        self._tenant_pools_lock = threading.Lock()
+        self.tenant_pool_limit = max(1, int(os.getenv('TENANT_POOL_LIMIT', 16)))
+        
+        # Answer cache: shared by all worker processes through a local file, else in memory
+        self.answer_cache = None
+        self._preloaded_answers: Dict[str, Dict[str, Any]] = {}
+        # Hits/misses for interactive questions only (warm-up lookups are not counted)
+        self.answer_cache_stats = {"hits": 0, "misses": 0}
+        self.recent_questions = RecentQuestions(normalize=normalize_question)
+        
+        # Structured per-question log, appended by a background writer; feeds cache warming and tuning
+        self.query_log = None
+        self.query_log_window = float(os.getenv('QUERY_LOG_WARM_WINDOW_HOURS', 24)) * 3600
+        if os.getenv('QUERY_LOG', 'true').lower() == 'true':
+            self.query_log = QueryLog(
+                os.getenv('QUERY_LOG_PATH') or os.path.join(os.path.dirname(os.path.abspath(self.database_path)),
+                                                            'query_log.db'),
+                batch_size=int(os.getenv('QUERY_LOG_BATCH_SIZE', 200)),
+                flush_interval=float(os.getenv('QUERY_LOG_FLUSH_SECONDS', 1))
+            )
+        
+        # Conversation sessions: last SQL result per session for follow-up refinements
+        self.sessions = SessionStore(
+            ttl_seconds=float(os.getenv('SESSION_TTL', 1800)),
+            max_sessions=int(os.getenv('SESSION_MAX', 1000)),
+            max_bytes=int(float(os.getenv('SESSION_MAX_MB', 256)) * 1024 * 1024)
+        )
+        # Last good answer per question regardless of data version, served while the LLM is down
+        self.fallback_cache = None
+        self._fallback_answers: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        if self.shared_cache_path:
+            from shared_cache import SharedCache
+            self.answer_cache = SharedCache(self.shared_cache_path, ttl_seconds=self.answer_cache_ttl,
+                                            namespace="answers")
+            self.fallback_cache = SharedCache(self.shared_cache_path, ttl_seconds=self.fallback_answer_ttl,
+                                              namespace="fallback_answers")
+        else:
+            from shared_cache import MemoryCache
+            self.answer_cache = MemoryCache(ttl_seconds=self.answer_cache_ttl)
+        
+        # Responses depend on the result rows and the response settings; any data change clears them
+        self.response_cache = None
+        if self.response_caching:
+            settings = "|".join([self.model, str(self.temperature), str(self.response_max_tokens),
+                                 str(self.data_token_budget),
+                                 hashlib.sha256(self.system_prompt.encode("utf-8")).hexdigest()[:16]])
+            self.response_cache = ResponseCache(
+                settings,
+                max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', 1024)),
+                ttl_seconds=float(os.getenv('RESPONSE_CACHE_TTL', 24 * 3600)),
+                shared_path=os.getenv('RESPONSE_CACHE_PATH', self.shared_cache_path or '') or None,
+                data_version=self.data_version
+            )
+        
+        # Templates depend on the model and the schema, not on the data
+        self.sql_templates = None
+        if self.sql_template_caching:
+            if self.shared_cache_path:
+                template_store = SharedCache(self.shared_cache_path, ttl_seconds=self.sql_template_ttl,
+                                             namespace="sql_templates")
+            else:
+                template_store = MemoryCache(ttl_seconds=self.sql_template_ttl, max_entries=4096)
+            schema_hash = hashlib.sha256(self.db_schema.encode("utf-8")).hexdigest()[:16]
+            self.sql_templates = SQLTemplateCache(
+                template_store,
+                self.intent_router.synonyms if self.intent_router
+                else build_metric_synonyms(columns_from_schema(self.db_schema)),
+                salt=f"{self.model}|{schema_hash}"
+            )
+    
+    def _get_llm_client(self):
+        """Return the OpenAI client for this process, creating it after any fork()."""
+        if self._llm_client is None or self._llm_client_pid != os.getpid():
+            from openai import OpenAI
+            # Retries are handled by self.llm_caller
+            self._llm_client = OpenAI(api_key=self.api_key, max_retries=0)
+            self._llm_client_pid = os.getpid()
+        return self._llm_client
+    
+    def _create_completion(self, messages: List[Dict[str, str]], max_tokens: int,
+                           timeout: Optional[float] = None):
+        """Raw chat completion call to the provider."""
+        return self._get_llm_client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=self.temperature,
+            timeout=timeout
+        )
+    
+    def _send_completion(self, messages: List[Dict[str, str]], max_tokens: int, prompt_tokens: int,
+                         priority: str, timeout: float):
+        """One provider request, admitted by the LLM scheduler when rate limits are configured."""
+        if self.llm_scheduler is None:
+            return self._create_completion(messages, max_tokens, timeout)
+        
+        # Providers count max_tokens against TPM when the request arrives, so reserve it too
+        self.llm_scheduler.acquire(prompt_tokens + max_tokens, priority)
+        try:
+            return self._create_completion(messages, max_tokens, timeout)
+        except Exception as e:
+            if type(e).__name__ == "RateLimitError":
+                retry_after = getattr(getattr(e, "response", None), "headers", {}).get("retry-after")
+                self.llm_scheduler.pause(float(retry_after or 1))
+            raise
+    
+    def _chat_completion(self, messages: List[Dict[str, str]], max_tokens: int) -> str:
+        """Send one chat completion request and return the stripped message text."""
+        prompt_tokens = count_message_tokens(messages)
+        priority = getattr(self._local, "priority", "interactive")
+        response = self.llm_caller.call(
+            lambda timeout: self._send_completion(messages, max_tokens, prompt_tokens, priority, timeout)
+        )
+        
+        # Account token spend for the request being processed on this thread
+        usage = getattr(self._local, "token_usage", None)
+        if usage is not None:
+            reported = getattr(response, "usage", None)
+            usage["llm_calls"] += 1
+            usage["prompt_tokens"] += getattr(reported, "prompt_tokens", None) or prompt_tokens
+            usage["completion_tokens"] += getattr(reported, "completion_tokens", None) or 0
+        
+        return response.choices[0].message.content.strip()
+    
+    def data_version(self) -> str:
+        """Cheap fingerprint of the database file that changes whenever it is written."""
+        try:
+            stat = os.stat(self.database_path)
+            return f"{stat.st_mtime_ns}-{stat.st_size}"
+        except OSError:
+            return "unknown"
+    
+    def question_key(self, user_question: str, tenant_id: Optional[str] = None) -> str:
+        """Identity of an answer: normalized question, tenant, model and data version."""
+        raw = "|".join([
+            normalize_question(user_question), tenant_id or "", self.model,
+            str(self.temperature), self.data_version()
+        ])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def preload_answers(self, questions: List[str]):
+        """Copy cached answers for known questions (e.g. the examples) into process memory."""
+        if not self.answer_cache:
+            return
+        for question in questions:
+            key = self.question_key(question)
+            cached = self.answer_cache.get(key)
+            if cached is not None:
+                self._preloaded_answers[key] = cached
+        logger.info(f"Preloaded {len(self._preloaded_answers)} cached answers")
+    
+    def _fallback_key(self, user_question: str, tenant_id: Optional[str] = None) -> str:
+        """Like question_key but without the data version, so older answers still match."""
+        raw = "|".join([normalize_question(user_question), tenant_id or "", self.model])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def _remember_fallback(self, user_question: str, tenant_id: Optional[str], result: Dict[str, Any]):
+        """Keep the latest good answer for use while the LLM provider is unavailable."""
+        key = self._fallback_key(user_question, tenant_id)
+        self._fallback_answers[key] = result
+        self._fallback_answers.move_to_end(key)
+        while len(self._fallback_answers) > 256:
+            self._fallback_answers.popitem(last=False)
+        if self.fallback_cache:
+            self.fallback_cache.set(key, result)
+    
+    def _get_fallback_answer(self, user_question: str, tenant_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Most recent good answer to this question, possibly for older data."""
+        key = self._fallback_key(user_question, tenant_id)
+        fallback = self._fallback_answers.get(key)
+        if fallback is None and self.fallback_cache:
+            fallback = self.fallback_cache.get(key)
+        return fallback
+    
+    def _get_cached_answer(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Look up an answer in the preloaded answers, then in the shared cache."""
+        cached = self._preloaded_answers.get(cache_key)
+        if cached is None and self.answer_cache:
+            cached = self.answer_cache.get(cache_key)
+        return cached
+    
+    def has_cached_answer(self, user_question: str, tenant_id: Optional[str] = None) -> bool:
+        """Whether an answer for the current data version is already cached."""
+        return self._get_cached_answer(self.question_key(user_question, tenant_id)) is not None
+    
+    def popular_questions(self, n: int) -> List[Tuple[str, Optional[str]]]:
+        """Most asked interactive (question, tenant_id) pairs: from the query log, else the recent window."""
+        if self.query_log:
+            try:
+                return [(question, tenant_id) for question, tenant_id, _ in
+                        self.query_log.frequent_questions(n, since_seconds=self.query_log_window)]
+            except sqlite3.Error as e:
+                logger.error(f"Error reading the query log: {e}")
+        return self.recent_questions.top(n)
+    
+    def cache_metrics(self) -> Dict[str, Any]:
+        """Answer cache hit rate for interactive questions plus the cache's own counters."""
+        lookups = self.answer_cache_stats["hits"] + self.answer_cache_stats["misses"]
+        metrics = dict(self.answer_cache_stats,
+                       hit_rate=self.answer_cache_stats["hits"] / lookups if lookups else 0.0)
+        if self.answer_cache:
+            metrics["entries"] = self.answer_cache.stats()["entries"]
+        return metrics
         
     def _get_database_schema(self) -> str:
         """Get database schema information for LLM context."""
@@ -61,10 +430,15 @@ class FarmDataRAG:
             # Get all tables
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
             tables = cursor.fetchall()
+            # The fact table goes first: it is the preferred source, and the budget trims later tables first
+            tables.sort(key=lambda table: table[0] != FACT_TABLE)
             
             schema_info = []
             for table in tables:
                 table_name = table[0]
+                if is_internal_table(table_name) or (table_name == FACT_TABLE and not self.use_fact_table) or (
+                        table_name == CHANGE_TABLE and not self.use_change_table):
+                    continue
                 cursor.execute(f"PRAGMA table_info({table_name})")
                 columns = cursor.fetchall()
                 
@@ -84,15 +458,73 @@ class FarmDataRAG:
             logger.error(f"Error getting database schema: {e}")
             return "Database schema information unavailable"
     
-    def _generate_sql_query(self, user_question: str) -> str:
-        """Use OpenAI to generate SQL query from user question."""
+    def _generate_sql_query(self, user_question: str, history: str = "", feedback: str = "") -> str:
+        """Use OpenAI to generate SQL query from user question (and the conversation so far)."""
+        
+        # The schema and the history can grow; trim them to the budget, schema first
+        sections = TokenBudget(self.prompt_token_budget).fit([
+            PromptSection("question", user_question, priority=3),
+            PromptSection("history", history, priority=2, shrink=shrink_lines),
+            PromptSection("schema", self.db_schema, priority=1,
+                          shrink=lambda text, limit: shrink_schema(text, limit, user_question)),
+        ])
+        
+        entities = ""
+        hint = self.entity_resolver.prompt_hint(user_question) if self.entity_resolver else ""
+        if hint:
+            entities = f"""
+Entities named in the question (filter on these exact values with =, not LIKE):
+{hint}
+"""
+        
+        facts = ""
+        if self.has_fact_table:
+            facts = f"""
+Prefer {FACT_TABLE}: it has one row per farm-year (hdb_main_data_id) with the descriptor columns and the most-used fm_guide/fm_stmts metrics under their original names, so it needs no JOINs. Join the source tables only for columns it does not have.
+"""
+        
+        changes = ""
+        if self.has_change_table:
+            changes = f"""
+For changes over a year or across years, use {CHANGE_TABLE}: one row per farm-year (hdb_main_data_id, year) and metric, with beginning, ending, delta, pct_change, yoy_delta (vs the farm's previous year), yoy_pct and cagr (since the farm's first year). Metrics: {", ".join(self.change_metrics)}. For the biggest movers filter metric = '...' and ORDER BY one of {", ".join(RANK_COLUMNS)} with a LIMIT (index-backed).
+"""
+        
+        metrics = ""
+        if self.farm_metrics:
+            metrics = f"""
+Derived metric functions (pass the columns in this order; they return NULL for missing inputs or a zero denominator):
+{describe_sql_functions()}
+"""
+            if self.has_metrics_table:
+                metrics += f"{METRICS_TABLE} holds these metrics precomputed per farm-year (hdb_main_data_id), plus year-over-year changes.\n"
+        
+        quality = ""
+        if self.has_flags_table:
+            quality = f"""
+For data-quality questions use {FLAGS_TABLE}: one row per failing fm_stmts row (stmt_rowid = fm_stmts.id, hdb_main_data_id) and check_name, with the residual. Checks:
+{describe_checks()}
+"""
+        
+        rejected = ""
+        if feedback:
+            rejected = f"""
+A previous SQL query for this question was rejected before execution: {feedback}
+Write a different query: join tables only on hdb_main_data_id or fm_genin_guid, avoid correlated subqueries, and filter or aggregate instead of scanning everything.
+"""
+        
+        conversation = ""
+        if sections["history"]:
+            conversation = f"""
+Earlier in this conversation (resolve references such as "those" or "now only ..." against it):
+{sections["history"]}
+"""
         
         prompt = f"""
 You are a SQL expert specializing in farm financial data analysis. Based on the user's question, generate a SQL query to extract the relevant information.
 
 Database Schema:
-{self.db_schema}
-
+{sections["schema"]}
+{facts}{changes}{metrics}{quality}{entities}{conversation}{rejected}
 User Question: {user_question}
 
 Instructions:
@@ -106,27 +538,20 @@ Instructions:
 8. Return ONLY the SQL query, no explanations
 9. IMPORTANT: Do not use table names that don't exist in the schema
 
-Available tables: hdb_main_data, fm_genin, fm_guide, fm_stmts, fm_prf_lq, fm_cap_ad, fm_hhold, fm_nf_ie, fm_fm_exp, fm_fm_inc, fm_beg_bs_end_bs
+Available tables: {FACT_TABLE + ", " if self.has_fact_table else ""}{METRICS_TABLE + ", " if self.has_metrics_table else ""}{CHANGE_TABLE + ", " if self.has_change_table else ""}{FLAGS_TABLE + ", " if self.has_flags_table else ""}hdb_main_data, fm_genin, fm_guide, fm_stmts, fm_prf_lq, fm_cap_ad, fm_hhold, fm_nf_ie, fm_fm_exp, fm_fm_inc, fm_beg_bs_end_bs
 
 SQL Query:
 """
         
         try:
-            from openai import OpenAI
-            client = OpenAI(api_key=self.api_key)
-            
-            response = client.chat.completions.create(
-                model=self.model,
-                messages=[
+            sql_query = self._chat_completion(
+                [
                     {"role": "system", "content": "You are a SQL expert. Generate only SQL queries, no explanations."},
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
+                max_tokens=self.sql_max_tokens
             )
             
-            sql_query = response.choices[0].message.content.strip()
-            
             # Clean up the response to extract just the SQL
             if sql_query.startswith('```sql'):
                 sql_query = sql_query[7:]
@@ -135,51 +560,266 @@ SQL Query:
             
             sql_query = sql_query.strip()
             
-            logger.info(f"Generated SQL: {sql_query}")
+            logger.debug(f"Generated SQL: {sql_query}")
             return sql_query
             
+        except (SchedulerOverloaded, LLMUnavailable):
+            raise
         except Exception as e:
             logger.error(f"Error generating SQL: {e}")
             raise Exception(f"Failed to generate SQL query: {e}")
     
-    def _execute_sql_query(self, sql_query: str) -> QueryResult:
+    def _generate_sql_batch(self, questions: List[str], priority: str):
+        """SQL for several questions from one completion: (SQL or None per question, token usage)."""
+        self._local.priority = priority
+        self._local.token_usage = {"llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        joined = "\n".join(questions)
+        sections = TokenBudget(self.prompt_token_budget).fit([
+            PromptSection("questions", joined, priority=2),
+            PromptSection("schema", self.db_schema, priority=1,
+                          shrink=lambda text, limit: shrink_schema(text, limit, joined)),
+        ])
+        try:
+            reply = self._chat_completion(
+                [
+                    {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+                    {"role": "user", "content": batch_prompt(questions, sections["schema"])}
+                ],
+                max_tokens=min(self.sql_max_tokens * len(questions), 4096)
+            )
+            sql_queries = parse_batch_reply(reply, len(questions))
+        except (SchedulerOverloaded, LLMUnavailable):
+            raise
+        except Exception as e:
+            # Every item falls back to a call of its own
+            logger.error(f"Error generating batched SQL: {e}")
+            sql_queries = [None] * len(questions)
+        return sql_queries, dict(self._local.token_usage)
+    
+    def _generate_sql_alone(self, user_question: str, priority: str):
+        """Unbatched fallback for one item of a batch: (SQL, token usage)."""
+        self._local.priority = priority
+        self._local.token_usage = {"llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        return self._generate_sql_query(user_question), dict(self._local.token_usage)
+    
+    def _get_sql_batcher(self) -> SQLBatcher:
+        """The micro-batcher for this process (its threads do not survive fork())."""
+        if self.sql_batcher is None or self._sql_batcher_pid != os.getpid():
+            self.sql_batcher = SQLBatcher(self._generate_sql_batch, self._generate_sql_alone,
+                                           max_batch=self.sql_batch_size, max_wait_ms=self.sql_batch_wait_ms)
+            self._sql_batcher_pid = os.getpid()
+        return self.sql_batcher
+    
+    def _generate_sql(self, user_question: str) -> str:
+        """SQL for a standalone question, micro-batched with concurrent questions when enabled."""
+        if not self.sql_batching:
+            return self._generate_sql_query(user_question)
+        sql_query, usage = self._get_sql_batcher().submit(
+            user_question, getattr(self._local, "priority", "interactive"))
+        own_usage = getattr(self._local, "token_usage", None)
+        if own_usage is not None:
+            for name, value in usage.items():
+                own_usage[name] += value
+        return sql_query
+    
+    def _llm_sql(self, user_question: str, history: str = "") -> str:
+        """LLM SQL for a question; SQL the optimizer would reject is regenerated once with the reason."""
+        if history:
+            sql_query = self._generate_sql_query(user_question, history=history)
+        else:
+            sql_query = self._generate_sql(user_question)
+        if not (self.sql_optimizer and self.sql_regenerate):
+            return sql_query
+        with self.db_pool.connection() as conn:
+            review = self.sql_optimizer.review(conn, sql_query)
+        if not review.rejected:
+            return sql_query
+        logger.warning(f"Generated SQL rejected ({review.reason}); regenerating")
+        self.sql_optimizer.regenerated += 1
+        return self._generate_sql_query(user_question, history=history, feedback=review.reason)
+    
+    def _reviewed_sql(self, conn, sql_query: str, params: Sequence[Any] = ()) -> str:
+        """The optimizer's rewrite of a statement; raises SQLRejected when it must not run."""
+        review = self.sql_optimizer.review(conn, sql_query, params)
+        if review.rejected:
+            raise SQLRejected(f"Query rejected before execution: {review.reason}")
+        if review.rewrites:
+            logger.debug(f"SQL rewritten ({', '.join(review.rewrites)}): {review.sql}")
+        return review.sql
+    
+    def _answer_sql(self, user_question: str, history: str = "",
+                    tenant_id: Optional[str] = None) -> Tuple[QueryResult, Optional[RoutedQuestion]]:
+        """
+        Get SQL for a question and run it. The SQL comes from a vetted template when the
+        intent router is confident, then from a learned SQL template for the question's
+        shape, and only then from the LLM; LLM SQL that runs is learned for its shape.
+        """
+        if history:
+            # Context-dependent questions always need the LLM
+            sql_query = self._llm_sql(user_question, history=history)
+            return self._execute_sql_query(sql_query, tenant_id=tenant_id), None
+        
+        routed = self.intent_router.route(user_question) if self.intent_router else None
+        if routed is not None:
+            self._trace(source="router")
+            if tenant_id is None and self.shard_fan_out and self.shard_executor and routed.fan_out:
+                # Portfolio-wide: every tenant shard in parallel, partial results merged
+                return self._execute_fan_out(routed), routed
+            return self._execute_sql_query(routed.sql, tenant_id=tenant_id, params=routed.params), routed
+        
+        template = self.sql_templates.lookup(user_question) if self.sql_templates else None
+        if template is not None:
+            query_result = self._execute_sql_query(template[0], tenant_id=tenant_id, params=template[1])
+            if query_result.success:
+                self._trace(source="template")
+                return query_result, None
+            logger.warning(f"SQL template failed ({query_result.error_message}); asking the LLM")
+        
+        sql_query = self._llm_sql(user_question)
+        query_result = self._execute_sql_query(sql_query, tenant_id=tenant_id)
+        if query_result.success and self.sql_templates:
+            self.sql_templates.learn(user_question, sql_query)
+        return query_result, None
+    
+    def _execute_fan_out(self, routed: RoutedQuestion) -> QueryResult:
+        """Run a routed question on all tenant shards through the fan-out executor."""
+        import time
+        from tenant_shards import Aggregate
+        
+        start_time = time.time()
+        start_cpu = time.thread_time()
+        plan = dict(routed.fan_out)
+        sql_query = f"-- fan-out over {len(self.shard_executor.shards)} tenant shards\n" + render_sql(routed.sql, routed.params)
+        try:
+            if plan.pop("kind") == "top_k":
+                df = self.shard_executor.top_k(routed.sql, params=routed.params, **plan)
+            else:
+                plan["aggregates"] = {name: Aggregate(func, expression) for name, func, expression in plan["aggregates"]}
+                df = self.shard_executor.aggregate(params=routed.params, **plan)
+            return QueryResult(success=True, data=df, sql_query=sql_query, row_count=len(df),
+                               execution_time=time.time() - start_time, cpu_time=time.thread_time() - start_cpu)
+        except Exception as e:
+            logger.error(f"Shard fan-out error: {e}")
+            return QueryResult(success=False, data=None, sql_query=sql_query, error_message=str(e),
+                               execution_time=time.time() - start_time, cpu_time=time.thread_time() - start_cpu)
+    
+    def _tenant_pool(self, tenant_id: str) -> ConnectionPool:
+        """Connections that only see tenant_id's rows; the least recently used tenant's pool is closed first."""
+        with self._tenant_pools_lock:
+            pool = self._tenant_pools.get(tenant_id)
+            if pool is not None:
+                self._tenant_pools.move_to_end(tenant_id)
+                return pool
+            from tenant_shards import scope_to_tenant
+
+            def on_connect(conn):
+                if self.farm_metrics:
+                    register_sql_functions(conn)
+                scope_to_tenant(conn, tenant_id)
+
+            pool = ConnectionPool(self.database_path, size=min(2, self.db_pool.size),
+                                  statement_cache_size=self.db_pool.statement_cache_size, on_connect=on_connect)
+            self._tenant_pools[tenant_id] = pool
+            while len(self._tenant_pools) > self.tenant_pool_limit:
+                self._tenant_pools.popitem(last=False)[1].close()
+            return pool
+    
+    def _execute_sql_query(self, sql_query: str, tenant_id: Optional[str] = None,
+                           params: Sequence[Any] = ()) -> QueryResult:
         """Execute the SQL query and return results."""
         import time
+        import pandas as pd
         
         start_time = time.time()
+        # CPU time of this thread, charged to the tenant's SQL quota
+        start_cpu = time.thread_time()
         
         try:
-            conn = sqlite3.connect(self.database_path)
-            
-            # Execute query
-            df = pd.read_sql_query(sql_query, conn)
-            conn.close()
+            if tenant_id and self.shard_executor and self.shard_executor.has_tenant(tenant_id):
+                if self.sql_optimizer:
+                    # Shards share the schema; the full database's plan is an upper bound on the shard's
+                    with self.db_pool.connection() as conn:
+                        sql_query = self._reviewed_sql(conn, sql_query, params)
+                df = self.shard_executor.tenant_query(tenant_id, sql_query, params)
+            elif tenant_id:
+                # No shard for this tenant (or no shards at all): never read other tenants' rows
+                from tenant_shards import references_main_schema
+                if references_main_schema(sql_query):
+                    raise SQLRejected("Tenant questions must not name the main schema")
+                with self._tenant_pool(tenant_id).connection() as conn:
+                    if self.sql_optimizer:
+                        sql_query = self._reviewed_sql(conn, sql_query, params)
+                    df = pd.read_sql_query(sql_query, conn, params=tuple(params) or None)
+            else:
+                if self.entity_resolver:
+                    # LIKE on name columns becomes a lookup in the trigram index
+                    sql_query, _ = rewrite_like_predicates(sql_query)
+                with self.db_pool.connection() as conn:
+                    if self.sql_optimizer:
+                        sql_query = self._reviewed_sql(conn, sql_query, params)
+                    # Parameterized SQL keeps one statement text, which the connection compiles once
+                    sql_query = self.db_pool.statement(conn, sql_query)
+                    df = pd.read_sql_query(sql_query, conn, params=tuple(params) or None)
             
             execution_time = time.time() - start_time
             
             return QueryResult(
                 success=True,
                 data=df,
-                sql_query=sql_query,
+                sql_query=render_sql(sql_query, params) if params else sql_query,
                 row_count=len(df),
-                execution_time=execution_time
+                execution_time=execution_time,
+                cpu_time=time.thread_time() - start_cpu
             )
             
         except Exception as e:
             execution_time = time.time() - start_time
-            logger.error(f"SQL execution error: {e}")
+            if isinstance(e, SQLRejected):
+                logger.warning(str(e))
+            else:
+                logger.error(f"SQL execution error: {e}")
             
             return QueryResult(
                 success=False,
                 data=None,
-                sql_query=sql_query,
+                sql_query=render_sql(sql_query, params) if params else sql_query,
                 error_message=str(e),
-                execution_time=execution_time
+                execution_time=execution_time,
+                cpu_time=time.thread_time() - start_cpu
+            )
+    
+    def _narrate(self, prompt: str, cache_key: Optional[str] = None) -> str:
+        """The response call; successful responses are stored in the response cache under cache_key."""
+        try:
+            response = self._chat_completion(
+                [
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=self.response_max_tokens
             )
+            
+        except (SchedulerOverloaded, LLMUnavailable):
+            raise
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            return f"I apologize, but I encountered an error while processing your request: {e}"
+        
+        if cache_key and self.response_cache:
+            self.response_cache.store(cache_key, response)
+        return response
     
     def _generate_response(self, user_question: str, query_result: QueryResult) -> str:
         """Use OpenAI to generate a natural language response based on query results."""
         
+        # Same question over the same rows: reuse the earlier narrative
+        cache_key = None
+        if query_result.success and self.response_cache:
+            cache_key, cached = self.response_cache.lookup(normalize_question(user_question), [query_result.data])
+            if cached is not None:
+                self._trace(response_cache_hit=True)
+                return cached
+        
         if not query_result.success:
             prompt = f"""
 The user asked: {user_question}
@@ -191,8 +831,10 @@ But encountered an error: {query_result.error_message}
 Please provide a helpful response explaining what went wrong and suggest how the user might rephrase their question.
 """
         else:
-            # Convert DataFrame to readable format
-            if query_result.row_count > 0:
+            # Small results verbatim, large ones as a digest of every row, within the data token budget
+            if query_result.row_count > 0 and self.data_token_budget > 0:
+                data_summary = summarize_result(query_result.data, self.data_token_budget)
+            elif query_result.row_count > 0:
                 data_summary = query_result.data.head(20).to_string(index=False)
                 if query_result.row_count > 20:
                     data_summary += f"\n... and {query_result.row_count - 20} more rows"
@@ -221,40 +863,328 @@ Please provide a clear, insightful response that:
 Response:
 """
         
+        return self._narrate(prompt, cache_key)
+    
+    @staticmethod
+    def _result_is_complete(sql_query: str, row_count: int) -> bool:
+        """False when the query's outer LIMIT may have cut the result off."""
+        limits = re.findall(r'\blimit\s+(\d+)', sql_query, re.IGNORECASE)
+        return not limits or row_count < int(limits[-1])
+    
+    def _refine_session_result(self, session: Session, refinement: Refinement) -> QueryResult:
+        """Answer a follow-up by filtering/sorting the session's previous result in pandas."""
+        start_time = time.time()
+        merged = (session.refinement or Refinement()).merged_with(refinement)
+        data = merged.apply(session.base_result)
+        session.refinement = merged
+        logger.info(f"Follow-up answered from the previous result: {merged.describe()}")
+        return QueryResult(
+            success=True,
+            data=data,
+            sql_query=f"{session.base_sql}\n-- refined from the previous result: {merged.describe()}",
+            row_count=len(data),
+            execution_time=time.time() - start_time
+        )
+    
+    def _plan_question(self, user_question: str) -> Optional[QueryPlan]:
+        """Ask the LLM planner to split a comparison question; fall back to the rule-based split."""
+        tables = re.findall(r'^Table: (\w+)', self.db_schema, re.MULTILINE)
         try:
-            from openai import OpenAI
-            client = OpenAI(api_key=self.api_key)
-            
-            response = client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": prompt}
+            reply = self._chat_completion(
+                [
+                    {"role": "system", "content": PLANNER_SYSTEM_PROMPT},
+                    {"role": "user", "content": planner_prompt(user_question, tables, self.planner_max_steps)}
                 ],
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
+                max_tokens=self.sql_max_tokens
             )
-            
-            return response.choices[0].message.content.strip()
-            
+            plan = parse_plan(reply, user_question, self.planner_max_steps)
+        except (SchedulerOverloaded, LLMUnavailable):
+            raise
         except Exception as e:
-            logger.error(f"Error generating response: {e}")
-            return f"I apologize, but I encountered an error while processing your request: {e}"
+            logger.warning(f"Unusable query plan ({e}); splitting the question by rules")
+            plan = split_comparison(user_question)
+        
+        # A single step is just the normal pipeline
+        if plan is None or len(plan.steps) < 2:
+            return None
+        logger.info(f"Planned {len(plan.steps)} sub-queries ({plan.source}): {plan.describe()}")
+        return plan
+    
+    def _run_plan_step(self, step: PlanStep, dependencies: Dict[str, QueryResult],
+                       tenant_id: Optional[str], priority: str):
+        """Generate and run the SQL for one sub-question on a plan worker thread."""
+        self._local.priority = priority
+        self._local.token_usage = {"llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        # The query log records the plan as a whole
+        self._local.trace = None
+        
+        # Dependent steps see their inputs the way follow-ups see the conversation
+        context = []
+        for dep_id, dep_result in dependencies.items():
+            if dep_result.success and dep_result.row_count > 0:
+                summary = summarize_result(dep_result.data, self.history_token_budget // len(dependencies))
+            else:
+                summary = dep_result.error_message or "No rows."
+            context.append(f"Result of step {dep_id} ({dep_result.row_count} rows):\n{summary}")
+        
+        try:
+            query_result, _ = self._answer_sql(step.question, history="\n".join(context), tenant_id=tenant_id)
+        except (SchedulerOverloaded, LLMUnavailable):
+            raise
+        except Exception as e:
+            query_result = QueryResult(success=False, data=None, sql_query="", error_message=str(e))
+        return query_result, dict(self._local.token_usage)
+    
+    def _execute_plan(self, plan: QueryPlan, tenant_id: Optional[str],
+                      cancel_event: Optional[threading.Event]) -> Dict[str, QueryResult]:
+        """Run the plan's sub-queries, independent ones concurrently, and add up their token usage."""
+        priority = getattr(self._local, "priority", "interactive")
+        outcomes = run_plan(
+            plan,
+            lambda step, deps: self._run_plan_step(step, {k: v[0] for k, v in deps.items()}, tenant_id, priority),
+            max_parallel=self.planner_max_parallel,
+            cancel_event=cancel_event
+        )
+        usage = self._local.token_usage
+        for _, step_usage in outcomes.values():
+            for name, value in step_usage.items():
+                usage[name] += value
+        return {step_id: query_result for step_id, (query_result, _) in outcomes.items()}
+    
+    @staticmethod
+    def _combine_plan_results(plan: QueryPlan, step_results: Dict[str, QueryResult],
+                              execution_time: float) -> QueryResult:
+        """One QueryResult for the whole plan; rows carry the step they came from."""
+        import pandas as pd
+        
+        frames, errors = [], []
+        for step in plan.steps:
+            result = step_results.get(step.id)
+            if result is None:
+                continue
+            if not result.success:
+                errors.append(f"{step.id}: {result.error_message}")
+            elif result.data is not None:
+                # Joins can repeat column names, which concat cannot align
+                frame = result.data.copy()
+                seen: Dict[str, int] = {}
+                columns = []
+                for name in map(str, frame.columns):
+                    seen[name] = seen.get(name, 0) + 1
+                    columns.append(name if seen[name] == 1 else f"{name}_{seen[name]}")
+                frame.columns = columns
+                frame.insert(0, "plan_step", step.id)
+                frames.append(frame)
+        
+        sql_query = "\n\n".join(f"-- {step.id}: {step.question}\n{step_results[step.id].sql_query}"
+                                 for step in plan.steps if step.id in step_results)
+        data = pd.concat(frames, ignore_index=True) if frames else None
+        return QueryResult(
+            success=bool(frames),
+            data=data,
+            sql_query=sql_query,
+            error_message="; ".join(errors) or None,
+            row_count=0 if data is None else len(data),
+            execution_time=execution_time,
+            cpu_time=sum(result.cpu_time for result in step_results.values())
+        )
     
-    def ask_question(self, user_question: str) -> Dict[str, Any]:
-        """Main method to process a user question and return a comprehensive response."""
+    def _generate_plan_response(self, user_question: str, plan: QueryPlan,
+                                step_results: Dict[str, QueryResult]) -> str:
+        """One response call that combines every sub-query's result."""
+        cache_key = None
+        results = [step_results.get(step.id) for step in plan.steps]
+        if self.response_cache and all(result is not None and result.success for result in results):
+            question_key = "|".join([normalize_question(user_question)] + [step.question for step in plan.steps])
+            cache_key, cached = self.response_cache.lookup(question_key, [result.data for result in results])
+            if cached is not None:
+                self._trace(response_cache_hit=True)
+                return cached
+        
+        # Each step gets an equal share of the data budget
+        share = self.data_token_budget // len(plan.steps) if self.data_token_budget > 0 else 0
+        parts = []
+        for step in plan.steps:
+            result = step_results.get(step.id)
+            if result is None:
+                continue
+            if not result.success:
+                data_summary = f"Query failed: {result.error_message}"
+            elif result.row_count == 0:
+                data_summary = "No data found matching the criteria."
+            elif share > 0:
+                data_summary = summarize_result(result.data, share)
+            else:
+                data_summary = result.data.head(20).to_string(index=False)
+            parts.append(f"""Sub-question {step.id}: {step.question}
+SQL: {result.sql_query}
+Rows returned: {result.row_count}
+Data:
+{data_summary}
+""")
+        
+        prompt = f"""
+The user asked: {user_question}
+
+I split the question into {len(parts)} sub-questions and ran one SQL query for each:
+
+{chr(10).join(parts)}
+Please provide a clear, insightful response that:
+1. Directly answers the user's question by comparing the sub-question results side by side
+2. Highlights the most important differences and similarities
+3. Provides context about what the numbers mean
+4. Mentions any sub-question that returned no data or failed
+5. Uses financial terminology appropriately for farm data analysis
+
+Response:
+"""
+        
+        return self._narrate(prompt, cache_key)
+    
+    def _trace(self, **fields):
+        """Note how this thread's question is being answered, for the query log."""
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            trace.update(fields)
+    
+    def _log_query(self, user_question: str, tenant_id: Optional[str], priority: str,
+                   result: Dict[str, Any], started: float):
+        """Queue the question's query log record; never fails the request."""
+        if not self.query_log:
+            return
+        try:
+            trace = self._local.trace
+            usage = self._local.token_usage
+            query_result = result.get("query_result") or {}
+            cached = trace["source"] == "answer_cache"
+            execution = 0.0 if cached else query_result.get("execution_time", 0.0)
+            sql_phase = trace.get("sql_seconds", 0.0)
+            self.query_log.record(QueryLogRecord(
+                question=user_question,
+                normalized=normalize_question(user_question),
+                tenant_id=tenant_id,
+                request_class=priority,
+                source=trace["source"],
+                sql=result.get("sql_query", ""),
+                success=bool(result.get("success") and query_result.get("success")),
+                error=result.get("error") or query_result.get("error_message"),
+                row_count=query_result.get("row_count", 0),
+                llm_calls=usage.get("llm_calls", 0),
+                prompt_tokens=usage.get("prompt_tokens", 0),
+                completion_tokens=usage.get("completion_tokens", 0),
+                answer_cache_hit=cached,
+                response_cache_hit=trace.get("response_cache_hit", False),
+                sql_generation_ms=max(0.0, sql_phase - execution) * 1000,
+                sql_execution_ms=execution * 1000,
+                sql_cpu_ms=0.0 if cached else query_result.get("cpu_time", 0.0) * 1000,
+                response_ms=trace.get("response_seconds", 0.0) * 1000,
+                total_ms=(time.time() - started) * 1000
+            ))
+        except Exception as e:
+            logger.error(f"Error recording query log entry: {e}")
+    
+    def ask_question(self, user_question: str, tenant_id: Optional[str] = None,
+                     cancel_event: Optional[threading.Event] = None,
+                     priority: str = "interactive", session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Main method to process a user question and return a comprehensive response.
+        With a session_id, follow-ups build on the session's previous question and result.
+        Setting cancel_event stops the pipeline before its next LLM call or query.
+        `priority` ("interactive" or "batch") orders LLM calls when rate limits are configured;
+        SchedulerOverloaded is raised to the caller when the LLM queue is saturated.
+        Every question is recorded in the query log.
+        """
+        started = time.time()
+        self._local.trace = {"source": "llm"}
+        try:
+            result = self._ask_question(user_question, tenant_id, cancel_event, priority, session_id)
+        except SchedulerOverloaded as e:
+            self._log_query(user_question, tenant_id, priority,
+                            {"success": False, "error": f"overloaded: {e}"}, started)
+            raise
+        self._log_query(user_question, tenant_id, priority, result, started)
+        return result
+    
+    def _ask_question(self, user_question: str, tenant_id: Optional[str],
+                      cancel_event: Optional[threading.Event], priority: str,
+                      session_id: Optional[str]) -> Dict[str, Any]:
+        """The pipeline behind ask_question()."""
+        
+        def check_cancelled():
+            if cancel_event is not None and cancel_event.is_set():
+                raise QuestionCancelled(user_question)
         
         try:
             logger.info(f"Processing question: {user_question}")
+            self._local.token_usage = {"llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            self._local.priority = priority
             
-            # Step 1: Generate SQL query
-            sql_query = self._generate_sql_query(user_question)
+            session = self.sessions.get(session_id, tenant_id) if session_id else None
+            followup = session is not None and bool(session.turns) and is_followup(user_question)
             
-            # Step 2: Execute SQL query
-            query_result = self._execute_sql_query(sql_query)
+            # Follow-ups that only filter/sort/limit the previous result skip SQL generation
+            refinement = None
+            plan = None
+            routed = None
+            if followup and session.base_result is not None:
+                refinement = parse_refinement(user_question, session.base_result, session.base_complete)
+            
+            sql_started = time.time()
+            if refinement is not None:
+                self._trace(source="refinement")
+                query_result = self._refine_session_result(session, refinement)
+                sql_query = query_result.sql_query
+                cache_key = None
+            else:
+                # Context-dependent follow-ups mean something different in every session: no cache
+                cache_key = None if followup else self.question_key(user_question, tenant_id)
+                cached = self._get_cached_answer(cache_key) if cache_key else None
+                if priority == "interactive":
+                    self.recent_questions.record(user_question, tenant_id)
+                    self.answer_cache_stats["hits" if cached is not None else "misses"] += 1
+                if cached is not None:
+                    self._trace(source="answer_cache")
+                    if session is not None:
+                        session.record_turn(user_question, cached.get("sql_query", ""),
+                                            cached.get("query_result", {}).get("row_count", 0))
+                        self.sessions.store_result(session, cached.get("sql_query", ""), None, False)
+                        return dict(cached, session_id=session_id)
+                    return cached
+                
+                # Comparison questions: plan sub-queries and run the independent ones in parallel
+                if self.query_planner and not followup and needs_plan(user_question):
+                    plan = self._plan_question(user_question)
+                
+                if plan is not None:
+                    self._trace(source="plan")
+                    check_cancelled()
+                    plan_start = time.time()
+                    step_results = self._execute_plan(plan, tenant_id, cancel_event)
+                    check_cancelled()
+                    query_result = self._combine_plan_results(plan, step_results, time.time() - plan_start)
+                    sql_query = query_result.sql_query
+                    if session is not None and query_result.success:
+                        self.sessions.store_result(session, sql_query, query_result.data, False)
+                else:
+                    # Steps 1-2: Get SQL (template, learned template or LLM) and execute it
+                    history = session.history(self.history_token_budget) if followup else ""
+                    query_result, routed = self._answer_sql(user_question, history=history, tenant_id=tenant_id)
+                    sql_query = query_result.sql_query
+                    if session is not None and query_result.success:
+                        self.sessions.store_result(session, sql_query, query_result.data,
+                                                   self._result_is_complete(sql_query, query_result.row_count))
             
             # Step 3: Generate natural language response
-            response = self._generate_response(user_question, query_result)
+            check_cancelled()
+            response_started = time.time()
+            self._trace(sql_seconds=response_started - sql_started)
+            if plan is not None:
+                response = self._generate_plan_response(user_question, plan, step_results)
+            elif routed is not None and self.intent_local_answers and query_result.success:
+                response = template_answer(routed, query_result.data)
+            else:
+                response = self._generate_response(user_question, query_result)
+            self._trace(response_seconds=time.time() - response_started)
             
             # Step 4: Return comprehensive result
             result = {
@@ -266,15 +1196,59 @@ Response:
                     "success": query_result.success,
                     "row_count": query_result.row_count,
                     "execution_time": query_result.execution_time,
+                    "cpu_time": query_result.cpu_time,
                     "error_message": query_result.error_message
-                }
+                },
+                "token_usage": dict(self._local.token_usage)
             }
             
+            if session is not None:
+                session.record_turn(user_question, sql_query, query_result.row_count,
+                                    refined=refinement.describe() if refinement else None)
+                result["session_id"] = session_id
+                result["refined_from_previous_result"] = refinement is not None
+            
+            if routed is not None:
+                result["intent"] = routed.describe()
+            
+            if plan is not None:
+                result["plan"] = [
+                    dict(step, row_count=step_results[step["id"]].row_count,
+                         success=step_results[step["id"]].success)
+                    for step in plan.describe() if step["id"] in step_results
+                ]
+            
             if query_result.success and query_result.data is not None:
                 result["data_preview"] = query_result.data.head(10).to_dict('records')
+                if cache_key:
+                    if self.answer_cache:
+                        self.answer_cache.set(cache_key, result)
+                    self._remember_fallback(user_question, tenant_id, result)
             
             return result
             
+        except SchedulerOverloaded:
+            raise
+        except LLMUnavailable as e:
+            # Provider degraded: serve the last good answer to this question if there is one
+            logger.error(f"LLM unavailable: {e}")
+            fallback = self._get_fallback_answer(user_question, tenant_id)
+            if fallback is not None:
+                return dict(fallback, degraded=True, degraded_reason=str(e))
+            return {
+                "success": False,
+                "question": user_question,
+                "error": str(e),
+                "response": "The language model service is currently unavailable. Please try again shortly."
+            }
+        except QuestionCancelled:
+            logger.info(f"Question cancelled: {user_question}")
+            return {
+                "success": False,
+                "question": user_question,
+                "error": "cancelled",
+                "response": "The request was cancelled before it completed."
+            }
         except Exception as e:
             logger.error(f"Error in ask_question: {e}")
             return {
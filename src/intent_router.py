@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+Local Intent Router
+Recognizes the handful of question shapes that make up most traffic (farm counts,
+top-N farms by a metric, averages by state or county, percentiles) with pattern
+matching and a metric synonym dictionary built from the fm_guide schema, and
+renders their SQL from vetted templates (on the farm-year fact table when it
+carries the metric, and on the change table for "biggest increase" and "how did
+... change" questions). Confidently matched questions skip SQL generation (and
+optionally the response call); everything else goes to the LLM.
+"""
+
+import re
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from conversation import US_STATES, _STATE_NAMES
+from result_digest import format_number
+from fact_table import FACT_TABLE
+from change_engine import CHANGE_TABLE, pairs_for_columns
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Column-name abbreviations in fm_guide and the words people use for them
+ABBREVIATIONS = {
+    'ret': 'return', 'fm': 'farm', 'cap': 'capital', 'accr': 'accrual', 'mkt': 'market',
+    'rev': 'revenue', 'exp': 'expenses', 'repl': 'replacement', 'beg': 'beginning', 'end': 'ending',
+    'def': 'deferred'
+}
+# Basis/period qualifiers; a metric named without them means the preferred variant
+VARIANT_WORDS = {'beg', 'end', 'cost', 'mkt', 'accr', 'no', 'def'}
+PREFERRED_VARIANTS = ('end', 'cost')
+# Common names that are not derivable from the column names
+EXTRA_SYNONYMS = {
+    'roa': 'rate_of_ret_on_farm_assets_cost',
+    'return on assets': 'rate_of_ret_on_farm_assets_cost',
+    'roe': 'rate_of_ret_on_farm_equity_cost',
+    'return on equity': 'rate_of_ret_on_farm_equity_cost',
+    'profit margin': 'operating_profit_margin_cost',
+    'net income': 'net_farm_income_cost',
+    'debt to asset ratio': 'end_cost_farm_debt_to_asset_ratio',
+    'debt to asset': 'end_cost_farm_debt_to_asset_ratio',
+    'debt to equity ratio': 'end_cost_farm_debt_to_equity_ratio',
+    'equity to asset ratio': 'end_cost_farm_equity_to_asset_ratio',
+    'term debt coverage': 'term_debt_coverage_ratio_accr',
+}
+
+_FROM_GUIDE = "FROM fm_guide g JOIN hdb_main_data h ON h.hdb_main_data_id = g.hdb_main_data_id"
+TEMPLATES = {
+    "count": "SELECT COUNT(*) AS farm_count FROM hdb_main_data h{where}",
+    "count_by": ("SELECT h.{group}, COUNT(*) AS farm_count FROM hdb_main_data h{where} "
+                 "GROUP BY h.{group} ORDER BY farm_count DESC"),
+    "top_n": ("SELECT h.hdb_main_data_id, h.state, h.county, h.year, g.{metric} " + _FROM_GUIDE +
+              "{where} ORDER BY g.{metric} {direction} LIMIT {n}"),
+    "average": "SELECT COUNT(g.{metric}) AS farms, AVG(g.{metric}) AS avg_{metric} " + _FROM_GUIDE + "{where}",
+    "average_by": ("SELECT h.{group}, COUNT(g.{metric}) AS farms, AVG(g.{metric}) AS avg_{metric} " + _FROM_GUIDE +
+                   "{where} GROUP BY h.{group} ORDER BY avg_{metric} DESC LIMIT 50"),
+    # SQLite has no percentile function: take the value at the nearest rank
+    "percentile": ("SELECT g.{metric} AS p{pct}_{metric} " + _FROM_GUIDE + "{where} ORDER BY g.{metric} "
+                   "LIMIT 1 OFFSET (SELECT CAST((COUNT(g.{metric}) - 1) * {pct} / 100.0 AS INTEGER) "
+                   + _FROM_GUIDE + "{where})"),
+}
+# The same shapes over the farm-year fact table, for metrics it carries: no join
+_FROM_FACTS = f"FROM {FACT_TABLE} h"
+FACT_TEMPLATES = {intent: sql.replace(_FROM_GUIDE, _FROM_FACTS).replace("g.{metric}", "h.{metric}")
+                  for intent, sql in TEMPLATES.items()}
+
+# Beginning-vs-ending and year-over-year changes of paired metrics, ranked in (metric, column) index order
+_FROM_CHANGES = f"FROM {CHANGE_TABLE} c JOIN hdb_main_data h ON h.hdb_main_data_id = c.hdb_main_data_id"
+CHANGE_TEMPLATES = {
+    "top_change": ("SELECT c.hdb_main_data_id, h.state, h.county, c.year, c.beginning, c.ending, c.{rank} "
+                   + _FROM_CHANGES + "{where} ORDER BY c.{rank} {direction} LIMIT {n}"),
+    "average_change": ("SELECT COUNT(c.{rank}) AS farms, AVG(c.beginning) AS avg_beginning, AVG(c.ending) AS avg_ending, "
+                       "AVG(c.{rank}) AS avg_{rank} " + _FROM_CHANGES + "{where}"),
+    "average_change_by": ("SELECT h.{group}, COUNT(c.{rank}) AS farms, AVG(c.beginning) AS avg_beginning, "
+                          "AVG(c.ending) AS avg_ending, AVG(c.{rank}) AS avg_{rank} " + _FROM_CHANGES +
+                          "{where} GROUP BY h.{group} ORDER BY avg_{rank} DESC LIMIT 50"),
+}
+CHANGE_SYNONYMS = {
+    'debt to asset': 'cost_farm_debt_to_asset_ratio',
+    'debt to asset ratio': 'cost_farm_debt_to_asset_ratio',
+    'debt to equity': 'cost_farm_debt_to_equity_ratio',
+    'equity to asset': 'cost_farm_equity_to_asset_ratio',
+}
+# How the change is measured, from the question's wording; plain "change" means the within-year delta
+_RANK_PATTERNS = [
+    ("cagr", re.compile(r"\b(cagr|compound(?:ed)?|annual growth|annualized)\b")),
+    ("yoy_delta", re.compile(r"\b(year over year|yoy|from (?:the )?(?:last|previous|prior) year)\b")),
+    ("pct_change", re.compile(r"\b(percent(?:age)?|pct|relative)\b|%")),
+]
+_CHANGE_PATTERN = re.compile(r"\b(increase[ds]?|decrease[ds]?|changed?|changes|grew|grow(?:th|n)?|gain(?:ed|s)?|"
+                             r"improve[ds]?|improvement|decline[ds]?|drop(?:ped|s)?|rose|rise|fell|fall|cagr)\b")
+_DECREASE_PATTERN = re.compile(r"\b(decrease[ds]?|decline[ds]?|drop(?:ped|s)?|fell|fall|worst|lowest|smallest)\b")
+_MOVER_PATTERN = re.compile(r"\b(which|top|biggest|largest|greatest|most|highest|lowest|best|worst|smallest)\b")
+_CHANGE_FILLER = {
+    'increase', 'increases', 'increased', 'decrease', 'decreases', 'decreased', 'change', 'changed', 'changes',
+    'grew', 'grow', 'growth', 'grown', 'gain', 'gained', 'gains', 'improve', 'improved', 'improves',
+    'improvement', 'decline', 'declined', 'declines', 'drop', 'dropped', 'drops', 'rose', 'rise', 'fell', 'fall',
+    'cagr', 'biggest', 'greatest', 'most', 'did', 'had', 'from', 'beginning', 'begin', 'end', 'ending', 'start',
+    'over', 'last', 'previous', 'prior', 'yoy', 'percent', 'percentage', 'pct', 'relative', 'annual', 'annualized',
+    'compound', 'compounded', 'rate', 'their', 'its'
+}
+_RANK_LABELS = {"delta": "change", "pct_change": "percent change", "yoy_delta": "change from the previous year",
+                "cagr": "compound annual growth"}
+
+_COUNT_PATTERN = re.compile(r"\b(how many|number of|count of|count)\b")
+_TOP_PATTERN = re.compile(r"\b(top|bottom|highest|lowest|best|worst|largest|smallest)\b")
+_AVERAGE_PATTERN = re.compile(r"\b(average|avg|mean)\b")
+_PERCENTILE_PATTERN = re.compile(r"\b(?:(\d{1,2})(?:st|nd|rd|th)?\s+percentile|p(\d{1,2})|(median))\b")
+_GROUP_PATTERN = re.compile(r"\b(?:by|per|each|every|for each|across)\s+(state|county|counties|states)\b")
+_COUNTY_PATTERN = re.compile(r"\b([A-Z][a-z]+(?: [A-Z][a-z]+)?) County\b")
+_YEAR_PATTERN = re.compile(r"\b((?:19|20)\d{2})\b")
+_N_PATTERN = re.compile(r"\b(?:top|bottom|first|best|worst|highest|lowest)\s+(\d{1,3})\b|\b(\d{1,3})\s+(?:farms|best|worst|highest|lowest|top)\b")
+_ASCENDING = {'bottom', 'lowest', 'worst', 'smallest'}
+# Templates only filter inclusively; a negated filter must not be answered as its opposite
+_NEGATION_PATTERN = re.compile(r"\b(not|no|non|never|without|exclud(?:e|es|ed|ing)|except(?:ing)?|outside|"
+                               r"other than|besides|apart from|isn'?t|aren'?t|don'?t|doesn'?t)\b")
+
+# Words that carry no meaning beyond the recognized intent and slots
+_FILLER_WORDS = {
+    'what', 'whats', 'which', 'is', 'are', 'the', 'a', 'an', 'of', 'in', 'for', 'by', 'per', 'each', 'every',
+    'across', 'all', 'there', 'show', 'me', 'list', 'give', 'get', 'find', 'tell', 'do', 'does', 'have',
+    'has', 'with', 'farm', 'farms', 'state', 'states', 'county', 'counties', 'year', 'how', 'many', 'number',
+    'count', 'top', 'bottom', 'highest', 'lowest', 'best', 'worst', 'largest', 'smallest', 'average', 'avg',
+    'mean', 'median', 'percentile', 'value', 'values', 'our', 'we', 'please', 'total', 'records', 'st',
+    'nd', 'rd', 'th', 'and', 'at', 'to', 'on', 'during', 'data', 'had', 's'
+}
+
+@dataclass
+class RoutedQuestion:
+    """A question matched to a template: the rendered SQL, its bound values and what was recognized."""
+    intent: str
+    sql: str
+    confidence: float
+    slots: Dict[str, Any] = field(default_factory=dict)
+    params: List[Any] = field(default_factory=list)
+    # How to run it on tenant shards with mergeable partials (None: single database only)
+    fan_out: Optional[Dict[str, Any]] = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {"intent": self.intent, "confidence": round(self.confidence, 2), "slots": self.slots}
+
+def fan_out_plan(intent: str, values: Dict[str, Any], conditions: List[str],
+                 on_facts: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    The template as a shard fan-out: ("top_k", kwargs) re-ranks each shard's top rows, and
+    ("aggregate", kwargs) merges per-shard partial aggregates. Output columns keep the
+    template's order. Percentiles do not merge from partials, so they have no plan.
+    """
+    if intent in ("top_n", "top_change"):
+        order_by = values["rank"] if intent == "top_change" else values["metric"]
+        return {"kind": "top_k", "order_by": order_by, "k": values["n"], "descending": values["direction"] == "DESC"}
+    if intent == "percentile":
+        return None
+    if intent in ("count", "count_by"):
+        from_clause = "hdb_main_data h"
+        aggregates = [("farm_count", "count", "*")]
+        order_by = "farm_count"
+    elif intent in ("average", "average_by"):
+        column = f"{'h' if on_facts else 'g'}.{values['metric']}"
+        from_clause = _FROM_FACTS[len("FROM "):] if on_facts else _FROM_GUIDE[len("FROM "):]
+        aggregates = [("farms", "count", column), (f"avg_{values['metric']}", "avg", column)]
+        order_by = f"avg_{values['metric']}"
+    else:
+        rank = values["rank"]
+        from_clause = _FROM_CHANGES[len("FROM "):]
+        aggregates = [("farms", "count", f"c.{rank}"), ("avg_beginning", "avg", "c.beginning"),
+                      ("avg_ending", "avg", "c.ending"), (f"avg_{rank}", "avg", f"c.{rank}")]
+        order_by = f"avg_{rank}"
+    grouped = intent.endswith("_by")
+    return {"kind": "aggregate", "from_clause": from_clause, "aggregates": aggregates,
+            "where": " AND ".join(conditions) or None, "group_by": [f"h.{values['group']}"] if grouped else None,
+            "order_by": order_by if grouped else None, "limit": 50 if grouped and intent != "count_by" else None}
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+def _phrase(words) -> str:
+    return " ".join(words)
+
+def build_metric_synonyms(columns: List[str]) -> Dict[str, Tuple[str, float]]:
+    """Phrase -> (column, confidence): raw and expanded names, plus short names without basis/period words."""
+    synonyms: Dict[str, Tuple[str, float]] = {}
+    short_names: Dict[str, List[str]] = {}
+    for column in columns:
+        tokens = column.lower().split("_")
+        synonyms[_phrase(tokens)] = (column, 1.0)
+        synonyms[_phrase(ABBREVIATIONS.get(token, token) for token in tokens)] = (column, 1.0)
+        core = [token for token in tokens if token not in VARIANT_WORDS]
+        if core and core != tokens:
+            short_names.setdefault(_phrase(ABBREVIATIONS.get(token, token) for token in core), []).append(column)
+
+    for phrase, candidates in short_names.items():
+        if phrase in synonyms:
+            continue
+        # "current ratio" means the ending, cost-basis value unless the question says otherwise
+        ranked = sorted(candidates, key=lambda c: -sum(v in c.split("_") for v in PREFERRED_VARIANTS))
+        synonyms[phrase] = (ranked[0], 0.95)
+
+    for phrase, column in EXTRA_SYNONYMS.items():
+        if column in columns and phrase not in synonyms:
+            synonyms[phrase] = (column, 0.9)
+    return synonyms
+
+def columns_from_schema(schema_text: str, table: str = "fm_guide") -> List[str]:
+    """Numeric columns of one table from FarmDataRAG's schema text."""
+    match = re.search(rf"^Table: {table}\nColumns:\n((?:  - .*\n?)+)", schema_text, re.MULTILINE)
+    if not match:
+        return []
+    columns = re.findall(r"^  - (\w+): (\w+)", match.group(1), re.MULTILINE)
+    return [name for name, col_type in columns
+            if col_type.upper() in ("REAL", "INTEGER", "NUMERIC") and name not in ("id",)]
+
+class IntentRouter:
+    """Matches questions to SQL templates; returns None when the LLM should handle them."""
+
+    def __init__(self, metric_columns: List[str], min_confidence: float = 0.8,
+                 fact_columns: Optional[List[str]] = None, change_metrics: Optional[List[str]] = None):
+        self.metric_columns = metric_columns
+        self.fact_columns = set(fact_columns or ())
+        self.synonyms = build_metric_synonyms(metric_columns)
+        # Longest phrases first so "net farm income ratio" wins over "net farm income"
+        self._phrases = sorted(self.synonyms, key=lambda p: -len(p.split()))
+        # Paired metrics in the change table; empty when the database has none
+        self.change_synonyms = build_metric_synonyms(change_metrics or [])
+        for phrase, metric in CHANGE_SYNONYMS.items():
+            if metric in (change_metrics or []):
+                self.change_synonyms.setdefault(phrase, (metric, 0.9))
+        self._change_phrases = sorted(self.change_synonyms, key=lambda p: -len(p.split()))
+        self.min_confidence = min_confidence
+        self.routed = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_schema(cls, schema_text: str, min_confidence: float = 0.8) -> "IntentRouter":
+        change_metrics = None
+        if f"Table: {CHANGE_TABLE}\n" in schema_text:
+            change_metrics = [pair.metric for pair in pairs_for_columns(
+                {table: columns_from_schema(schema_text, table) for table in ("fm_guide", "fm_stmts")})]
+        return cls(columns_from_schema(schema_text), min_confidence, columns_from_schema(schema_text, FACT_TABLE),
+                   change_metrics)
+
+    def _find_metric(self, words: List[str], changes: bool = False) -> Optional[Tuple[str, float, List[int]]]:
+        """Longest synonym phrase in the question: (column or paired metric, confidence, word positions)."""
+        synonyms = self.change_synonyms if changes else self.synonyms
+        text = f" {_phrase(words)} "
+        for phrase in (self._change_phrases if changes else self._phrases):
+            index = text.find(f" {phrase} ")
+            if index >= 0:
+                start = text[:index].count(" ")
+                column, confidence = synonyms[phrase]
+                return column, confidence, list(range(start, start + len(phrase.split())))
+        return None
+
+    @staticmethod
+    def _find_states(question: str, lower: str) -> List[str]:
+        found = [code for name, code in US_STATES.items() if re.search(rf"\b{name}\b", lower)]
+        # Codes only when written in capitals ("MN", not the word "in")
+        found += [code for code in _STATE_NAMES if re.search(rf"\b{code}\b", question) and code not in found]
+        return found
+
+    def classify(self, question: str) -> Optional[RoutedQuestion]:
+        """Best template match regardless of the confidence threshold."""
+        lower = question.lower().strip().rstrip("?.!")
+        if _NEGATION_PATTERN.search(lower):
+            return None
+        words = _words(lower)
+        consumed = set()
+
+        # Change questions about a paired metric read the change table
+        change_metric = self._find_metric(words, changes=True) if _CHANGE_PATTERN.search(lower) else None
+        metric = change_metric or self._find_metric(words)
+        if metric:
+            consumed.update(metric[2])
+        states = self._find_states(question, lower)
+        for name in (_STATE_NAMES[code] for code in states):
+            consumed.update(i for i, w in enumerate(words) if w in name.split())
+        consumed.update(i for i, w in enumerate(words) if w.upper() in states)
+        county_match = _COUNTY_PATTERN.search(question)
+        county = county_match.group(1) if county_match else None
+        if county:
+            consumed.update(i for i, w in enumerate(words) if w in county.lower().split())
+        year_match = _YEAR_PATTERN.search(lower)
+        year = year_match.group(1) if year_match else None
+        group_match = _GROUP_PATTERN.search(lower)
+        group = None
+        if group_match:
+            group = "county" if group_match.group(1).startswith("count") else "state"
+        percentile_match = _PERCENTILE_PATTERN.search(lower)
+        n_match = _N_PATTERN.search(lower)
+
+        # Numbers that are slots are not leftovers
+        numbers = {year} | {g for m in (percentile_match, n_match) if m for g in m.groups() if g}
+        consumed.update(i for i, w in enumerate(words) if w in numbers or re.fullmatch(r"p?\d{1,2}(st|nd|rd|th)?", w))
+
+        if change_metric:
+            if _AVERAGE_PATTERN.search(lower) or not _MOVER_PATTERN.search(lower):
+                intent = "average_change_by" if group else "average_change"
+            else:
+                intent = "top_change"
+            consumed.update(i for i, w in enumerate(words) if w in _CHANGE_FILLER)
+        elif percentile_match and metric:
+            intent = "percentile"
+        elif _AVERAGE_PATTERN.search(lower) and metric:
+            intent = "average_by" if group else "average"
+        elif _TOP_PATTERN.search(lower) and metric:
+            intent = "top_n"
+        elif _COUNT_PATTERN.search(lower) and re.search(r"\bfarms?\b", lower) and not metric:
+            intent = "count_by" if group else "count"
+        else:
+            return None
+
+        leftovers = [w for i, w in enumerate(words) if i not in consumed and w not in _FILLER_WORDS]
+        confidence = (metric[1] if metric else 1.0) - 0.2 * len(leftovers)
+
+        on_facts = bool(metric) and metric[0] in self.fact_columns and not change_metric
+        # Filter values are bound, so every question of one shape shares a compiled statement
+        conditions, where_params = [], []
+        rank = next((column for column, pattern in _RANK_PATTERNS if pattern.search(lower)), "delta")
+        if change_metric:
+            conditions.extend(["c.metric = ?", f"c.{rank} IS NOT NULL"])
+            where_params.append(metric[0])
+        elif intent not in ("count", "count_by"):
+            conditions.append(f"{'h' if on_facts else 'g'}.{metric[0]} IS NOT NULL")
+        if states:
+            conditions.append("h.state IN (" + ", ".join("?" for _ in states) + ")")
+            where_params.extend(states)
+        if county:
+            conditions.append("h.county = ?")
+            where_params.append(county)
+        if year:
+            conditions.append("h.year = ?")
+            where_params.append(year)
+        slots: Dict[str, Any] = {"metric": metric[0] if metric else None, "states": states,
+                                 "county": county, "year": year, "group": group}
+        values = {"where": (" WHERE " + " AND ".join(conditions)) if conditions else "",
+                  "metric": slots["metric"], "group": group}
+        if change_metric:
+            slots["rank"] = rank
+            values["rank"] = rank
+        if intent in ("top_n", "top_change"):
+            slots["n"] = int(next(g for g in n_match.groups() if g)) if n_match else 10
+            if intent == "top_change":
+                slots["descending"] = not _DECREASE_PATTERN.search(lower)
+            else:
+                slots["descending"] = not (set(words) & _ASCENDING)
+            values.update(n=slots["n"], direction="DESC" if slots["descending"] else "ASC")
+        elif intent == "percentile":
+            pct = next((g for g in percentile_match.groups()[:2] if g), None)
+            slots["percentile"] = int(pct) if pct else 50
+            values["pct"] = slots["percentile"]
+        slots = {key: value for key, value in slots.items() if value not in (None, [])}
+        if leftovers:
+            slots["unrecognized"] = leftovers
+
+        templates = CHANGE_TEMPLATES if change_metric else FACT_TEMPLATES if on_facts else TEMPLATES
+        return RoutedQuestion(intent=intent, sql=templates[intent].format(**values),
+                              confidence=max(0.0, confidence), slots=slots,
+                              params=where_params * templates[intent].count("{where}"),
+                              fan_out=fan_out_plan(intent, values, conditions, on_facts))
+
+    def route(self, question: str) -> Optional[RoutedQuestion]:
+        """
+        Template match at or above min_confidence with every word accounted for, else None
+        (use the LLM): an unrecognized word is usually a filter the template cannot express.
+        """
+        try:
+            routed = self.classify(question)
+        except Exception as e:
+            logger.warning(f"Intent routing failed for {question!r}: {e}")
+            routed = None
+        with self._lock:
+            if routed is not None and routed.confidence >= self.min_confidence and "unrecognized" not in routed.slots:
+                self.routed += 1
+                logger.info(f"Routed to template {routed.intent} ({routed.confidence:.2f}): {routed.slots}")
+                return routed
+            self.fallbacks += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.routed + self.fallbacks
+        return {"routed": self.routed, "fallbacks": self.fallbacks,
+                "routed_rate": self.routed / total if total else 0.0}
+
+def template_answer(routed: RoutedQuestion, df: "pd.DataFrame", max_items: int = 10) -> str:
+    """Plain-language answer for a templated result, without an LLM call."""
+    slots = routed.slots
+    metric = slots.get("metric", "").replace("_", " ")
+    scope = []
+    if slots.get("states"):
+        scope.append(", ".join(slots["states"]))
+    if slots.get("county"):
+        scope.append(f"{slots['county']} County")
+    if slots.get("year"):
+        scope.append(slots["year"])
+    where = f" in {' / '.join(scope)}" if scope else ""
+
+    if df is None or df.empty:
+        return f"No farms matched{where}."
+    rows = df.head(max_items).itertuples(index=False)
+    more = f" (showing {max_items} of {len(df)})" if len(df) > max_items else ""
+
+    if routed.intent == "count":
+        return f"There are {format_number(df.iloc[0, 0])} farms{where}."
+    if routed.intent in ("top_change", "average_change", "average_change_by"):
+        measure = _RANK_LABELS[slots["rank"]]
+        if routed.intent == "average_change":
+            if not df.iloc[0, 0]:
+                return f"No farms{where} have {metric} {measure} data."
+            return (f"Across {format_number(df.iloc[0, 0])} farms{where}, average {metric} went from "
+                    f"{format_number(df.iloc[0, 1])} to {format_number(df.iloc[0, 2])} "
+                    f"(average {measure} {format_number(df.iloc[0, 3])}).")
+        if routed.intent == "average_change_by":
+            items = "; ".join(f"{row[0]}: {format_number(row[4])} ({format_number(row[1])} farms)" for row in rows)
+            return f"Average {metric} {measure} by {slots['group']}{where}{more}: {items}."
+        order = "Largest increases" if slots.get("descending", True) else "Largest decreases"
+        items = "; ".join(f"{row[0]} ({row[1]}, {row[2]}, {row[3]}): {format_number(row[4])} to "
+                          f"{format_number(row[5])}, {measure} {format_number(row[6])}" for row in rows)
+        return f"{order} in {metric}{where}{more}: {items}."
+    if routed.intent == "count_by":
+        items = "; ".join(f"{row[0]}: {format_number(row[1])}" for row in rows)
+        return f"Farm counts by {slots['group']}{where}{more}: {items}."
+    if routed.intent in ("average", "percentile") and df.iloc[:, 0].isna().all() or (
+            routed.intent == "average" and df.iloc[0, 0] == 0):
+        return f"No farms{where} have {metric} data."
+    if routed.intent == "average":
+        return (f"The average {metric}{where} is {format_number(df.iloc[0, 1])} "
+                f"across {format_number(df.iloc[0, 0])} farms.")
+    if routed.intent == "average_by":
+        items = "; ".join(f"{row[0]}: {format_number(row[2])} ({format_number(row[1])} farms)" for row in rows)
+        return f"Average {metric} by {slots['group']}{where}{more}: {items}."
+    if routed.intent == "percentile":
+        if slots["percentile"] == 50:
+            return f"The median {metric}{where} is {format_number(df.iloc[0, 0])}."
+        return f"The {slots['percentile']}th percentile of {metric}{where} is {format_number(df.iloc[0, 0])}."
+    order = "Highest" if slots.get("descending", True) else "Lowest"
+    items = "; ".join(f"{row[0]} ({row[1]}, {row[2]}, {row[3]}): {format_number(row[4])}" for row in rows)
+    return f"{order} {metric}{where}{more}: {items}."
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Resilient LLM Calls
+Wraps a blocking provider call with a per-call deadline, retries with jittered
+exponential backoff for transient errors, optional hedging (a duplicate request
+sent once the first one is slower than the recent p95) and a circuit breaker
+that fails fast while the provider is degraded.
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Provider errors worth retrying (openai exception class names)
+TRANSIENT_ERRORS = {"APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError",
+                    "DeadlineExceeded"}
+
+class LLMUnavailable(Exception):
+    """The provider could not produce an answer within the deadline and retry budget."""
+
+class CircuitOpen(LLMUnavailable):
+    """The circuit breaker is open; calls fail fast until it resets."""
+
+class DeadlineExceeded(Exception):
+    """An attempt did not finish before the call's deadline."""
+
+def is_transient(error: BaseException) -> bool:
+    """Timeouts, connection errors, 429s and 5xx responses."""
+    if type(error).__name__ in TRANSIENT_ERRORS:
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+class LatencyTracker:
+    """Recent successful call latencies for percentile-based hedge delays."""
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, percent: float) -> float:
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+class CircuitBreaker:
+    """Opens after consecutive transient failures; lets one trial call through after reset_seconds."""
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"LLM circuit breaker opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """End a half-open trial that said nothing about the provider; the next call becomes the trial."""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+
+class ResilientCaller:
+    """Runs call(timeout) with deadline, retries, hedging and a circuit breaker."""
+
+    def __init__(self, deadline_seconds: float = 30.0, max_retries: int = 2,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 hedge: bool = False, hedge_percentile: float = 95.0, hedge_min_samples: int = 20,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.deadline_seconds = deadline_seconds
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self._pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-call") if hedge else None
+        self.stats: Dict[str, int] = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+                                      "failures": 0, "short_circuited": 0}
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Send a duplicate once the first request is slower than recent p95 (after warm-up)."""
+        if not self.hedge or len(self.latency) < self.hedge_min_samples:
+            return None
+        return self.latency.percentile(self.hedge_percentile)
+
+    def _attempt(self, call: Callable[[float], Any], deadline: float) -> Any:
+        """One attempt, hedged when enabled; the slower duplicate's result is discarded."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None or hedge_delay >= remaining:
+            return call(remaining)
+
+        primary = self._pool.submit(call, remaining)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        self.stats["hedges"] += 1
+        hedge = self._pool.submit(call, deadline - time.monotonic())
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.stats["hedge_wins"] += 1
+                    # The loser keeps its thread until its own timeout; cancel() only helps if it never started
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        if error is not None:
+            raise error
+        raise DeadlineExceeded()
+
+    def call(self, call: Callable[[float], Any]) -> Any:
+        """Call `call(timeout_seconds)` until it succeeds, fails permanently or the deadline passes."""
+        self.stats["calls"] += 1
+        if not self.breaker.allow():
+            self.stats["short_circuited"] += 1
+            raise CircuitOpen("LLM provider circuit breaker is open")
+
+        deadline = time.monotonic() + self.deadline_seconds
+        attempt = 0
+        settled = False
+        try:
+            while True:
+                start = time.monotonic()
+                try:
+                    result = self._attempt(call, deadline)
+                except Exception as e:
+                    if not is_transient(e) and not isinstance(e, DeadlineExceeded):
+                        # Permanent errors (bad request, local overload) are not the provider being down
+                        raise
+                    self.breaker.record_failure()
+                    settled = True
+                    backoff = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+                    if attempt >= self.max_retries or time.monotonic() + backoff >= deadline or not self.breaker.allow():
+                        self.stats["failures"] += 1
+                        raise LLMUnavailable(f"LLM call failed after {attempt + 1} attempts: {e}") from e
+                    settled = False
+                    attempt += 1
+                    self.stats["retries"] += 1
+                    logger.warning(f"Transient LLM error ({e}); retry {attempt} in {backoff:.2f}s")
+                    time.sleep(backoff)
+                    continue
+                self.latency.record(time.monotonic() - start)
+                self.breaker.record_success()
+                settled = True
+                return result
+        finally:
+            # Every other exit (permanent error, interrupt) must not leave a half-open trial pending
+            if not settled:
+                self.breaker.release_trial()
+
+    def status(self) -> Dict[str, Any]:
+        """Counters and breaker state for monitoring."""
+        return dict(self.stats, breaker=self.breaker.state,
+                    p50_seconds=self.latency.percentile(50), p95_seconds=self.latency.percentile(95))
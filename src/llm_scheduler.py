@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+LLM Admission Control
+Keeps LLM calls under the provider's requests-per-minute and tokens-per-minute
+limits with token buckets. Calls wait in a bounded priority queue (interactive
+before batch); when the queue is full, or a call would wait too long, the
+scheduler sheds it at once with a Retry-After hint instead of piling up 429s.
+"""
+
+import time
+import heapq
+import itertools
+import logging
+import threading
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Lower value is served first
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+class SchedulerOverloaded(Exception):
+    """The LLM queue is full or too slow; retry after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Refills continuously at rate_per_minute up to `burst_seconds` worth of capacity."""
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = 1.0):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (0 if available now)."""
+        self._refill(now)
+        # A request bigger than the bucket is admitted once the bucket is full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= amount
+
+class LLMScheduler:
+    """Thread-safe admission control for blocking LLM calls."""
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_queue: int = 64, max_wait_seconds: float = 30.0, burst_seconds: float = 1.0):
+        """Zero for a limit disables that bucket."""
+        self.request_bucket = TokenBucket(requests_per_minute, burst_seconds) if requests_per_minute > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute > 0 else None
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self._condition = threading.Condition()
+        self._queue: List[tuple] = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self.admitted = 0
+        self.shed = 0
+        self.total_wait = 0.0
+
+    def _wait_time(self, tokens: float, now: float) -> float:
+        wait = max(0.0, self._paused_until - now)
+        if self.request_bucket:
+            wait = max(wait, self.request_bucket.wait_time(1, now))
+        if self.token_bucket:
+            wait = max(wait, self.token_bucket.wait_time(tokens, now))
+        return wait
+
+    def _estimated_drain(self, now: float) -> float:
+        """Rough seconds until the current queue has been admitted (for Retry-After)."""
+        queued_tokens = sum(entry[2] for entry in self._queue)
+        drain = max(0.0, self._paused_until - now)
+        if self.request_bucket:
+            drain = max(drain, len(self._queue) / self.request_bucket.rate)
+        if self.token_bucket:
+            drain = max(drain, queued_tokens / self.token_bucket.rate)
+        return max(1.0, drain)
+
+    def acquire(self, estimated_tokens: int, priority: str = "interactive"):
+        """Block until the call may be sent; raises SchedulerOverloaded when shedding."""
+        rank = PRIORITIES.get(priority, PRIORITIES["batch"])
+        start = time.monotonic()
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                self.shed += 1
+                raise SchedulerOverloaded("LLM queue is full", self._estimated_drain(start))
+
+            entry = (rank, next(self._sequence), estimated_tokens)
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(estimated_tokens, now) if self._queue[0] is entry else None
+                    if wait == 0.0:
+                        heapq.heappop(self._queue)
+                        if self.request_bucket:
+                            self.request_bucket.take(1, now)
+                        if self.token_bucket:
+                            self.token_bucket.take(estimated_tokens, now)
+                        self.admitted += 1
+                        self.total_wait += now - start
+                        self._condition.notify_all()
+                        return
+                    remaining = self.max_wait_seconds - (now - start)
+                    if remaining <= 0:
+                        self.shed += 1
+                        raise SchedulerOverloaded("LLM queue wait exceeded", self._estimated_drain(now))
+                    self._condition.wait(min(remaining, wait) if wait is not None else remaining)
+            except BaseException:
+                if entry in self._queue:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    self._condition.notify_all()
+                raise
+
+    def pause(self, seconds: float):
+        """Stop admitting calls for a while, e.g. after the provider answered 429."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            logger.warning(f"LLM provider rate limited; pausing admissions for {seconds:.1f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring."""
+        with self._condition:
+            return {
+                "queued": len(self._queue),
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "avg_wait_seconds": self.total_wait / self.admitted if self.admitted else 0.0
+            }
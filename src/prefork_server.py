@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Prefork Production Server for the Farm Financial Data RAG API
+Imports the API once in the parent process (building the schema catalog and the
+RAG engine), binds the listening socket, then forks N uvicorn workers that share
+the preloaded read-only state copy-on-write.
+"""
+
+import gc
+import os
+import sys
+import signal
+import logging
+import importlib
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+def _run_worker(config, sock):
+    """Body of a forked worker: serve on the inherited socket until told to stop."""
+    import uvicorn
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+def serve(app_path: str = "farm_rag_api:app", host: str = "0.0.0.0", port: int = 8000,
+          workers: int = 2, log_level: str = "info"):
+    """Preload the application and supervise `workers` forked uvicorn processes."""
+    import uvicorn
+
+    if not hasattr(os, "fork"):
+        # No fork() on Windows: fall back to uvicorn's own (spawn-based) workers
+        uvicorn.run(app_path, host=host, port=port, workers=workers, log_level=log_level)
+        return
+
+    module_name, app_name = app_path.split(":")
+    module = importlib.import_module(module_name)
+    preload = getattr(module, "preload", None)
+    if preload is not None:
+        preload()
+    app = getattr(module, app_name)
+
+    config = uvicorn.Config(app, host=host, port=port, log_level=log_level, lifespan="on")
+    sock = config.bind_socket()
+
+    # Move everything loaded so far out of the GC's reach so collections in the
+    # workers do not touch (and therefore copy) the shared pages
+    gc.collect()
+    gc.freeze()
+
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            # Lets the app run once-per-server work (e.g. cache warming) in a single worker
+            os.environ["API_WORKER_INDEX"] = str(slot)
+            try:
+                _run_worker(config, sock)
+            finally:
+                os._exit(0)
+        children[pid] = slot
+        logger.info(f"Started worker {slot} (pid {pid})")
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    for slot in range(workers):
+        spawn(slot)
+    logger.info(f"Serving {app_path} on {host}:{port} with {workers} prefork workers")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid, None)
+        if slot is not None and not stopping:
+            logger.warning(f"Worker {slot} (pid {pid}) exited with status {status}; restarting")
+            spawn(slot)
+
+    sock.close()
+
+def main():
+    """Command line entry point."""
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Prefork server for the Farm RAG API")
+    parser.add_argument("--app", default="farm_rag_api:app")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    serve(args.app, args.host, args.port, args.workers)
+
+if __name__ == "__main__":
+    sys.exit(main())
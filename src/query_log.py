@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Structured Query Log
+One record per question: wording, normalized form, SQL, where the SQL came
+from, stage timings, row count, token usage, cache hits and errors. Records go
+into an in-memory queue and a background thread appends them to a local store
+in batched commits, so the request path never waits on disk. The store is a
+SQLite file (or JSON lines when the path ends in .jsonl), and the query API
+answers the usual tuning questions: slowest requests, most frequent questions,
+failure rates and the SQL that costs the most execution time.
+"""
+
+import os
+import json
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class QueryLogRecord:
+    """What happened to one question."""
+    question: str
+    normalized: str
+    tenant_id: Optional[str] = None
+    request_class: str = "interactive"
+    source: str = "llm"          # answer_cache, refinement, plan, router, template, llm or error
+    sql: str = ""
+    success: bool = True
+    error: Optional[str] = None
+    row_count: int = 0
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    answer_cache_hit: bool = False
+    response_cache_hit: bool = False
+    sql_generation_ms: float = 0.0
+    sql_execution_ms: float = 0.0
+    sql_cpu_ms: float = 0.0
+    response_ms: float = 0.0
+    total_ms: float = 0.0
+    ts: float = field(default_factory=time.time)
+
+_COLUMNS = [f.name for f in fields(QueryLogRecord)]
+_SQL_TYPES = {str: "TEXT", Optional[str]: "TEXT", bool: "INTEGER", int: "INTEGER", float: "REAL"}
+
+def _create_table(conn: sqlite3.Connection):
+    columns = ", ".join(f"{f.name} {_SQL_TYPES[f.type]}" for f in fields(QueryLogRecord))
+    conn.execute(f"CREATE TABLE IF NOT EXISTS query_log (id INTEGER PRIMARY KEY, {columns})")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_query_log_ts ON query_log (ts)")
+
+class QueryLog:
+    """Non-blocking record(); a writer thread per process commits records in batches."""
+
+    def __init__(self, path: str, batch_size: int = 200, flush_interval: float = 1.0, max_queue: int = 10000):
+        self.path = path
+        self.jsonl = path.endswith(".jsonl")
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.write_errors = 0
+        self._lock = threading.Lock()
+        self._start_writer()
+
+    def _start_writer(self):
+        self._queue: "queue.Queue[Optional[QueryLogRecord]]" = queue.Queue(maxsize=self.max_queue)
+        self._idle = threading.Event()
+        self._idle.set()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._write_loop, name="query-log-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, record: QueryLogRecord):
+        """Queue a record; never blocks. Records are dropped (and counted) while the queue is full."""
+        if self._pid != os.getpid():
+            # The writer thread does not survive fork(); each worker process starts its own
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._start_writer()
+        self._idle.clear()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        conn = None
+        if not self.jsonl:
+            conn = sqlite3.connect(self.path, timeout=10.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _create_table(conn)
+            conn.commit()
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                self._idle.set()
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(conn, batch)
+                self.written += len(batch)
+                self.batches += 1
+            except Exception as e:
+                self.write_errors += 1
+                logger.error(f"Query log write failed ({len(batch)} records lost): {e}")
+            if self._queue.empty():
+                self._idle.set()
+
+    def _write(self, conn: Optional[sqlite3.Connection], batch: List[QueryLogRecord]):
+        """Append one batch in a single commit."""
+        if conn is None:
+            with open(self.path, "a", encoding="utf-8") as handle:
+                handle.write("".join(json.dumps(asdict(record)) + "\n" for record in batch))
+            return
+        placeholders = ", ".join("?" for _ in _COLUMNS)
+        with conn:
+            conn.executemany(f"INSERT INTO query_log ({', '.join(_COLUMNS)}) VALUES ({placeholders})",
+                             [tuple(getattr(record, name) for name in _COLUMNS) for record in batch])
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until every queued record has been written (for shutdown, tests and benchmarks)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._queue.empty() and self._idle.wait(0.05) and self._queue.empty():
+                return True
+        return False
+
+    def _reader(self) -> sqlite3.Connection:
+        """A connection for the query API; JSON lines are loaded into memory first."""
+        if not self.jsonl:
+            conn = sqlite3.connect(self.path, timeout=10.0)
+            _create_table(conn)
+            return conn
+        conn = sqlite3.connect(":memory:")
+        _create_table(conn)
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as handle:
+                rows = [json.loads(line) for line in handle if line.strip()]
+            conn.executemany(f"INSERT INTO query_log ({', '.join(_COLUMNS)}) VALUES "
+                             f"({', '.join('?' for _ in _COLUMNS)})",
+                             [tuple(row.get(name) for name in _COLUMNS) for row in rows])
+        return conn
+
+    def _query(self, sql: str, params: Tuple = ()) -> List[Dict[str, Any]]:
+        conn = self._reader()
+        try:
+            cursor = conn.execute(sql, params)
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _since(since_seconds: Optional[float]) -> float:
+        return time.time() - since_seconds if since_seconds else 0.0
+
+    def slowest(self, limit: int = 10, since_seconds: Optional[float] = None) -> List[Dict[str, Any]]:
+        """The slowest requests, with their stage timings."""
+        return self._query(
+            "SELECT ts, tenant_id, question, source, sql, total_ms, sql_generation_ms, sql_execution_ms, "
+            "response_ms, row_count, success FROM query_log WHERE ts >= ? ORDER BY total_ms DESC LIMIT ?",
+            (self._since(since_seconds), limit))
+
+    def frequent_questions(self, limit: int = 20, since_seconds: Optional[float] = None,
+                           request_class: Optional[str] = "interactive") -> List[Tuple[str, Optional[str], int]]:
+        """(latest wording, tenant_id, count) of the most asked successful questions."""
+        rows = self._query(
+            "SELECT normalized, tenant_id, COUNT(*) AS asked, MAX(id) AS latest FROM query_log "
+            "WHERE ts >= ? AND success = 1 AND (? IS NULL OR request_class = ?) "
+            "GROUP BY normalized, tenant_id ORDER BY asked DESC, latest DESC LIMIT ?",
+            (self._since(since_seconds), request_class, request_class, limit))
+        if not rows:
+            return []
+        wording = {row["id"]: row["question"] for row in self._query(
+            f"SELECT id, question FROM query_log WHERE id IN ({', '.join('?' for _ in rows)})",
+            tuple(row["latest"] for row in rows))}
+        return [(wording[row["latest"]], row["tenant_id"], row["asked"]) for row in rows]
+
+    def failure_rates(self, since_seconds: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """Requests, failures and failure rate per SQL source."""
+        rows = self._query(
+            "SELECT source, COUNT(*) AS requests, SUM(success = 0) AS failures FROM query_log "
+            "WHERE ts >= ? GROUP BY source ORDER BY requests DESC", (self._since(since_seconds),))
+        return {row["source"]: {"requests": row["requests"], "failures": row["failures"],
+                                "failure_rate": row["failures"] / row["requests"]} for row in rows}
+
+    def heaviest_sql(self, limit: int = 10, since_seconds: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Executed SQL by total execution time: the statements worth an index."""
+        return self._query(
+            "SELECT sql, COUNT(*) AS executions, SUM(sql_execution_ms) AS total_ms, "
+            "AVG(sql_execution_ms) AS avg_ms, SUM(sql_cpu_ms) AS cpu_ms FROM query_log "
+            "WHERE ts >= ? AND sql != '' AND source NOT IN ('answer_cache', 'refinement') "
+            "GROUP BY sql ORDER BY total_ms DESC LIMIT ?",
+            (self._since(since_seconds), limit))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "write_errors": self.write_errors
+        }
+
+def main():
+    """Print a summary of a query log file."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize the query log")
+    parser.add_argument("path", nargs="?", default=os.getenv("QUERY_LOG_PATH", "query_log.db"))
+    parser.add_argument("--since-hours", type=float, default=None)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"❌ Query log not found: {args.path}")
+        return 1
+    log = QueryLog(args.path)
+    since = args.since_hours * 3600 if args.since_hours else None
+
+    print(f"📊 Query log: {args.path}")
+    print("\n⏱️  Slowest requests:")
+    for row in log.slowest(args.limit, since):
+        print(f"   {row['total_ms']:8.0f} ms  [{row['source']}]  {row['question']}")
+    print("\n🔁 Most frequent questions:")
+    for question, tenant_id, asked in log.frequent_questions(args.limit, since):
+        print(f"   {asked:6d}x  {question}" + (f"  (tenant {tenant_id})" if tenant_id else ""))
+    print("\n❌ Failure rates by source:")
+    for source, rates in log.failure_rates(since).items():
+        print(f"   {source:<14} {rates['failures']:5d}/{rates['requests']:<6d} {rates['failure_rate']:6.1%}")
+    print("\n🐢 SQL by total execution time:")
+    for row in log.heaviest_sql(args.limit, since):
+        print(f"   {row['total_ms']:8.1f} ms  {row['executions']:5d}x  {' '.join(row['sql'].split())[:100]}")
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Multi-Step Query Planning
+Splits comparison and multi-part questions into sub-questions with explicit
+dependencies, then runs the plan as a DAG: every step whose dependencies are
+done runs at once on a thread pool, so independent sub-queries (one per state,
+say) overlap instead of running one after another.
+"""
+
+import re
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PLANNER_SYSTEM_PROMPT = ("You are a query planner for farm financial data. "
+                         "Reply with a JSON plan only, no explanations.")
+
+# Questions that usually need one query per compared entity or period
+_PLAN_PATTERN = re.compile(
+    r'\b(compare|comparison|compared|versus|vs\.?|differences?\s+between|relative\s+to|contrast)\b',
+    re.IGNORECASE
+)
+_BETWEEN_PATTERN = re.compile(r'\bbetween\s+(.+?)\s+and\s+(.+?)\s*[?.!]*$', re.IGNORECASE)
+_VERSUS_PATTERN = re.compile(r'^(?:(.*?)\s+(?:in|for)\s+)?(.+?)\s+(?:vs\.?|versus)\s+(.+?)\s*[?.!]*$',
+                             re.IGNORECASE)
+_LEADING_VERB = re.compile(
+    r'^\s*(compare|comparison of|contrast|how does|how do|what (?:is|are) the differences?)\b\s*',
+    re.IGNORECASE
+)
+
+class PlanError(ValueError):
+    """The planner's output is not a usable plan."""
+
+@dataclass
+class PlanStep:
+    """One sub-question; it runs once every step in depends_on has finished."""
+    id: str
+    question: str
+    depends_on: List[str] = field(default_factory=list)
+
+@dataclass
+class QueryPlan:
+    """Sub-questions of one user question, forming a dependency graph."""
+    question: str
+    steps: List[PlanStep]
+    source: str = "llm"
+
+    def validate(self, max_steps: int = 6):
+        """Raise PlanError for empty, oversized, dangling or cyclic plans."""
+        if not self.steps:
+            raise PlanError("plan has no steps")
+        if len(self.steps) > max_steps:
+            raise PlanError(f"plan has {len(self.steps)} steps (max {max_steps})")
+        ids = [step.id for step in self.steps]
+        if len(set(ids)) != len(ids):
+            raise PlanError("duplicate step ids")
+        for step in self.steps:
+            missing = [dep for dep in step.depends_on if dep not in ids]
+            if missing:
+                raise PlanError(f"step {step.id} depends on unknown steps {missing}")
+        self.levels()
+
+    def levels(self) -> List[List[PlanStep]]:
+        """Steps grouped into waves that can run concurrently (Kahn's algorithm)."""
+        remaining = {step.id: step for step in self.steps}
+        done: set = set()
+        waves = []
+        while remaining:
+            wave = [step for step in remaining.values() if set(step.depends_on) <= done]
+            if not wave:
+                raise PlanError(f"dependency cycle among steps {sorted(remaining)}")
+            waves.append(wave)
+            for step in wave:
+                done.add(step.id)
+                del remaining[step.id]
+        return waves
+
+    def describe(self) -> List[Dict[str, Any]]:
+        return [{"id": step.id, "question": step.question, "depends_on": step.depends_on}
+                for step in self.steps]
+
+def needs_plan(question: str) -> bool:
+    """Comparison-style questions are worth planning; everything else stays one-shot."""
+    return bool(_PLAN_PATTERN.search(question)) or bool(_BETWEEN_PATTERN.search(question))
+
+def split_comparison(question: str) -> Optional[QueryPlan]:
+    """Rule-based plan for "compare X between A and B" / "X in A vs B": one step per entity."""
+    match = _BETWEEN_PATTERN.search(question)
+    if match:
+        subject = question[:match.start()]
+        entities = [match.group(1), match.group(2)]
+    else:
+        match = _VERSUS_PATTERN.search(question)
+        if not match:
+            return None
+        subject = match.group(1) or ""
+        entities = [_LEADING_VERB.sub("", match.group(2)), match.group(3)]
+
+    subject = _LEADING_VERB.sub("", subject).strip(" ,") or "Farm financial performance"
+    subject = subject[0].upper() + subject[1:]
+    steps = [PlanStep(id=f"s{i}", question=f"{subject} for {entity.strip()}")
+             for i, entity in enumerate(entities, 1)]
+    return QueryPlan(question=question, steps=steps, source="rules")
+
+def planner_prompt(question: str, tables: List[str], max_steps: int) -> str:
+    """Instructions for the LLM planner."""
+    return f"""
+Break the user's question about farm financial data into the smallest set of sub-questions
+that can each be answered with one SQL query over these tables: {", ".join(tables)}.
+
+User Question: {question}
+
+Rules:
+1. At most {max_steps} steps; use a single step if one query can answer the question
+2. Each sub-question must be self-contained (name the state, year or metric explicitly)
+3. A step lists in depends_on only the steps whose results it needs; leave it empty otherwise,
+   so independent steps run in parallel
+4. Do not add a step for the final comparison; the results are combined afterwards
+
+Reply with JSON only:
+{{"steps": [{{"id": "s1", "question": "...", "depends_on": []}}]}}
+"""
+
+def parse_plan(text: str, question: str, max_steps: int = 6) -> QueryPlan:
+    """Parse and validate the planner's JSON reply."""
+    text = text.strip()
+    if text.startswith('```'):
+        text = re.sub(r'^```(?:json)?|```$', '', text).strip()
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise PlanError(f"planner reply is not JSON: {e}")
+
+    raw_steps = payload.get("steps") if isinstance(payload, dict) else payload
+    if not isinstance(raw_steps, list):
+        raise PlanError("planner reply has no step list")
+    steps = []
+    for index, raw in enumerate(raw_steps, 1):
+        if not isinstance(raw, dict) or not str(raw.get("question", "")).strip():
+            raise PlanError(f"step {index} has no question")
+        depends_on = raw.get("depends_on") or []
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        steps.append(PlanStep(id=str(raw.get("id") or f"s{index}"), question=str(raw["question"]).strip(),
+                              depends_on=[str(dep) for dep in depends_on]))
+
+    plan = QueryPlan(question=question, steps=steps)
+    plan.validate(max_steps)
+    return plan
+
+def run_plan(plan: QueryPlan, run_step: Callable[[PlanStep, Dict[str, Any]], Any],
+             max_parallel: int = 4, cancel_event: Optional[threading.Event] = None) -> Dict[str, Any]:
+    """
+    Run every step as soon as its dependencies are done and return {step id: result}.
+    run_step(step, dependency_results) is called on a pool thread; a step whose
+    dependency raised is not run and its exception propagates to the caller.
+    """
+    steps = {step.id: step for step in plan.steps}
+    results: Dict[str, Any] = {}
+    running = {}
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(steps))),
+                            thread_name_prefix="plan-step") as pool:
+        while steps or running:
+            if cancel_event is not None and cancel_event.is_set():
+                for future in running:
+                    future.cancel()
+                break
+            for step_id in [sid for sid, step in steps.items() if set(step.depends_on) <= results.keys()]:
+                step = steps.pop(step_id)
+                dependencies = {dep: results[dep] for dep in step.depends_on}
+                running[pool.submit(run_step, step, dependencies)] = step_id
+            if not running:
+                break
+            done, _ = wait(running, timeout=0.25, return_when=FIRST_COMPLETED)
+            for future in done:
+                # Raise here so a failed dependency never runs its dependents
+                results[running.pop(future)] = future.result()
+
+    logger.info(f"Ran {len(results)}-step plan in {time.monotonic() - started:.2f}s "
+                f"({len(plan.levels())} waves, max {max_parallel} in parallel)")
+    return results
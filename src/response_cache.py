@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Response Cache
+Remembers the narrative written for a question and a query result, keyed on the
+normalized question, a content hash of the result rows and the response settings.
+The same question over the same rows (a dashboard refresh, another tenant, a
+learned SQL template) then reuses the narrative instead of a response call.
+Entries live in an in-process LRU, optionally backed by the shared SQLite cache
+file, and are dropped whenever the database's data version changes.
+"""
+
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from shared_cache import MemoryCache
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+def result_fingerprint(frames: Sequence[Optional["pd.DataFrame"]]) -> str:
+    """Content hash of one or more results: column names, dtypes and every row, in order."""
+    import pandas as pd
+
+    digest = hashlib.sha256()
+    for frame in frames:
+        if frame is None:
+            digest.update(b"<none>")
+            continue
+        digest.update("|".join(f"{name}:{dtype}" for name, dtype in zip(map(str, frame.columns), frame.dtypes))
+                      .encode("utf-8"))
+        # Positional columns: joined results may repeat names
+        for position in range(frame.shape[1]):
+            digest.update(pd.util.hash_pandas_object(frame.iloc[:, position], index=False).values.tobytes())
+        digest.update(f"#{len(frame)}".encode("utf-8"))
+    return digest.hexdigest()
+
+class ResponseCache:
+    """LRU of responses per (question, result fingerprint, settings), invalidated on data changes."""
+
+    def __init__(self, settings: str, max_entries: int = 1024, ttl_seconds: float = 86400.0,
+                 shared_path: Optional[str] = None, data_version: Optional[Callable[[], str]] = None):
+        self.settings = settings
+        self.memory = MemoryCache(ttl_seconds=ttl_seconds, max_entries=max_entries)
+        self.shared = None
+        if shared_path:
+            from shared_cache import SharedCache
+            self.shared = SharedCache(shared_path, ttl_seconds=ttl_seconds, namespace="responses")
+        self.data_version = data_version
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._version: Optional[str] = data_version() if data_version else None
+        self._lock = threading.Lock()
+
+    def _check_data_version(self):
+        """Drop every entry once the database has been written."""
+        if self.data_version is None:
+            return
+        version = self.data_version()
+        with self._lock:
+            if version == self._version:
+                return
+            self._version = version
+            self.invalidations += 1
+        logger.info(f"Data version changed to {version}; clearing the response cache")
+        self.memory.clear()
+        if self.shared:
+            self.shared.clear()
+
+    def key(self, normalized_question: str, frames: Sequence[Optional["pd.DataFrame"]]) -> str:
+        raw = "|".join([normalized_question, result_fingerprint(frames), self.settings])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, normalized_question: str,
+               frames: Sequence[Optional["pd.DataFrame"]]) -> Tuple[str, Optional[str]]:
+        """(cache key, cached response or None)."""
+        self._check_data_version()
+        key = self.key(normalized_question, frames)
+        response = self.memory.get(key)
+        if response is None and self.shared:
+            response = self.shared.get(key)
+            if response is not None:
+                self.memory.set(key, response)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return key, response
+
+    def store(self, key: str, response: str):
+        self.memory.set(key, response)
+        if self.shared:
+            self.shared.set(key, response)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        stats = {
+            "entries": self.memory.stats()["entries"],
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations
+        }
+        if self.shared:
+            stats["shared_entries"] = self.shared.stats()["entries"]
+        return stats
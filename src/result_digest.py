@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Result Digest for Response Generation
+Summarizes a full query result with vectorized column statistics (range, quartiles,
+nulls, top categories, ordering and outliers) plus a few representative rows, so
+the model sees the whole result instead of only its first rows.
+"""
+
+import math
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from token_budget import count_tokens, fit_dataframe, low_value_columns
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Results up to this many rows are shown in full; larger ones are digested
+FULL_RESULT_ROWS = 20
+
+def _is_id_column(name: str) -> bool:
+    """Surrogate keys carry no information worth summarizing."""
+    name = str(name).lower()
+    return name == "id" or name.endswith(("_id", "_guid"))
+
+def format_number(value) -> str:
+    """Compact number formatting for prompts."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "n/a"
+    value = float(value)
+    if value.is_integer() or abs(value) >= 1000:
+        return f"{value:,.0f}"
+    return f"{value:.3g}"
+
+@dataclass
+class NumericSummary:
+    """Distribution of one numeric column."""
+    name: str
+    count: int
+    nulls: int
+    minimum: float
+    p25: float
+    median: float
+    p75: float
+    maximum: float
+    mean: float
+    outliers_low: List[Tuple[str, float]] = field(default_factory=list)
+    outliers_high: List[Tuple[str, float]] = field(default_factory=list)
+    outlier_count: int = 0
+
+@dataclass
+class CategorySummary:
+    """Most frequent values of one text column."""
+    name: str
+    distinct: int
+    nulls: int
+    top_values: List[Tuple[str, int]]
+
+@dataclass
+class ResultDigest:
+    """Compact description of a whole query result."""
+    row_count: int
+    column_count: int
+    numeric: List[NumericSummary]
+    categories: List[CategorySummary]
+    ordering: Optional[Tuple[str, bool]] = None
+    skipped_columns: List[str] = field(default_factory=list)
+    representative_rows: Optional["pd.DataFrame"] = field(default=None, repr=False)
+    representative_label: str = ""
+
+    def to_text(self) -> str:
+        """Render the digest (without representative rows) for the prompt."""
+        lines = [f"Digest of all {self.row_count:,} rows ({self.column_count} columns):"]
+        if self.ordering:
+            column, descending = self.ordering
+            lines.append(f"Rows are ordered by {column} {'descending' if descending else 'ascending'}.")
+
+        if self.numeric:
+            lines.append("Numeric columns (min / p25 / median / p75 / max; mean):")
+            for summary in self.numeric:
+                line = (f"- {summary.name}: {format_number(summary.minimum)} / {format_number(summary.p25)} / "
+                        f"{format_number(summary.median)} / {format_number(summary.p75)} / "
+                        f"{format_number(summary.maximum)}; mean {format_number(summary.mean)}")
+                if summary.nulls:
+                    line += f"; {summary.nulls:,} nulls"
+                if summary.outlier_count:
+                    extremes = summary.outliers_high + summary.outliers_low
+                    shown = ", ".join(f"{label}={format_number(value)}" for label, value in extremes)
+                    line += f"; {summary.outlier_count} outliers ({shown})"
+                lines.append(line)
+
+        if self.categories:
+            lines.append("Text columns (most frequent values):")
+            for summary in self.categories:
+                if summary.distinct == self.row_count - summary.nulls:
+                    examples = ", ".join(value for value, _ in summary.top_values)
+                    line = f"- {summary.name}: all {summary.distinct:,} values unique, e.g. {examples}"
+                else:
+                    top = ", ".join(f"{value} {count:,}" for value, count in summary.top_values)
+                    line = f"- {summary.name}: {summary.distinct:,} distinct; {top}"
+                if summary.nulls:
+                    line += f"; {summary.nulls:,} nulls"
+                lines.append(line)
+
+        if self.skipped_columns:
+            lines.append(f"Not summarized: {', '.join(self.skipped_columns)}")
+        return "\n".join(lines)
+
+def _label_column(df: "pd.DataFrame") -> Optional[int]:
+    """Position of the text column that best names a row (most distinct values)."""
+    from pandas.api.types import is_numeric_dtype
+
+    best, best_distinct = None, 1
+    for position in range(len(df.columns)):
+        series = df.iloc[:, position]
+        if is_numeric_dtype(series) or _is_id_column(df.columns[position]):
+            continue
+        distinct = series.nunique(dropna=True)
+        if distinct > best_distinct:
+            best, best_distinct = position, distinct
+    return best
+
+def _detect_ordering(numeric: "pd.DataFrame") -> Optional[Tuple[str, bool]]:
+    """Numeric column the rows are sorted by (ORDER BY), if any."""
+    for name in numeric.columns:
+        series = numeric[name].dropna()
+        if len(series) < 3 or series.nunique() < 3:
+            continue
+        if series.is_monotonic_decreasing:
+            return name, True
+        if series.is_monotonic_increasing:
+            return name, False
+    return None
+
+def build_digest(df: "pd.DataFrame", top_k: int = 5, max_outliers: int = 3,
+                 representative_rows: int = 6) -> ResultDigest:
+    """Compute the digest over every row of the result."""
+    import numpy as np
+    import pandas as pd
+
+    # Duplicate names (joins) would make label-based access ambiguous
+    frame = df.copy()
+    seen: Dict[str, int] = {}
+    columns, skipped = [], []
+    for name in map(str, df.columns):
+        seen[name] = seen.get(name, 0) + 1
+        columns.append(name if seen[name] == 1 else f"{name}_{seen[name]}")
+        if _is_id_column(name):
+            skipped.append(columns[-1])
+    frame.columns = columns
+
+    body = frame.drop(columns=skipped)
+    numeric = body.select_dtypes(include="number", exclude="bool")
+    numeric = numeric.loc[:, numeric.notna().any()]
+    text = body.drop(columns=numeric.columns).select_dtypes(exclude="number")
+
+    label_position = _label_column(frame)
+    if label_position is not None:
+        labels = frame.iloc[:, label_position].astype(object).where(frame.iloc[:, label_position].notna(), "")
+        labels = labels.map(str).to_numpy()
+    else:
+        labels = np.array([f"row {i + 1}" for i in range(len(frame))], dtype=object)
+
+    numeric_summaries = []
+    if not numeric.empty:
+        # One vectorized pass for every numeric column
+        values = numeric.to_numpy(dtype=float)
+        quartiles = np.nanquantile(values, [0.25, 0.5, 0.75], axis=0)
+        counts = (~np.isnan(values)).sum(axis=0)
+        minimum, maximum = np.nanmin(values, axis=0), np.nanmax(values, axis=0)
+        mean = np.nanmean(values, axis=0)
+        iqr = quartiles[2] - quartiles[0]
+        with np.errstate(invalid="ignore"):
+            low_mask = values < quartiles[0] - 1.5 * iqr
+            high_mask = values > quartiles[2] + 1.5 * iqr
+
+        for index, name in enumerate(numeric.columns):
+            column = values[:, index]
+            high_rows = np.flatnonzero(high_mask[:, index])
+            low_rows = np.flatnonzero(low_mask[:, index])
+            high_rows = high_rows[np.argsort(-column[high_rows])][:max_outliers]
+            low_rows = low_rows[np.argsort(column[low_rows])][:max_outliers]
+            numeric_summaries.append(NumericSummary(
+                name=name,
+                count=int(counts[index]),
+                nulls=int(len(column) - counts[index]),
+                minimum=minimum[index], p25=quartiles[0][index], median=quartiles[1][index],
+                p75=quartiles[2][index], maximum=maximum[index], mean=mean[index],
+                outliers_high=[(labels[row], column[row]) for row in high_rows],
+                outliers_low=[(labels[row], column[row]) for row in low_rows],
+                outlier_count=int(high_mask[:, index].sum() + low_mask[:, index].sum())
+            ))
+
+    category_summaries = []
+    for name in text.columns:
+        series = text[name]
+        counts = series.value_counts(dropna=True)
+        if counts.empty:
+            continue
+        category_summaries.append(CategorySummary(
+            name=name,
+            distinct=int(len(counts)),
+            nulls=int(series.isna().sum()),
+            top_values=[(str(value), int(count)) for value, count in counts.head(top_k).items()]
+        ))
+
+    ordering = _detect_ordering(numeric)
+
+    # Representative rows: both ends of the ordering, or the quartile rows of the main metric
+    if ordering is not None:
+        half = max(1, representative_rows // 2)
+        positions = list(range(min(half, len(frame)))) + list(range(max(len(frame) - half, 0), len(frame)))
+        label = f"top and bottom rows by {ordering[0]}"
+    elif numeric_summaries:
+        main = max(numeric_summaries, key=lambda s: (s.count, -s.nulls))
+        column = numeric[main.name].to_numpy(dtype=float)
+        order = np.argsort(np.where(np.isnan(column), np.inf, column))[:main.count]
+        picks = np.linspace(0, len(order) - 1, num=min(representative_rows, len(order))).round().astype(int)
+        positions = order[picks].tolist()
+        label = f"rows at evenly spaced quantiles of {main.name}"
+    else:
+        positions = list(range(min(representative_rows, len(frame))))
+        label = "first rows"
+    positions = list(dict.fromkeys(positions))
+
+    return ResultDigest(
+        row_count=len(frame),
+        column_count=len(frame.columns),
+        numeric=numeric_summaries,
+        categories=category_summaries,
+        ordering=ordering,
+        skipped_columns=skipped,
+        representative_rows=df.iloc[positions] if len(df) else pd.DataFrame(),
+        representative_label=label
+    )
+
+def summarize_result(df: "pd.DataFrame", max_tokens: int) -> str:
+    """
+    Text for the response prompt within max_tokens.
+    Small results are shown in full; larger ones become a digest plus representative rows.
+    """
+    if len(df) <= FULL_RESULT_ROWS:
+        return fit_dataframe(df, max_tokens, max_rows=FULL_RESULT_ROWS)
+
+    digest = build_digest(df)
+
+    # Wide results: summarize the most informative columns first, up to ~2/3 of the budget
+    text = digest.to_text()
+    if count_tokens(text) > max_tokens * 2 // 3:
+        order = [str(df.columns[position]) for position in reversed(low_value_columns(df))]
+        keep = len(order)
+        while count_tokens(text) > max_tokens * 2 // 3 and keep > 1:
+            keep = max(1, keep * 2 // 3)
+            wanted = set(order[:keep])
+            trimmed = ResultDigest(
+                row_count=digest.row_count,
+                column_count=digest.column_count,
+                numeric=[s for s in digest.numeric if s.name in wanted],
+                categories=[s for s in digest.categories if s.name in wanted],
+                ordering=digest.ordering,
+                skipped_columns=digest.skipped_columns[:8]
+            )
+            omitted = len(digest.numeric) + len(digest.categories) - len(trimmed.numeric) - len(trimmed.categories)
+            text = trimmed.to_text() + (f"\n({omitted} less informative columns not summarized)" if omitted else "")
+
+    remaining = max_tokens - count_tokens(text)
+    if remaining > 50 and digest.representative_rows is not None and len(digest.representative_rows):
+        rows = fit_dataframe(digest.representative_rows, remaining, max_rows=len(digest.representative_rows))
+        # fit_dataframe notes "more rows" relative to the sample; the digest already covers all rows
+        rows = "\n".join(line for line in rows.split("\n") if not line.startswith("... and "))
+        text += f"\n\nRepresentative rows ({digest.representative_label}):\n{rows}"
+    return text
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Shared File-Backed Cache
+A small key/value store on a local SQLite file in WAL mode. Every worker process
+opens the same file, so an entry written by one worker is a cache hit for all.
+MemoryCache offers the same interface for single-process use.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class SharedCache:
+    """Process-shared JSON cache with TTL expiry, stored in a SQLite file."""
+
+    def __init__(self, path: str, ttl_seconds: float = 3600.0, namespace: str = "default"):
+        """Remember the cache location; connections are opened lazily per process."""
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._connection()
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread and per process; never reuse a connection across fork()."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                cache_key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, cache_key)
+            )
+        """)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, hit: bool):
+        """Update this process's hit/miss counters."""
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None when missing or expired."""
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND cache_key = ?",
+                (self.namespace, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache read failed: {e}")
+            self._count(False)
+            return None
+
+        if row is None or row[1] < time.time():
+            self._count(False)
+            return None
+        self._count(True)
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """Store a JSON-serializable value under key."""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, cache_key, value, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value, default=str), time.time() + ttl)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache write failed: {e}")
+
+    def purge_expired(self) -> int:
+        """Delete expired entries and return how many were removed."""
+        cursor = self._connection().execute("DELETE FROM cache_entries WHERE expires_at < ?", (time.time(),))
+        return cursor.rowcount
+
+    def clear(self):
+        """Remove every entry in this namespace."""
+        self._connection().execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this process plus the shared entry count."""
+        entries = self._connection().execute(
+            "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+        ).fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+class MemoryCache:
+    """In-process LRU cache with the same interface, used when no shared cache file is configured."""
+
+    def __init__(self, ttl_seconds: float = 3600.0, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None when missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.time():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """Store value under key, evicting the least recently used entries beyond max_entries."""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def purge_expired(self) -> int:
+        """Delete expired entries and return how many were removed."""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._entries.items() if expires_at < now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and entry count."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
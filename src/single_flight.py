@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Single-Flight Request Coalescing
+Concurrent calls with the same key share one execution of the underlying function.
+The execution is cancelled once every caller waiting on it has gone away.
+"""
+
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+class WaiterDisconnected(Exception):
+    """The caller's client went away before the shared execution finished."""
+
+@dataclass
+class _Flight:
+    """One in-progress execution and the callers attached to it."""
+    task: "asyncio.Task"
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    waiters: int = 0
+
+class SingleFlight:
+    """Deduplicates concurrent blocking calls that share a key (asyncio side)."""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def run(self, key: str, func: Callable[..., Any], *args,
+                  disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+                  poll_interval: float = 0.25, **kwargs) -> Any:
+        """
+        Run func(*args, cancel_event=..., **kwargs) in the thread pool (awaited directly when
+        it is a coroutine function), or join the execution already running under key.
+        `disconnected` is polled while waiting; when it reports True this caller detaches
+        and gets WaiterDisconnected.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            cancel_event = threading.Event()
+            if asyncio.iscoroutinefunction(func):
+                task = asyncio.ensure_future(func(*args, cancel_event=cancel_event, **kwargs))
+            else:
+                task = asyncio.ensure_future(
+                    run_in_threadpool(func, *args, cancel_event=cancel_event, **kwargs)
+                )
+            flight = _Flight(task=task, cancel_event=cancel_event)
+            self._flights[key] = flight
+            task.add_done_callback(lambda _: self._forget(key, flight))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+            logger.info(f"Joining in-flight request ({flight.waiters} already waiting)")
+
+        flight.waiters += 1
+        try:
+            while True:
+                done, _ = await asyncio.wait({flight.task}, timeout=poll_interval if disconnected else None)
+                if done:
+                    return flight.task.result()
+                if await disconnected():
+                    self._detach(key, flight)
+                    raise WaiterDisconnected(key)
+        except asyncio.CancelledError:
+            self._detach(key, flight)
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _detach(self, key: str, flight: _Flight):
+        """Called when a waiter leaves early; cancels the execution if nobody is left."""
+        if flight.waiters <= 1 and not flight.task.done():
+            logger.info("All waiters disconnected; cancelling in-flight request")
+            flight.cancel_event.set()
+            flight.task.cancel()
+            self.cancelled += 1
+            self._forget(key, flight)
+
+    def _forget(self, key: str, flight: _Flight):
+        """Drop the flight so the next call with this key starts a fresh execution."""
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring."""
+        return {
+            "in_flight": len(self._flights),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled
+        }
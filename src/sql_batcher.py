@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+SQL Generation Micro-Batching
+Collects concurrent SQL-generation requests for a few milliseconds (or until a
+batch is full) and answers them with one structured completion that carries the
+schema once. Each waiting request gets its own SQL back; an item the batch reply
+does not answer falls back to a call of its own, so one bad item never fails the
+others.
+"""
+
+import re
+import json
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BATCH_SYSTEM_PROMPT = ("You are a SQL expert. Answer every numbered question with one SQL query. "
+                       "Reply with JSON only, no explanations.")
+
+@dataclass
+class _Item:
+    question: str
+    priority: str
+    future: Future = field(default_factory=Future)
+    enqueued: float = field(default_factory=time.monotonic)
+
+def batch_prompt(questions: List[str], schema: str) -> str:
+    """One prompt for several questions; the schema is sent once."""
+    numbered = "\n".join(f"Q{index}: {question}" for index, question in enumerate(questions, 1))
+    return f"""
+You are a SQL expert specializing in farm financial data analysis. Write one SQL query for each question.
+
+Database Schema:
+{schema}
+
+Questions:
+{numbered}
+
+Instructions:
+1. Use ONLY the table names and column names from the schema above
+2. Use appropriate JOINs, WHERE clauses and ORDER BY as each question needs
+3. Limit results to reasonable amounts (use LIMIT 10-50)
+4. Answer every question independently; do not combine questions
+
+Reply with JSON only:
+{{"queries": [{{"id": 1, "sql": "SELECT ..."}}]}}
+"""
+
+def parse_batch_reply(text: str, count: int) -> List[Optional[str]]:
+    """Per-question SQL from the batch reply; None for any item that is missing or empty."""
+    text = text.strip()
+    if text.startswith('```'):
+        text = re.sub(r'^```(?:json)?|```$', '', text).strip()
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError:
+        logger.warning("Batch SQL reply is not JSON")
+        return [None] * count
+
+    entries = payload.get("queries") if isinstance(payload, dict) else payload
+    results: List[Optional[str]] = [None] * count
+    for position, entry in enumerate(entries if isinstance(entries, list) else []):
+        if not isinstance(entry, dict):
+            continue
+        try:
+            index = int(str(entry.get("id", position + 1)).lstrip("Qq")) - 1
+        except ValueError:
+            continue
+        sql = str(entry.get("sql") or "").strip().rstrip(";").strip()
+        if 0 <= index < count and sql.lower().startswith(("select", "with")):
+            results[index] = sql
+    return results
+
+class SQLBatcher:
+    """
+    submit(question, priority) blocks until the question's SQL is ready.
+    generate_batch(questions, priority) -> (sql or None per question, token usage dict);
+    generate_one(question, priority) -> (sql, token usage dict) is the per-item fallback.
+    """
+
+    def __init__(self, generate_batch: Callable[[List[str], str], Tuple[List[Optional[str]], Dict[str, int]]],
+                 generate_one: Callable[[str, str], Tuple[str, Dict[str, int]]],
+                 max_batch: int = 8, max_wait_ms: float = 10.0, max_concurrent_batches: int = 4):
+        self.generate_batch = generate_batch
+        self.generate_one = generate_one
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending: List[_Item] = []
+        self._condition = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="sql-batch")
+        self._thread: Optional[threading.Thread] = None
+        self.batches = 0
+        self.items = 0
+        self.fallbacks = 0
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._collect, name="sql-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, question: str, priority: str = "interactive") -> Tuple[str, Dict[str, int]]:
+        """(SQL, this question's share of the batch's token usage)."""
+        item = _Item(question, priority)
+        with self._condition:
+            self._ensure_thread()
+            self._pending.append(item)
+            self._condition.notify()
+        return item.future.result()
+
+    def _collect(self):
+        """Cut a batch when it is full or its oldest item has waited max_wait."""
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = self._pending[0].enqueued + self.max_wait
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            self._pool.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[_Item]):
+        # Interactive work in the batch decides its scheduling priority
+        priority = "interactive" if any(item.priority == "interactive" for item in batch) else "batch"
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            if len(batch) == 1:
+                results, usage = [None], {}
+            else:
+                results, usage = self.generate_batch([item.question for item in batch], priority)
+        except Exception as e:
+            # Provider-level failures (overload, outage) apply to every item alike
+            for item in batch:
+                item.future.set_exception(e)
+            return
+
+        for position, (item, sql) in enumerate(zip(batch, results)):
+            if sql is not None:
+                # Split the batch's usage so the per-question shares add up to the total
+                share = {name: value // len(batch) + (position < value % len(batch))
+                         for name, value in usage.items()}
+                item.future.set_result((sql, share))
+                continue
+            # Missing or unusable item: answer it on its own
+            self.fallbacks += len(batch) > 1
+            try:
+                item.future.set_result(self.generate_one(item.question, item.priority))
+            except Exception as e:
+                item.future.set_exception(e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "fallbacks": self.fallbacks
+        }
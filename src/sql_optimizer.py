@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+Pre-Execution SQL Optimizer
+Reviews SQL before it reaches the shared database. Safe rewrites come first:
+correlated per-farm scalar subqueries become LEFT JOINs, `SELECT *` over joins
+drops the repeated join columns, an outer LIMIT is pushed into a plain derived
+table and statements without a LIMIT get one. Join predicates are then checked
+against the foreign-key graph (every farm table links to hdb_main_data through
+hdb_main_data_id, and to fm_genin through fm_genin_guid) to catch cartesian
+products and joins on mismatched keys. Last, `EXPLAIN QUERY PLAN` is costed
+with the catalog row counts (sqlite_stat1 when the database has been analyzed).
+Statements with bad joins or an estimated cost above the limit are rejected;
+the caller can regenerate them.
+"""
+
+import re
+import math
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from fact_table import FACT_TABLE
+
+logger = logging.getLogger(__name__)
+
+# Columns that link farm tables; joins must equate a key with the same key
+JOIN_KEYS = ("hdb_main_data_id", "fm_genin_guid")
+# Columns whose equality lookup finds about one row (per year, for fbm_farm_id)
+UNIQUE_COLUMNS = set(JOIN_KEYS) | {"rowid", "id", "fbm_farm_id"}
+# Tables with at most one row per farm-year, so a per-farm scalar subquery on them is a LEFT JOIN
+ONE_ROW_PER_FARM = {"hdb_main_data", "fm_genin", "fm_guide", "fm_stmts", FACT_TABLE}
+# Rows assumed for tables and derived tables the catalog knows nothing about
+DEFAULT_ROWS = 1000
+
+class SQLRejected(Exception):
+    """The statement was not run: it joins tables incorrectly or is estimated to cost too much."""
+
+@dataclass
+class SQLReview:
+    """What the optimizer did to one statement and whether it may run."""
+    original: str
+    sql: str
+    cost: float = 0.0
+    rewrites: List[str] = field(default_factory=list)
+    problems: List[str] = field(default_factory=list)
+    rejected: bool = False
+
+    @property
+    def reason(self) -> str:
+        return "; ".join(self.problems)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_CLAUSE_END = re.compile(r"\b(WHERE|GROUP\s+BY|HAVING|WINDOW|ORDER\s+BY|LIMIT|UNION|EXCEPT|INTERSECT)\b", re.IGNORECASE)
+_TABLE_REF = re.compile(
+    r"(?:^|,|\bJOIN\b)\s*(\w+|\(\s*\))(?:\s+(?:AS\s+)?(?!(?:ON|USING|NATURAL|LEFT|RIGHT|FULL|INNER|OUTER|CROSS|JOIN)\b)(\w+))?",
+    re.IGNORECASE)
+_EQUALITY = re.compile(r"\b(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)\b")
+_ANY_TABLE = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?|,\s*(\w+)\s+(?:AS\s+)?(\w+)", re.IGNORECASE)
+_SCALAR_SUBQUERY = re.compile(
+    r"\(\s*SELECT\s+([\w.]+)\s+FROM\s+(\w+)(?:\s+(?:AS\s+)?(?!WHERE\b)(\w+))?\s+WHERE\s+([\w.]+)\s*=\s*([\w.]+)\s*\)",
+    re.IGNORECASE)
+_KEYWORDS = {"where", "group", "order", "limit", "on", "using", "left", "join", "inner", "cross", "natural",
+             "select", "from", "as", "and", "or", "having", "union"}
+
+def _mask_strings(sql: str) -> Tuple[str, List[str]]:
+    """Replace string literals with numbered placeholders so the patterns never match inside them."""
+    literals: List[str] = []
+
+    def keep(match):
+        literals.append(match.group(0))
+        return f"'{len(literals) - 1}'"
+    return _STRING.sub(keep, sql), literals
+
+def _unmask(sql: str, literals: List[str]) -> str:
+    return re.sub(r"'(\d+)'", lambda match: literals[int(match.group(1))], sql)
+
+def _flatten(sql: str) -> str:
+    """Same length as sql with everything inside parentheses blanked: top-level clauses only."""
+    depth = 0
+    chars = []
+    for char in sql:
+        if char == ")":
+            depth -= 1
+        chars.append(char if depth <= 0 else " ")
+        if char == "(":
+            depth += 1
+    return "".join(chars)
+
+def _depth_at(sql: str, position: int) -> int:
+    return sql.count("(", 0, position) - sql.count(")", 0, position)
+
+def _from_span(flat: str) -> Optional[Tuple[int, int]]:
+    """Start and end of the top-level FROM clause (after the keyword)."""
+    match = re.search(r"\bFROM\b", flat, re.IGNORECASE)
+    if not match:
+        return None
+    end = _CLAUSE_END.search(flat, match.end())
+    return match.end(), end.start() if end else len(flat.rstrip().rstrip(";"))
+
+def _table_refs(from_flat: str) -> List[Tuple[str, str]]:
+    """(table or '' for a derived table, alias) for each item of a flattened FROM clause."""
+    refs = []
+    for match in _TABLE_REF.finditer(from_flat):
+        name, alias = match.group(1), match.group(2)
+        if alias and alias.lower() in _KEYWORDS:
+            alias = None
+        derived = name.startswith("(")
+        refs.append(("" if derived else name, alias or ("" if derived else name)))
+    return refs
+
+_AGGREGATE = re.compile(r"\b(COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT)\s*\(", re.IGNORECASE)
+
+def _derived_rows(masked: str, name: str, scanned: float) -> float:
+    """Rows of a derived table or CTE: the plan only shows the rows scanned to build it."""
+    body = None
+    cte = re.search(rf"\b{re.escape(name)}\s+AS\s*\(", masked, re.IGNORECASE)
+    if cte:
+        depth = 1
+        for position in range(cte.end(), len(masked)):
+            depth += {"(": 1, ")": -1}.get(masked[position], 0)
+            if depth == 0:
+                body = masked[cte.end():position]
+                break
+    derived = re.search(rf"\)\s*(?:AS\s+)?{re.escape(name)}\b", masked, re.IGNORECASE)
+    if body is None and derived:
+        depth = 1
+        for position in range(derived.start() - 1, -1, -1):
+            depth += {")": 1, "(": -1}.get(masked[position], 0)
+            if depth == 0:
+                body = masked[position + 1:derived.start()]
+                break
+    if body is None:
+        return min(scanned, DEFAULT_ROWS)
+    body = _flatten(body)
+    if _AGGREGATE.search(body) and not re.search(r"\bGROUP\s+BY\b", body, re.IGNORECASE):
+        return 1.0
+    limit = re.search(r"\bLIMIT\s+(\d+)", body, re.IGNORECASE)
+    return min(scanned, float(limit.group(1))) if limit else scanned
+
+class SQLOptimizer:
+    """Reviews statements against one database; reviews are cached per statement text and data version."""
+
+    def __init__(self, max_cost: float = 1e9, row_limit: int = 1000, cache_size: int = 256,
+                 data_version: Optional[Callable[[], str]] = None):
+        self.max_cost = max_cost
+        self.row_limit = row_limit
+        self.cache_size = cache_size
+        self.data_version = data_version or (lambda: "")
+        self.reviewed = 0
+        self.rewritten = 0
+        self.rejected = 0
+        self.regenerated = 0
+        self.rewrite_counts: Dict[str, int] = {}
+        self._reviews: "OrderedDict[str, SQLReview]" = OrderedDict()
+        self._catalog: Optional[Dict[str, Any]] = None
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    # Catalog ---------------------------------------------------------------
+
+    def _load_catalog(self, conn: sqlite3.Connection) -> Dict[str, Any]:
+        """Row counts, columns and per-index fan-out; counts come from sqlite_stat1 when it exists."""
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        stats: List[Tuple[str, Optional[str], str]] = []
+        if "sqlite_stat1" in tables:
+            stats = conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1").fetchall()
+        # Every sqlite_stat1 row starts with the table's row count; index rows go on with rows per key
+        analyzed = {table: int(stat.split()[0]) for table, _, stat in stats}
+        fanout = {index: max(1, int(stat.split()[1])) for _, index, stat in stats if index and len(stat.split()) > 1}
+        rows: Dict[str, int] = {}
+        columns: Dict[str, List[str]] = {}
+        for table in tables:
+            if table.startswith("sqlite_"):
+                continue
+            columns[table] = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+            try:
+                # MAX(rowid) is a B-tree edge lookup; close to COUNT(*) for tables that are appended to
+                rows[table] = analyzed[table] if table in analyzed else (conn.execute(
+                    f'SELECT MAX(rowid) FROM "{table}"').fetchone()[0] or 0)
+            except sqlite3.Error:
+                rows[table] = DEFAULT_ROWS
+        return {"rows": rows, "columns": columns, "fanout": fanout}
+
+    def _catalog_for(self, conn: sqlite3.Connection) -> Dict[str, Any]:
+        version = self.data_version()
+        with self._lock:
+            if self._catalog is None or version != self._version:
+                self._catalog = self._load_catalog(conn)
+                self._version = version
+                self._reviews.clear()
+            return self._catalog
+
+    # Rewrites --------------------------------------------------------------
+
+    def _subqueries_to_joins(self, sql: str) -> Tuple[str, bool]:
+        """(SELECT q.col FROM t q WHERE q.key = o.key) in the outer statement -> LEFT JOIN t ON the key."""
+        flat = _flatten(sql)
+        span = _from_span(flat)
+        if span is None:
+            return sql, False
+        outer = {alias.lower() for table, alias in _table_refs(flat[span[0]:span[1]]) if table}
+        joins: Dict[Tuple[str, str, str], str] = {}
+        pieces = []
+        last = 0
+        for match in _SCALAR_SUBQUERY.finditer(sql):
+            if _depth_at(sql, match.start()) != 0:
+                continue
+            column, table, alias, left, right = match.groups()
+            alias = alias or table
+            # The inner side is unqualified or qualified by the subquery's own table
+            inner_side, outer_side = (left, right) if ("." not in left or left.split(".")[0] in (alias, table)) \
+                else (right, left)
+            inner_column = inner_side.split(".")[-1]
+            if ("." not in outer_side or table not in ONE_ROW_PER_FARM or inner_column not in JOIN_KEYS
+                    or outer_side.split(".")[1] != inner_column or outer_side.split(".")[0].lower() not in outer
+                    or column.split(".")[0] not in (alias, table, column)):
+                continue
+            key = (table, inner_column, outer_side)
+            joined = joins.setdefault(key, f"sq{len(joins) + 1}")
+            pieces.append(sql[last:match.start()] + f"{joined}.{column.split('.')[-1]}")
+            last = match.end()
+        if not joins:
+            return sql, False
+        sql = "".join(pieces) + sql[last:]
+        span = _from_span(_flatten(sql))
+        clause = "".join(f" LEFT JOIN {table} {joined} ON {joined}.{column} = {outer_side}"
+                         for (table, column, outer_side), joined in joins.items())
+        return sql[:span[1]].rstrip() + clause + " " + sql[span[1]:].lstrip(), True
+
+    def _prune_select_star(self, sql: str, catalog: Dict[str, Any]) -> Tuple[str, bool]:
+        """SELECT * over a join: list the columns once each instead of repeating every join column."""
+        flat = _flatten(sql)
+        star = re.match(r"\s*SELECT\s+\*\s+FROM\b", flat, re.IGNORECASE)
+        span = _from_span(flat)
+        if not star or span is None or re.search(r"\bGROUP\s+BY\b", flat, re.IGNORECASE):
+            return sql, False
+        refs = _table_refs(flat[span[0]:span[1]])
+        if len(refs) < 2 or any(table not in catalog["columns"] for table, _ in refs):
+            return sql, False
+        seen: Set[str] = set()
+        selected = []
+        for table, alias in refs:
+            for column in catalog["columns"][table]:
+                if column not in seen:
+                    seen.add(column)
+                    selected.append(f"{alias}.{column}")
+        star_at = flat.index("*", star.start())
+        return sql[:star_at] + ", ".join(selected) + sql[star_at + 1:], True
+
+    def _push_down_limit(self, sql: str) -> Tuple[str, bool]:
+        """SELECT cols FROM (inner) LIMIT n -> the inner query stops after n rows too."""
+        flat = _flatten(sql)
+        match = re.match(r"\s*SELECT\s+(?!DISTINCT\b)([^()]*?)\s+FROM\s*\(\s*\)\s*(?:AS\s+)?\w*\s+LIMIT\s+(\d+)\s*;?\s*$",
+                         flat, re.IGNORECASE)
+        if not match:
+            return sql, False
+        open_at = flat.index("(", match.start(1))
+        close_at = flat.index(")", open_at)
+        inner = sql[open_at + 1:close_at]
+        if re.search(r"\bLIMIT\b", _flatten(inner), re.IGNORECASE):
+            return sql, False
+        return sql[:close_at].rstrip() + f" LIMIT {match.group(2)}" + sql[close_at:], True
+
+    def _add_limit(self, sql: str) -> Tuple[str, bool]:
+        if re.search(r"\bLIMIT\b", _flatten(sql), re.IGNORECASE):
+            return sql, False
+        return sql.rstrip().rstrip(";").rstrip() + f" LIMIT {self.row_limit}", True
+
+    # Checks ----------------------------------------------------------------
+
+    def _check_joins(self, sql: str, catalog: Dict[str, Any]) -> List[str]:
+        """Top-level joins must follow the key graph: no cartesian products, no mismatched keys."""
+        flat = _flatten(sql)
+        span = _from_span(flat)
+        if span is None:
+            return []
+        from_flat = flat[span[0]:span[1]]
+        refs = _table_refs(from_flat)
+        if len(refs) < 2:
+            return []
+        aliases = {alias.lower(): table for table, alias in refs}
+        parent = {alias: alias for alias in aliases}
+
+        def find(alias):
+            while parent[alias] != alias:
+                alias = parent[alias]
+            return alias
+
+        problems = []
+        where = re.search(r"\bWHERE\b(.*?)(?:\bGROUP\s+BY\b|\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|$)", flat,
+                          re.IGNORECASE | re.DOTALL)
+        for left, left_column, right, right_column in _EQUALITY.findall(from_flat + " " + (where.group(1) if where else "")):
+            left, right = left.lower(), right.lower()
+            if left not in aliases or right not in aliases or left == right:
+                continue
+            if left_column != right_column and ({left_column, right_column} & set(JOIN_KEYS + ("id",))):
+                problems.append(f"join on mismatched keys {left}.{left_column} = {right}.{right_column}")
+                continue
+            parent[find(left)] = find(right)
+        # USING and NATURAL joins connect the table to everything before it
+        for match in re.finditer(r"\bJOIN\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?\s+USING\b|\bNATURAL\s+(?:\w+\s+)*?JOIN\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?",
+                                 from_flat, re.IGNORECASE):
+            alias = (match.group(2) or match.group(1) or match.group(4) or match.group(3)).lower()
+            if alias in aliases:
+                for other in list(aliases)[:list(aliases).index(alias)]:
+                    parent[find(alias)] = find(other)
+
+        groups: Dict[str, List[str]] = {}
+        for alias, table in aliases.items():
+            if table in catalog["columns"]:
+                groups.setdefault(find(alias), []).append(alias)
+        if len(groups) > 1:
+            problems.append("cartesian product between " + " and ".join(
+                "{" + ", ".join(members) + "}" for members in groups.values()) + " (no join predicate)")
+        return problems
+
+    def estimate_cost(self, conn: sqlite3.Connection, sql: str, params: Sequence[Any] = (),
+                      catalog: Optional[Dict[str, Any]] = None) -> float:
+        """Row visits implied by the query plan: nested loops multiply, subqueries run once or per outer row."""
+        catalog = catalog or self._catalog_for(conn)
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, tuple(params)).fetchall()
+        children: Dict[int, List[Tuple[int, str]]] = {}
+        for node, parent, _, detail in plan:
+            children.setdefault(parent, []).append((node, detail))
+        masked, _ = _mask_strings(sql)
+        aliases: Dict[str, str] = {}
+        for match in _ANY_TABLE.finditer(masked):
+            table, alias = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+            if table in catalog["rows"]:
+                aliases.setdefault(table, table)
+                if alias and alias.lower() not in _KEYWORDS:
+                    aliases[alias] = table
+        derived: Dict[str, float] = {}
+
+        def rows_of(name: str) -> float:
+            if name in aliases:
+                return float(max(1, catalog["rows"].get(aliases[name], DEFAULT_ROWS)))
+            return derived.get(name, DEFAULT_ROWS)
+
+        def walk(parent: int, outer: float) -> Tuple[float, float]:
+            cost, loop_rows = 0.0, outer
+            for node, detail in children.get(parent, []):
+                words = detail.split()
+                if words[0] in ("SCAN", "SEARCH") and len(words) > 1 and words[1] != "CONSTANT":
+                    table_rows = rows_of(words[1])
+                    if words[0] == "SCAN":
+                        per_row, visits = table_rows, table_rows
+                    else:
+                        index = re.search(r"USING (?:COVERING )?INDEX (\w+)", detail)
+                        constrained = re.findall(r"(\w+)=\?", detail)
+                        if "AUTOMATIC" in detail:
+                            # Built for this statement: one pass over the table plus the sort
+                            cost += table_rows * math.log2(table_rows + 2)
+                        if index and index.group(1) in catalog["fanout"] and constrained:
+                            per_row = float(catalog["fanout"][index.group(1)])
+                        elif constrained and ("PRIMARY KEY" in detail or "autoindex" in detail
+                                              or all(column in UNIQUE_COLUMNS for column in constrained)):
+                            per_row = 1.0
+                        elif constrained:
+                            # Equality on a non-key column without statistics: assume ten distinct values
+                            per_row = max(1.0, table_rows / 10)
+                        else:
+                            # Range constraint: SQLite's own guess is a quarter of the rows
+                            per_row = table_rows / 4
+                        visits = per_row + math.log2(table_rows + 2)
+                    cost += loop_rows * visits
+                    loop_rows *= max(per_row, 1.0)
+                elif detail.startswith("CORRELATED"):
+                    cost += walk(node, loop_rows)[0]
+                elif detail.startswith(("MATERIALIZE", "CO-ROUTINE")):
+                    sub_cost, sub_rows = walk(node, 1.0)
+                    cost += sub_cost
+                    derived[words[-1]] = _derived_rows(masked, words[-1], sub_rows)
+                elif detail.startswith(("SCALAR SUBQUERY", "LIST SUBQUERY")):
+                    cost += walk(node, 1.0)[0]
+                elif detail.startswith("USE TEMP B-TREE"):
+                    cost += loop_rows * math.log2(loop_rows + 2)
+                else:
+                    sub_cost, sub_rows = walk(node, outer)
+                    cost += sub_cost
+                    if detail.startswith(("COMPOUND", "LEFT-MOST", "UNION", "EXCEPT", "INTERSECT")):
+                        loop_rows = max(loop_rows, sub_rows)
+            return cost, loop_rows
+
+        return walk(0, 1.0)[0]
+
+    # Review ----------------------------------------------------------------
+
+    def review(self, conn: sqlite3.Connection, sql: str, params: Sequence[Any] = ()) -> SQLReview:
+        """Rewrite, check and cost one statement; the result says whether it may run."""
+        catalog = self._catalog_for(conn)
+        with self._lock:
+            cached = self._reviews.get(sql)
+            if cached is not None:
+                self._reviews.move_to_end(sql)
+                return cached
+
+        review = SQLReview(original=sql, sql=sql)
+        masked, literals = _mask_strings(sql.strip())
+        if re.match(r"\s*(SELECT|WITH)\b", masked, re.IGNORECASE):
+            rewritten = masked
+            for name, rewrite in (("subquery_to_join", self._subqueries_to_joins),
+                                  ("select_star", lambda text: self._prune_select_star(text, catalog)),
+                                  ("limit_push_down", self._push_down_limit),
+                                  ("limit", self._add_limit)):
+                candidate, changed = rewrite(rewritten)
+                if changed:
+                    rewritten = candidate
+                    review.rewrites.append(name)
+            review.problems = self._check_joins(rewritten, catalog)
+            if review.rewrites:
+                review.sql = _unmask(rewritten, literals)
+            try:
+                review.cost = self.estimate_cost(conn, review.sql, params, catalog)
+            except sqlite3.Error as e:
+                if review.sql == sql:
+                    # Invalid SQL is reported by the execution itself
+                    return SQLReview(original=sql, sql=sql)
+                logger.warning(f"SQL rewrite {review.rewrites} produced invalid SQL ({e}); keeping the original")
+                review = SQLReview(original=sql, sql=sql, problems=review.problems)
+                try:
+                    review.cost = self.estimate_cost(conn, sql, params, catalog)
+                except sqlite3.Error:
+                    return SQLReview(original=sql, sql=sql)
+            if review.cost > self.max_cost:
+                review.problems.append(f"estimated cost {review.cost:.3g} row visits is above the limit "
+                                       f"of {self.max_cost:.3g}")
+            review.rejected = bool(review.problems)
+
+        with self._lock:
+            self.reviewed += 1
+            if review.rewrites:
+                self.rewritten += 1
+                for name in review.rewrites:
+                    self.rewrite_counts[name] = self.rewrite_counts.get(name, 0) + 1
+            if review.rejected:
+                self.rejected += 1
+            self._reviews[sql] = review
+            while len(self._reviews) > self.cache_size:
+                self._reviews.popitem(last=False)
+        return review
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "reviewed": self.reviewed,
+            "rewritten": self.rewritten,
+            "rewrites": dict(self.rewrite_counts),
+            "rejected": self.rejected,
+            "regenerated": self.regenerated,
+            "max_cost": self.max_cost
+        }
+
+def main():
+    """Review one statement against a database and print the outcome."""
+    import os
+    import argparse
+    from contextlib import closing
+
+    parser = argparse.ArgumentParser(description="Rewrite, check and cost a SQL statement before running it")
+    parser.add_argument("sql")
+    parser.add_argument("--database", default=os.getenv("DATABASE_PATH", "finbin_farm_data.db"))
+    parser.add_argument("--max-cost", type=float, default=float(os.getenv("SQL_MAX_COST", 1e9)))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"❌ Database not found: {args.database}")
+        return 1
+    with closing(sqlite3.connect(f"file:{args.database}?mode=ro", uri=True)) as conn:
+        review = SQLOptimizer(max_cost=args.max_cost).review(conn, args.sql)
+    print(f"{'❌ Rejected' if review.rejected else '✅ Accepted'} (estimated cost {review.cost:.3g} row visits)")
+    if review.rewrites:
+        print(f"🔧 Rewrites: {', '.join(review.rewrites)}")
+        print(f"   {review.sql}")
+    for problem in review.problems:
+        print(f"⚠️  {problem}")
+    return 1 if review.rejected else 0
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
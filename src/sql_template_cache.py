@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Parameterized SQL Template Cache
+Questions that differ only in their entities ("... between Minnesota and Wisconsin"
+vs "... between Iowa and Illinois", "top 10" vs "top 25", one metric vs another)
+share a shape. After the LLM writes SQL for one member of the family, the entity
+literals in that SQL become bound parameters, and every later question with the
+same shape replays the template with its own values: one SQL text, so SQLite
+reuses the compiled statement, and no LLM call.
+"""
+
+import re
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from conversation import US_STATES, _STATE_NAMES
+
+logger = logging.getLogger(__name__)
+
+_COUNTY_PATTERN = re.compile(r"\b([A-Z][a-z]+(?: [A-Z][a-z]+)?) County\b")
+_NUMBER_PATTERN = re.compile(r"(?<![\w.])(\d+)(?![\w.])")
+# SQL string and numeric literals (identifiers and keywords are never parameterized)
+_SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+_METRIC_TOKEN = "__ENTITY_{}__"
+
+@dataclass
+class Entity:
+    """A value in the question that varies within a question family."""
+    kind: str      # state, county, year, number or metric
+    value: str     # state code, county name, digits or column name
+    start: int = 0
+
+@dataclass
+class QuestionShape:
+    """The question with its entities replaced by typed placeholders."""
+    key: str
+    entities: List[Entity]
+
+def extract_entities(question: str, metric_synonyms: Dict[str, Tuple[str, float]]) -> QuestionShape:
+    """Find states, counties, years, numbers and metric names; the rest of the wording is the shape."""
+    found: List[Tuple[int, int, Entity]] = []
+
+    def claim(start: int, end: int, entity: Entity):
+        if not any(start < other_end and other_start < end for other_start, other_end, _ in found):
+            entity.start = start
+            found.append((start, end, entity))
+
+    lower = question.lower()
+    for match in _COUNTY_PATTERN.finditer(question):
+        claim(match.start(), match.end(), Entity("county", match.group(1)))
+    for name, code in sorted(US_STATES.items(), key=lambda item: -len(item[0])):
+        for match in re.finditer(rf"\b{name}\b", lower):
+            claim(match.start(), match.end(), Entity("state", code))
+    for code in _STATE_NAMES:
+        # Codes only when written in capitals ("MN", not the word "in")
+        for match in re.finditer(rf"\b{code}\b", question):
+            claim(match.start(), match.end(), Entity("state", code))
+    for phrase in sorted(metric_synonyms, key=lambda p: -len(p)):
+        for match in re.finditer(rf"\b{re.escape(phrase)}\b", lower):
+            claim(match.start(), match.end(), Entity("metric", metric_synonyms[phrase][0]))
+    for match in _NUMBER_PATTERN.finditer(question):
+        value = match.group(1)
+        kind = "year" if re.fullmatch(r"(19|20)\d{2}", value) else "number"
+        claim(match.start(), match.end(), Entity(kind, value))
+
+    found.sort(key=lambda item: item[0])
+    pieces, position, entities = [], 0, []
+    for start, end, entity in found:
+        pieces.append(question[position:start])
+        pieces.append(f"{{{entity.kind}}}")
+        entities.append(entity)
+        position = end
+    pieces.append(question[position:])
+    key = re.sub(r"\s+", " ", "".join(pieces).strip().lower()).rstrip("?.! ")
+    return QuestionShape(key=key, entities=entities)
+
+def _state_forms(code: str) -> Dict[str, str]:
+    name = _STATE_NAMES[code]
+    return {"code": code, "name": name.title(), "lower": name, "upper": name.upper()}
+
+def _literal_value(entity: Entity, form: str) -> Any:
+    """The parameter value of an entity in a given SQL literal form."""
+    if entity.kind == "state":
+        return _state_forms(entity.value)[form]
+    if form == "int":
+        return int(entity.value)
+    return entity.value
+
+def _render_literal(value: Any) -> str:
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+def render_sql(sql: str, params: Sequence[Any]) -> str:
+    """Inline bound parameters for display and for the response prompt."""
+    values = iter(params)
+    return re.sub(r"\?", lambda _: _render_literal(next(values)), sql)
+
+@dataclass
+class SQLTemplate:
+    """SQL with a `?` per entity literal and tokens for metric columns."""
+    sql: str
+    slots: List[Tuple[int, str]]   # one (entity index, literal form) per `?`
+
+    def bind(self, entities: List[Entity]) -> Tuple[str, List[Any]]:
+        sql = self.sql
+        for index, entity in enumerate(entities):
+            if entity.kind == "metric":
+                sql = sql.replace(_METRIC_TOKEN.format(index), entity.value)
+        return sql, [_literal_value(entities[index], form) for index, form in self.slots]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"sql": self.sql, "slots": [list(slot) for slot in self.slots]}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SQLTemplate":
+        return cls(sql=data["sql"], slots=[tuple(slot) for slot in data["slots"]])
+
+def _match_literal(literal: str, entity: Entity) -> Optional[str]:
+    """The form in which the SQL literal spells this entity, or None."""
+    if literal.startswith("'"):
+        text = literal[1:-1].replace("''", "'")
+        if entity.kind == "state":
+            return next((form for form, value in _state_forms(entity.value).items() if value == text), None)
+        if entity.kind in ("county", "year", "number"):
+            return "str" if text == entity.value else None
+        return None
+    if entity.kind in ("year", "number") and literal == entity.value:
+        return "int"
+    return None
+
+def parameterize(sql: str, shape: QuestionShape) -> Optional[SQLTemplate]:
+    """
+    Turn generated SQL into a template, or None when that would be unsafe: an entity
+    that does not appear in the SQL, a literal that could belong to two entities, or
+    a number that appears more than once.
+    """
+    if not shape.entities:
+        return None
+    template = sql
+    for index, entity in enumerate(shape.entities):
+        if entity.kind == "metric":
+            if entity.value not in template:
+                return None
+            template = template.replace(entity.value, _METRIC_TOKEN.format(index))
+
+    slots: List[Tuple[int, str]] = []
+    used = set()
+    pieces, position = [], 0
+    for match in _SQL_LITERAL.finditer(template):
+        candidates = [(index, form) for index, entity in enumerate(shape.entities)
+                      for form in [_match_literal(match.group(0), entity)] if form]
+        if not candidates:
+            continue
+        if len(candidates) > 1:
+            return None
+        index, form = candidates[0]
+        if shape.entities[index].kind == "number" and index in used:
+            return None
+        used.add(index)
+        slots.append((index, form))
+        pieces.append(template[position:match.start()])
+        pieces.append("?")
+        position = match.end()
+    pieces.append(template[position:])
+
+    literal_entities = {i for i, entity in enumerate(shape.entities) if entity.kind != "metric"}
+    if literal_entities - used:
+        return None
+    result = SQLTemplate(sql="".join(pieces), slots=slots)
+    # The template must reproduce the original SQL exactly
+    if render_sql(*result.bind(shape.entities)) != sql:
+        return None
+    return result
+
+class SQLTemplateCache:
+    """Question shape -> SQL template, stored in the same kind of cache as answers."""
+
+    def __init__(self, cache, metric_synonyms: Dict[str, Tuple[str, float]], salt: str = ""):
+        self.cache = cache
+        self.metric_synonyms = metric_synonyms
+        self.salt = salt
+        self.hits = 0
+        self.misses = 0
+        self.learned = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _key(self, shape: QuestionShape) -> str:
+        kinds = ",".join(entity.kind for entity in shape.entities)
+        return hashlib.sha256(f"{shape.key}|{kinds}|{self.salt}".encode("utf-8")).hexdigest()
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def lookup(self, question: str) -> Optional[Tuple[str, List[Any]]]:
+        """(SQL with `?` placeholders, parameters) for a known question shape, else None."""
+        shape = extract_entities(question, self.metric_synonyms)
+        if not shape.entities:
+            return None
+        stored = self.cache.get(self._key(shape))
+        if stored is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        sql, params = SQLTemplate.from_dict(stored).bind(shape.entities)
+        logger.info(f"SQL template hit for shape {shape.key!r}")
+        return sql, params
+
+    def learn(self, question: str, sql: str) -> bool:
+        """Store generated SQL as the template for this question's shape when it parameterizes safely."""
+        shape = extract_entities(question, self.metric_synonyms)
+        if not shape.entities:
+            return False
+        template = parameterize(sql, shape)
+        if template is None:
+            self._count("rejected")
+            return False
+        self.cache.set(self._key(shape), template.to_dict())
+        self._count("learned")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "learned": self.learned,
+                "rejected": self.rejected, "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Stub LLM Server for Benchmarks
+A local, OpenAI-compatible /v1/chat/completions endpoint with configurable latency.
+Point the application at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+DEFAULT_SQL = (
+    "SELECT h.state, COUNT(*) AS farm_count, AVG(g.current_ratio_end) AS avg_current_ratio "
+    "FROM hdb_main_data h JOIN fm_guide g ON g.hdb_main_data_id = h.hdb_main_data_id "
+    "GROUP BY h.state ORDER BY farm_count DESC LIMIT 20"
+)
+# Scripted planner reply: two independent per-state steps and a baseline step
+DEFAULT_PLAN = json.dumps({"steps": [
+    {"id": "s1", "question": "Average net farm income and current ratio for farms in Minnesota", "depends_on": []},
+    {"id": "s2", "question": "Average net farm income and current ratio for farms in Wisconsin", "depends_on": []},
+    {"id": "s3", "question": "Average net farm income and current ratio for all farms", "depends_on": []}
+]})
+DEFAULT_ANSWER = "Farms are spread across the listed states; the averages above summarize their liquidity."
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate used for the usage block (about four characters per token)."""
+    return max(1, len(text) // 4)
+
+class StubLLMConfig:
+    """Mutable settings shared by all request handler threads."""
+
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 0.0,
+                 ms_per_1k_prompt_tokens: float = 0.0, sql: str = DEFAULT_SQL, plan: str = DEFAULT_PLAN,
+                 rpm: float = 0, tpm: float = 0, rate_window_seconds: float = 60.0,
+                 spike_rate: float = 0.0, spike_ms: float = 0.0, error_rate: float = 0.0,
+                 ms_per_completion_token: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.ms_per_1k_prompt_tokens = ms_per_1k_prompt_tokens
+        # Decoding time: longer completions take longer, like a real model
+        self.ms_per_completion_token = ms_per_completion_token
+        self.sql = sql
+        self.plan = plan
+        # Provider-style limits (0 = unlimited), enforced over a sliding window
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rate_window_seconds = rate_window_seconds
+        # Fault injection: a fraction of requests is slow (spike_ms extra) or fails with a 500
+        self.spike_rate = spike_rate
+        self.spike_ms = spike_ms
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self._window = deque()
+
+    def check_rate_limit(self, tokens: int) -> float:
+        """Admit a request against RPM/TPM; returns 0, or seconds to wait when limited."""
+        with self.lock:
+            now = time.monotonic()
+            while self._window and self._window[0][0] <= now - self.rate_window_seconds:
+                self._window.popleft()
+            scale = self.rate_window_seconds / 60.0
+            over_requests = self.rpm and len(self._window) + 1 > self.rpm * scale
+            over_tokens = self.tpm and sum(t for _, t in self._window) + tokens > self.tpm * scale
+            if over_requests or over_tokens:
+                self.rate_limited += 1
+                oldest = self._window[0][0] if self._window else now
+                return max(0.1, oldest + self.rate_window_seconds - now)
+            self._window.append((now, tokens))
+            return 0.0
+
+    def record(self, prompt_tokens: int):
+        """Count a served request."""
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Serves chat completions: plans for planner prompts, SQL for SQL-expert prompts, prose otherwise."""
+
+    config: StubLLMConfig = None
+
+    def log_message(self, format, *args):
+        """Keep benchmark output quiet."""
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _completion_text(self, messages) -> str:
+        """Pick a canned completion based on the system prompt."""
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        if "query planner" in system:
+            return self.config.plan
+        if "numbered question" in system:
+            # Batched SQL generation: one query per "Q<n>:" line
+            user = next((m["content"] for m in messages if m["role"] == "user"), "")
+            ids = re.findall(r"^Q(\d+):", user, re.MULTILINE)
+            return json.dumps({"queries": [{"id": int(i), "sql": self.config.sql} for i in ids]})
+        if "SQL" in system:
+            return self.config.sql
+        return DEFAULT_ANSWER
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        messages = request.get("messages", [])
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+
+        # Like the real API, max_tokens counts against the token limit when the request arrives
+        retry_after = self.config.check_rate_limit(prompt_tokens + int(request.get("max_tokens") or 0))
+        if retry_after:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                            "code": "rate_limit_exceeded"}},
+                            headers={"Retry-After": f"{retry_after:.1f}"})
+            return
+
+        content = self._completion_text(messages)
+        completion_tokens = estimate_tokens(content)
+
+        # Fixed overhead + jitter + prompt processing time that grows with prompt size + decoding
+        delay = (self.config.latency_ms + random.uniform(0, self.config.jitter_ms)
+                 + prompt_tokens / 1000.0 * self.config.ms_per_1k_prompt_tokens
+                 + completion_tokens * self.config.ms_per_completion_token)
+        if random.random() < self.config.spike_rate:
+            delay += self.config.spike_ms
+        if random.random() < self.config.error_rate:
+            with self.config.lock:
+                self.config.errors += 1
+            time.sleep(delay / 2000.0)
+            self._send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+        time.sleep(delay / 1000.0)
+
+        self.config.record(prompt_tokens)
+        self._send_json(200, {
+            "id": f"chatcmpl-stub-{self.config.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+def start_stub_server(port: int = 0, latency_ms: float = 50.0, jitter_ms: float = 0.0, **options):
+    """Start the stub server on a background thread; returns (server, config, base_url)."""
+    config = StubLLMConfig(latency_ms=latency_ms, jitter_ms=jitter_ms, **options)
+    handler = type("BoundStubLLMHandler", (StubLLMHandler,), {"config": config})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    return server, config, base_url
+
+def main():
+    """Run the stub server in the foreground."""
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rpm", type=float, default=0, help="requests per minute before 429s (0 = unlimited)")
+    parser.add_argument("--tpm", type=float, default=0, help="tokens per minute before 429s (0 = unlimited)")
+    args = parser.parse_args()
+
+    server, config, base_url = start_stub_server(args.port, args.latency_ms, args.jitter_ms,
+                                                 rpm=args.rpm, tpm=args.tpm)
+    print(f"🤖 Stub LLM listening at {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    sys.exit(main())
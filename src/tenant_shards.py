@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Tenant Sharding for Farm Financial Data
+Splits the farm database into one SQLite file per tenant and runs portfolio-wide
+queries on every shard in parallel, merging the partial results correctly.
+"""
+
+import os
+import re
+import sys
+import json
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from fact_table import FACT_TABLE
+from farm_metrics import METRICS_TABLE, register_sql_functions
+from change_engine import CHANGE_TABLE
+
+logger = logging.getLogger(__name__)
+
+# Farm tables in load order; every child table links back through hdb_main_data_id
+FARM_TABLES = [
+    'hdb_main_data', 'fm_genin', 'fm_guide', 'fm_stmts',
+    'fm_prf_lq', 'fm_cap_ad', 'fm_hhold', 'fm_nf_ie',
+    'fm_fm_exp', 'fm_fm_inc', 'fm_beg_bs_end_bs', FACT_TABLE, METRICS_TABLE,
+    CHANGE_TABLE
+]
+
+MANIFEST_FILE = "shards.json"
+UNASSIGNED_TENANT = "_unassigned"
+
+@dataclass
+class Aggregate:
+    """A portfolio-wide aggregate that can be split into mergeable per-shard parts."""
+    func: str
+    expression: str = "*"
+
+    def __post_init__(self):
+        self.func = self.func.lower()
+        if self.func not in ('sum', 'count', 'min', 'max', 'avg'):
+            raise ValueError(f"Unsupported aggregate function: {self.func}")
+
+def _shard_file_name(tenant_id: str) -> str:
+    """Build a filesystem-safe shard file name for a tenant."""
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', tenant_id) + ".db"
+
+def build_tenant_shards(source_db: str, shard_dir: str) -> Dict[str, str]:
+    """Split the source database into one SQLite file per tenant_id."""
+    os.makedirs(shard_dir, exist_ok=True)
+
+    source = sqlite3.connect(source_db)
+    cursor = source.cursor()
+
+    placeholders = ",".join("?" for _ in FARM_TABLES)
+    cursor.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type='table' AND name IN ({placeholders})",
+        FARM_TABLES
+    )
+    table_sql = dict(cursor.fetchall())
+    # The source's own indexes (auto-indexes from constraints come with the table DDL)
+    cursor.execute(
+        f"SELECT tbl_name, sql FROM sqlite_master WHERE type='index' AND sql IS NOT NULL "
+        f"AND tbl_name IN ({placeholders})",
+        FARM_TABLES
+    )
+    index_sql: Dict[str, List[str]] = {}
+    for table, sql in cursor.fetchall():
+        index_sql.setdefault(table, []).append(sql)
+
+    cursor.execute("SELECT DISTINCT COALESCE(tenant_id, ?) FROM hdb_main_data", (UNASSIGNED_TENANT,))
+    tenants = sorted(row[0] for row in cursor.fetchall())
+    source.close()
+
+    shards = {}
+    for tenant_id in tenants:
+        shard_path = os.path.join(shard_dir, _shard_file_name(tenant_id))
+        if os.path.exists(shard_path):
+            os.remove(shard_path)
+
+        conn = sqlite3.connect(shard_path)
+        conn.execute("ATTACH DATABASE ? AS src", (source_db,))
+        tenant_filter = (
+            "SELECT hdb_main_data_id FROM src.hdb_main_data "
+            "WHERE COALESCE(tenant_id, ?) = ?"
+        )
+
+        for table in FARM_TABLES:
+            if table not in table_sql:
+                continue
+            conn.execute(table_sql[table])
+            conn.execute(
+                f"INSERT INTO main.{table} SELECT * FROM src.{table} "
+                f"WHERE hdb_main_data_id IN ({tenant_filter})",
+                (UNASSIGNED_TENANT, tenant_id)
+            )
+            # Built after the load, so rows are inserted without index maintenance
+            for sql in index_sql.get(table, []):
+                conn.execute(sql)
+            if table not in ('hdb_main_data', FACT_TABLE, METRICS_TABLE):
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{table}_hdb_main_data_id "
+                    f"ON {table}(hdb_main_data_id)"
+                )
+
+        conn.commit()
+        conn.execute("DETACH DATABASE src")
+        conn.execute("ANALYZE")
+        conn.close()
+
+        shards[tenant_id] = os.path.basename(shard_path)
+        logger.info(f"Built shard for tenant {tenant_id}: {shard_path}")
+
+    with open(os.path.join(shard_dir, MANIFEST_FILE), "w") as f:
+        json.dump({"source_db": os.path.abspath(source_db), "shards": shards}, f, indent=2)
+
+    return {tenant: os.path.join(shard_dir, name) for tenant, name in shards.items()}
+
+def load_shard_manifest(shard_dir: str) -> Dict[str, str]:
+    """Load the tenant_id -> shard path mapping written by build_tenant_shards."""
+    with open(os.path.join(shard_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    return {tenant: os.path.join(shard_dir, name) for tenant, name in manifest["shards"].items()}
+
+def scope_to_tenant(conn: sqlite3.Connection, tenant_id: str):
+    """
+    Limit a shared-database connection to one tenant's rows, for tenants without a shard.
+    A TEMP view of the same name shadows every table for unqualified references: farm tables
+    keep the tenant's farms only, and tables that cannot be attributed to a farm read as empty.
+    """
+    tenant = "'" + tenant_id.replace("'", "''") + "'"
+    farms = f"SELECT hdb_main_data_id FROM main.hdb_main_data WHERE COALESCE(tenant_id, '{UNASSIGNED_TENANT}') = {tenant}"
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM main.sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'")]
+    for table in tables:
+        columns = {row[1] for row in conn.execute(f'PRAGMA main.table_info("{table}")')}
+        if table == 'hdb_main_data':
+            condition = f"COALESCE(tenant_id, '{UNASSIGNED_TENANT}') = {tenant}"
+        elif 'hdb_main_data_id' in columns:
+            condition = f"hdb_main_data_id IN ({farms})"
+        else:
+            condition = "0"
+        conn.execute(f'CREATE TEMP VIEW IF NOT EXISTS "{table}" AS SELECT * FROM main."{table}" WHERE {condition}')
+
+def references_main_schema(sql: str) -> bool:
+    """True when sql names main.<table>, which reads past the views of scope_to_tenant."""
+    return re.search(r'(?<![\w"`\]])["`\[]?main["`\]]?\s*\.', sql, re.IGNORECASE) is not None
+
+def _run_shard_query(shard_path: str, sql: str, params: Sequence[Any]) -> Tuple[List[str], List[tuple]]:
+    """Run one query on one shard. Top-level so it can be shipped to worker processes."""
+    conn = sqlite3.connect(f"file:{shard_path}?mode=ro", uri=True)
+    register_sql_functions(conn)
+    try:
+        cursor = conn.execute(sql, tuple(params))
+        columns = [desc[0] for desc in cursor.description]
+        return columns, cursor.fetchall()
+    finally:
+        conn.close()
+
+def _output_name(expression: str) -> str:
+    """Column name SQLite reports for a plain (optionally table-qualified) column."""
+    return expression.split(".")[-1].strip().strip('"')
+
+class FanOutExecutor:
+    """Runs queries on tenant shards in parallel and merges the partial results."""
+
+    def __init__(self, shard_dir: str, max_workers: Optional[int] = None, use_processes: bool = False):
+        """Load the shard manifest and start the worker pool."""
+        self.shard_dir = shard_dir
+        self.shards = load_shard_manifest(shard_dir)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self._pool = pool_class(max_workers=self.max_workers)
+
+    def has_tenant(self, tenant_id: str) -> bool:
+        """Whether a shard exists for this tenant."""
+        return tenant_id in self.shards
+
+    def _shard_paths(self, tenant_ids: Optional[Sequence[str]] = None) -> List[str]:
+        """Resolve the shards a query must touch."""
+        if tenant_ids is None:
+            return list(self.shards.values())
+        missing = [t for t in tenant_ids if t not in self.shards]
+        if missing:
+            raise KeyError(f"No shard for tenant(s): {', '.join(missing)}")
+        return [self.shards[t] for t in tenant_ids]
+
+    def run(self, sql: str, params: Sequence[Any] = (),
+            tenant_ids: Optional[Sequence[str]] = None) -> List[pd.DataFrame]:
+        """Run the same query on each selected shard and return the partial frames."""
+        paths = self._shard_paths(tenant_ids)
+        if len(paths) == 1:
+            # Single-tenant questions stay on the calling thread
+            partials = [_run_shard_query(paths[0], sql, params)]
+        else:
+            futures = [self._pool.submit(_run_shard_query, path, sql, params) for path in paths]
+            partials = [future.result() for future in futures]
+        return [pd.DataFrame.from_records(rows, columns=columns) for columns, rows in partials]
+
+    def query(self, sql: str, params: Sequence[Any] = (),
+              tenant_ids: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Run a row-level query on the selected shards and concatenate the rows."""
+        frames = self.run(sql, params, tenant_ids)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def tenant_query(self, tenant_id: str, sql: str, params: Sequence[Any] = ()) -> pd.DataFrame:
+        """Run a query against a single tenant's shard only."""
+        return self.query(sql, params, tenant_ids=[tenant_id])
+
+    def top_k(self, sql: str, order_by: str, k: int, descending: bool = True,
+              params: Sequence[Any] = (), tenant_ids: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Global top-k: each shard returns its own top-k, then the candidates are re-ranked."""
+        direction = "DESC" if descending else "ASC"
+        shard_sql = f'SELECT * FROM ({sql}) ORDER BY "{order_by}" {direction} LIMIT {int(k)}'
+        merged = self.query(shard_sql, params, tenant_ids)
+        if merged.empty:
+            return merged
+        return merged.sort_values(order_by, ascending=not descending, kind="mergesort").head(k).reset_index(drop=True)
+
+    def aggregate(self, from_clause: str, aggregates: Dict[str, Aggregate],
+                  group_by: Optional[List[str]] = None, where: Optional[str] = None,
+                  params: Sequence[Any] = (), order_by: Optional[str] = None,
+                  descending: bool = True, limit: Optional[int] = None,
+                  tenant_ids: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        Portfolio-wide grouped aggregate.
+        Averages are computed as SUM/COUNT per shard and divided after merging,
+        and ORDER BY/LIMIT are only applied once all groups are combined.
+        """
+        group_by = group_by or []
+        group_names = [_output_name(expr) for expr in group_by]
+
+        select_parts = [f'{expr} AS "{name}"' for expr, name in zip(group_by, group_names)]
+        for name, agg in aggregates.items():
+            if agg.func == 'avg':
+                select_parts.append(f'SUM({agg.expression}) AS "{name}__sum"')
+                select_parts.append(f'COUNT({agg.expression}) AS "{name}__count"')
+            else:
+                select_parts.append(f'{agg.func.upper()}({agg.expression}) AS "{name}"')
+
+        shard_sql = f"SELECT {', '.join(select_parts)} FROM {from_clause}"
+        if where:
+            shard_sql += f" WHERE {where}"
+        if group_by:
+            shard_sql += f" GROUP BY {', '.join(group_by)}"
+
+        partial = self.query(shard_sql, params, tenant_ids)
+        merged = merge_partial_aggregates(partial, aggregates, group_names)
+
+        if order_by:
+            merged = merged.sort_values(order_by, ascending=not descending, kind="mergesort")
+        if limit is not None:
+            merged = merged.head(limit)
+        return merged.reset_index(drop=True)
+
+    def close(self):
+        """Shut down the worker pool."""
+        self._pool.shutdown(wait=True)
+
+def merge_partial_aggregates(partial: pd.DataFrame, aggregates: Dict[str, Aggregate],
+                             group_names: List[str]) -> pd.DataFrame:
+    """Combine per-shard partial aggregates into the final result."""
+    merge_ops = {}
+    for name, agg in aggregates.items():
+        if agg.func == 'avg':
+            merge_ops[f"{name}__sum"] = 'sum'
+            merge_ops[f"{name}__count"] = 'sum'
+        elif agg.func in ('sum', 'count'):
+            merge_ops[name] = 'sum'
+        else:
+            merge_ops[name] = agg.func
+
+    if partial.empty:
+        return pd.DataFrame(columns=group_names + list(aggregates))
+
+    # min_count=1 keeps SQL semantics: SUM over no non-null values is NULL, not 0
+    if group_names:
+        grouped = partial.groupby(group_names, dropna=False, sort=False)
+        merged = pd.DataFrame({
+            column: grouped[column].sum(min_count=1) if op == 'sum' else grouped[column].agg(op)
+            for column, op in merge_ops.items()
+        }).reset_index()
+    else:
+        merged = pd.DataFrame([{
+            column: (partial[column].sum(min_count=1) if op == 'sum' else getattr(partial[column], op)())
+            for column, op in merge_ops.items()
+        }])
+
+    for name, agg in aggregates.items():
+        if agg.func == 'avg':
+            counts = merged.pop(f"{name}__count")
+            sums = merged.pop(f"{name}__sum")
+            merged[name] = sums / counts.where(counts > 0)
+        elif agg.func == 'count':
+            merged[name] = merged[name].fillna(0).astype("int64")
+
+    return merged[group_names + list(aggregates)]
+
+def main():
+    """Build tenant shards from the main database."""
+    print("🌾 Building Tenant Shards")
+    print("=" * 50)
+
+    source_db = os.getenv('DATABASE_PATH', 'finbin_farm_data.db')
+    shard_dir = sys.argv[1] if len(sys.argv) > 1 else os.getenv('SHARD_DIR', 'shards')
+
+    if not os.path.exists(source_db):
+        print(f"❌ Database file not found: {source_db}")
+        return
+
+    try:
+        shards = build_tenant_shards(source_db, shard_dir)
+        for tenant_id, path in shards.items():
+            print(f"✅ {tenant_id}: {path}")
+        print("=" * 50)
+        print(f"📁 {len(shards)} shards written to {shard_dir}")
+    except Exception as e:
+        print(f"❌ Error building shards: {e}")
+
+if __name__ == "__main__":
+    main()
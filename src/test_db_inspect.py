@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for database inspection: trigger-maintained row counts, which tables get
+triggers, and where each reported count comes from.
+"""
+
+import sqlite3
+
+import pytest
+
+from db_inspect import (SOURCE_ANALYZE, SOURCE_EXACT, SOURCE_TRIGGERS, STATS_TABLE, inspect_database,
+                        install_row_counts, maintained_counts)
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "farms.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE hdb_main_data (hdb_main_data_id TEXT PRIMARY KEY, state TEXT)")
+    conn.execute("CREATE TABLE fm_genin (fm_genin_guid TEXT PRIMARY KEY, hdb_main_data_id TEXT)")
+    conn.execute("CREATE TABLE farm_metrics (hdb_main_data_id TEXT PRIMARY KEY, value REAL)")
+    conn.executemany("INSERT INTO hdb_main_data VALUES (?, ?)", [(f"f{i}", "MN") for i in range(10)])
+    conn.executemany("INSERT INTO fm_genin VALUES (?, ?)", [(f"g{i}", f"f{i}") for i in range(4)])
+    conn.executemany("INSERT INTO farm_metrics VALUES (?, ?)", [(f"f{i}", 1.0) for i in range(3)])
+    conn.commit()
+    yield path, conn
+    conn.close()
+
+def test_install_seeds_counts_for_the_maintained_source_tables(database):
+    _, conn = database
+    assert install_row_counts(conn) == {"hdb_main_data": 10, "fm_genin": 4}
+    assert maintained_counts(conn) == {"hdb_main_data": 10, "fm_genin": 4}
+
+def test_inserts_and_deletes_keep_counts_current(database):
+    _, conn = database
+    install_row_counts(conn)
+    with conn:
+        conn.executemany("INSERT INTO hdb_main_data VALUES (?, ?)", [("n1", "IA"), ("n2", "IA")])
+        conn.execute("DELETE FROM fm_genin WHERE fm_genin_guid IN ('g0', 'g1', 'g2')")
+    assert maintained_counts(conn) == {"hdb_main_data": 12, "fm_genin": 1}
+
+def test_upserted_tables_are_counted_instead(database):
+    path, conn = database
+    install_row_counts(conn)
+    # INSERT OR REPLACE deletes without firing DELETE triggers, so such tables get none
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO farm_metrics VALUES ('f0', 2.0)")
+    health = {table.name: table for table in inspect_database(path, estimates=False).tables}
+    assert (health["farm_metrics"].rows, health["farm_metrics"].source) == (3, SOURCE_EXACT)
+    assert (health["hdb_main_data"].rows, health["hdb_main_data"].source) == (10, SOURCE_TRIGGERS)
+    assert STATS_TABLE not in health
+
+def test_reinstalling_drops_triggers_of_tables_no_longer_listed(database):
+    _, conn = database
+    install_row_counts(conn)
+    install_row_counts(conn, ["fm_genin"])
+    assert maintained_counts(conn) == {"fm_genin": 4}
+    triggers = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    assert not any("hdb_main_data" in name for name in triggers)
+
+def test_dropped_triggers_stop_trusting_the_count(database):
+    path, conn = database
+    install_row_counts(conn)
+    conn.execute(f'DROP TRIGGER "{STATS_TABLE}_fm_genin_delete"')
+    with conn:
+        conn.execute("DELETE FROM fm_genin")
+    assert "fm_genin" not in maintained_counts(conn)
+    health = {table.name: table for table in inspect_database(path, estimates=False).tables}
+    assert (health["fm_genin"].rows, health["fm_genin"].source) == (0, SOURCE_EXACT)
+
+def test_analyze_estimates_are_used_without_triggers(database):
+    path, conn = database
+    conn.execute("ANALYZE")
+    conn.commit()
+    health = {table.name: table for table in inspect_database(path).tables}
+    assert (health["hdb_main_data"].rows, health["hdb_main_data"].source) == (10, SOURCE_ANALYZE)
+    exact = {table.name: table for table in inspect_database(path, exact=True).tables}
+    assert exact["hdb_main_data"].source == SOURCE_EXACT
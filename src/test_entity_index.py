@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Tests for the entity index: LIKE rewrites keyed on primary keys, which must stay
+correct when rowids change, and the triggers that keep the index in sync.
+"""
+
+import sqlite3
+
+import pytest
+
+from entity_index import build_entity_index, has_entity_index, rewrite_like_predicates
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "farms.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE hdb_main_data (hdb_main_data_id TEXT PRIMARY KEY, client_first_last_name TEXT, "
+                 "county TEXT, primary_banker_name TEXT)")
+    conn.execute("CREATE TABLE fm_genin (fm_genin_guid TEXT PRIMARY KEY, hdb_main_data_id TEXT, item_name TEXT)")
+    for index in range(30):
+        farm_id = f"farm_{index:03d}"
+        conn.execute("INSERT INTO hdb_main_data VALUES (?, ?, ?, ?)",
+                     (farm_id, f"Client {index}", "Boone" if index % 3 else "Lac qui Parle", "Pat Banker"))
+        conn.execute("INSERT INTO fm_genin VALUES (?, ?, ?)", (f"guid_{index:03d}", farm_id, f"Client {index} Farm"))
+    conn.commit()
+    conn.close()
+    build_entity_index(path)
+    conn = sqlite3.connect(path)
+    yield conn
+    conn.close()
+
+QUERY = ("SELECT g.item_name, h.county FROM fm_genin g JOIN hdb_main_data h "
+         "ON g.hdb_main_data_id = h.hdb_main_data_id WHERE g.item_name LIKE '%ent 1%' AND h.county LIKE '%qui%'")
+
+def test_like_predicates_become_key_lookups(database):
+    rewritten, rewrites = rewrite_like_predicates(QUERY)
+    assert rewrites == 2
+    assert "g.fm_genin_guid IN (SELECT key FROM entity_index_keys" in rewritten
+    assert "h.hdb_main_data_id IN (SELECT key FROM entity_index_keys" in rewritten
+    assert sorted(database.execute(rewritten).fetchall()) == sorted(database.execute(QUERY).fetchall())
+
+def test_rewrites_stay_correct_when_rowids_change(database):
+    # VACUUM may renumber the rowids of tables with TEXT primary keys; no index trigger fires
+    with database:
+        database.execute("DELETE FROM fm_genin WHERE fm_genin_guid < 'guid_010'")
+        database.execute("UPDATE fm_genin SET rowid = 100 - rowid")
+        database.execute("UPDATE hdb_main_data SET rowid = 100 - rowid")
+    database.execute("VACUUM")
+    rewritten, _ = rewrite_like_predicates(QUERY)
+    expected = sorted(database.execute(QUERY).fetchall())
+    assert expected
+    assert sorted(database.execute(rewritten).fetchall()) == expected
+
+def test_triggers_follow_inserts_updates_and_deletes(database):
+    sql, _ = rewrite_like_predicates("SELECT fm_genin_guid FROM fm_genin WHERE item_name LIKE '%Zzyzx%'")
+    with database:
+        database.execute("INSERT INTO fm_genin VALUES ('guid_new', 'farm_001', 'Zzyzx Ranch')")
+    assert database.execute(sql).fetchall() == [("guid_new",)]
+    with database:
+        database.execute("UPDATE fm_genin SET item_name = 'Other Ranch' WHERE fm_genin_guid = 'guid_new'")
+    assert database.execute(sql).fetchall() == []
+    with database:
+        database.execute("UPDATE fm_genin SET fm_genin_guid = 'guid_moved', item_name = 'Zzyzx' "
+                         "WHERE fm_genin_guid = 'guid_new'")
+    assert database.execute(sql).fetchall() == [("guid_moved",)]
+    with database:
+        database.execute("DELETE FROM fm_genin WHERE fm_genin_guid = 'guid_moved'")
+    assert database.execute(sql).fetchall() == []
+    assert database.execute("SELECT COUNT(*) FROM entity_index").fetchone()[0] == \
+        database.execute("SELECT COUNT(*) FROM entity_index_keys").fetchone()[0]
+
+def test_unqualified_column_in_a_self_join_is_left_alone():
+    sql = "SELECT a.item_name FROM fm_genin a JOIN fm_genin b ON a.hdb_main_data_id = b.hdb_main_data_id " \
+          "WHERE item_name LIKE '%x%'"
+    assert rewrite_like_predicates(sql) == (sql, 0)
+
+def test_index_without_key_table_needs_a_rebuild(database):
+    assert has_entity_index(database)
+    database.execute("DROP TABLE entity_index_keys")
+    assert not has_entity_index(database)
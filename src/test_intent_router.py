@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for the intent router: which questions are answered from templates and
+which must go to the LLM.
+"""
+
+import pytest
+
+from intent_router import IntentRouter
+
+METRICS = ["current_ratio_end", "working_capital_end", "net_farm_income", "debt_to_asset_ratio_end"]
+
+@pytest.fixture
+def router():
+    return IntentRouter(METRICS)
+
+@pytest.mark.parametrize("question", [
+    "How many farms are not in Minnesota?",
+    "How many farms excluding Iowa?",
+    "How many farms are outside Wisconsin?",
+    "Average current ratio except Minnesota",
+    "Average current ratio for farms other than Iowa",
+])
+def test_negated_filters_go_to_the_llm(router, question):
+    assert router.route(question) is None
+
+@pytest.mark.parametrize("question", [
+    "How many farms are profitable?",
+    "How many organic farms are there?",
+    "How many farms are in group 3?",
+    "How many dairy farms are in Wisconsin?",
+])
+def test_unrecognized_words_go_to_the_llm(router, question):
+    assert router.route(question) is None
+    # classify still explains what was not understood
+    routed = router.classify(question)
+    assert routed is None or routed.slots.get("unrecognized")
+
+def test_count_with_state_filter_binds_the_state(router):
+    routed = router.route("How many farms are in Wisconsin?")
+    assert routed.intent == "count"
+    assert routed.params == ["WI"]
+    assert "h.state IN (?)" in routed.sql
+
+def test_count_by_state(router):
+    routed = router.route("How many farms are in each state?")
+    assert routed.intent == "count_by"
+    assert routed.slots["group"] == "state"
+
+def test_top_n_direction_and_limit(router):
+    routed = router.route("Which farms have the lowest current ratio?")
+    assert routed.intent == "top_n"
+    assert routed.slots["descending"] is False
+    assert "ORDER BY g.current_ratio_end ASC LIMIT 10" in routed.sql
+    routed = router.route("Top 5 farms by net farm income")
+    assert routed.slots["n"] == 5 and routed.slots["descending"] is True
+
+def test_average_by_state_with_year(router):
+    routed = router.route("What is the average working capital by state in 2021?")
+    assert routed.intent == "average_by"
+    assert routed.params == ["2021"]
+
+def test_percentile(router):
+    routed = router.route("What's the 75th percentile for current ratio?")
+    assert routed.intent == "percentile"
+    assert routed.slots["percentile"] == 75
+    # The where clause appears twice, so its values are bound twice
+    assert routed.sql.count("?") == len(routed.params)
+
+def test_questions_of_one_shape_share_sql_text(router):
+    first = router.route("How many farms are in Iowa?")
+    second = router.route("How many farms are in Minnesota?")
+    assert first.sql == second.sql
+    assert first.params != second.params
+
+def test_change_questions_need_the_change_table():
+    router = IntentRouter(METRICS, change_metrics=["working_capital"])
+    routed = router.route("Which farms had the biggest increase in working capital?")
+    assert routed.intent == "top_change"
+    assert routed.params[0] == "working_capital"
+    without_table = IntentRouter(METRICS).route("Which farms had the biggest increase in working capital?")
+    assert without_table is None or without_table.intent != "top_change"
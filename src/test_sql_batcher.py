@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Tests for SQL generation micro-batching: parsing the batched JSON reply and
+falling back to single calls for items the reply does not answer.
+"""
+
+import json
+import threading
+
+import pytest
+
+from sql_batcher import SQLBatcher, batch_prompt, parse_batch_reply
+
+def test_reply_items_are_placed_by_id():
+    reply = json.dumps({"queries": [{"id": 2, "sql": "SELECT 2;"}, {"id": 1, "sql": "SELECT 1"}]})
+    assert parse_batch_reply(reply, 2) == ["SELECT 1", "SELECT 2"]
+
+def test_fenced_json_and_q_prefixed_ids_are_accepted():
+    reply = '```json\n{"queries": [{"id": "Q1", "sql": "WITH t AS (SELECT 1) SELECT * FROM t"}]}\n```'
+    assert parse_batch_reply(reply, 1) == ["WITH t AS (SELECT 1) SELECT * FROM t"]
+
+def test_a_bare_list_uses_positions_when_ids_are_missing():
+    reply = json.dumps([{"sql": "SELECT 1"}, {"sql": "SELECT 2"}])
+    assert parse_batch_reply(reply, 2) == ["SELECT 1", "SELECT 2"]
+
+@pytest.mark.parametrize("reply", [
+    "Here are your queries: SELECT 1",
+    json.dumps({"queries": "SELECT 1"}),
+])
+def test_unparseable_replies_answer_nothing(reply):
+    assert parse_batch_reply(reply, 2) == [None, None]
+
+def test_missing_unsafe_and_out_of_range_items_are_none():
+    reply = json.dumps({"queries": [
+        {"id": 1, "sql": "DELETE FROM fm_genin"},
+        {"id": 3, "sql": ""},
+        {"id": 7, "sql": "SELECT 7"},
+        {"id": "x", "sql": "SELECT 1"},
+        "SELECT 2",
+    ]})
+    assert parse_batch_reply(reply, 3) == [None, None, None]
+
+def test_prompt_numbers_questions_and_sends_the_schema_once():
+    prompt = batch_prompt(["How many farms?", "Average income?"], "Table: fm_guide")
+    assert "Q1: How many farms?" in prompt and "Q2: Average income?" in prompt
+    assert prompt.count("Table: fm_guide") == 1
+
+def test_items_the_batch_misses_fall_back_to_single_calls():
+    started = threading.Barrier(3)
+    batches = []
+
+    def generate_batch(questions, priority):
+        batches.append((list(questions), priority))
+        return [f"SELECT '{q}'" if q != "b" else None for q in questions], {"total_tokens": 10}
+
+    def generate_one(question, priority):
+        return f"SELECT 'single {question}'", {"total_tokens": 1}
+
+    batcher = SQLBatcher(generate_batch, generate_one, max_batch=3, max_wait_ms=2000)
+    results = {}
+
+    def ask(question, priority):
+        started.wait()
+        results[question] = batcher.submit(question, priority)
+
+    threads = [threading.Thread(target=ask, args=(q, p)) for q, p in (("a", "batch"), ("b", "batch"),
+                                                                      ("c", "interactive"))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert len(batches) == 1 and sorted(batches[0][0]) == ["a", "b", "c"]
+    # Interactive work in the batch decides its priority
+    assert batches[0][1] == "interactive"
+    assert results["b"] == ("SELECT 'single b'", {"total_tokens": 1})
+    assert results["a"][0] == "SELECT 'a'" and results["c"][0] == "SELECT 'c'"
+    # The answered items' shares of the batch usage never exceed the total
+    assert results["a"][1]["total_tokens"] + results["c"][1]["total_tokens"] <= 10
+    assert batcher.stats()["fallbacks"] == 1
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for the pre-execution SQL optimizer: each safe rewrite, the join checks
+against the key graph, and the cost limit.
+"""
+
+import sqlite3
+
+import pytest
+
+from sql_optimizer import SQLOptimizer
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE hdb_main_data (hdb_main_data_id TEXT PRIMARY KEY, state TEXT, county TEXT)")
+    conn.execute("CREATE TABLE fm_genin (fm_genin_guid TEXT PRIMARY KEY, hdb_main_data_id TEXT, item_name TEXT)")
+    conn.execute("CREATE TABLE fm_guide (hdb_main_data_id TEXT, net_farm_income REAL)")
+    for index in range(50):
+        farm_id = f"f{index}"
+        conn.execute("INSERT INTO hdb_main_data VALUES (?, ?, ?)", (farm_id, "MN" if index % 2 else "IA", "Boone"))
+        conn.execute("INSERT INTO fm_genin VALUES (?, ?, ?)", (f"g{index}", farm_id, f"Farm {index}"))
+        conn.execute("INSERT INTO fm_guide VALUES (?, ?)", (farm_id, index * 10.0))
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def optimizer():
+    return SQLOptimizer(max_cost=1e9, row_limit=100)
+
+def rows(conn, sql):
+    return sorted(conn.execute(sql).fetchall())
+
+def test_missing_limit_is_added(conn, optimizer):
+    review = optimizer.review(conn, "SELECT state FROM hdb_main_data;")
+    assert review.rewrites == ["limit"]
+    assert review.sql == "SELECT state FROM hdb_main_data LIMIT 100"
+    assert not review.rejected
+
+def test_per_farm_scalar_subquery_becomes_a_left_join(conn, optimizer):
+    sql = ("SELECT h.hdb_main_data_id, (SELECT g.net_farm_income FROM fm_guide g "
+           "WHERE g.hdb_main_data_id = h.hdb_main_data_id) AS income FROM hdb_main_data h LIMIT 50")
+    review = optimizer.review(conn, sql)
+    assert review.rewrites == ["subquery_to_join"]
+    assert "LEFT JOIN fm_guide sq1 ON sq1.hdb_main_data_id = h.hdb_main_data_id" in review.sql
+    assert "(SELECT" not in review.sql
+    assert rows(conn, review.sql) == rows(conn, sql)
+
+def test_select_star_over_a_join_lists_join_columns_once(conn, optimizer):
+    sql = ("SELECT * FROM hdb_main_data h JOIN fm_genin g ON g.hdb_main_data_id = h.hdb_main_data_id "
+           "WHERE h.state = 'MN' LIMIT 5")
+    review = optimizer.review(conn, sql)
+    assert review.rewrites == ["select_star"]
+    columns = [description[0] for description in conn.execute(review.sql).description]
+    assert columns.count("hdb_main_data_id") == 1
+    assert columns == ["hdb_main_data_id", "state", "county", "fm_genin_guid", "item_name"]
+
+def test_outer_limit_is_pushed_into_a_plain_derived_table(conn, optimizer):
+    sql = "SELECT state FROM (SELECT state, county FROM hdb_main_data WHERE county = 'Boone') t LIMIT 5"
+    review = optimizer.review(conn, sql)
+    assert review.rewrites == ["limit_push_down"]
+    assert "WHERE county = 'Boone' LIMIT 5)" in review.sql
+    assert len(conn.execute(review.sql).fetchall()) == 5
+
+def test_string_literals_are_never_rewritten(conn, optimizer):
+    sql = "SELECT item_name FROM fm_genin WHERE item_name = 'SELECT * FROM x LIMIT'"
+    review = optimizer.review(conn, sql)
+    assert review.sql.startswith(sql)
+    assert "'SELECT * FROM x LIMIT'" in review.sql
+
+def test_cartesian_product_is_rejected(conn, optimizer):
+    review = optimizer.review(conn, "SELECT h.state, g.item_name FROM hdb_main_data h, fm_genin g LIMIT 10")
+    assert review.rejected
+    assert "cartesian product" in review.reason
+
+def test_join_on_mismatched_keys_is_rejected(conn, optimizer):
+    review = optimizer.review(conn, "SELECT * FROM hdb_main_data h JOIN fm_genin g "
+                                    "ON g.fm_genin_guid = h.hdb_main_data_id LIMIT 10")
+    assert review.rejected
+    assert "mismatched keys" in review.reason
+
+def test_statements_over_the_cost_limit_are_rejected(conn):
+    optimizer = SQLOptimizer(max_cost=10, row_limit=100)
+    review = optimizer.review(conn, "SELECT * FROM fm_guide")
+    assert review.rejected
+    assert "estimated cost" in review.reason
+
+def test_reviews_are_cached_per_statement(conn, optimizer):
+    first = optimizer.review(conn, "SELECT state FROM hdb_main_data")
+    assert optimizer.review(conn, "SELECT state FROM hdb_main_data") is first
+    assert optimizer.stats()["reviewed"] == 1
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQL template cache: entity extraction, turning generated SQL into
+parameterized templates, and replaying a template for another question of the same shape.
+"""
+
+import pytest
+
+from intent_router import build_metric_synonyms
+from shared_cache import MemoryCache
+from sql_template_cache import SQLTemplateCache, extract_entities, parameterize, render_sql
+
+SYNONYMS = build_metric_synonyms(["current_ratio_end", "working_capital_end", "net_farm_income"])
+
+COMPARE_SQL = ("SELECT h.state, AVG(g.current_ratio_end) FROM hdb_main_data h JOIN fm_guide g "
+               "ON g.hdb_main_data_id = h.hdb_main_data_id WHERE h.state IN ('MN', 'WI') GROUP BY h.state")
+
+@pytest.fixture
+def templates():
+    return SQLTemplateCache(MemoryCache(), SYNONYMS)
+
+def test_questions_with_other_entities_share_a_shape():
+    first = extract_entities("Compare current ratio between Minnesota and Wisconsin", SYNONYMS)
+    second = extract_entities("Compare working capital between Iowa and Illinois", SYNONYMS)
+    assert first.key == second.key
+    assert [(e.kind, e.value) for e in first.entities] == [
+        ("metric", "current_ratio_end"), ("state", "MN"), ("state", "WI")]
+
+def test_years_counties_and_numbers_are_entities():
+    shape = extract_entities("Top 10 farms in Boone County in 2022", SYNONYMS)
+    assert [(e.kind, e.value) for e in shape.entities] == [("number", "10"), ("county", "Boone"), ("year", "2022")]
+
+def test_parameterize_replaces_literals_and_metric_columns():
+    shape = extract_entities("Compare current ratio between Minnesota and Wisconsin", SYNONYMS)
+    template = parameterize(COMPARE_SQL, shape)
+    assert template is not None
+    assert "'MN'" not in template.sql and "current_ratio_end" not in template.sql
+    assert template.sql.count("?") == 2
+    # Binding the question's own entities reproduces the generated SQL
+    assert render_sql(*template.bind(shape.entities)) == COMPARE_SQL
+
+def test_numbers_bind_as_integers_and_states_in_their_sql_spelling():
+    shape = extract_entities("Top 10 farms in Minnesota", SYNONYMS)
+    template = parameterize("SELECT * FROM hdb_main_data WHERE state_name = 'Minnesota' LIMIT 10", shape)
+    other = extract_entities("Top 25 farms in Iowa", SYNONYMS)
+    # Parameters follow the placeholders' order in the SQL, not the question's
+    assert template.bind(other.entities)[1] == ["Iowa", 25]
+
+@pytest.mark.parametrize("question, sql", [
+    # The state never appears in the SQL
+    ("How many farms in Minnesota?", "SELECT COUNT(*) FROM hdb_main_data"),
+    # The number appears twice, so which occurrence is the entity is ambiguous
+    ("Top 5 farms", "SELECT * FROM fm_guide WHERE net_farm_income > 5 LIMIT 5"),
+    # No entities at all
+    ("How many farms are there?", "SELECT COUNT(*) FROM hdb_main_data"),
+])
+def test_unsafe_sql_is_not_parameterized(question, sql):
+    assert parameterize(sql, extract_entities(question, SYNONYMS)) is None
+
+def test_learned_template_is_replayed_for_the_same_shape(templates):
+    assert templates.learn("Compare current ratio between Minnesota and Wisconsin", COMPARE_SQL)
+    sql, params = templates.lookup("Compare working capital between Iowa and Illinois")
+    assert "working_capital_end" in sql and "current_ratio_end" not in sql
+    assert params == ["IA", "IL"]
+    # One SQL text for every state pair, so the statement is compiled once
+    assert templates.lookup("Compare working capital between Ohio and Texas")[0] == sql
+    assert templates.stats()["hits"] == 2
+
+def test_unknown_shape_misses(templates):
+    assert templates.lookup("Average net farm income in Iowa") is None
+    assert templates.stats()["misses"] == 1
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for tenant shards: merging per-shard partial aggregates, fan-out results
+against the single database, and scoping shared-database connections to a tenant.
+"""
+
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from tenant_shards import (Aggregate, FanOutExecutor, build_tenant_shards, merge_partial_aggregates,
+                           references_main_schema, scope_to_tenant)
+
+FARMS = [
+    ("f1", "tenant_a", "MN", 100.0),
+    ("f2", "tenant_a", "IA", None),
+    ("f3", "tenant_b", "MN", 300.0),
+    ("f4", "tenant_b", "MN", 500.0),
+    ("f5", None, "WI", 50.0),
+]
+
+@pytest.fixture
+def farm_db(tmp_path):
+    path = str(tmp_path / "farms.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE hdb_main_data (hdb_main_data_id TEXT PRIMARY KEY, tenant_id TEXT, state TEXT)")
+    conn.execute("CREATE TABLE fm_guide (hdb_main_data_id TEXT, net_farm_income REAL)")
+    conn.execute("CREATE TABLE table_row_counts (table_name TEXT PRIMARY KEY, row_count INTEGER)")
+    for farm_id, tenant_id, state, income in FARMS:
+        conn.execute("INSERT INTO hdb_main_data VALUES (?, ?, ?)", (farm_id, tenant_id, state))
+        conn.execute("INSERT INTO fm_guide VALUES (?, ?)", (farm_id, income))
+    conn.execute("INSERT INTO table_row_counts VALUES ('hdb_main_data', 5)")
+    conn.commit()
+    conn.close()
+    return path
+
+def test_averages_merge_from_sums_and_counts():
+    partial = pd.DataFrame({"state": ["MN", "MN", "IA"], "income__sum": [100.0, 800.0, 30.0],
+                            "income__count": [1, 2, 1]})
+    merged = merge_partial_aggregates(partial, {"income": Aggregate("avg", "x")}, ["state"])
+    assert dict(zip(merged["state"], merged["income"])) == {"MN": 300.0, "IA": 30.0}
+
+def test_counts_sum_and_extremes_keep_their_function():
+    partial = pd.DataFrame({"farms": [2, 3], "low": [5.0, 1.0], "high": [7.0, 9.0]})
+    merged = merge_partial_aggregates(
+        partial, {"farms": Aggregate("count"), "low": Aggregate("min", "x"), "high": Aggregate("max", "x")}, [])
+    assert merged.iloc[0].tolist() == [5, 1.0, 9.0]
+
+def test_groups_without_values_stay_null():
+    partial = pd.DataFrame({"state": ["IA", "IA"], "total": [None, None], "income__sum": [None, None],
+                            "income__count": [0, 0], "farms": [None, 0]})
+    merged = merge_partial_aggregates(
+        partial, {"total": Aggregate("sum", "x"), "income": Aggregate("avg", "x"), "farms": Aggregate("count")},
+        ["state"])
+    row = merged.iloc[0]
+    assert pd.isna(row["total"]) and pd.isna(row["income"])
+    assert row["farms"] == 0
+
+def test_empty_partials_give_an_empty_frame():
+    merged = merge_partial_aggregates(pd.DataFrame(), {"farms": Aggregate("count")}, ["state"])
+    assert merged.empty and list(merged.columns) == ["state", "farms"]
+
+def test_unsupported_aggregate_is_rejected():
+    with pytest.raises(ValueError):
+        Aggregate("median", "x")
+
+def test_fan_out_matches_the_single_database(farm_db, tmp_path):
+    shards = build_tenant_shards(farm_db, str(tmp_path / "shards"))
+    assert set(shards) == {"tenant_a", "tenant_b", "_unassigned"}
+    executor = FanOutExecutor(str(tmp_path / "shards"), max_workers=2)
+    try:
+        fanned = executor.aggregate("hdb_main_data h JOIN fm_guide g ON g.hdb_main_data_id = h.hdb_main_data_id",
+                                    {"farms": Aggregate("count"), "income": Aggregate("avg", "g.net_farm_income")},
+                                    group_by=["h.state"], order_by="state", descending=False)
+        conn = sqlite3.connect(farm_db)
+        single = pd.read_sql_query(
+            "SELECT h.state AS state, COUNT(*) AS farms, AVG(g.net_farm_income) AS income FROM hdb_main_data h "
+            "JOIN fm_guide g ON g.hdb_main_data_id = h.hdb_main_data_id GROUP BY h.state ORDER BY h.state", conn)
+        conn.close()
+        pd.testing.assert_frame_equal(fanned, single, check_dtype=False)
+        assert executor.tenant_query("tenant_b", "SELECT COUNT(*) AS n FROM fm_guide")["n"][0] == 2
+    finally:
+        executor.close()
+
+def test_scoped_connection_only_sees_the_tenants_rows(farm_db):
+    conn = sqlite3.connect(f"file:{farm_db}?mode=ro", uri=True)
+    scope_to_tenant(conn, "tenant_a")
+    assert conn.execute("SELECT COUNT(*) FROM hdb_main_data").fetchone()[0] == 2
+    assert {row[0] for row in conn.execute("SELECT hdb_main_data_id FROM fm_guide")} == {"f1", "f2"}
+    # Tables that cannot be tied to a farm read as empty
+    assert conn.execute("SELECT COUNT(*) FROM table_row_counts").fetchone()[0] == 0
+    conn.close()
+
+def test_scope_quotes_the_tenant_id(farm_db):
+    conn = sqlite3.connect(f"file:{farm_db}?mode=ro", uri=True)
+    scope_to_tenant(conn, "x' OR '1' = '1")
+    assert conn.execute("SELECT COUNT(*) FROM hdb_main_data").fetchone()[0] == 0
+    conn.close()
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT * FROM main.fm_guide", True),
+    ('SELECT * FROM "main" . fm_guide', True),
+    ("SELECT hdb_main_data_id FROM hdb_main_data", False),
+    ("SELECT domain.x FROM t domain", False),
+])
+def test_references_main_schema(sql, expected):
+    assert references_main_schema(sql) is expected
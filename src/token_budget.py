@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Token Budgeting for LLM Prompts
+Counts prompt tokens locally (no network, no model files) and fits prompt sections
+such as schema, instructions, data and history into a token budget by shrinking
+the lowest-value sections first.
+"""
+
+import re
+import math
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Mirrors the pre-tokenization split of OpenAI's cl100k/o200k encodings: contractions,
+# words with their leading space, 1-3 digit groups, punctuation runs and whitespace
+_PRETOKEN_PATTERN = re.compile(
+    r"'(?:s|t|re|ve|m|ll|d)| ?[A-Za-z]+| ?\d{1,3}| ?[^\sA-Za-z\d]+|\s+(?!\S)|\s+"
+)
+
+def count_tokens(text: str) -> int:
+    """
+    Estimate the number of BPE tokens in text.
+    Short words and digit groups are one token, longer words cost about one token
+    per four letters, which tracks cl100k closely for English, SQL and tables.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _PRETOKEN_PATTERN.findall(text):
+        letters = len(piece.strip())
+        if letters <= 6:
+            tokens += 1
+        else:
+            tokens += math.ceil(letters / 4)
+    return tokens
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """Tokens for a chat request, including the per-message framing overhead."""
+    return sum(count_tokens(message.get("content", "")) + 4 for message in messages) + 3
+
+@dataclass
+class PromptSection:
+    """One part of a prompt; lower priority sections are shrunk first."""
+    name: str
+    text: str
+    priority: int
+    max_tokens: Optional[int] = None
+    shrink: Optional[Callable[[str, int], str]] = field(default=None, repr=False)
+
+class TokenBudget:
+    """Fits prompt sections into a total token budget."""
+
+    def __init__(self, total_tokens: int):
+        """Set the total prompt budget; 0 or less disables budgeting."""
+        self.total_tokens = total_tokens
+
+    def fit(self, sections: List[PromptSection]) -> Dict[str, str]:
+        """Shrink sections to their own caps, then lowest priority first until the total fits."""
+        texts = {section.name: section.text for section in sections}
+        if self.total_tokens <= 0:
+            return texts
+
+        for section in sections:
+            if section.max_tokens is not None and section.shrink and count_tokens(texts[section.name]) > section.max_tokens:
+                texts[section.name] = section.shrink(texts[section.name], section.max_tokens)
+
+        for section in sorted(sections, key=lambda s: s.priority):
+            total = sum(count_tokens(text) for text in texts.values())
+            overflow = total - self.total_tokens
+            if overflow <= 0:
+                break
+            if section.shrink is None:
+                continue
+            current = count_tokens(texts[section.name])
+            texts[section.name] = section.shrink(texts[section.name], max(current - overflow, 0))
+
+        total = sum(count_tokens(text) for text in texts.values())
+        if total > self.total_tokens:
+            logger.warning(f"Prompt still {total} tokens after shrinking (budget {self.total_tokens})")
+        return texts
+
+# Columns that keep joins and common filters possible even when the schema is cut down
+KEY_COLUMNS = {'hdb_main_data_id', 'fm_genin_guid', 'item_name', 'state', 'county', 'year',
+               'tenant_id', 'client_first_last_name'}
+
+def _words(text: str) -> set:
+    """Lower-case word set used for relevance matching."""
+    return set(re.findall(r'[a-z]+', text.lower()))
+
+def shrink_schema(schema_text: str, max_tokens: int, question: str = "") -> str:
+    """
+    Cut the schema description down to max_tokens.
+    Columns are ranked by overlap with the question; key/join columns are kept
+    as long as possible and the least relevant columns are dropped first.
+    """
+    question_words = _words(question)
+    tables = []
+    for block in schema_text.strip().split("\n\n"):
+        lines = block.strip().split("\n")
+        if not lines or not lines[0].startswith("Table:"):
+            continue
+        header = lines[:2] if len(lines) > 1 and lines[1].strip() == "Columns:" else lines[:1]
+        columns = lines[len(header):]
+        tables.append((header, columns))
+
+    scored = []
+    for table_index, (header, columns) in enumerate(tables):
+        table_words = _words(header[0])
+        for column_index, line in enumerate(columns):
+            name = line.strip().lstrip("- ").split(":")[0]
+            name_words = set(name.split("_"))
+            score = len(name_words & question_words) * 2 + len(table_words & question_words)
+            if name in KEY_COLUMNS or "PRIMARY KEY" in line:
+                score += 3
+            scored.append((score, table_index, column_index))
+
+    # Drop lowest-scored columns first, later columns before earlier ones on ties
+    drop_order = sorted(scored, key=lambda item: (item[0], -item[1], -item[2]))
+    dropped = set()
+
+    def render() -> str:
+        blocks = []
+        for table_index, (header, columns) in enumerate(tables):
+            kept = [line for column_index, line in enumerate(columns) if (table_index, column_index) not in dropped]
+            omitted = len(columns) - len(kept)
+            if not kept:
+                continue
+            block = "\n".join(header + kept)
+            if omitted:
+                block += f"\n  ... ({omitted} less relevant columns omitted)"
+            blocks.append(block)
+        return "\n\n".join(blocks)
+
+    text = render()
+    step = max(1, len(drop_order) // 20)
+    position = 0
+    while count_tokens(text) > max_tokens and position < len(drop_order):
+        for _, table_index, column_index in drop_order[position:position + step]:
+            dropped.add((table_index, column_index))
+        position += step
+        text = render()
+    return text
+
+def low_value_columns(df: "pd.DataFrame") -> List[int]:
+    """Column positions ordered from least to most useful to show the model."""
+    def value(position: int) -> tuple:
+        # Positional access: joined results often repeat column names
+        series = df.iloc[:, position]
+        name = str(df.columns[position])
+        is_id = name.endswith(("_id", "_guid")) or name == "id"
+        return (bool(series.notna().any()), series.nunique(dropna=True) > 1, not is_id)
+    return sorted(range(len(df.columns)), key=value)
+
+def fit_dataframe(df: "pd.DataFrame", max_tokens: int, max_rows: int = 20) -> str:
+    """
+    Render a result table within max_tokens.
+    Empty, constant and id-like columns are dropped first, then rows are halved;
+    omitted rows and columns are stated so the model knows the table is partial.
+    """
+    view = df.head(max_rows)
+
+    # Estimate each column's share of the rendered table once instead of re-rendering per drop
+    costs = [
+        count_tokens(str(view.columns[position])) + count_tokens(" ".join(map(str, view.iloc[:, position])))
+        for position in range(len(view.columns))
+    ]
+    kept = set(range(len(view.columns)))
+    dropped_columns: List[str] = []
+    estimate = sum(costs)
+    for position in low_value_columns(view):
+        if estimate <= max_tokens or len(kept) <= 2:
+            break
+        kept.remove(position)
+        dropped_columns.append(str(view.columns[position]))
+        estimate -= costs[position]
+    view = view.iloc[:, sorted(kept)]
+
+    def render(frame) -> str:
+        text = frame.to_string(index=False)
+        notes = []
+        if len(df) > len(frame):
+            notes.append(f"... and {len(df) - len(frame)} more rows")
+        if dropped_columns:
+            shown = ", ".join(dropped_columns[:8])
+            more = f" and {len(dropped_columns) - 8} more" if len(dropped_columns) > 8 else ""
+            notes.append(f"(columns omitted: {shown}{more})")
+        return "\n".join([text] + notes)
+
+    text = render(view)
+    while count_tokens(text) > max_tokens and len(view) > 1:
+        view = view.head(len(view) // 2)
+        text = render(view)
+    return text
+
+def shrink_lines(text: str, max_tokens: int) -> str:
+    """Generic shrinker: drop the oldest lines (from the top) until the text fits."""
+    lines = text.split("\n")
+    while lines and count_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)